@@ -8,12 +8,18 @@ from datetime import timedelta, datetime
 import logging
 import os
 import shutil
+import socket
 from utils.battle_manager_utils import init_battle_manager_utils
 from utils.automatch_utils import init_automatch_utils, get_automatch
+from utils.response_cache import init_response_cache
+from utils.sql_profiler import init_sql_profiler
+from services.admin_jobs import init_admin_jobs
+from services.metrics import init_metrics
 from blueprints.ai_editing_control import ai_editing_control
 
 from database.base import db, login_manager
 from database import initialize_database
+from database import upgrade_schema, backfill_battle_analytics
 from database import (
     get_user_by_email,
     create_user,
@@ -292,24 +298,65 @@ def initialize_default_data(app):
             raise
 
 
+def recover_interrupted_battles(app):
+    """
+    在服务器启动时恢复意外中断的对局 (重新入队或判定失败)。
+    Web 进程不执行对战 (RUN_BATTLE_WORKERS=0) 时由对战工作进程 (game.worker) 恢复；
+    多个进程同时启动时只有抢到维护租约的一个执行。
+    """
+    if not app.config.get("RUN_BATTLE_WORKERS", True):
+        app.logger.info("对战由独立工作进程执行，启动恢复交给 game.worker")
+        return
+    with app.app_context():
+        try:
+            from database import (
+                acquire_service_lease,
+                recover_battle_queue,
+                release_service_lease,
+            )
+            from database.battle_queue import (
+                STARTUP_RECOVERY_LEASE,
+                STARTUP_RECOVERY_LEASE_SECONDS,
+            )
+
+            owner = f"{socket.gethostname()}:{os.getpid()}"
+            if not acquire_service_lease(
+                STARTUP_RECOVERY_LEASE, owner, STARTUP_RECOVERY_LEASE_SECONDS
+            ):
+                app.logger.info("其他进程正在恢复对战队列，跳过")
+                return
+            try:
+                summary = recover_battle_queue(include_orphans=True)
+            finally:
+                release_service_lease(STARTUP_RECOVERY_LEASE, owner)
+            if summary is None:
+                app.logger.error("❌ 恢复持久化对战队列失败")
+            elif any(summary.values()):
+                app.logger.warning(f"⚠️ 已恢复意外中断的对局: {summary}")
+            else:
+                app.logger.info("✅ 没有发现需要恢复的对局")
+        except Exception as e:
+            app.logger.critical(
+                f"💥 恢复对局过程中发生严重错误: {str(e)}", exc_info=True
+            )
+
+
 def cleanup_stale_battles(app):
-    """在服务器启动时删除所有标记为playing、waiting或cancelled状态的对局"""
+    """在服务器启动时删除所有标记为cancelled状态的对局"""
     with app.app_context():
         try:
             from database.models import Battle, GameStats, BattlePlayer, db
             from database.action import delete_battle
 
-            # 修改查询条件，也包括已取消的对局
-            stale_battles = Battle.query.filter(
-                Battle.status.in_(["playing", "waiting", "cancelled"])
-            ).all()
+            # playing/waiting 的对局由持久化队列恢复，这里只清理已取消的对局
+            stale_battles = Battle.query.filter(Battle.status == "cancelled").all()
 
             if not stale_battles:
                 app.logger.info("✅ 没有发现需要清理的对局")
                 return
 
             app.logger.warning(
-                f"⚠️ 发现 {len(stale_battles)} 个需要清理的对局(playing、waiting或cancelled)，开始删除..."
+                f"⚠️ 发现 {len(stale_battles)} 个需要清理的对局(cancelled)，开始删除..."
             )
 
             for battle in stale_battles:
@@ -379,6 +426,25 @@ def cleanup_stale_battles(app):
             )
 
 
+def cleanup_stale_ranking_members(app):
+    """在服务器启动时清理没有激活AI的用户在天梯榜单中的统计记录"""
+    with app.app_context():
+        try:
+            from database import cleanup_stale_game_stats
+
+            deleted = cleanup_stale_game_stats()
+            if deleted < 0:
+                app.logger.error("❌ 清理榜单过期成员失败")
+            elif deleted:
+                app.logger.warning(f"⚠️ 已清理 {deleted} 条无激活AI的榜单统计记录")
+            else:
+                app.logger.info("✅ 没有发现需要清理的榜单成员")
+        except Exception as e:
+            app.logger.critical(
+                f"💥 清理榜单成员过程中发生严重错误: {str(e)}", exc_info=True
+            )
+
+
 def create_app(config_object=Config):
     """创建Flask应用实例"""
     app = Flask(__name__)
@@ -408,6 +474,12 @@ def create_app(config_object=Config):
     # 初始化数据库
     initialize_database(app)
 
+    # 初始化响应缓存 (评分写入提交后自动失效对应榜单)
+    init_response_cache(app)
+
+    # 按采样率统计每个请求的 SQL 查询数与耗时，发现 N+1 时告警
+    init_sql_profiler(app)
+
     # 初始化登录管理器
     login_manager.init_app(app)
     login_manager.login_view = "auth.login"
@@ -444,6 +516,9 @@ def create_app(config_object=Config):
     # 创建数据库表
     with app.app_context():
         db.create_all()
+        # 为已有数据库补上后加的列和索引，并按已有结果补填对战分析列
+        upgrade_schema()
+        backfill_battle_analytics()
 
     # 配置日志
     logging.basicConfig(level=app.config["LOG_LEVEL"])
@@ -468,10 +543,17 @@ def create_app(config_object=Config):
     automatch = get_automatch()
     automatch.terminate_all_and_clear()  # 确保应用启动时没有遗留的运行实例
 
-    # 再清理意外中断的对局
+    # 再恢复意外中断的对局，并清理已取消的对局
+    recover_interrupted_battles(app)
     cleanup_stale_battles(app)
     # 清理文件不存在的AI代码记录
     cleanup_invalid_ai_codes(app)
+    # 清理没有激活AI的榜单成员 (参与者查询不再顺带删除)
+    cleanup_stale_ranking_members(app)
+    # 管理后台任务的工作线程 (同时标记上次退出时中断的任务)
+    init_admin_jobs(app)
+    # 定期写入本进程的监控指标快照，/metrics 合并所有进程输出
+    init_metrics(app)
     if is_debug:
         # 如果是开发环境，添加性能分析中间件
         # 确定日志文件路径（根目录）
@@ -1,20 +1,37 @@
 # admin.py 完整代码
 from datetime import datetime
 import logging
+import os
 import sys
-from flask import Blueprint, request, jsonify, render_template, abort
+from flask import Blueprint, request, jsonify, render_template, abort, send_file
 from flask_login import login_required, current_user
 from functools import wraps
 from sqlalchemy.orm import joinedload
-from database.models import User, Battle, GameStats, AICode, BattlePlayer
+from database.models import (
+    User,
+    Battle,
+    GameStats,
+    AICode,
+    BattlePlayer,
+    ArchivedBattlePlayer,
+)
 from blueprints.ai_editing_control import ai_editing_control
 from database.promotion import (
     promote_from_multiple_rankings,
-    reset_ranking,
-    reset_stats,
+    reset_rankings,
+)
+from database import (
+    db,
+    get_battle_trace,
+    request_battle_trace_dump,
+    set_ai_code_validation,
+    set_battle_trace,
 )
-from database import db
+from database.rating_replay import create_rating_engine, replay_ranking
+from database.battle_list import get_battle_page
 from utils.automatch_utils import get_automatch
+from services.admin_jobs import admin_job, get_admin_jobs
+from game.decorator import has_trace
 
 # 管理员蓝图
 admin_bp = Blueprint("admin", __name__)
@@ -97,6 +114,9 @@ def delete_user(user_id):
         BattlePlayer.query.filter_by(user_id=target.id).delete(
             synchronize_session=False
         )
+        ArchivedBattlePlayer.query.filter_by(user_id=target.id).delete(
+            synchronize_session=False
+        )
 
         # 2. 删除用户统计数据
         GameStats.query.filter_by(user_id=target.id).delete()
@@ -212,91 +232,252 @@ def reset_password(user_id):
 @login_required
 @admin_required
 def terminate_game(game_id):
-    try:
-        game = Battle.query.get_or_404(game_id)
-        if game.status != "playing":
-            abort(400, description="只能终止进行中的对局")
-
-        # 使用battle_manager取消对战，确保状态在所有地方一致
-        from utils.battle_manager_utils import get_battle_manager
-
-        battle_manager = get_battle_manager()
-
-        # 调用battle_manager的cancel_battle方法
-        reason = f"由管理员 {current_user.username} 手动终止"
-        if battle_manager.cancel_battle(game_id, reason):
-            logging.info(f"对战 {game_id} 已成功取消: {reason}")
-
-            # 处理ELO变化（如果有）
-            battle_players = game.players.all()
-            for bp in battle_players:
-                if bp.elo_change is not None:
-                    stats = GameStats.query.filter_by(user_id=bp.user_id).first()
-                    if stats:
-                        stats.elo_score -= bp.elo_change
-                bp.outcome = "cancelled"
-                bp.elo_change = None
-                db.session.add(bp)
-
-            # 确保对局结束时间设置
-            if not game.ended_at:
-                game.ended_at = datetime.now()
-                db.session.add(game)
-
-            db.session.commit()
-
-            return (
-                jsonify(
-                    {
-                        "message": "对局已终止",
-                        "details": {
-                            "battle_id": game.id,
-                            "cancelled_at": (
-                                game.ended_at.isoformat()
-                                if game.ended_at
-                                else datetime.now().isoformat()
-                            ),
-                            "affected_players": [bp.user_id for bp in battle_players],
-                        },
-                    }
-                ),
-                200,
-            )
-        else:
-            abort(500, description=f"取消对战失败，请检查战局状态")
-
-    except Exception as e:
-        db.session.rollback()
-        logging.error(f"终止对局失败: {str(e)}", exc_info=True)
-        abort(500, description=f"终止对局失败: {str(e)}")
+    game = Battle.query.get_or_404(game_id)
+    if game.status != "playing":
+        abort(400, description="只能终止进行中的对局")
+    reason = f"由管理员 {current_user.username} 手动终止"
+    return _submit_job(
+        "terminate_game", f"终止对局 {game_id}", game_id=game_id, reason=reason
+    )
 
 
 @admin_bp.route("/admin/delete_game/<string:game_id>", methods=["POST"])
 @login_required
 @admin_required
 def delete_game(game_id):
-    try:
-        game = Battle.query.get_or_404(game_id)
-        allowed_statuses = ["completed", "cancelled", "error"]
-        if game.status not in allowed_statuses:
-            abort(400, description="只能删除已结束的对局")
-
-        battle_players = game.players.all()
-        for bp in battle_players:
-            if bp.elo_change is not None and bp.user:
-                stats = GameStats.query.filter_by(user_id=bp.user.id).first()
-                if stats:
-                    stats.elo_score -= bp.elo_change
-                    db.session.add(stats)
-
-        db.session.delete(game)
-        db.session.commit()
-        return jsonify({"message": "对局已删除并恢复Elo"}), 200
+    game = Battle.query.get_or_404(game_id)
+    allowed_statuses = ["completed", "cancelled", "error"]
+    if game.status not in allowed_statuses:
+        abort(400, description="只能删除已结束的对局")
+    return _submit_job("delete_game", f"删除对局 {game_id}", game_id=game_id)
+
+
+@admin_bp.route("/admin/validate_ai_code/<string:ai_id>", methods=["POST"])
+@login_required
+@admin_required
+def validate_ai_code(ai_id):
+    """重新进行冒烟对局校验 (例如校验任务中断，AI一直处于校验中)"""
+    ai_code = AICode.query.get_or_404(ai_id)
+    if not set_ai_code_validation(ai_code.id, "pending"):
+        abort(500, description="更新校验状态失败")
+    return _submit_job(
+        "validate_ai_code",
+        f"校验AI代码 {ai_code.name} ({ai_id})",
+        ai_code_id=ai_id,
+    )
+
+
+# -----------------------------------------------------------------------------------------
+# 后台任务: 耗时的管理操作写入任务表后立即返回 202 和任务ID，由 AdminJobRunner 的工作线程
+# 执行 (见 services/admin_jobs.py)，前端轮询 /admin/jobs/<任务ID>
+
+
+def _submit_job(kind, name, **params):
+    """提交后台任务，返回 202 和任务ID"""
+    job = get_admin_jobs().submit(kind, name, params, created_by=current_user.id)
+    if job is None:
+        abort(500, description=f"提交{name}失败")
+    return (
+        jsonify(
+            {
+                "status": "accepted",
+                "message": f"{name}已提交后台执行",
+                "job_id": job["id"],
+            }
+        ),
+        202,
+    )
+
+
+def _summarize(results, label, verb):
+    """按各榜单结果汇总状态和信息"""
+    success_count = sum(1 for result in results.values() if result == "success")
+    total = len(results)
+    if success_count == total:
+        status, message = (
+            "success",
+            f"成功{verb}所有{label}榜单 ({success_count}/{total})",
+        )
+    elif success_count > 0:
+        status, message = (
+            "partial_success",
+            f"部分{label}榜单{verb}成功 ({success_count}/{total})",
+        )
+    else:
+        status, message = "error", f"所有{label}榜单{verb}失败"
+    return {"status": status, "message": message, "details": results}
 
-    except Exception as e:
-        db.session.rollback()
-        logging.error(f"删除对局失败: {str(e)}")
-        abort(500, description=f"删除对局失败: {str(e)}")
+
+def _start_rankings(ranking_ids, progress=None):
+    """依次启动榜单的自动对战，返回 {榜单ID: "success" / "failure" / 错误信息}"""
+    automatch = get_automatch()
+    results = {}
+    for index, ranking_id in enumerate(ranking_ids):
+        if progress is not None:
+            progress(index, len(ranking_ids), f"正在启动榜单 {ranking_id}")
+        try:
+            started = automatch.start_automatch_for_ranking(ranking_id)
+            results[str(ranking_id)] = "success" if started else "failure"
+        except Exception as e:
+            results[str(ranking_id)] = str(e)
+            logging.error(f"启动榜单 {ranking_id} 时出错: {str(e)}")
+    return results
+
+
+@admin_job("reset_rankings")
+def _reset_rankings_job(label, ranking_ids, clear, progress=None):
+    results = reset_rankings(ranking_ids, clear=clear, progress=progress)
+    return _summarize(results, label, "重置")
+
+
+def _submit_reset_job(label, ranking_ids, clear):
+    """重置 (clear=False) 或清空 (clear=True) 一组榜单"""
+    return _submit_job(
+        "reset_rankings",
+        f"重置{label}榜单",
+        label=label,
+        ranking_ids=list(ranking_ids),
+        clear=clear,
+    )
+
+
+@admin_job("promote_and_start")
+def _promote_and_start_job(
+    label, source_ids, target_ranking_id, start_ids, progress=None
+):
+    """把源榜单的前50%晋级到目标榜单，然后启动 start_ids 榜单的自动对战"""
+    promotion_result = promote_from_multiple_rankings(
+        source_ids, target_ranking_id, percentage=0.5, progress=progress
+    )
+
+    # 记录晋级结果
+    total_promoted = promotion_result["summary"]["success"]
+    logging.info(f"晋级到{label}榜单: 成功晋级 {total_promoted} 名选手")
+    for ranking_id, result in promotion_result["details"].items():
+        logging.info(
+            f"榜单 {ranking_id} 晋级结果: 成功 {result['success']}/{result['total']}"
+        )
+        for error in result["errors"]:
+            logging.warning(f"榜单 {ranking_id} 晋级错误: {error}")
+
+    summary = _summarize(_start_rankings(start_ids), label, "启动")
+    summary["message"] = f"已晋级 {total_promoted} 名选手，{summary['message']}"
+    summary["promotion"] = promotion_result["summary"]
+    return summary
+
+
+@admin_job("start_rankings")
+def _start_rankings_job(ranking_ids, progress=None):
+    return _summarize(_start_rankings(ranking_ids, progress), "指定", "启动")
+
+
+@admin_job("terminate_game")
+def _terminate_game_job(game_id, reason, progress):
+    """取消进行中的对战，撤销已记录的ELO变化"""
+    game = db.session.get(Battle, game_id)
+    if game is None or game.status != "playing":
+        raise ValueError("只能终止进行中的对局")
+
+    # 使用battle_manager取消对战，确保状态在所有地方一致
+    from utils.battle_manager_utils import get_battle_manager
+
+    progress(0, 2, "正在取消对战")
+    if not get_battle_manager().cancel_battle(game_id, reason):
+        raise RuntimeError("取消对战失败，请检查战局状态")
+    logging.info(f"对战 {game_id} 已成功取消: {reason}")
+
+    # 处理ELO变化（如果有）
+    progress(1, 2, "正在撤销ELO变化")
+    db.session.refresh(game)
+    battle_players = game.players.all()
+    for bp in battle_players:
+        if bp.elo_change is not None:
+            stats = GameStats.query.filter_by(user_id=bp.user_id).first()
+            if stats:
+                stats.elo_score -= bp.elo_change
+        bp.outcome = "cancelled"
+        bp.elo_change = None
+        db.session.add(bp)
+
+    # 确保对局结束时间设置
+    if not game.ended_at:
+        game.ended_at = datetime.now()
+        db.session.add(game)
+
+    db.session.commit()
+    return {
+        "status": "success",
+        "message": "对局已终止",
+        "details": {
+            "battle_id": game.id,
+            "cancelled_at": game.ended_at.isoformat(),
+            "affected_players": [bp.user_id for bp in battle_players],
+        },
+    }
+
+
+@admin_job("delete_game")
+def _delete_game_job(game_id, progress):
+    """删除已结束的对战，恢复参与者的ELO"""
+    game = db.session.get(Battle, game_id)
+    if game is None:
+        raise ValueError("对局不存在")
+    if game.status not in ["completed", "cancelled", "error"]:
+        raise ValueError("只能删除已结束的对局")
+
+    battle_players = game.players.all()
+    for index, bp in enumerate(battle_players):
+        progress(index, len(battle_players), "正在恢复Elo")
+        if bp.elo_change is not None and bp.user:
+            stats = GameStats.query.filter_by(user_id=bp.user.id).first()
+            if stats:
+                stats.elo_score -= bp.elo_change
+                db.session.add(stats)
+
+    db.session.delete(game)
+    db.session.commit()
+    return {"status": "success", "message": "对局已删除并恢复Elo"}
+
+
+@admin_bp.route("/admin/jobs")
+@login_required
+@admin_required
+def list_admin_jobs():
+    """
+    最近提交的后台任务，新的在前。
+
+    查询参数:
+        status: 只返回该状态的任务
+        limit: 返回数量，默认 20
+    """
+    limit = min(request.args.get("limit", 20, type=int), 200)
+    jobs = get_admin_jobs().list(limit, request.args.get("status"))
+    return jsonify({"status": "success", "jobs": jobs}), 200
+
+
+@admin_bp.route("/admin/jobs/<string:job_id>")
+@login_required
+@admin_required
+def get_admin_job(job_id):
+    """
+    后台任务的状态: status 为 queued / running / done / failed / cancelled，
+    progress 为完成百分比，结束后 result 为任务结果 (失败或取消时 error 为原因)
+    """
+    job = get_admin_jobs().get(job_id)
+    if job is None:
+        abort(404, description="任务不存在")
+    return jsonify(job), 200
+
+
+@admin_bp.route("/admin/jobs/<string:job_id>/cancel", methods=["POST"])
+@login_required
+@admin_required
+def cancel_admin_job(job_id):
+    """取消排队中或执行中的后台任务 (执行中的任务在下一次报告进度时中止)"""
+    job = get_admin_jobs().cancel(job_id)
+    if job is None:
+        abort(404, description="任务不存在或已结束")
+    return jsonify({"status": "success", "job": job}), 200
 
 
 # Helper function for start/stop actions
@@ -476,51 +657,7 @@ def terminate_auto_test_match():
 @admin_bp.route("/admin/reset_auto_test_match", methods=["POST"])
 @admin_required
 def reset_auto_test_match():
-    primary_ids = range(1)
-    results = {}
-    success_count = 0
-    total = len(list(primary_ids))
-
-    for ranking_id in primary_ids:
-        if reset_stats(ranking_id):
-            success_count += 1
-            results[str(ranking_id)] = "success"
-        else:
-            results[str(ranking_id)] = "failure"
-
-    if success_count == total:
-        return (
-            jsonify(
-                {
-                    "status": "success",
-                    "message": f"成功重置所有测试榜单 ({success_count}/{total})",
-                    "details": results,
-                }
-            ),
-            200,
-        )
-    elif success_count > 0:
-        return (
-            jsonify(
-                {
-                    "status": "partial_success",
-                    "message": f"部分测试榜单重置成功 ({success_count}/{total})",
-                    "details": results,
-                }
-            ),
-            207,
-        )
-    else:
-        return (
-            jsonify(
-                {
-                    "status": "error",
-                    "message": "所有测试榜单重置失败",
-                    "details": results,
-                }
-            ),
-            500,
-        )
+    return _submit_reset_job("测试", range(1), clear=False)
 
 
 @admin_bp.route("/admin/start_auto_primary_match", methods=["POST"])
@@ -568,87 +705,26 @@ def reset_auto_primary_match():
     primary_ids = range(
         PRIMARY_RANKING_START_ID, PRIMARY_RANKING_START_ID + PRIMARY_PARTITION
     )
-    results = {}
-    success_count = 0
-    total = len(list(primary_ids))
-
-    for ranking_id in primary_ids:
-        if reset_stats(ranking_id):
-            success_count += 1
-            results[str(ranking_id)] = "success"
-        else:
-            results[str(ranking_id)] = "failure"
-
-    if success_count == total:
-        return (
-            jsonify(
-                {
-                    "status": "success",
-                    "message": f"成功重置所有初选赛榜单 ({success_count}/{total})",
-                    "details": results,
-                }
-            ),
-            200,
-        )
-    elif success_count > 0:
-        return (
-            jsonify(
-                {
-                    "status": "partial_success",
-                    "message": f"部分初选赛榜单重置成功 ({success_count}/{total})",
-                    "details": results,
-                }
-            ),
-            207,
-        )
-    else:
-        return (
-            jsonify(
-                {
-                    "status": "error",
-                    "message": "所有初选赛榜单重置失败",
-                    "details": results,
-                }
-            ),
-            500,
-        )
+    return _submit_reset_job("初选赛", primary_ids, clear=False)
 
 
 @admin_bp.route("/admin/start_auto_semi_match", methods=["POST"])
 @admin_required
 def start_auto_semi_match():
-
-    # 1. 从榜单1-6的前50%晋级到榜单11
+    # 从榜单1-6的前50%晋级到榜单11，再启动半决赛榜单的自动对战
     primary_ids = list(
         range(PRIMARY_RANKING_START_ID, PRIMARY_RANKING_START_ID + PRIMARY_PARTITION)
     )
-    target_ranking_id = SEMI_RANKING_START_ID  # 榜单11
-
-    # 执行晋级操作
-    promotion_result = promote_from_multiple_rankings(
-        primary_ids, target_ranking_id, percentage=0.5
+    semi_ids = list(
+        range(SEMI_RANKING_START_ID, SEMI_RANKING_START_ID + SEMI_PARTITION)
     )
-
-    # 记录晋级结果
-    total_promoted = promotion_result["summary"]["success"]
-    logging.info(f"从初选赛榜单晋级到半决赛榜单: 成功晋级 {total_promoted} 名选手")
-
-    for ranking_id, result in promotion_result["details"].items():
-        logging.info(
-            f"榜单 {ranking_id} 晋级结果: 成功 {result['success']}/{result['total']}"
-        )
-        if result["errors"]:
-            for error in result["errors"]:
-                logging.warning(f"榜单 {ranking_id} 晋级错误: {error}")
-
-    # 2. 启动半决赛榜单的自动对战
-    semi_ids = range(SEMI_RANKING_START_ID, SEMI_RANKING_START_ID + SEMI_PARTITION)
-    return _handle_match_operation(
-        get_automatch,
-        semi_ids,
-        "start_automatch_for_ranking",
-        "已启动（已完成选手晋级）",
-        "已在运行。",
+    return _submit_job(
+        "promote_and_start",
+        "半决赛晋级",
+        label="半决赛",
+        source_ids=primary_ids,
+        target_ranking_id=SEMI_RANKING_START_ID,
+        start_ids=semi_ids,
     )
 
 
@@ -676,87 +752,26 @@ def terminate_auto_semi_match():
 @admin_required
 def reset_auto_semi_match():
     semi_ids = range(SEMI_RANKING_START_ID, SEMI_RANKING_START_ID + SEMI_PARTITION)
-    results = {}
-    success_count = 0
-    total = len(list(semi_ids))
-
-    for ranking_id in semi_ids:
-        if reset_ranking(ranking_id):
-            success_count += 1
-            results[str(ranking_id)] = "success"
-        else:
-            results[str(ranking_id)] = "failure"
-
-    if success_count == total:
-        return (
-            jsonify(
-                {
-                    "status": "success",
-                    "message": f"成功重置所有半决赛榜单 ({success_count}/{total})",
-                    "details": results,
-                }
-            ),
-            200,
-        )
-    elif success_count > 0:
-        return (
-            jsonify(
-                {
-                    "status": "partial_success",
-                    "message": f"部分半决赛榜单重置成功 ({success_count}/{total})",
-                    "details": results,
-                }
-            ),
-            207,
-        )
-    else:
-        return (
-            jsonify(
-                {
-                    "status": "error",
-                    "message": "所有半决赛榜单重置失败",
-                    "details": results,
-                }
-            ),
-            500,
-        )
+    return _submit_reset_job("半决赛", semi_ids, clear=True)
 
 
 @admin_bp.route("/admin/start_auto_final_match", methods=["POST"])
 @admin_required
 def start_auto_final_match():
-
-    # 1. 从半决赛榜单(11)的前50%晋级到决赛榜单(21)
+    # 从半决赛榜单(11)的前50%晋级到决赛榜单(21)，再启动决赛榜单的自动对战
     semi_ids = list(
         range(SEMI_RANKING_START_ID, SEMI_RANKING_START_ID + SEMI_PARTITION)
     )
-    target_ranking_id = FINAL_RANKING_START_ID  # 榜单21
-
-    # 执行晋级操作
-    promotion_result = promote_from_multiple_rankings(
-        semi_ids, target_ranking_id, percentage=0.5
+    final_ids = list(
+        range(FINAL_RANKING_START_ID, FINAL_RANKING_START_ID + FINAL_PARTITION)
     )
-
-    # 记录晋级结果
-    total_promoted = promotion_result["summary"]["success"]
-    logging.info(f"从半决赛榜单晋级到决赛榜单: 成功晋级 {total_promoted} 名选手")
-
-    for ranking_id, result in promotion_result["details"].items():
-        logging.info(
-            f"榜单 {ranking_id} 晋级结果: 成功 {result['success']}/{result['total']}"
-        )
-        if result["errors"]:
-            for error in result["errors"]:
-                logging.warning(f"榜单 {ranking_id} 晋级错误: {error}")
-
-    # 2. 启动决赛榜单的自动对战
-    final_ids = range(FINAL_RANKING_START_ID, FINAL_RANKING_START_ID + FINAL_PARTITION)
-    return _handle_match_operation(
-        get_automatch,
-        final_ids,
-        "start_automatch_for_ranking",
-        "已启动（已完成选手晋级）",
-        "已在运行。",
+    return _submit_job(
+        "promote_and_start",
+        "决赛晋级",
+        label="决赛",
+        source_ids=semi_ids,
+        target_ranking_id=FINAL_RANKING_START_ID,
+        start_ids=final_ids,
     )
 
 
@@ -784,50 +799,7 @@ def terminate_auto_final_match():
 @admin_required
 def reset_auto_final_match():
     final_ids = range(FINAL_RANKING_START_ID, FINAL_RANKING_START_ID + FINAL_PARTITION)
-    results = {}
-    success_count = 0
-    total = len(list(final_ids))
-
-    for ranking_id in final_ids:
-        if reset_ranking(ranking_id):
-            success_count += 1
-            results[str(ranking_id)] = "success"
-        else:
-            results[str(ranking_id)] = "failure"
-
-    if success_count == total:
-        return (
-            jsonify(
-                {
-                    "status": "success",
-                    "message": f"成功重置所有决赛榜单 ({success_count}/{total})",
-                    "details": results,
-                }
-            ),
-            200,
-        )
-    elif success_count > 0:
-        return (
-            jsonify(
-                {
-                    "status": "partial_success",
-                    "message": f"部分决赛榜单重置成功 ({success_count}/{total})",
-                    "details": results,
-                }
-            ),
-            207,
-        )
-    else:
-        return (
-            jsonify(
-                {
-                    "status": "error",
-                    "message": "所有决赛榜单重置失败",
-                    "details": results,
-                }
-            ),
-            500,
-        )
+    return _submit_reset_job("决赛", final_ids, clear=True)
 
 
 @admin_bp.route("/admin/toggle_admin/<string:user_id>", methods=["POST"])
@@ -892,6 +864,68 @@ def get_users():
         abort(500, description="获取用户列表失败")
 
 
+@admin_bp.route("/admin/battles")
+@login_required
+@admin_required
+def get_battles():
+    """
+    对战列表 (游标分页)
+
+    查询参数:
+        status, ranking_id: 过滤条件 (status=ready 查看待启动的对局)
+        per_page: 每页条数，默认 20
+        after / before: 上一次响应中的 next_cursor / prev_cursor
+        total: estimate (默认) / exact / none
+    """
+    total = request.args.get("total", "estimate")
+    if total not in ("estimate", "exact", "none"):
+        abort(400, description="total 只能是 estimate、exact 或 none")
+    filters = {
+        "status": request.args.get("status") or None,
+        "ranking_id": request.args.get("ranking_id", type=int),
+    }
+    try:
+        page = get_battle_page(
+            filters=filters,
+            limit=request.args.get("per_page", 20, type=int),
+            after=request.args.get("after") or None,
+            before=request.args.get("before") or None,
+            total=None if total == "none" else total,
+        )
+    except ValueError as e:
+        abort(400, description=str(e))
+    if page is None:
+        abort(500, description="获取对战列表失败")
+
+    battles = page.pop("items")
+    return (
+        jsonify(
+            {
+                "battles": [
+                    {
+                        "id": battle.id,
+                        "status": battle.status,
+                        "ranking_id": battle.ranking_id,
+                        "battle_type": battle.battle_type,
+                        "is_elo_exempt": battle.is_elo_exempt,
+                        "winner": battle.winner,
+                        "win_reason": battle.win_reason,
+                        "created_at": (
+                            battle.created_at.isoformat() if battle.created_at else None
+                        ),
+                        "ended_at": (
+                            battle.ended_at.isoformat() if battle.ended_at else None
+                        ),
+                    }
+                    for battle in battles
+                ],
+                "pagination": page,
+            }
+        ),
+        200,
+    )
+
+
 @admin_bp.route("/admin/dashboard")
 @login_required
 @admin_required
@@ -960,32 +994,183 @@ def freeze_code():
     return jsonify({"message": "代码已冻结"}), 200
 
 
+@admin_job("replay_ratings")
+def _replay_ratings_job(ranking_id, engine, params, apply, limit, progress=None):
+    """重放榜单评分，报告 (前 limit 名玩家) 作为任务结果"""
+    if apply:
+        # 写回是覆盖式的，自动对战进行中会与新结算互相覆盖
+        status = get_automatch().get_status_for_ranking(ranking_id)
+        if status and status.get("is_on"):
+            raise RuntimeError(f"榜单 {ranking_id} 的自动对战正在运行，请先停止再写回")
+
+    if progress is not None:
+        progress(0, 1, "正在重放评分")
+    report = replay_ranking(ranking_id, engine=engine, apply=apply, **params)
+    if report is None:
+        raise RuntimeError("评分重放失败")
+    report["players"] = report["players"][:limit]
+    return {"status": "success", **report}
+
+
+@admin_bp.route("/admin/replay_ranking/<int:ranking_id>", methods=["POST"])
+@login_required
+@admin_required
+def replay_ranking_ratings(ranking_id):
+    """
+    按对战历史重放榜单评分 (后台任务，报告为任务结果)。
+
+    请求体 (JSON，均可选):
+        engine: elo (默认) / glicko2 / trueskill
+        params: 引擎参数，例如 {"k_factor": 20, "team_mean": "arithmetic"}
+        apply: 为 true 时写回 GameStats，默认只返回对比报告 (dry-run)
+        limit: 报告中返回的玩家数，默认 100
+    """
+    data = request.get_json(silent=True) or {}
+    engine = data.get("engine", "elo")
+    params = data.get("params") or {}
+    apply = bool(data.get("apply", False))
+    if not isinstance(params, dict):
+        abort(400, description="params必须是对象")
+    try:
+        limit = int(data.get("limit", 100))
+        # 引擎名称和参数在提交前校验
+        create_rating_engine(engine, **params)
+    except (TypeError, ValueError) as e:
+        abort(400, description=str(e))
+
+    return _submit_job(
+        "replay_ratings",
+        f"{'重放并写回' if apply else '试算'}榜单 {ranking_id} 评分",
+        ranking_id=ranking_id,
+        engine=engine,
+        params=params,
+        apply=apply,
+        limit=limit,
+    )
+
+
+@admin_job("archive_battles")
+def _archive_battles_job(older_than_days, progress=None):
+    """抢占 battle_archive 租约后分批归档，每批提交后报告进度 (可取消)"""
+    from utils.battle_manager_utils import get_shared_battle_service
+
+    archiver = get_shared_battle_service().archiver
+    archived = archiver.archive_now(older_than_days, progress=progress)
+    if archived is None:
+        raise RuntimeError(
+            "其他进程本轮已经或正在归档 (battle_archive 租约)，请稍后重试"
+        )
+    return {"status": "success", "archived": archived}
+
+
+@admin_bp.route("/admin/archive_battles", methods=["POST"])
+@login_required
+@admin_required
+def archive_old_battles():
+    """
+    立即归档结束较久的对战 (后台任务，平时由归档线程定期执行)。
+
+    请求体 (JSON，可选):
+        older_than_days: 归档阈值 (天)，默认 BATTLE_ARCHIVE_AFTER_DAYS
+    """
+    data = request.get_json(silent=True) or {}
+    older_than_days = data.get("older_than_days")
+    if older_than_days is not None:
+        try:
+            older_than_days = float(older_than_days)
+        except (TypeError, ValueError):
+            abort(400, description="older_than_days必须是数字")
+        if older_than_days < 0:
+            abort(400, description="older_than_days不能为负数")
+
+    return _submit_job(
+        "archive_battles", "归档已结束的对战", older_than_days=older_than_days
+    )
+
+
+@admin_bp.route("/admin/battle_trace/<string:battle_id>", methods=["GET", "POST"])
+@login_required
+@admin_required
+def battle_trace(battle_id):
+    """
+    查看或设置对战的调用追踪 (见 game/decorator.py)。
+
+    GET: 返回追踪设置和导出状态，?download=1 下载已导出的追踪文件
+    POST 请求体 (JSON):
+        sample_rate: 0 ~ 1 (默认 1)，0 为关闭；执行中的对战在几秒内生效
+    """
+    Battle.query.get_or_404(battle_id)
+    if request.method == "GET":
+        trace = get_battle_trace(battle_id)
+        if request.args.get("download"):
+            if not trace or not trace["dump_path"]:
+                abort(404, description="追踪记录尚未导出")
+            if not os.path.exists(trace["dump_path"]):
+                abort(404, description="追踪文件不存在")
+            return send_file(
+                trace["dump_path"],
+                mimetype="text/plain",
+                as_attachment=True,
+                download_name=f"trace_{battle_id}.log",
+            )
+        return jsonify({"status": "success", "trace": trace}), 200
+
+    data = request.get_json(silent=True) or {}
+    try:
+        sample_rate = float(data.get("sample_rate", 1.0))
+    except (TypeError, ValueError):
+        abort(400, description="sample_rate必须是数字")
+    if not 0 <= sample_rate <= 1:
+        abort(400, description="sample_rate必须在0到1之间")
+    trace = set_battle_trace(battle_id, sample_rate)
+    if trace is None:
+        abort(500, description="设置追踪失败")
+    return jsonify({"status": "success", "trace": trace}), 200
+
+
+@admin_bp.route("/admin/battle_trace/<string:battle_id>/dump", methods=["POST"])
+@login_required
+@admin_required
+def dump_battle_trace(battle_id):
+    """导出对战的追踪记录；记录在其他进程中时由该进程在几秒内导出，返回 202"""
+    from utils.battle_manager_utils import get_battle_manager
+
+    Battle.query.get_or_404(battle_id)
+    trace = request_battle_trace_dump(battle_id)
+    if trace is None:
+        abort(500, description="请求导出追踪失败")
+    if has_trace(battle_id) and get_battle_manager().dump_battle_trace(battle_id):
+        return jsonify({"status": "success", "trace": get_battle_trace(battle_id)}), 200
+    return (
+        jsonify(
+            {
+                "status": "accepted",
+                "message": "已请求导出，由持有追踪记录的进程导出",
+                "trace": trace,
+            }
+        ),
+        202,
+    )
+
+
 # 启动指定ranking_id范围的榜单，当前未被使用
 @admin_bp.route("/admin/start_rankings", methods=["POST"])
 @login_required
 @admin_required
 def start_specific_rankings():
     """启动指定ID范围的榜单"""
-    try:
-        data = request.get_json()
-        if not data or "ranking_ids" not in data:
-            abort(400, description="请求需要包含ranking_ids参数")
-
-        ranking_ids = data.get("ranking_ids", [])
-        if not ranking_ids or not isinstance(ranking_ids, list):
-            return (
-                jsonify({"status": "error", "message": "ranking_ids必须是非空ID列表"}),
-                400,
-            )
+    data = request.get_json(silent=True)
+    if not data or "ranking_ids" not in data:
+        abort(400, description="请求需要包含ranking_ids参数")
 
-        # 调用通用处理函数
-        return _handle_match_operation(
-            get_automatch,
-            ranking_ids,  # 直接使用提供的ID列表
-            "start_automatch_for_ranking",
-            "已启动",
-            "启动失败",
+    ranking_ids = data.get("ranking_ids", [])
+    if not ranking_ids or not isinstance(ranking_ids, list):
+        return (
+            jsonify({"status": "error", "message": "ranking_ids必须是非空ID列表"}),
+            400,
         )
-    except Exception as e:
-        logging.error(f"启动指定榜单失败: {str(e)}")
-        return jsonify({"status": "error", "message": f"启动失败: {str(e)}"}), 500
+    try:
+        ranking_ids = [int(ranking_id) for ranking_id in ranking_ids]
+    except (TypeError, ValueError):
+        abort(400, description="ranking_ids必须是整数列表")
+    return _submit_job("start_rankings", "启动指定榜单", ranking_ids=ranking_ids)
@@ -34,6 +34,7 @@ from database import (
     delete_ai_code as db_delete_ai_code,
     get_user_active_ai_code as db_get_user_active_ai_code,
     get_ai_code_path_full as db_get_ai_code_path_full,
+    set_ai_code_validation as db_set_ai_code_validation,
     get_user_by_id as db_get_user_by_id,
     get_available_ai_instances,
     update_battle_player_count,
@@ -46,7 +47,16 @@ from database import (
 )
 from database.models import AICode, BattlePlayer  # 仍然需要模型用于类型提示或特定查询
 from blueprints.ai_editing_control import ai_editing_control
+from game.code_validator import (
+    SMOKE_TIMEOUT_SECONDS,
+    check_source,
+    compile_artifact,
+    run_smoke_game,
+)
+from services.admin_jobs import admin_job, get_admin_jobs
 from datetime import datetime
+import hashlib
+import py_compile
 import importlib.util
 import sys
 import inspect
@@ -169,6 +179,23 @@ def upload_ai():
             os.makedirs(os.path.dirname(full_path), exist_ok=True)
             file.save(full_path)
 
+            # 上传时静态检查，问题代码不入库 (冒烟对局见下方的后台任务)
+            with open(full_path, "rb") as f:
+                source = f.read()
+            try:
+                errors = check_source(source.decode("utf-8"), filename)
+            except UnicodeDecodeError:
+                errors = ["文件不是 UTF-8 编码"]
+            if errors:
+                os.remove(full_path)
+                for error in errors:
+                    flash(f"AI代码校验未通过: {error}", "danger")
+                return redirect(request.url)
+            try:
+                compile_artifact(full_path)
+            except py_compile.PyCompileError as e:
+                current_app.logger.warning(f"预编译AI代码 {full_path} 失败: {e}")
+
             name = request.form.get("name", "我的AI")
             description = request.form.get("description", "")
             make_active = request.form.get("make_active") == "on"
@@ -198,6 +225,9 @@ def upload_ai():
                         )
 
                 flash("AI代码上传成功！", "success")
+                _submit_validation(
+                    new_ai_code, hashlib.sha256(source).hexdigest(), current_user.id
+                )
                 # 如果需要设为激活
                 if make_active:
                     if db_set_active_ai_code(current_user.id, new_ai_code.id):
@@ -217,6 +247,45 @@ def upload_ai():
     return render_template("ai/upload.html")
 
 
+def _submit_validation(ai_code, code_hash=None, created_by=None):
+    """
+    把AI代码标记为校验中并提交冒烟对局任务。
+
+    返回:
+        bool: 是否提交成功 (失败时保持未校验状态，不影响参赛)。
+    """
+    if not db_set_ai_code_validation(ai_code.id, "pending", code_hash=code_hash):
+        return False
+    job = get_admin_jobs().submit(
+        "validate_ai_code",
+        f"校验AI代码 {ai_code.name} ({ai_code.id})",
+        {"ai_code_id": ai_code.id},
+        created_by=created_by,
+    )
+    if job is None:
+        db_set_ai_code_validation(ai_code.id, None)
+        flash("提交AI代码校验失败，请稍后重试", "warning")
+        return False
+    flash("正在后台进行冒烟对局校验，通过后才会参加自动对战", "info")
+    return True
+
+
+@admin_job("validate_ai_code")
+def _validate_ai_code_job(ai_code_id, progress):
+    """与 idiot_player 进行一局冒烟对局，记录校验结论"""
+    path = db_get_ai_code_path_full(ai_code_id)
+    if path is None:
+        raise ValueError("AI代码不存在")
+    progress(0, 1, "正在进行冒烟对局")
+    ok, error = run_smoke_game(
+        path, current_app.config.get("AI_SMOKE_TIMEOUT", SMOKE_TIMEOUT_SECONDS)
+    )
+    status = "valid" if ok else "invalid"
+    if not db_set_ai_code_validation(ai_code_id, status, error):
+        raise RuntimeError("记录校验结论失败")
+    return {"status": status, "error": error}
+
+
 # 注意：路由参数类型应与模型ID类型匹配 (String)
 @ai_bp.route("/activate_ai/<string:ai_id>", methods=["POST"])
 @login_required
@@ -29,12 +29,17 @@ from database import (
     create_battle as db_create_battle,
     get_battle_by_id as db_get_battle_by_id,
     get_battle_players_for_battle as db_get_battle_players_for_battle,
+    get_battle_players_for_battles as db_get_battle_players_for_battles,
     get_user_ai_codes as db_get_user_ai_codes,
-    get_battles_paginated_filtered,
+    get_battle_page,
     get_available_ai_instances,
     create_battle_instance,
     add_player_to_battle,
     get_recent_battles as db_get_recent_battles,
+    get_battle_summary as db_get_battle_summary,
+    ensure_battle_summaries,
+    get_archived_battle,
+    get_archived_battle_players,
 )
 from database.models import Battle, BattlePlayer, User, AICode
 from database import db
@@ -354,6 +359,10 @@ def view_battle(battle_id):
     """显示对战详情页面（进行中或已完成）"""
     battle = db_get_battle_by_id(battle_id)
     if not battle:
+        if get_archived_battle(battle_id) is not None:
+            # 已归档的对战只保留存根，详情由回放页提供
+            flash("该对战已归档，仅提供回放", "info")
+            return redirect(url_for("visualizer.game_replay", game_id=battle_id))
         flash("对战不存在", "danger")
         return redirect(url_for("game.lobby"))
 
@@ -371,422 +380,70 @@ def view_battle(battle_id):
     error_info_raw = {
         "battle_id": battle_id,
         "error_or_NOT": None,
-        # "error_type": None,
         "error_user_id": None,
         "error_username": None,
         "error_pid_in_game": None,
-        # "error_code_method": None,
         "error_msg": None,
-        # "elo_initial": None,
-        # "elo_change": None,
-        # "elo_final": None,
-        # "friendly_msg": None,
     }
 
-    if battle.status == "completed" or battle.status == "error":
-        # battle.results 存储了JSON字符串
-        try:
-            if battle.results:
-                game_result = json.loads(battle.results)
-                # 确保game_result有roles键，即使它是空的
-                if "roles" not in game_result:
-                    game_result["roles"] = {}
+    # 结果摘要在对战结束时写入 (见 database/battle_summary.py)，这里只读一次
+    summary = (
+        db_get_battle_summary(battle)
+        if battle.status in ("completed", "error", "cancelled")
+        else None
+    )
+    if summary is not None:
+        game_result = summary.to_dict()
 
-            if battle.status == "error":
+        if battle.status == "error":
+            error_info_raw["error_or_NOT"] = "error"
+            error_info_raw["error_msg"] = (
+                summary.traceback or "未能提取traceback，请自行排查错误"
+            )
 
-                PUBLIC_LIB_FILE_DIR = os.path.join(
-                    ".", "data", battle_id, f"public_game_{battle_id}.json"
+            error_pid_in_game = summary.error_pid
+            if summary.error_type is None:
+                error_info["error_msg"] = (
+                    f"游戏错误: {summary.error}"
+                    if summary.error
+                    else "未找到具体错误信息"
                 )
-
-                if not PUBLIC_LIB_FILE_DIR:
-                    logger.error(f"[Battle {battle_id}] 缺少公共日志文件路径")
-                    error_info["error_msg"] = (
-                        "无法获取对战详细错误信息：缺少日志文件路径"
+            elif error_pid_in_game is None or not 1 <= error_pid_in_game <= 7:
+                error_info["error_msg"] = f"无效的错误玩家PID: {error_pid_in_game}"
+            elif summary.error_user_id is None:
+                error_info["error_msg"] = (
+                    f"无法识别玩家：索引 {error_pid_in_game - 1} 超出范围"
+                )
+            else:
+                err_user_id = summary.error_user_id
+                err_user = get_user_by_id(err_user_id)
+                err_username = err_user.username if err_user else f"玩家 {err_user_id}"
+
+                # 包装错误信息
+                error_info["error_type"] = summary.error_type
+                error_info["error_user_id"] = err_user_id
+                error_info["error_username"] = err_username
+                error_info["error_pid_in_game"] = error_pid_in_game
+                error_info["error_code_method"] = summary.error_method
+                error_info["error_msg"] = summary.error_message
+
+                error_info_raw["error_user_id"] = err_user_id
+                error_info_raw["error_username"] = err_username
+                error_info_raw["error_pid_in_game"] = error_pid_in_game
+
+                # 计算ELO扣分
+                err_player = next(
+                    (bp for bp in battle_players if bp.user_id == err_user_id), None
+                )
+                if err_player:
+                    error_info["elo_initial"] = err_player.initial_elo
+                    error_info["elo_change"] = err_player.elo_change
+                    error_info["elo_final"] = err_player.initial_elo + (
+                        err_player.elo_change or 0
                     )
 
-                    error_info_raw["error_or_NOT"] = "error"
-                    error_info_raw["error_msg"] = (
-                        "这里是line411标识行，无共有库路径，请自行排查错误"
-                    )
-                else:
-                    # 读取公共日志获取错误玩家
-                    try:
-                        with open(PUBLIC_LIB_FILE_DIR, "r", encoding="utf-8") as plib:
-                            data = json.load(plib)
-                            # 从日志中查找错误记录（从后向前搜索）
-                            error_record = None
-                            error_raw_record = False  # 记录是否找到traceback
-                            for record in reversed(data):
-                                if "type" in record and record["type"] in [
-                                    "critical_player_ERROR",
-                                    "player_ruturn_ERROR",
-                                ]:
-                                    error_record = record
-                                    break
-
-                            for record in reversed(data):
-                                # 检查result中是否有traceback
-                                if (
-                                    "result" in record
-                                    and "traceback" in record["result"]
-                                ):
-                                    # 找到traceback
-                                    error_info_raw["error_or_NOT"] = "error"
-                                    error_info_raw["error_msg"] = record["result"][
-                                        "traceback"
-                                    ]
-                                    error_raw_record = True
-                                    break
-
-                                # 检查是否有traceback
-                                if "traceback" in record and record["traceback"]:
-                                    # 找到traceback
-                                    error_info_raw["error_or_NOT"] = "error"
-                                    error_info_raw["error_msg"] = record["traceback"]
-
-                                    error_raw_record = True
-                                    break
-
-                            if error_raw_record == False:
-                                # 如果没有找到traceback，使用默认错误信息
-                                error_info_raw["error_or_NOT"] = "error"
-                                error_info_raw["error_msg"] = (
-                                    "这里是line454标识行，两次未能提取traceback，请自行排查错误"
-                                )
-
-                            if error_record:
-                                error_pid_in_game = error_record.get("error_code_pid")
-                                if (
-                                    error_pid_in_game is not None
-                                    and 1 <= error_pid_in_game <= 7
-                                ):
-                                    error_type = error_record.get("type")
-                                    error_code_method = error_record.get(
-                                        "error_code_method"
-                                    )
-                                    error_msg = error_record.get("error_msg")
-
-                                    # 提取错误玩家的用户ID
-                                    err_player_index = error_pid_in_game - 1
-                                    if err_player_index < len(battle_players):
-                                        err_user_id = battle_players[
-                                            err_player_index
-                                        ].user_id
-
-                                        # 获取玩家信息
-                                        err_user = get_user_by_id(err_user_id)
-                                        err_username = (
-                                            err_user.username
-                                            if err_user
-                                            else f"玩家 {err_user_id}"
-                                        )
-
-                                        # 包装错误信息
-                                        error_info["error_type"] = error_type
-                                        error_info["error_user_id"] = err_user_id
-                                        error_info["error_username"] = err_username
-                                        error_info["error_pid_in_game"] = (
-                                            error_pid_in_game
-                                        )
-                                        error_info["error_code_method"] = (
-                                            error_code_method
-                                        )
-                                        error_info["error_msg"] = error_msg
-
-                                        # # raw
-                                        # error_info_raw["error_or_NOT"] = "error"
-                                        # error_info_raw["error_type"] = error_type
-                                        error_info_raw["error_user_id"] = err_user_id
-                                        error_info_raw["error_username"] = err_username
-                                        error_info_raw["error_pid_in_game"] = (
-                                            error_pid_in_game
-                                        )
-                                        # error_info_raw["error_code_method"] = (
-                                        #     error_code_method
-                                        # )
-                                        # error_info_raw["error_msg"] = error_msg
-
-                                        # 计算ELO扣分
-                                        err_player = next(
-                                            (
-                                                bp
-                                                for bp in battle_players
-                                                if bp.user_id == err_user_id
-                                            ),
-                                            None,
-                                        )
-                                        if err_player:
-                                            error_info["elo_initial"] = (
-                                                err_player.initial_elo
-                                            )
-                                            error_info["elo_change"] = (
-                                                err_player.elo_change
-                                            )
-                                            error_info["elo_final"] = (
-                                                err_player.initial_elo
-                                                + err_player.elo_change
-                                            )
-
-                                        # 优化错误信息显示（针对常见错误类型）
-                                        if error_code_method == "walk":
-                                            if "direction type" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "移动方向必须是字符串类型（如'up'、'down'、'left'、'right'），而非数字或其他类型"
-                                                )
-                                            elif "invalid move" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "移动方向无效，必须是'up'、'down'、'left'、'right'之一"
-                                                )
-                                            elif "occupied position" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "移动位置已被其他玩家占据"
-                                                )
-                                            else:
-                                                error_info["friendly_msg"] = (
-                                                    "移动操作出现错误"
-                                                )
-                                        elif (
-                                            error_code_method == "decide_mission_member"
-                                        ):
-                                            if "non-list" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "选择队员函数必须返回列表类型"
-                                                )
-                                            elif "invalid member" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "选择的队员ID无效，必须是1-7之间的整数"
-                                                )
-                                            elif "duplicate member" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "选择了重复的队员"
-                                                )
-                                            elif "many(few)" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "选择的队员数量不符合要求"
-                                                )
-                                            else:
-                                                error_info["friendly_msg"] = (
-                                                    "队伍选择操作出现错误"
-                                                )
-                                        elif error_code_method == "mission_vote2":
-                                            if "non-bool" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "任务投票必须返回布尔值（True/False）"
-                                                )
-                                            elif (
-                                                "Blue player" in error_msg
-                                                and "against execution" in error_msg
-                                            ):
-                                                error_info["friendly_msg"] = (
-                                                    "蓝方玩家不允许对任务投失败票"
-                                                )
-                                            else:
-                                                error_info["friendly_msg"] = (
-                                                    "任务投票操作出现错误"
-                                                )
-                                        elif error_code_method == "say":
-                                            if "non-string speech" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "发言函数必须返回字符串"
-                                                )
-                                            else:
-                                                error_info["friendly_msg"] = (
-                                                    "发言操作出现错误"
-                                                )
-                                        elif error_code_method == "assass":
-                                            if "invalid target" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "刺杀目标无效，必须是1-7之间的整数（且不能是自己）"
-                                                )
-                                            elif "targeted himself" in error_msg:
-                                                error_info["friendly_msg"] = (
-                                                    "刺客不能刺杀自己"
-                                                )
-                                            else:
-                                                error_info["friendly_msg"] = (
-                                                    "刺杀操作出现错误"
-                                                )
-                                        elif error_code_method == "__init__":
-                                            error_info["friendly_msg"] = (
-                                                "AI代码初始化失败，这可能是由于代码语法错误或类定义问题"
-                                            )
-                                        else:
-                                            # 通用错误提示
-                                            error_info["friendly_msg"] = (
-                                                f"AI代码在执行 {error_code_method} 函数时出现错误"
-                                            )
-                                    else:
-                                        error_info["error_msg"] = (
-                                            f"无法识别玩家：索引 {err_player_index} 超出范围"
-                                        )
-                                else:
-                                    error_info["error_msg"] = (
-                                        f"无效的错误玩家PID: {error_pid_in_game}"
-                                    )
-                            else:
-                                # 如果找不到标准错误记录，尝试查找最后一条记录
-                                last_record = data[-1] if data else None
-                                if last_record and "error" in str(last_record):
-                                    error_info["error_msg"] = (
-                                        f"游戏错误: {last_record.get('error', '未知错误')}"
-                                    )
-
-                                    # 尝试从错误消息提取更多信息
-                                    if isinstance(last_record.get("error"), str):
-                                        error_msg = last_record.get("error")
-
-                                        # 尝试从错误消息中提取玩家ID
-                                        import re
-
-                                        player_match = re.search(
-                                            r"Player (\d+)", error_msg
-                                        )
-                                        if player_match:
-                                            try:
-                                                pid = int(player_match.group(1))
-                                                if 1 <= pid <= 7 and pid - 1 < len(
-                                                    battle_players
-                                                ):
-                                                    err_user_id = battle_players[
-                                                        pid - 1
-                                                    ].user_id
-                                                    err_user = get_user_by_id(
-                                                        err_user_id
-                                                    )
-                                                    error_info["error_user_id"] = (
-                                                        err_user_id
-                                                    )
-                                                    error_info["error_username"] = (
-                                                        err_user.username
-                                                        if err_user
-                                                        else f"玩家 {err_user_id}"
-                                                    )
-                                                    error_info["error_pid_in_game"] = (
-                                                        pid
-                                                    )
-
-                                                    error_info_raw["error_user_id"] = (
-                                                        err_user_id
-                                                    )
-                                                    error_info_raw["error_username"] = (
-                                                        err_user.username
-                                                        if err_user
-                                                        else None
-                                                    )
-                                                    error_info_raw[
-                                                        "error_pid_in_game"
-                                                    ] = pid
-
-                                                    # 尝试提取错误方法
-                                                    method_match = re.search(
-                                                        r"method '([^']+)'|executing ([^ ]+)",
-                                                        error_msg,
-                                                    )
-                                                    if method_match:
-                                                        method = method_match.group(
-                                                            1
-                                                        ) or method_match.group(2)
-                                                        error_info[
-                                                            "error_code_method"
-                                                        ] = method
-
-                                                        # 添加友好错误消息
-                                                        if "walk" in method:
-                                                            error_info[
-                                                                "friendly_msg"
-                                                            ] = "移动操作出现错误"
-                                                        elif "mission" in method:
-                                                            error_info[
-                                                                "friendly_msg"
-                                                            ] = "任务相关操作出现错误"
-                                                        else:
-                                                            error_info[
-                                                                "friendly_msg"
-                                                            ] = f"AI代码在执行 {method} 函数时出现错误"
-                                            except (ValueError, IndexError) as e:
-                                                logger.error(
-                                                    f"[Battle {battle_id}] 尝试提取玩家ID时出错: {str(e)}"
-                                                )
-                                else:
-                                    error_info["error_msg"] = "未找到具体错误信息"
-                    except Exception as e:
-                        logger.error(
-                            f"[Battle {battle_id}] 读取公共日志失败: {str(e)}",
-                            exc_info=True,
-                        )
-                        error_info["error_msg"] = f"读取错误日志失败: {str(e)}"
-
-                        try:
-                            # 尝试从原始数据中提取traceback
-                            for record in reversed(data):
-                                # 检查result中是否有traceback
-                                if (
-                                    "result" in record
-                                    and "traceback" in record["result"]
-                                ):
-                                    # 找到traceback
-                                    error_info_raw["error_or_NOT"] = "error"
-                                    error_info_raw["error_msg"] = record["result"][
-                                        "traceback"
-                                    ]
-                                    break
-                                # 检查是否有traceback
-                                if "traceback" in record and record["traceback"]:
-                                    # 找到traceback
-                                    error_info_raw["error_or_NOT"] = "error"
-                                    error_info_raw["error_msg"] = record["traceback"]
-                                    break
-
-                        except Exception as e_:
-                            # 如果没有找到traceback，使用默认错误信息
-                            error_info_raw["error_or_NOT"] = "error"
-                            error_info_raw["error_msg"] = (
-                                f"这里是line744标识行，未能提取traceback，请自行排查错误\n部分信息：{str(e)}"
-                            )
-
-        except Exception as e:
-            logger.error(
-                f"无法解析对战 {battle_id} 的结果JSON: {str(e)}", exc_info=True
-            )
-            game_result = {"error": "结果解析失败", "roles": {}}  # 确保有roles键
-            error_info["error_msg"] = f"结果解析失败: {str(e)}"
-
-            try:
-                for record in reversed(data):
-                    # 检查result中是否有traceback
-                    if "result" in record and "traceback" in record["result"]:
-                        # 找到traceback
-                        error_info_raw["error_or_NOT"] = "error"
-                        error_info_raw["error_msg"] = record["result"]["traceback"]
-                        break
-                    # 检查是否有traceback
-                    if "traceback" in record and record["traceback"]:
-                        # 找到traceback
-                        error_info_raw["error_or_NOT"] = "error"
-                        error_info_raw["error_msg"] = record["traceback"]
-                        break
-
-                    if (
-                        "event_type" in record
-                        and record["event_type"] == "Bug"
-                        and "traceback" in record["event_data"]
-                    ):
-                        # 使用正则表达式提取 traceback 部分
-                        error_message = record["event_data"]
-                        pattern = r"Traceback.*"
-                        match = re.search(pattern, error_message, re.DOTALL)
-
-                        if match:
-                            # 找到traceback
-                            error_info_raw["error_or_NOT"] = "error"
-                            error_info_raw["error_msg"] = match.group(0)
-                            break
-
-            except Exception as e_:
-                # 未能提取traceback
-                error_info_raw["error_or_NOT"] = "error"
-                error_info_raw["error_msg"] = (
-                    f"这里是line789标识行，三次尝试未能提取traceback，请自行排查错误\n部分信息：{str(e_)}"
+                error_info["friendly_msg"] = _friendly_error_message(
+                    summary.error_method, summary.error_message or ""
                 )
 
     # 根据状态渲染不同模板或页面部分
@@ -814,6 +471,48 @@ def view_battle(battle_id):
         return redirect(url_for("game.lobby"))
 
 
+def _friendly_error_message(error_code_method, error_msg):
+    """针对常见错误类型给出更易懂的错误说明"""
+    if error_code_method == "walk":
+        if "direction type" in error_msg:
+            return "移动方向必须是字符串类型（如'up'、'down'、'left'、'right'），而非数字或其他类型"
+        if "invalid move" in error_msg:
+            return "移动方向无效，必须是'up'、'down'、'left'、'right'之一"
+        if "occupied position" in error_msg:
+            return "移动位置已被其他玩家占据"
+        return "移动操作出现错误"
+    if error_code_method == "decide_mission_member":
+        if "non-list" in error_msg:
+            return "选择队员函数必须返回列表类型"
+        if "invalid member" in error_msg:
+            return "选择的队员ID无效，必须是1-7之间的整数"
+        if "duplicate member" in error_msg:
+            return "选择了重复的队员"
+        if "many(few)" in error_msg:
+            return "选择的队员数量不符合要求"
+        return "队伍选择操作出现错误"
+    if error_code_method == "mission_vote2":
+        if "non-bool" in error_msg:
+            return "任务投票必须返回布尔值（True/False）"
+        if "Blue player" in error_msg and "against execution" in error_msg:
+            return "蓝方玩家不允许对任务投失败票"
+        return "任务投票操作出现错误"
+    if error_code_method == "say":
+        if "non-string speech" in error_msg:
+            return "发言函数必须返回字符串"
+        return "发言操作出现错误"
+    if error_code_method == "assass":
+        if "invalid target" in error_msg:
+            return "刺杀目标无效，必须是1-7之间的整数（且不能是自己）"
+        if "targeted himself" in error_msg:
+            return "刺客不能刺杀自己"
+        return "刺杀操作出现错误"
+    if error_code_method == "__init__":
+        return "AI代码初始化失败，这可能是由于代码语法错误或类定义问题"
+    # 通用错误提示
+    return f"AI代码在执行 {error_code_method} 函数时出现错误"
+
+
 # 添加到game.py中，用于处理测试对战的创建
 
 
@@ -1020,6 +719,20 @@ def get_game_status(battle_id):
 
 
 # 可能需要添加获取对战列表的API
+def _battle_summary_fields(summary):
+    """对战列表中附带的结果摘要字段 (对战未结束时均为 None)"""
+    return {
+        "winner": summary.winner if summary else None,
+        "win_reason": summary.win_reason if summary else None,
+        "rounds_played": summary.rounds_played if summary else None,
+        "blue_wins": summary.blue_wins if summary else None,
+        "red_wins": summary.red_wins if summary else None,
+        "error_pid": summary.error_pid if summary else None,
+        "error_user_id": summary.error_user_id if summary else None,
+        "duration_seconds": summary.duration_seconds if summary else None,
+    }
+
+
 @game_bp.route("/get_battles", methods=["GET"])
 def get_battles():
     """获取对战列表（例如，最近的、进行中的）"""
@@ -1029,11 +742,11 @@ def get_battles():
     # waiting_battles = Battle.query.filter_by(status='waiting').order_by(Battle.created_at.desc()).limit(10).all()
 
     # 简化：只返回最近完成的
+    summaries = ensure_battle_summaries(recent_completed)
+    players = db_get_battle_players_for_battles([b.id for b in recent_completed])
     battles_data = []
     for battle in recent_completed:
-        players_info = [
-            bp.to_dict() for bp in db_get_battle_players_for_battle(battle.id)
-        ]
+        players_info = [bp.to_dict() for bp in players.get(battle.id, [])]
         battles_data.append(
             {
                 "id": battle.id,
@@ -1043,7 +756,7 @@ def get_battles():
                 ),
                 "ended_at": battle.ended_at.isoformat() if battle.ended_at else None,
                 "players": players_info,
-                # 可以添加获胜方等摘要信息
+                **_battle_summary_fields(summaries.get(battle.id)),
             }
         )
 
@@ -1112,9 +825,17 @@ def download_private(battle_id):
 
         # 3'. 找人
         battle = db_get_battle_by_id(battle_id)
-        if not battle:
+        if battle:
+            players_id = [player.id for player in battle.get_players()]
+        else:
+            # 已归档的对战从归档表读取座位
+            players_id = [
+                bp.user_id
+                for bp in get_archived_battle_players(battle_id)
+                if bp.position is not None
+            ]
+        if not players_id:
             return jsonify({"success": False, "message": "对战不存在"})
-        players_id = [player.id for player in battle.get_players()]
         if current_user.id in players_id:
             player_idx = players_id.index(current_user.id) + 1
         else:
@@ -1279,10 +1000,30 @@ def get_battles_stats():
 
 @game_bp.route("/api/battles/list", methods=["GET"])
 def get_battles_list():
-    """获取分页的对战列表API"""
+    """
+    获取分页的对战列表API (游标分页)
+
+    查询参数:
+        per_page: 每页条数，默认 5
+        after / before: 上一次响应中的 next_cursor / prev_cursor
+        total: estimate (默认，封顶计数) / exact / none
+        status, date_from, date_to, players: 过滤条件
+    """
     try:
-        page = request.args.get("page", 1, type=int)
         per_page = request.args.get("per_page", 5, type=int)
+        after = request.args.get("after") or None
+        before = request.args.get("before") or None
+        total_mode = request.args.get("total", "estimate")
+        if total_mode not in ("estimate", "exact", "none"):
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "message": "total 只能是 estimate、exact 或 none",
+                    }
+                ),
+                400,
+            )
         status_filter = request.args.get("status", None, type=str)
         date_from_str = request.args.get("date_from", None, type=str)
         date_to_str = request.args.get("date_to", None, type=str)
@@ -1308,13 +1049,23 @@ def get_battles_list():
         if player_filters:
             filters["players"] = player_filters
 
-        battles_pagination = get_battles_paginated_filtered(
-            filters=filters, page=page, per_page=per_page
-        )
+        try:
+            page = get_battle_page(
+                filters=filters,
+                limit=per_page,
+                after=after,
+                before=before,
+                total=None if total_mode == "none" else total_mode,
+            )
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        if page is None:
+            return jsonify({"success": False, "message": "获取对战列表失败"})
 
         # 格式化分页数据为JSON
+        summaries = ensure_battle_summaries(page["items"])
         battles_data = []
-        for battle in battles_pagination.items:
+        for battle in page["items"]:
             battles_data.append(
                 {
                     "id": battle.id,
@@ -1332,6 +1083,7 @@ def get_battles_list():
                         if battle.ended_at
                         else "-"
                     ),
+                    **_battle_summary_fields(summaries.get(battle.id)),
                 }
             )
 
@@ -1340,13 +1092,13 @@ def get_battles_list():
                 "success": True,
                 "battles": battles_data,
                 "pagination": {
-                    "page": battles_pagination.page,
-                    "pages": battles_pagination.pages,
-                    "total": battles_pagination.total,
-                    "has_prev": battles_pagination.has_prev,
-                    "has_next": battles_pagination.has_next,
-                    "prev_num": battles_pagination.prev_num,
-                    "next_num": battles_pagination.next_num,
+                    "per_page": per_page,
+                    "total": page["total"],
+                    "total_is_estimate": page["total_is_estimate"],
+                    "has_prev": page["has_prev"],
+                    "has_next": page["has_next"],
+                    "prev_cursor": page["prev_cursor"],
+                    "next_cursor": page["next_cursor"],
                 },
             }
         )
@@ -1,10 +1,13 @@
 # author: shihuaidexianyu (refactored by AI assistant)
 # date: 2025-04-25
 # status: done
-# description: 主页蓝图，包含主页路由。
+# description: 主页蓝图，包含主页路由和监控指标端点。
 
+import hmac
 
-from flask import Blueprint, render_template
+from flask import Blueprint, Response, current_app, render_template, request
+
+from services.metrics import CONTENT_TYPE, get_metrics
 
 main_bp = Blueprint("main", __name__)
 
@@ -12,3 +15,14 @@ main_bp = Blueprint("main", __name__)
 @main_bp.route("/")
 def home():
     return render_template("index.html")
+
+
+@main_bp.route("/metrics")
+def metrics():
+    """Prometheus 抓取端点 (合并所有进程的指标)，配置 METRICS_TOKEN 后需要 Bearer 令牌"""
+    token = current_app.config.get("METRICS_TOKEN")
+    if token and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(get_metrics().render(), content_type=CONTENT_TYPE)
@@ -1,70 +1,27 @@
-from flask import Blueprint, render_template, jsonify
-import os
-import json
+from flask import Blueprint, render_template, jsonify, request
+import logging
 import time
-import threading
-import math
 
-# 创建蓝图
-performance_bp = Blueprint("performance", __name__)
-
-# JSON数据文件路径
-JSON_DATA_FILE = os.path.join(
-    os.path.dirname(os.path.dirname(__file__)), "game", "client_usage_times.json"
+from database import (
+    get_recent_usage_samples,
+    get_usage_summary,
+    get_usage_timeseries,
 )
+from database.llm_usage import GROUP_COLUMNS, choose_step
+from blueprints.admin import admin_required
+from utils.sql_profiler import get_sql_profiler
 
-# 全局缓存变量
-# 移除了 "timer" 键，last_update 初始化为 0 以确保首次访问时加载数据
-cache = {"data": None, "last_update": 0, "lock": threading.Lock()}
-
-# 缓存更新间隔（秒）
-CACHE_UPDATE_INTERVAL = 10
+logger = logging.getLogger(__name__)
 
+# 创建蓝图
+performance_bp = Blueprint("performance", __name__)
 
-# 核心缓存更新逻辑（假定锁已被获取）
-def _perform_cache_update_locked():
-    """
-    执行实际的缓存更新操作，从JSON文件加载数据。
-    此函数假定 cache["lock"] 已被调用者获取。
-    """
-    try:
-        # 检查文件是否存在，不存在则创建空文件
-        if not os.path.exists(JSON_DATA_FILE):
-            os.makedirs(os.path.dirname(JSON_DATA_FILE), exist_ok=True)
-            with open(JSON_DATA_FILE, "w", encoding="utf-8") as f:
-                json.dump([], f)
-            cache["data"] = []
-        else:
-            with open(JSON_DATA_FILE, "r", encoding="utf-8") as f:
-                cache["data"] = json.load(f)
-
-        cache["last_update"] = time.time()  # 仅在成功加载后更新时间戳
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"缓存更新失败 (JSON error): {str(e)}")
-        if cache["data"] is None:  # 确保 data 至少是一个空列表
-            cache["data"] = []
-    except OSError as e:  # 捕获其他 OS 错误，例如权限错误
-        print(f"缓存更新失败 (OS error): {str(e)}")
-        if cache["data"] is None:
-            cache["data"] = []
-    except Exception as e:  # 捕获更新缓存时的任何其他意外错误
-        print(f"缓存更新失败 (Unexpected error): {str(e)}")
-        if cache["data"] is None:
-            cache["data"] = []
-
-
-# 应用启动时进行一次初始缓存加载
-def initial_cache_load():
-    with cache["lock"]:
-        _perform_cache_update_locked()
-        # 确保即使加载失败，cache["data"] 也被初始化为一个列表
-        if cache["data"] is None:
-            cache["data"] = []
-        # 如果 _perform_cache_update_locked 失败，last_update 将保持为0，
-        # 这将导致第一次API调用时尝试更新。
-
-
-initial_cache_load()
+# 统计窗口 (秒)
+DEFAULT_WINDOW = 3600
+MAX_WINDOW = 90 * 86400
+# 时间序列最多返回的点数
+DEFAULT_POINTS = 120
+MAX_POINTS = 1000
 
 
 @performance_bp.route("/")
@@ -73,64 +30,123 @@ def performance_report_page():
     return render_template("performance/report.html")
 
 
-# 辅助函数，用于清理数据中的 NaN/Infinity 值
-def clean_usage_data(records):
-    cleaned_records = []
-    if not isinstance(records, list):  # 添加检查以确保 records 是列表
-        return []
+def _parse_query():
+    """
+    解析统计接口的公共参数。
+
+    查询参数:
+        window (int): 统计最近多少秒，默认 3600；或用 start/end (Unix 秒) 指定区间。
+        group_by (str): client / model / client_model，默认不分组。
+        client_id (str), model (str): 只统计指定的客户端/模型。
+
+    返回:
+        dict: get_usage_summary / get_usage_timeseries 的参数。
+
+    异常:
+        ValueError: 参数无效。
+    """
+    end = request.args.get("end", type=float) or time.time()
+    start = request.args.get("start", type=float)
+    if start is None:
+        window = request.args.get("window", DEFAULT_WINDOW, type=int)
+        start = end - window
+    if not 0 < end - start <= MAX_WINDOW:
+        raise ValueError(f"统计区间需在 0 到 {MAX_WINDOW} 秒之间")
+    group_by = request.args.get("group_by") or None
+    if group_by is not None and group_by not in GROUP_COLUMNS:
+        raise ValueError(f"group_by 只能是 {', '.join(GROUP_COLUMNS)}")
+    return {
+        "start": start,
+        "end": end,
+        "group_by": group_by,
+        "client_id": request.args.get("client_id") or None,
+        "model": request.args.get("model") or None,
+    }
+
+
+@performance_bp.route("/api/usage_stats")
+def get_usage_stats():
+    """时间窗口内各客户端/模型的 p50/p95/p99 耗时、吞吐和错误率 (服务端聚合)"""
+    try:
+        params = _parse_query()
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    summary = get_usage_summary(**params)
+    if summary is None:
+        return jsonify({"success": False, "error": "服务器内部错误"}), 500
+    return jsonify(
+        {"success": True, "start": params["start"], "end": params["end"], **summary}
+    )
+
 
-    for record in records:
-        if not isinstance(record, dict):  # 跳过非字典类型的记录
-            cleaned_records.append(record)
-            continue
+@performance_bp.route("/api/usage_series")
+def get_usage_series():
+    """
+    按时间桶降采样的统计序列。
 
-        cleaned_record = record.copy()
-        usage_time = cleaned_record.get("usage_time")
-        if isinstance(usage_time, float):
-            if math.isnan(usage_time) or math.isinf(usage_time):
-                cleaned_record["usage_time"] = None  # 替换为 None
-        cleaned_records.append(cleaned_record)
-    return cleaned_records
+    查询参数 (另见 _parse_query):
+        points (int): 最多返回的点数，默认 120，决定自动选取的步长。
+        step (int): 直接指定时间桶长度 (秒)。
+    """
+    try:
+        params = _parse_query()
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    window = params["end"] - params["start"]
+    points = min(
+        max(request.args.get("points", DEFAULT_POINTS, type=int), 1), MAX_POINTS
+    )
+    step = request.args.get("step", type=int) or choose_step(window, points)
+    if step <= 0 or window / step > MAX_POINTS:
+        return (
+            jsonify({"success": False, "error": f"时间桶数量不能超过 {MAX_POINTS}"}),
+            400,
+        )
+    series = get_usage_timeseries(step=step, **params)
+    if series is None:
+        return jsonify({"success": False, "error": "服务器内部错误"}), 500
+    return jsonify({"success": True, **series})
 
 
 @performance_bp.route("/api/usage_times")
 def get_usage_data():
-    """获取客户端使用时间数据API"""
+    """获取最近 1000 条原始调用记录 (兼容旧接口，统计请使用 usage_stats/usage_series)"""
     try:
-        with cache["lock"]:
-            current_time = time.time()
-            # 如果缓存从未更新过 (last_update == 0) 或缓存已过期，则更新缓存
-            if cache["last_update"] == 0 or (
-                current_time - cache["last_update"] > CACHE_UPDATE_INTERVAL
-            ):
-                print(
-                    f"缓存过期或未初始化，执行更新。上次更新时间: {cache['last_update']}"
-                )
-                _perform_cache_update_locked()
-
-            # 确保 cache["data"] 始终是一个列表，即使更新失败
-            if cache["data"] is None:
-                cache["data"] = []
-
-            # 计算总记录数
-            total_records = len(cache["data"])
-
-            # 只返回最近的1000条数据
-            recent_data = (
-                cache["data"][-1000:] if total_records > 1000 else cache["data"]
-            )
-
-            # 清理数据以确保 JSON 可序列化
-            cleaned_recent_data = clean_usage_data(recent_data)
-
+        records, total_records = get_recent_usage_samples(limit=1000)
         return jsonify(
             {
                 "success": True,
-                "data": cleaned_recent_data,
+                "data": records,
                 "total_records": total_records,
             }
         )
     except Exception as e:
-        # 实际应用中应使用更完善的日志记录
-        print(f"处理 /api/usage_times 请求时发生错误: {str(e)}")
+        logger.error(f"处理 /api/usage_times 请求时发生错误: {e}", exc_info=True)
         return jsonify({"success": False, "error": "服务器内部错误"}), 500
+
+
+@performance_bp.route("/api/sql_profiles")
+@admin_required
+def get_sql_profiles():
+    """
+    本进程最近采样的请求/后台任务 SQL 统计 (见 utils/sql_profiler.py)。
+
+    查询参数:
+        limit (int): 最多返回的记录数，默认 50。
+        n_plus_one (int): 为 1 时只返回疑似 N+1 的记录。
+    """
+    profiler = get_sql_profiler()
+    if profiler is None:
+        return jsonify({"success": False, "error": "SQL 统计未启用"}), 404
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 500)
+    return jsonify(
+        {
+            "success": True,
+            "sample_rate": profiler.sample_rate,
+            "n_plus_one_threshold": profiler.threshold,
+            "summary": profiler.summary(),
+            "recent": profiler.recent(
+                limit, n_plus_one_only=request.args.get("n_plus_one") == "1"
+            ),
+        }
+    )
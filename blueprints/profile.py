@@ -4,18 +4,36 @@
 # description: 用户个人资料蓝图，包含用户资料和对战历史的路由。
 # 包含页面html: profile/profile.html, profile/battle_history.html
 
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort
 from flask_login import login_required, current_user
 from database.models import User, GameStats, Battle, db
 from database.action import (
     get_game_stats_by_user_id,
-    get_user_battle_history as db_get_user_battle_history,
     get_user_by_username,
 )
+from database.battle_list import get_user_battle_page
 
 # 创建蓝图
 profile_bp = Blueprint("profile", __name__)
 
+HISTORY_PAGE_SIZE = 10
+
+
+def _battle_history_page(user_id):
+    """按请求中的 after/before 游标取用户对战历史的一页，游标无效时返回 400"""
+    try:
+        page = get_user_battle_page(
+            user_id,
+            limit=HISTORY_PAGE_SIZE,
+            after=request.args.get("after") or None,
+            before=request.args.get("before") or None,
+        )
+    except ValueError:
+        abort(400)
+    if page is None:
+        abort(500)
+    return page
+
 
 @profile_bp.route("/profile")
 @profile_bp.route("/profile/<username>")
@@ -57,25 +75,11 @@ def profile(username=None):
 @login_required
 def battle_history():
     """显示用户完整对战历史"""
-    page = request.args.get("page", 1, type=int)
-    per_page = 10
-
-    # 使用正确的数据库函数获取用户的对战记录 (此部分已在之前修改过，保持不变)
-    # from database.action import get_user_battle_history as db_get_user_battle_history # 移到文件顶部
-
-    battles, total = db_get_user_battle_history(
-        current_user.id, page=page, per_page=per_page
-    )
-
-    # 计算总页数
-    total_pages = (total + per_page - 1) // per_page
-
+    page = _battle_history_page(current_user.id)
     return render_template(
         "profile/battle_history.html",
-        battles=battles,
-        current_page=page,
-        total_pages=total_pages,
-        total_battles=total,
+        battles=page["items"],
+        page=page,
     )
 
 
@@ -110,23 +114,10 @@ def public_battle_history(user_id):
     # 获取目标用户
     user = User.query.get_or_404(user_id)
 
-    # 分页参数
-    page = request.args.get("page", 1, type=int)
-    per_page = 10
-
-    # 获取对战记录
-    battles, total = db_get_user_battle_history(
-        user_id=user.id, page=page, per_page=per_page
-    )
-
-    # 计算总页数
-    total_pages = (total + per_page - 1) // per_page
-
+    page = _battle_history_page(user.id)
     return render_template(
         "profile/public_battle_history.html",
         user=user,
-        battles=battles,
-        current_page=page,
-        total_pages=total_pages,
-        total_battles=total,
+        battles=page["items"],
+        page=page,
     )
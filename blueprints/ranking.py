@@ -1,55 +1,38 @@
 from flask import Blueprint, render_template, jsonify, request, current_app
 from flask_login import current_user
 from database.action import get_leaderboard, get_game_stats_by_user_id, get_user_by_id
+from database.leaderboard import (
+    get_filtered_leaderboard,
+    get_leaderboard_page,
+    get_user_rank,
+    get_players_around,
+)
+from database.battle_stats import get_outcome_stats, get_player_stats
 from database.models import User, GameStats
 from functools import lru_cache
-import time  # 确保导入time模块
+from utils.response_cache import (
+    ALL_RANKINGS_TAG,
+    get_response_cache,
+    ranking_tags,
+    user_tag,
+)
 from flask_login import login_required
 
 ranking_bp = Blueprint("ranking", __name__)
 
-# 添加缓存字典和访问时间管理
-_cache = {}
-_cache_last_access = {}  # 新增：记录缓存项的最后访问时间
-CACHE_TIMEOUT = 10  # 缓存过期阈值：10秒
+CACHE_TIMEOUT = 10  # 缓存过期时间：10秒 (从写入时算起)
 RANKING_IDS = [0, 1, 2, 3, 4, 5, 6, 11, 21]
 
 
-def get_cached_data(key, fetch_func, timeout=CACHE_TIMEOUT):
+def get_cached_data(key, fetch_func, timeout=CACHE_TIMEOUT, tags=()):
     """获取缓存数据或者重新获取并缓存
 
-    基于最后访问时间的缓存策略：当距离上次访问超过timeout秒时才更新
+    使用跨 worker 共享的响应缓存 (utils/response_cache.py)：过期时间从写入时算起，
+    评分写入提交后带有对应榜单/玩家标签的条目立即失效
     """
-    current_time = time.time()
-
-    # 检查缓存是否存在
-    if key in _cache:
-        # 获取上次访问时间
-        last_access_time = _cache_last_access.get(key, 0)
-        time_since_last_access = current_time - last_access_time
-
-        # 如果距离上次访问未超过timeout，直接返回缓存数据
-        if time_since_last_access < timeout:
-            # 更新最后访问时间
-            _cache_last_access[key] = current_time
-            current_app.logger.debug(
-                f"Cache hit for key: {key}, accessed {time_since_last_access:.1f}s ago"
-            )
-            return _cache[key]
-        else:
-            current_app.logger.debug(
-                f"Cache expired for key: {key}, last accessed {time_since_last_access:.1f}s ago"
-            )
-
-    # 缓存不存在或已过期，获取新数据
-    current_app.logger.debug(f"Fetching fresh data for key: {key}")
-    data = fetch_func()
-
-    # 更新缓存和最后访问时间
-    _cache[key] = data
-    _cache_last_access[key] = current_time
-
-    return data
+    return get_response_cache().get_or_set(
+        f"ranking_bp:{key}", fetch_func, ttl=timeout, tags=tags
+    )
 
 
 @lru_cache(maxsize=8)
@@ -76,6 +59,9 @@ def show_ranking():
     page = request.args.get("page", 1, type=int)
     per_page = 15  # 每页15个项目
     min_games = request.args.get("min_games", 0, type=int)
+    # 筛选场次时按名次游标翻页 (上一页最后一名 / 本页第一名的名次)
+    after = request.args.get("after", 0, type=int)
+    before = request.args.get("before", None, type=int)
     is_ajax = request.args.get("ajax", 0, type=int)  # 新增: 检查是否为AJAX请求
 
     # 获取排行榜ID
@@ -95,31 +81,47 @@ def show_ranking():
     )
 
     # 创建缓存键，包含分页信息
-    cache_key = f"ranking_page:{ranking_id}:{page}:{per_page}:{min_games}"
+    if min_games > 0:
+        cache_key = f"ranking_page:{ranking_id}:{per_page}:{min_games}:{after}:{before}"
+    else:
+        cache_key = f"ranking_page:{ranking_id}:{page}:{per_page}:{min_games}"
 
     def fetch_ranking_page_data():
         try:
             # 使用数据库层面的分页获取排行榜数据
-            items_for_current_page, total_items_in_db = get_leaderboard(
-                ranking_id=ranking_id,
-                page=page,
-                per_page=per_page,
-                min_games_played=min_games,
-            )
+            cursors = None
+            if min_games > 0:
+                filtered = get_filtered_leaderboard(
+                    ranking_id,
+                    min_games,
+                    per_page=per_page,
+                    after=after,
+                    before=before,
+                )
+                if filtered is None:
+                    return [], 0, None
+                items_for_current_page = filtered.pop("items")
+                total_items_in_db = None  # 筛选视图不统计总数
+                cursors = filtered
+            else:
+                items_for_current_page, total_items_in_db = get_leaderboard(
+                    ranking_id=ranking_id,
+                    page=page,
+                    per_page=per_page,
+                )
 
             if items_for_current_page is None:
                 current_app.logger.warning(
                     "get_leaderboard returned None for items, defaulting to empty list."
                 )
-                return [], 0  # 修复：返回空列表和0，而不是没有返回值
+                return [], 0, None  # 修复：返回空列表和0，而不是没有返回值
 
             # 预处理排行榜数据，添加必要信息
             processed_items = []
-            for i, player_data in enumerate(items_for_current_page):
+            for player_data in items_for_current_page:
                 if isinstance(player_data, dict):
                     player_data_copy = player_data.copy()
-                    # 计算排名，数据库返回的数据已经是按排名排序的
-                    player_data_copy["rank"] = (page - 1) * per_page + i + 1
+                    # rank 为物化排行榜中的名次
 
                     # 确保必要字段存在
                     player_data_copy.setdefault(
@@ -145,23 +147,30 @@ def show_ranking():
                         f"Item in leaderboard is not a dict: {player_data}"
                     )
 
-            return processed_items, total_items_in_db
+            return processed_items, total_items_in_db, cursors
 
         except Exception as e:
             current_app.logger.error(f"Error fetching leaderboard data: {e}")
-            return [], 0
+            return [], 0, None
 
     # 从缓存获取数据或重新获取
-    leaderboard_items, total_count = get_cached_data(
-        cache_key, fetch_ranking_page_data, timeout=60
+    leaderboard_items, total_count, cursors = get_cached_data(
+        cache_key, fetch_ranking_page_data, timeout=60, tags=ranking_tags(ranking_id)
     )
 
     # 计算分页相关信息
-    pages = (total_count - 1) // per_page + 1 if total_count > 0 else 0
-    has_prev = page > 1
-    has_next = page < pages
-    prev_num = page - 1 if has_prev else None
-    next_num = page + 1 if has_next else None
+    if cursors is not None:
+        # 筛选视图只有上一页/下一页，页码按名次游标换算不出来
+        pages = 0
+        has_prev, has_next = cursors["has_prev"], cursors["has_next"]
+        prev_num = next_num = None
+    else:
+        cursors = {"prev_cursor": None, "next_cursor": None}
+        pages = (total_count - 1) // per_page + 1 if total_count > 0 else 0
+        has_prev = page > 1
+        has_next = page < pages
+        prev_num = page - 1 if has_prev else None
+        next_num = page + 1 if has_next else None
 
     # 如果是 AJAX 请求，返回 JSON 数据
     if is_ajax:
@@ -176,6 +185,8 @@ def show_ranking():
             "prev_num": prev_num,
             "next_num": next_num,
             "total": total_count,
+            "prev_cursor": cursors["prev_cursor"],
+            "next_cursor": cursors["next_cursor"],
         }
         return jsonify(
             {
@@ -198,6 +209,11 @@ def show_ranking():
         has_next=has_next,
         prev_num=prev_num,
         next_num=next_num,
+        prev_cursor=cursors["prev_cursor"],
+        next_cursor=cursors["next_cursor"],
+        min_games=min_games,
+        after=after,
+        before=before,
         current_user=current_user,
         all_ranking_ids=all_ranking_ids,
         current_ranking_id=ranking_id,
@@ -211,23 +227,27 @@ def get_ranking_data():
     min_games = request.args.get("min_games", 1, type=int)
     ranking_id = request.args.get("ranking_id", 0, type=int)
     sort_by = request.args.get("sort_by", "score")
+    after = request.args.get("after", 0, type=int)  # 上一页最后一名的名次
 
     # 限制最大查询数量，防止过大查询
     if limit > 500:
         limit = 500
 
-    cache_key = f"ranking:{ranking_id}:{min_games}:{limit}:{sort_by}"
+    cache_key = f"ranking:{ranking_id}:{min_games}:{limit}:{sort_by}:{after}"
 
     def fetch_ranking_data():
         try:
-            # 获取排行榜数据，如果失败则返回空列表
-            leaderboard_data_raw, _ = get_leaderboard(
-                ranking_id=ranking_id, limit=limit, min_games_played=min_games
-            ) or ([], 0)
+            # 按名次游标获取排行榜数据，如果失败则返回空列表
+            leaderboard_data_raw, next_cursor = get_leaderboard_page(
+                ranking_id=ranking_id,
+                after=after,
+                limit=limit,
+                min_games_played=min_games,
+            )
 
             # 处理数据并添加必要字段
             ranking_list_api = []
-            for idx, data in enumerate(leaderboard_data_raw):
+            for data in leaderboard_data_raw:
                 # 预先计算胜率，避免重复计算
                 total = data.get("games_played", data.get("total", 0))
                 win_rate = data.get("win_rate", 0)
@@ -235,7 +255,7 @@ def get_ranking_data():
                     win_rate = round((data.get("wins", 0) / total) * 100, 1)
 
                 entry = {
-                    "rank": idx + 1,
+                    "rank": data["rank"],
                     "user_id": data.get("user_id"),
                     "username": data.get("username"),
                     "score": data.get("elo_score", data.get("score", 0)),
@@ -252,6 +272,7 @@ def get_ranking_data():
                 "sort_by": sort_by,
                 "rankings": ranking_list_api,
                 "count": len(ranking_list_api),
+                "next_cursor": next_cursor,
             }
         except Exception as e:
             current_app.logger.error(f"Error in get_ranking_data: {e}")
@@ -260,11 +281,12 @@ def get_ranking_data():
                 "sort_by": sort_by,
                 "rankings": [],
                 "count": 0,
+                "next_cursor": None,
                 "error": str(e),
             }
 
     result = get_cached_data(
-        cache_key, fetch_ranking_data, timeout=10
+        cache_key, fetch_ranking_data, timeout=10, tags=ranking_tags(ranking_id)
     )  # 排行榜数据缓存10秒
     return jsonify(result)
 
@@ -303,6 +325,9 @@ def get_user_stats(user_id):
                 else 0
             )
 
+            # 物化排行榜中的名次与百分位
+            rank_info = get_user_rank(ranking_id, user_id) or {}
+
             return {
                 "success": True,
                 "user_id": user_id,
@@ -315,6 +340,10 @@ def get_user_stats(user_id):
                     "draws": stat.draws,
                     "total": stat.games_played,
                     "win_rate": win_rate,
+                    "rank": rank_info.get("rank"),
+                    "ranked_players": rank_info.get("total"),
+                    "percentile": rank_info.get("percentile"),
+                    "top_percent": rank_info.get("top_percent"),
                 },
             }
         except Exception as e:
@@ -322,11 +351,127 @@ def get_user_stats(user_id):
             return {"success": False, "message": "获取用户统计时出错"}, 500
 
     # 获取缓存的结果或新查询的结果
+    # 名次随榜单中其他玩家变化，同时带上榜单标签
     result = get_cached_data(
-        cache_key, fetch_user_stats, timeout=60
+        cache_key,
+        fetch_user_stats,
+        timeout=60,
+        tags=ranking_tags(ranking_id) + (user_tag(user_id),),
     )  # 用户数据缓存时间短一些
 
-    # 如果结果是元组（表示有HTTP状态码），则需要正确返回
-    if isinstance(result, tuple):
+    # 如果结果是元组/列表（表示有HTTP状态码），则需要正确返回
+    if isinstance(result, (tuple, list)):
+        return jsonify(result[0]), result[1]
+    return jsonify(result)
+
+
+@ranking_bp.route("/api/around/<string:user_id>")
+def get_ranking_around(user_id):
+    """获取用户在榜单中前后若干名玩家（API）"""
+    ranking_id = request.args.get("ranking_id", 0, type=int)
+    window = request.args.get("window", 5, type=int)
+
+    # 限制窗口大小，防止过大查询
+    window = max(0, min(window, 50))
+
+    cache_key = f"around:{user_id}:{ranking_id}:{window}"
+
+    def fetch_players_around():
+        items = get_players_around(ranking_id, user_id, window=window)
+        if items is None:
+            return {"success": False, "message": "该用户不在此榜单中"}, 404
+        return {
+            "success": True,
+            "user_id": user_id,
+            "ranking_id": ranking_id,
+            "window": window,
+            "rankings": items,
+        }
+
+    result = get_cached_data(
+        cache_key, fetch_players_around, timeout=10, tags=ranking_tags(ranking_id)
+    )
+
+    if isinstance(result, (tuple, list)):
+        return jsonify(result[0]), result[1]
+    return jsonify(result)
+
+
+def _stats_response(kind, fetch_stats, default_group_by):
+    """
+    分组统计接口的公共部分: 解析 group_by (逗号分隔) 和 ranking_id，按参数缓存结果。
+
+    fetch_stats(group_by, ranking_id, args) 返回统计列表，失败返回 None，
+    分组维度无效时抛出 ValueError。
+    """
+    group_by = tuple(
+        name.strip()
+        for name in request.args.get("group_by", default_group_by).split(",")
+        if name.strip()
+    )
+    ranking_id = request.args.get("ranking_id", type=int)
+    args = request.args.to_dict()
+    cache_key = f"stats:{kind}:" + "&".join(f"{k}={v}" for k, v in sorted(args.items()))
+
+    def fetch():
+        try:
+            stats = fetch_stats(group_by, ranking_id, args)
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, 400
+        if stats is None:
+            return {"success": False, "message": "获取统计数据时出错"}, 500
+        return {
+            "success": True,
+            "group_by": list(group_by),
+            "ranking_id": ranking_id,
+            "stats": stats,
+        }
+
+    # 不限榜单的统计只能靠过期时间刷新
+    tags = ranking_tags(ranking_id) if ranking_id is not None else (ALL_RANKINGS_TAG,)
+    result = get_cached_data(cache_key, fetch, timeout=60, tags=tags)
+    if isinstance(result, (tuple, list)):
         return jsonify(result[0]), result[1]
     return jsonify(result)
+
+
+@ranking_bp.route("/api/stats/players")
+def get_player_stats_api():
+    """
+    参与者的分组胜负统计（API），例如某 AI 各角色的胜率:
+    /ranking/api/stats/players?ai_code_id=<id>&group_by=role
+
+    查询参数:
+        group_by: user / ai_code / role / team / position / ranking，逗号分隔，默认 role
+        ranking_id, user_id, ai_code_id, role, team: 过滤条件
+    """
+
+    def fetch_stats(group_by, ranking_id, args):
+        return get_player_stats(
+            group_by,
+            ranking_id=ranking_id,
+            user_id=args.get("user_id") or None,
+            ai_code_id=args.get("ai_code_id") or None,
+            role=args.get("role") or None,
+            team=args.get("team") or None,
+        )
+
+    return _stats_response("players", fetch_stats, "role")
+
+
+@ranking_bp.route("/api/stats/outcomes")
+def get_outcome_stats_api():
+    """
+    对战结果的分组统计（API），例如各榜单红方靠刺杀获胜的比例:
+    /ranking/api/stats/outcomes?group_by=ranking,winner,win_reason
+
+    查询参数:
+        group_by: ranking / winner / win_reason / battle_type，逗号分隔，
+                  默认 ranking,winner,win_reason
+        ranking_id: 只统计该榜单
+    """
+
+    def fetch_stats(group_by, ranking_id, args):
+        return get_outcome_stats(group_by, ranking_id=ranking_id)
+
+    return _stats_response("outcomes", fetch_stats, "ranking,winner,win_reason")
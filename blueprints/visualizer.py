@@ -9,13 +9,12 @@ from flask import (
     flash,
     current_app,
     send_file,
+    make_response,
 )
 from flask_login import login_required, current_user
 import json
 import os
-from datetime import datetime
 from config.config import Config
-import math
 from copy import deepcopy
 import uuid
 from werkzeug.utils import secure_filename
@@ -24,26 +23,20 @@ import logging
 from pathlib import Path
 from database.models import Battle, User, BattlePlayer
 from database.action import get_battle_by_id
+from database import db
 import threading
-from jinja2 import Undefined
+import hashlib
+import time
+from utils.replay_compiler import (
+    ReplayFormatError,
+    load_compiled_replay,
+    replay_etag,
+)
 
 # 创建蓝图
 visualizer_bp = Blueprint("visualizer", __name__, template_folder="templates")
 
 
-def clean_undefined_objects(obj):
-    """递归清理数据中的 Undefined 对象"""
-
-    if isinstance(obj, Undefined):
-        return None
-    elif isinstance(obj, dict):
-        return {k: clean_undefined_objects(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [clean_undefined_objects(item) for item in obj]
-    else:
-        return obj
-
-
 @visualizer_bp.route("/game/<game_id>")
 def game_index(game_id):
     """游戏对局索引页面 - 简单重定向到重放页面"""
@@ -54,31 +47,32 @@ def game_index(game_id):
 def game_replay(game_id):
     """游戏对局重放页面"""
 
-    def _get_user_names(game_id) -> list:
-        from database import get_battle_by_id
+    def _get_user_names(game_id, roles) -> list:
+        from database import get_battle_by_id, get_archived_seat_usernames
 
         battle_obj = get_battle_by_id(game_id)
         if not battle_obj:
-            # 数据库查不到，从日志文件推断
-            data_dir = Config._yaml_config.get("DATA_DIR", "./data")
-            log_file = os.path.join(data_dir, f"{game_id}/archive_game_{game_id}.json")
-            if os.path.exists(log_file):
-                try:
-                    with open(log_file, "r", encoding="utf-8") as f:
-                        game_data = json.load(f)
-                    for event in game_data:
-                        if event.get("event_type") == "RoleAssign":
-                            roles_data = event.get("event_data", {})
-                            # 创建按player_id索引的用户名数组
-                            max_players = 7
-                            usernames = ["未知"] * max_players
-                            for pid_str in roles_data.keys():
-                                pid = int(pid_str)
-                                if 1 <= pid <= max_players:
-                                    usernames[pid - 1] = f"玩家{pid}"
-                            return usernames
-                except Exception as e:
-                    print(f"自动提取用户名失败: {e}")
+            # 已归档的对战从归档表读取座位
+            seats = get_archived_seat_usernames(game_id)
+            if seats:
+                usernames = ["未知"] * 7
+                for position, username in seats:
+                    if position is not None and 1 <= position <= 7:
+                        usernames[position - 1] = username
+                return usernames
+            # 数据库查不到，从归档中的角色分配推断 (编译结果中已有)
+            if roles:
+                # 创建按player_id索引的用户名数组
+                max_players = 7
+                usernames = ["未知"] * max_players
+                for pid_str in roles.keys():
+                    try:
+                        pid = int(pid_str)
+                    except ValueError:
+                        continue
+                    if 1 <= pid <= max_players:
+                        usernames[pid - 1] = f"玩家{pid}"
+                return usernames
             # 实在没有就返回空
             return []
 
@@ -88,12 +82,18 @@ def game_replay(game_id):
         usernames = ["未知"] * max_players  # 初始化
 
         try:
-            battle_players = battle_obj.players.all()
-            for bp in battle_players:
-                if bp.user and bp.user.username and bp.position is not None:
+            # 一次联表查询取出座位和用户名，不再逐个参与者加载 bp.user
+            seats = (
+                db.session.query(BattlePlayer.position, User.username)
+                .join(User, User.id == BattlePlayer.user_id)
+                .filter(BattlePlayer.battle_id == battle_obj.id)
+                .all()
+            )
+            for position, username in seats:
+                if username and position is not None:
                     # position应该等于游戏中的player_id，从1开始
-                    if 1 <= bp.position <= max_players:
-                        usernames[bp.position - 1] = bp.user.username
+                    if 1 <= position <= max_players:
+                        usernames[position - 1] = username
         except Exception as e:
             print(f"获取用户名失败: {e}")
             # 如果出错，使用原来的方法作为后备
@@ -102,85 +102,115 @@ def game_replay(game_id):
 
         return usernames
 
-    try:
-        # 处理示例回放的特殊情况
-        if game_id == "example":
-            # 获取 visualizer.py 文件所在的目录
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            # 构建相对于 visualizer.py 的 example replay 文件路径
-            # visualizer.py 在 blueprints/
-            # 目标文件在 static/example/
-            # 需要向上走一层 (..) 到 /，再进入 static/example/
-            example_replay_path = os.path.join(
-                current_dir, "..", "static/example", "archive_game_example.json"
-            )
-            # 标准化路径 (例如，处理 '..')
-            log_file = os.path.normpath(example_replay_path)
-
-            # 检查计算出的路径是否存在
-            if not os.path.exists(log_file):
-                flash("示例回放文件不存在，请确保已正确配置。", "warning")
-                return render_template("error.html", message="示例回放文件不存在")
-
-        else:
-            # 原有的游戏日志文件路径构建逻辑
-            log_file = os.path.join(
-                Config._yaml_config.get("DATA_DIR", "./data"),
-                f"{game_id}/archive_game_{game_id}.json",
-            )
+    log_file = _resolve_archive_path(game_id)
+    if log_file is None:
+        flash("示例回放文件不存在，请确保已正确配置。", "warning")
+        return render_template("error.html", message="示例回放文件不存在")
 
-        print(f"尝试读取文件: {log_file}")
-        print(f"文件存在: {os.path.exists(log_file)}")
+    # 检查文件是否存在
+    if not os.path.exists(log_file):
+        flash(f"错误：找不到对局记录文件 {os.path.basename(log_file)}", "danger")
+        return render_template("error.html", message="对局记录不存在")
 
-        # 检查文件是否存在
-        if not os.path.exists(log_file):
-            flash(f"错误：找不到对局记录文件 {os.path.basename(log_file)}", "danger")
-            return render_template("error.html", message="对局记录不存在")
+    try:
+        # 归档不变时浏览器直接使用缓存的页面 (页面内容还与登录用户和 CSRF 令牌有关)
+        csrf_window = current_app.config.get("WTF_CSRF_TIME_LIMIT") or 3600
+        etag = hashlib.sha1(
+            f"{replay_etag(log_file)}:{current_user.get_id()}:"
+            f"{int(time.time() // max(csrf_window // 2, 1))}".encode()
+        ).hexdigest()
+        if etag in request.if_none_match:
+            return _not_modified(etag, private=True)
 
-        # 读取游戏日志文件
-        with open(log_file, "r", encoding="utf-8") as f:
-            try:
-                game_data = json.load(f)
-            except json.JSONDecodeError as json_err:
-                flash(
-                    f"错误：无法解析对局记录文件 {log_file}。错误：{json_err}", "danger"
-                )
-                return render_template(
-                    "error.html", message=f"加载对局记录时出错: 无效的JSON文件"
-                )
-
-        # 验证JSON基本格式
-        if not isinstance(game_data, list) or not game_data:
+        try:
+            compiled = load_compiled_replay(log_file, game_id, _replay_cache_dir())
+        except json.JSONDecodeError as json_err:
+            flash(f"错误：无法解析对局记录文件 {log_file}。错误：{json_err}", "danger")
+            return render_template(
+                "error.html", message=f"加载对局记录时出错: 无效的JSON文件"
+            )
+        except ReplayFormatError:
             flash(f"错误：对局记录文件 {log_file} 格式无效或为空。", "danger")
             return render_template(
                 "error.html", message=f"加载对局记录时出错: 文件格式无效或为空"
             )
 
-        # 提取基本游戏信息
-        game_info = extract_game_info(game_data, game_id)
+        response = make_response(
+            render_template(
+                "visualizer/medieval_style_replay_page.html",
+                game_id=game_id,
+                game_info=compiled["game_info"],
+                game_events=compiled["game_events"],
+                player_usernames=_get_user_names(
+                    game_id,
+                    # 示例回放不在数据目录中，不推断用户名
+                    compiled["game_info"]["roles"] if game_id != "example" else None,
+                ),
+            )
+        )
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+    except Exception as e:
+        flash(f"加载对局记录时发生意外错误: {str(e)}", "danger")
+        logging.getLogger(__name__).error(
+            f"Error loading replay {game_id}: {e}", exc_info=True
+        )
+        return render_template("error.html", message=f"加载对局记录时出错: {str(e)}")
 
-        # 处理游戏事件
-        game_events = process_game_events(game_data)
 
-        # 在返回模板之前清理数据
-        game_events = clean_undefined_objects(game_events)
-        game_info = clean_undefined_objects(game_info)
+@visualizer_bp.route("/replay/<game_id>/data")
+def game_replay_data(game_id):
+    """编译后的重放模型（API），归档不变时返回 304"""
+    log_file = _resolve_archive_path(game_id)
+    if log_file is None or not os.path.exists(log_file):
+        return jsonify({"success": False, "message": "对局记录不存在"}), 404
 
-        return render_template(
-            "visualizer/medieval_style_replay_page.html",
-            game_id=game_id,
-            game_info=game_info,
-            game_events=game_events,
-            player_usernames=_get_user_names(game_id),
+    etag = replay_etag(log_file)
+    if etag in request.if_none_match:
+        return _not_modified(etag)
+    try:
+        compiled = load_compiled_replay(log_file, game_id, _replay_cache_dir())
+    except (json.JSONDecodeError, ReplayFormatError):
+        return jsonify({"success": False, "message": "对局记录格式无效"}), 422
+
+    response = jsonify(compiled)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "public, no-cache"
+    return response
+
+
+def _resolve_archive_path(game_id):
+    """对局归档路径；示例回放文件缺失时返回 None"""
+    if game_id == "example":
+        # 示例回放位于 static/example/ (visualizer.py 在 blueprints/ 下)
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        log_file = os.path.normpath(
+            os.path.join(
+                current_dir, "..", "static/example", "archive_game_example.json"
+            )
         )
-    except Exception as e:
-        flash(f"加载对局记录时发生意外错误: {str(e)}", "danger")
-        # Log the full error for debugging
-        print(f"Error loading replay {game_id}: {e}")
-        import traceback
+        return log_file if os.path.exists(log_file) else None
+    return os.path.join(
+        Config._yaml_config.get("DATA_DIR", "./data"),
+        f"{game_id}/archive_game_{game_id}.json",
+    )
 
-        traceback.print_exc()
-        return render_template("error.html", message=f"加载对局记录时出错: {str(e)}")
+
+def _replay_cache_dir():
+    """编译后重放模型的磁盘缓存目录"""
+    return current_app.config.get("REPLAY_CACHE_DIR") or os.path.join(
+        Config._yaml_config.get("DATA_DIR", "./data"), "replay_cache"
+    )
+
+
+def _not_modified(etag, private=False):
+    response = make_response("", 304)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = (
+        "private, no-cache" if private else "public, no-cache"
+    )
+    return response
 
 
 @visualizer_bp.route("/upload", methods=["GET"])
@@ -286,399 +316,3 @@ def is_valid_game_json(json_data):
         )  # Warning, not necessarily invalid
 
     return True
-
-
-def extract_game_info(game_data, game_id_from_url):
-    """从游戏数据中提取基本信息 (基于 observer.py)"""
-    game_info = {
-        "game_id": game_id_from_url,  # Use ID from URL/filename as primary
-        "player_count": 0,
-        "map_size": 0,
-        "start_time": None,
-        "end_time": None,
-        "winner": "未知",
-        "rounds_played": 0,
-        "roles": {},
-        "win_reason": "未知",
-        "blue_wins": 0,
-        "red_wins": 0,
-        "is_completed": False,  # Assume not completed until GameResult is found
-        "start_time_formatted": "未知",
-        "end_time_formatted": "未知",
-        "duration": "未知",
-    }
-    last_round_num = 0
-    last_scoreboard = None
-
-    # 从游戏开始事件提取信息
-    for event in game_data:
-        event_type = event.get("event_type")
-        event_data = event.get("event_data")
-        timestamp = event.get("timestamp")  # Get timestamp from event
-
-        if event_type == "GameStart":
-            game_info["player_count"] = event.get("player_count", 0)
-            game_info["map_size"] = event.get("map_size", 0)
-            game_info["start_time"] = timestamp  # Use event timestamp
-            # Use battle_id from event if needed, but prefer URL one
-            # game_info["game_id"] = event.get("battle_id", game_id_from_url)
-
-        elif event_type == "RoleAssign":
-            # Ensure keys are strings if they are numbers in JSON
-            game_info["roles"] = (
-                {str(k): v for k, v in event_data.items()}
-                if isinstance(event_data, dict)
-                else {}
-            )
-
-        elif event_type == "RoundStart":
-            if isinstance(event_data, int):
-                last_round_num = max(last_round_num, event_data)
-
-        elif event_type == "ScoreBoard":
-            if isinstance(event_data, list) and len(event_data) == 2:
-                last_scoreboard = event_data  # Store the latest scoreboard
-
-        # 从游戏结束事件提取信息
-        elif event_type == "GameResult":
-            if isinstance(event_data, (list, tuple)) and len(event_data) >= 2:
-                game_info["winner"] = event_data[
-                    0
-                ].lower()  # Ensure lowercase 'blue' or 'red'
-                game_info["win_reason"] = event_data[1]
-                game_info["end_time"] = timestamp  # Use event timestamp
-                game_info["is_completed"] = True
-
-        elif event_type == "FinalScore":
-            if isinstance(event_data, list) and len(event_data) == 2:
-                game_info["blue_wins"] = event_data[0]
-                game_info["red_wins"] = event_data[1]
-                game_info["rounds_played"] = (
-                    game_info["blue_wins"] + game_info["red_wins"]
-                )
-
-    # 如果游戏未正常结束 (没有 GameResult)
-    if not game_info["is_completed"]:
-        game_info["end_time_formatted"] = "游戏未正常结束"
-        game_info["win_reason"] = "游戏未记录结束状态"
-        # 使用最后记录的回合数和计分板（如果存在）
-        game_info["rounds_played"] = last_round_num
-        if last_scoreboard:
-            game_info["blue_wins"] = last_scoreboard[0]
-            game_info["red_wins"] = last_scoreboard[1]
-            # Try to infer winner based on last score if game didn't finish
-            if game_info["blue_wins"] >= 3:
-                game_info["winner"] = "blue"
-                game_info["win_reason"] = "游戏中断时蓝方已达3胜"
-            elif game_info["red_wins"] >= 3:
-                game_info["winner"] = "red"
-                game_info["win_reason"] = "游戏中断时红方已达3胜"
-
-    # 格式化时间戳
-    time_format_in = "%Y-%m-%d %H:%M:%S"  # Format from observer
-    time_format_out = "%Y-%m-%d %H:%M"  # Shorter format for display
-
-    if game_info["start_time"]:
-        try:
-            # Handle potential fractional seconds if present
-            dt_start = datetime.strptime(
-                game_info["start_time"].split(".")[0], time_format_in
-            )
-            game_info["start_time_formatted"] = dt_start.strftime(time_format_out)
-        except (ValueError, TypeError):
-            game_info["start_time_formatted"] = str(game_info["start_time"])  # Fallback
-
-    if game_info["end_time"] and game_info["is_completed"]:
-        try:
-            dt_end = datetime.strptime(
-                game_info["end_time"].split(".")[0], time_format_in
-            )
-            game_info["end_time_formatted"] = dt_end.strftime(time_format_out)
-        except (ValueError, TypeError):
-            # Keep "游戏未正常结束" or fallback
-            if game_info["end_time_formatted"] == "未知":
-                game_info["end_time_formatted"] = str(game_info["end_time"])
-
-    # 计算游戏时长
-    if game_info["start_time"] and game_info["end_time"] and game_info["is_completed"]:
-        try:
-            start = datetime.strptime(
-                game_info["start_time"].split(".")[0], time_format_in
-            )
-            end = datetime.strptime(game_info["end_time"].split(".")[0], time_format_in)
-            duration = end - start
-            total_seconds = duration.total_seconds()
-            if total_seconds >= 0:
-                minutes = math.floor(total_seconds / 60)
-                seconds = math.floor(total_seconds % 60)
-                game_info["duration"] = f"{minutes}分{seconds}秒"
-            else:
-                game_info["duration"] = "时间戳错误"
-        except (ValueError, TypeError):
-            game_info["duration"] = "无法计算"
-    elif not game_info["is_completed"]:
-        game_info["duration"] = "未完成"
-
-    # Ensure roles has string keys for template
-    game_info["roles"] = {str(k): v for k, v in game_info.get("roles", {}).items()}
-
-    return game_info
-
-
-def process_game_events(game_data):
-    """处理游戏事件用于可视化 (基于 observer.py)"""
-    events_by_round = {}
-    round_num = 0
-    assassination_info = None
-    current_leader = None  # 跟踪当前队长
-
-    # 预扫描：为每个TeamPropose事件找到对应的Leader
-    team_propose_leaders = {}  # {event_index: leader_id}
-
-    for i, event in enumerate(game_data):
-        event_type = event.get("event_type")
-        event_data = event.get("event_data")
-
-        if event_type == "TeamPropose":
-            # 为每个TeamPropose事件查找对应的Leader
-            leader_id = None
-            current_round = None
-
-            # 首先找到当前轮次
-            for j in range(i - 1, -1, -1):
-                prev_event = game_data[j]
-                if prev_event.get("event_type") == "RoundStart" and isinstance(
-                    prev_event.get("event_data"), int
-                ):
-                    current_round = prev_event.get("event_data")
-                    break
-
-            # 在当前轮次内查找最近的Leader事件（向前或向后查找）
-            if current_round:
-                # 首先向后查找（TeamPropose后面的Leader事件）
-                for j in range(i + 1, len(game_data)):
-                    next_event = game_data[j]
-                    # 如果遇到下一轮开始，停止查找
-                    if next_event.get("event_type") == "RoundStart":
-                        break
-                    if next_event.get("event_type") == "Leader":
-                        leader_id = str(next_event.get("event_data"))
-                        print(
-                            f"Pre-scan: TeamPropose at index {i} -> Leader {leader_id} (found forward)"
-                        )
-                        break
-
-                # 如果向后没找到，向前查找（TeamPropose前面的Leader事件）
-                if not leader_id:
-                    for j in range(i - 1, -1, -1):
-                        prev_event = game_data[j]
-                        # 如果遇到前一轮结束，停止查找
-                        if prev_event.get("event_type") == "RoundStart":
-                            break
-                        if prev_event.get("event_type") == "Leader":
-                            leader_id = str(prev_event.get("event_data"))
-                            print(
-                                f"Pre-scan: TeamPropose at index {i} -> Leader {leader_id} (found backward)"
-                            )
-                            break
-
-            if leader_id:
-                team_propose_leaders[i] = leader_id
-            else:
-                print(
-                    f"Pre-scan: Warning - No leader found for TeamPropose at index {i}"
-                )
-
-    for i, event in enumerate(game_data):
-        event_type = event.get("event_type")
-        event_data = event.get("event_data")
-
-        # --- Special Events Handling ---
-        if event_type == "Assass":
-            if isinstance(event_data, list) and len(event_data) == 4:
-                assassination_info = {
-                    "assassin": str(event_data[0]),  # Ensure string ID
-                    "target": str(event_data[1]),  # Ensure string ID
-                    "target_role": event_data[2],
-                    "success": event_data[3] == "Success",
-                }
-            continue  # Processed special event
-
-        # --- Round Based Events Handling ---
-        if event_type == "RoundStart":
-            if isinstance(event_data, int):
-                round_num = event_data
-                if round_num > 0 and round_num not in events_by_round:
-                    # Initialize round structure when RoundStart is encountered
-                    events_by_round[round_num] = {
-                        "round": round_num,
-                        "leader": None,  # 将在TeamPropose时确定
-                        "team_members": [],
-                        # Combined list of events: [(type, data)]
-                        "events": [],
-                        # {success: bool, fail_votes: int}
-                        "mission_execution": None,
-                        # {success: bool} - Simplified for badge
-                        "mission_result": None,
-                    }
-            continue  # Processed RoundStart
-
-        # Only process other events if a valid round structure exists
-        if round_num > 0 and round_num in events_by_round:
-            current_round = events_by_round[round_num]
-
-            if event_type == "Leader":
-                current_leader = str(event_data)  # 更新当前队长
-                current_round["leader"] = (
-                    current_leader  # 也更新回合级别的队长（用于向后兼容）
-                )
-                print(f"Leader event - Round {round_num}, Leader: {current_leader}")
-            elif event_type == "TeamPropose":
-                # Ensure members are strings
-                members = (
-                    [str(m) for m in event_data] if isinstance(event_data, list) else []
-                )
-                current_round["team_members"] = members
-                # 使用预扫描找到的对应队长信息
-                leader_id = (
-                    team_propose_leaders.get(i)
-                    or current_leader
-                    or current_round.get("leader")
-                )
-                # 调试信息
-                print(
-                    f"TeamPropose event - Round {round_num}, Leader: {leader_id} (pre-scan: {team_propose_leaders.get(i)}, current: {current_leader}, round: {current_round.get('leader')}), Members: {members}"
-                )
-                current_round["events"].append(
-                    {
-                        "type": "team_propose",
-                        "data": {
-                            "leader": leader_id,
-                            "team_members": members,
-                        },
-                    }
-                )
-            elif event_type == "PublicSpeech":
-                if isinstance(event_data, (list, tuple)) and len(event_data) == 2:
-                    # 标记为公开发言
-                    current_round["events"].append(
-                        {
-                            "type": "speech",
-                            "data": (
-                                str(event_data[0]),
-                                event_data[1],
-                                "public",
-                                ["ALL"],
-                            ),
-                        }
-                    )
-            elif event_type == "PublicVote":
-                if isinstance(event_data, (list, tuple)) and len(event_data) == 2:
-                    # 检查是否需要创建新的投票尝试
-                    if (
-                        not current_round["events"]
-                        or current_round["events"][-1]["type"] != "vote_attempt"
-                    ):
-                        current_round["events"].append(
-                            {
-                                "type": "vote_attempt",
-                                "data": {
-                                    "votes": {},
-                                    "approved": None,
-                                    "approve_count": 0,
-                                    "reject_count": 0,
-                                },
-                            }
-                        )
-                    # 更新最新的投票尝试
-                    current_round["events"][-1]["data"]["votes"][str(event_data[0])] = (
-                        event_data[1] == "Approve"
-                    )
-            elif event_type == "PublicVoteResult":
-                if isinstance(event_data, list) and len(event_data) == 2:
-                    # 确保存在投票尝试
-                    if (
-                        not current_round["events"]
-                        or current_round["events"][-1]["type"] != "vote_attempt"
-                    ):
-                        current_round["events"].append(
-                            {
-                                "type": "vote_attempt",
-                                "data": {
-                                    "votes": {},
-                                    "approved": None,
-                                    "approve_count": 0,
-                                    "reject_count": 0,
-                                },
-                            }
-                        )
-                    # 更新投票结果
-                    current_round["events"][-1]["data"]["approve_count"] = event_data[0]
-                    current_round["events"][-1]["data"]["reject_count"] = event_data[1]
-            elif event_type == "MissionApproved":
-                # 确保存在投票尝试
-                if (
-                    not current_round["events"]
-                    or current_round["events"][-1]["type"] != "vote_attempt"
-                ):
-                    current_round["events"].append(
-                        {
-                            "type": "vote_attempt",
-                            "data": {
-                                "votes": {},
-                                "approved": None,
-                                "approve_count": 0,
-                                "reject_count": 0,
-                            },
-                        }
-                    )
-                # 更新投票结果
-                current_round["events"][-1]["data"]["approved"] = True
-            elif event_type == "MissionRejected":
-                # 确保存在投票尝试
-                if (
-                    not current_round["events"]
-                    or current_round["events"][-1]["type"] != "vote_attempt"
-                ):
-                    current_round["events"].append(
-                        {
-                            "type": "vote_attempt",
-                            "data": {
-                                "votes": {},
-                                "approved": None,
-                                "approve_count": 0,
-                                "reject_count": 0,
-                            },
-                        }
-                    )
-                # 更新投票结果
-                current_round["events"][-1]["data"]["approved"] = False
-            elif event_type == "MissionVote":
-                if isinstance(event_data, dict):
-                    fail_votes = sum(1 for vote in event_data.values() if not vote)
-                    # Initialize mission_execution if not already done
-                    if current_round["mission_execution"] is None:
-                        current_round["mission_execution"] = {}
-                    current_round["mission_execution"]["fail_votes"] = fail_votes
-            elif event_type == "MissionResult":
-                if isinstance(event_data, (list, tuple)) and len(event_data) == 2:
-                    success = event_data[1] == "Success"
-                    if current_round["mission_execution"] is None:
-                        current_round["mission_execution"] = {}
-                    current_round["mission_execution"]["success"] = success
-                    # Also store simplified mission result for badge color
-                    current_round["mission_result"] = {"success": success}
-
-    # Convert dict to list and sort by round number
-    game_events_list = sorted(events_by_round.values(), key=lambda x: x["round"])
-
-    # Append assassination info at the end if it exists
-    if assassination_info:
-        game_events_list.append(
-            {
-                "round": "assassination",  # Special key for template logic
-                "assassination": assassination_info,
-            }
-        )
-
-    return game_events_list
@@ -39,9 +39,87 @@ class Config:
     )  # 使用 BASE_DIR 简化路径
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # 数据库性能配置 (见 database/engine_profile.py)
+    # 连接池大小与 SQLite 连接 PRAGMA (WAL、synchronous=NORMAL、busy_timeout、mmap)
+    DB_PERFORMANCE_PROFILE = os.environ.get(
+        "DB_PERFORMANCE_PROFILE", "1"
+    ).lower() not in ("0", "false", "no")
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get("SQLALCHEMY_POOL_SIZE", 10))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get("SQLALCHEMY_MAX_OVERFLOW", 20))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 15000))
+    SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+    # 对战 "playing" 状态由单独的写线程合并提交 (对战并发很高时开启)
+    BATTLE_STATUS_WRITER = os.environ.get("BATTLE_STATUS_WRITER", "0").lower() in (
+        "1",
+        "true",
+        "yes",
+    )
+
+    # 响应缓存 (见 utils/response_cache.py)：进程内 LRU + Redis 共享，评分写入后按榜单/玩家失效
+    RESPONSE_CACHE_REDIS = os.environ.get("RESPONSE_CACHE_REDIS", "1").lower() not in (
+        "0",
+        "false",
+        "no",
+    )
+    RESPONSE_CACHE_REDIS_URL = os.environ.get(
+        "RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0"
+    )
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+
+    # 对战结束事件 (见 services/battle_events.py)：经 Redis 发布/订阅通知其他进程的自动对战，
+    # 关闭或 Redis 不可用时其他进程每隔几秒查询数据库
+    BATTLE_EVENTS_REDIS = os.environ.get("BATTLE_EVENTS_REDIS", "1").lower() not in (
+        "0",
+        "false",
+        "no",
+    )
+    BATTLE_EVENTS_REDIS_URL = os.environ.get(
+        "BATTLE_EVENTS_REDIS_URL", "redis://localhost:6379/0"
+    )
+
+    # LLM 调用耗时记录 (见 database/llm_usage.py)：保留天数，过期记录由写线程定期清理
+    LLM_USAGE_RETENTION_DAYS = float(os.environ.get("LLM_USAGE_RETENTION_DAYS", 30))
+
+    # 按请求 / 后台任务统计 SQL 查询 (见 utils/sql_profiler.py)：采样率 (0 关闭)、
+    # 同一语句在一次请求内执行多少次视为疑似 N+1、每个进程保留的最近记录数
+    SQL_PROFILER_SAMPLE_RATE = float(os.environ.get("SQL_PROFILER_SAMPLE_RATE", 0))
+    SQL_PROFILER_N_PLUS_ONE_THRESHOLD = int(
+        os.environ.get("SQL_PROFILER_N_PLUS_ONE_THRESHOLD", 5)
+    )
+    SQL_PROFILER_HISTORY = int(os.environ.get("SQL_PROFILER_HISTORY", 200))
+
+    # 对战归档 (见 database/archive.py)：结束超过多少天的对战移入归档表 (0 关闭，默认关闭，
+    # 需要时显式开启，例如 90)、归档线程的执行间隔 (秒)
+    BATTLE_ARCHIVE_AFTER_DAYS = float(os.environ.get("BATTLE_ARCHIVE_AFTER_DAYS", 0))
+    BATTLE_ARCHIVE_INTERVAL = int(os.environ.get("BATTLE_ARCHIVE_INTERVAL", 3600))
+
+    # 管理后台任务 (见 services/admin_jobs.py)：每个进程的工作线程数、
+    # 领取其他进程提交的任务的轮询间隔 (秒)
+    ADMIN_JOB_WORKERS = int(os.environ.get("ADMIN_JOB_WORKERS", 2))
+    ADMIN_JOB_POLL_INTERVAL = float(os.environ.get("ADMIN_JOB_POLL_INTERVAL", 2))
+
+    # 上传AI代码后冒烟对局校验的超时 (秒，见 game/code_validator.py)
+    AI_SMOKE_TIMEOUT = float(os.environ.get("AI_SMOKE_TIMEOUT", 60))
+
+    # 监控指标 (/metrics，见 services/metrics.py)：各进程写入指标快照的间隔 (秒)，
+    # 设置 METRICS_TOKEN 后抓取需要带 Authorization: Bearer <令牌>
+    METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 15))
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
     # 日志配置
     LOG_LEVEL = os.environ.get("LOG_LEVEL") or logging.INFO
 
+    # 对战执行配置
+    # 为 False 时 Web 进程只负责入队和读取，对战由独立进程 (python -m game.worker) 执行
+    RUN_BATTLE_WORKERS = os.environ.get("RUN_BATTLE_WORKERS", "1").lower() not in (
+        "0",
+        "false",
+        "no",
+    )
+
+    # 自动对战阵容选择策略: random (默认) 或 information_gain，见 game/matchmaker.py
+    AUTOMATCH_MATCHMAKER = os.environ.get("AUTOMATCH_MATCHMAKER", "random")
+
     # --- YAML 加载逻辑移到这里 ---
     # 注意：这里不再需要 if yaml_config 检查，因为 setattr 会在类上创建新属性或覆盖现有属性
     # for key, value in yaml_config.items():
@@ -0,0 +1,61 @@
+"""
+pytest 公共夹具: 每个测试一个临时 SQLite 数据库的应用，以及造数据的辅助函数。
+
+运行: python -m pytest -q
+"""
+
+import pytest
+from flask import Flask
+
+from database import db, initialize_database
+from database.models import AICode, GameStats, User
+
+
+@pytest.fixture
+def app(tmp_path):
+    """使用临时 SQLite 数据库的应用，测试期间处于应用上下文中"""
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}",
+        SECRET_KEY="test",
+        TESTING=True,
+        RESPONSE_CACHE_REDIS=False,
+        BATTLE_EVENTS_REDIS=False,
+    )
+    initialize_database(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def make_players(app):
+    """
+    创建玩家 (用户 + 激活的AI代码 + 榜单记录)。
+
+    返回的函数: make_players(数量, ranking_id=1, elo_scores=None)
+        -> [{"user_id", "ai_code_id"}]
+    """
+
+    def _make_players(count, ranking_id=1, elo_scores=None):
+        start = User.query.count()
+        players = []
+        for i in range(count):
+            user = User(username=f"player{start + i}", email=f"p{start + i}@test")
+            db.session.add(user)
+            db.session.flush()
+            ai_code = AICode(
+                user_id=user.id, name="ai", code_path="ai.py", is_active=True
+            )
+            db.session.add(ai_code)
+            db.session.flush()
+            elo = elo_scores[i] if elo_scores else 1200
+            db.session.add(
+                GameStats(user_id=user.id, ranking_id=ranking_id, elo_score=elo)
+            )
+            players.append({"user_id": user.id, "ai_code_id": ai_code.id})
+        db.session.commit()
+        return players
+
+    return _make_players
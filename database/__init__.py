@@ -7,15 +7,36 @@
 from .base import db, login_manager
 
 # 从 models.py 导出所有模型类
-from .models import User, AICode, GameStats, Battle, BattlePlayer
+from .models import (
+    User,
+    AICode,
+    GameStats,
+    Battle,
+    BattlePlayer,
+    BattleJob,
+    RatingLedger,
+    BattleSummary,
+    LeaderboardEntry,
+    LlmUsageSample,
+    DataVersion,
+    ArchivedBattle,
+    ArchivedBattlePlayer,
+    AdminJob,
+    BattleTrace,
+    MetricSnapshot,
+    ServiceLease,
+)
 
 from flask import current_app
+from .engine_profile import configure_engine_options, apply_engine_profile
 
 
 # 定义数据库初始化函数
 def initialize_database(app):
-    """初始化数据库并关联应用"""
+    """初始化数据库并关联应用 (同时应用连接池和 SQLite 性能配置)"""
+    configure_engine_options(app)
     db.init_app(app)
+    apply_engine_profile(app)
     # login_manager 也可以在这里初始化，如果它依赖于 app 配置
     # login_manager.init_app(app)
 
@@ -41,29 +62,36 @@ from .action import (
     update_ai_code,
     delete_ai_code,
     set_active_ai_code,
+    set_ai_code_validation,
     get_ai_code_path_full,
     get_active_ai_codes_by_ranking_ids,
+    cleanup_stale_game_stats,
     # 游戏统计 (GameStats) 操作
     get_game_stats_by_user_id,
     create_game_stats,
     update_game_stats,
+    get_ranking_rating_snapshot,
     get_leaderboard,
     # 对战 (Battle) 及 对战参与者 (BattlePlayer) 操作
     create_battle,
+    create_battles,
     create_battle_instance,
     get_battle_by_id,
+    get_battle_statuses,
     update_battle,
+    update_battle_statuses,
     delete_battle,
     get_battle_players_for_battle,
+    get_battle_players_for_battles,
     process_battle_results_and_update_stats,
-    get_user_battle_history,
+    apply_battle_results_batch,
+    get_rating_ledger,
     get_recent_battles,
     get_battle_player_by_id,
     update_battle_player,
     # 其他可能需要的函数...
     mark_battle_as_cancelled,
     handle_cancelled_battle_stats,
-    get_battles_paginated_filtered,
     get_available_ai_instances,
     update_battle_player_count,
     add_player_to_battle,
@@ -75,8 +103,120 @@ from .action import (
 # 从 promotion.py 导出晋级相关函数
 from .promotion import (
     get_top_players_from_ranking,
+    get_top_player_ids_from_ranking,
     promote_players_to_ranking,
     promote_from_multiple_rankings,
+    reset_rankings,
+)
+
+# 从 battle_queue.py 导出持久化对战队列函数
+from .battle_queue import (
+    enqueue_battle_job,
+    claim_battle_job,
+    heartbeat_battle_jobs,
+    ack_battle_job,
+    cancel_battle_job,
+    recover_battle_queue,
+    get_battle_queue_stats,
+)
+
+# 从 admin_job_queue.py 导出管理后台任务队列函数
+from .admin_job_queue import (
+    enqueue_admin_job,
+    claim_admin_job,
+    heartbeat_admin_jobs,
+    finish_admin_job,
+    cancel_admin_job,
+    recover_admin_jobs,
+    get_admin_job,
+    list_admin_jobs,
+)
+
+# 从 battle_trace.py 导出对战调用追踪设置函数
+from .battle_trace import (
+    set_battle_trace,
+    request_battle_trace_dump,
+    record_battle_trace_dump,
+    get_battle_trace,
+    get_battle_traces,
+)
+
+# 从 service_lease.py 导出维护任务租约函数
+from .service_lease import (
+    acquire_service_lease,
+    release_service_lease,
+)
+
+# 从 metrics_store.py 导出监控指标快照函数
+from .metrics_store import (
+    save_metric_snapshot,
+    load_metric_snapshots,
+    retire_metric_snapshots,
+    get_active_battle_counts,
+)
+
+# 从 data_version.py 导出数据版本号函数 (导入时同时注册版本递增的会话事件)
+from .data_version import (
+    ACTIVE_PARTICIPANTS,
+    get_data_version,
+    bump_data_version,
+)
+
+# 从 rating_replay.py 导出按历史重放评分的函数
+from .rating_replay import (
+    RATING_ENGINES,
+    load_ranking_history,
+    replay_ranking,
+)
+
+# 从 leaderboard.py 导出物化排行榜函数 (导入时同时注册榜单过期的会话事件)
+from .leaderboard import (
+    rebuild_leaderboard,
+    get_leaderboard_page,
+    get_filtered_leaderboard,
+    get_user_rank,
+    get_players_around,
+)
+
+# 从 battle_summary.py 导出对战结果摘要函数 (导入时同时注册写入摘要的会话事件)
+from .battle_summary import (
+    get_battle_summary,
+    get_battle_summaries,
+    ensure_battle_summaries,
+)
+
+# 从 battle_list.py 导出对战列表与用户对战历史的游标分页函数
+from .battle_list import (
+    get_battle_page,
+    get_user_battle_page,
+)
+
+# 从 archive.py 导出已结束对战的归档与读穿透函数
+from .archive import (
+    archive_battles,
+    get_archived_battle,
+    get_archived_battle_players,
+    get_archived_seat_usernames,
+)
+
+# 从 schema_upgrade.py 导出已有数据库的增量升级
+from .schema_upgrade import upgrade_schema
+
+# 从 battle_stats.py 导出角色、座位与胜负的分组统计函数
+from .battle_stats import (
+    backfill_battle_analytics,
+    get_player_stats,
+    get_outcome_stats,
+)
+
+# 从 llm_usage.py 导出 LLM 调用耗时的时间序列函数
+from .llm_usage import (
+    record_usage_samples,
+    prune_usage_samples,
+    import_usage_log,
+    get_usage_summary,
+    get_usage_timeseries,
+    get_recent_usage_samples,
 )
 
 
@@ -100,6 +240,18 @@ __all__ = [
     "GameStats",
     "Battle",
     "BattlePlayer",
+    "BattleJob",
+    "RatingLedger",
+    "BattleSummary",
+    "LeaderboardEntry",
+    "LlmUsageSample",
+    "DataVersion",
+    "ArchivedBattle",
+    "ArchivedBattlePlayer",
+    "AdminJob",
+    "BattleTrace",
+    "MetricSnapshot",
+    "ServiceLease",
     # 用户操作
     "get_user_by_id",
     "get_user_by_username",
@@ -115,22 +267,30 @@ __all__ = [
     "update_ai_code",
     "delete_ai_code",
     "set_active_ai_code",
+    "set_ai_code_validation",
     "get_ai_code_path_full",
     "get_active_ai_codes_by_ranking_ids",
+    "cleanup_stale_game_stats",
     # 统计操作
     "get_game_stats_by_user_id",
     "create_game_stats",
     "update_game_stats",
+    "get_ranking_rating_snapshot",
     "get_leaderboard",
     # 对战操作
     "create_battle",
+    "create_battles",
     "get_battle_by_id",
+    "get_battle_statuses",
     "create_battle_instance",
     "update_battle",
+    "update_battle_statuses",
     "delete_battle",
     "get_battle_players_for_battle",
+    "get_battle_players_for_battles",
     "process_battle_results_and_update_stats",
-    "get_user_battle_history",
+    "apply_battle_results_batch",
+    "get_rating_ledger",
     "get_recent_battles",
     "get_battle_player_by_id",
     "update_battle_player",
@@ -140,6 +300,77 @@ __all__ = [
     "create_battle_instance",
     # 晋级相关函数
     "get_top_players_from_ranking",
+    "get_top_player_ids_from_ranking",
     "promote_players_to_ranking",
     "promote_from_multiple_rankings",
+    "reset_rankings",
+    # 对战队列函数
+    "enqueue_battle_job",
+    "claim_battle_job",
+    "heartbeat_battle_jobs",
+    "ack_battle_job",
+    "cancel_battle_job",
+    "recover_battle_queue",
+    "get_battle_queue_stats",
+    # 管理后台任务队列函数
+    "enqueue_admin_job",
+    "claim_admin_job",
+    "heartbeat_admin_jobs",
+    "finish_admin_job",
+    "cancel_admin_job",
+    "recover_admin_jobs",
+    "get_admin_job",
+    "list_admin_jobs",
+    # 对战调用追踪设置
+    "set_battle_trace",
+    "request_battle_trace_dump",
+    "record_battle_trace_dump",
+    "get_battle_trace",
+    "get_battle_traces",
+    # 维护任务租约
+    "acquire_service_lease",
+    "release_service_lease",
+    # 监控指标快照
+    "save_metric_snapshot",
+    "load_metric_snapshots",
+    "retire_metric_snapshots",
+    "get_active_battle_counts",
+    # 数据版本号
+    "ACTIVE_PARTICIPANTS",
+    "get_data_version",
+    "bump_data_version",
+    # 评分重放
+    "RATING_ENGINES",
+    "load_ranking_history",
+    "replay_ranking",
+    # 物化排行榜
+    "rebuild_leaderboard",
+    "get_leaderboard_page",
+    "get_filtered_leaderboard",
+    "get_user_rank",
+    "get_players_around",
+    # 对战结果摘要
+    "get_battle_summary",
+    "get_battle_summaries",
+    "ensure_battle_summaries",
+    # 游标分页
+    "get_battle_page",
+    "get_user_battle_page",
+    # 归档
+    "archive_battles",
+    "get_archived_battle",
+    "get_archived_battle_players",
+    "get_archived_seat_usernames",
+    "upgrade_schema",
+    # 分组统计
+    "backfill_battle_analytics",
+    "get_player_stats",
+    "get_outcome_stats",
+    # LLM 调用耗时
+    "record_usage_samples",
+    "prune_usage_samples",
+    "import_usage_log",
+    "get_usage_summary",
+    "get_usage_timeseries",
+    "get_recent_usage_samples",
 ]
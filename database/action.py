@@ -23,7 +23,8 @@ MAX_TOKEN_ALLOWED = 3000
 
 from .base import db
 import logging
-from sqlalchemy import select, update, or_, func
+from sqlalchemy import select, update, or_, func, case
+from sqlalchemy.orm import joinedload
 from datetime import datetime
 import json
 import math
@@ -34,8 +35,15 @@ from .models import (
     GameStats,
     AICode,
     BattlePlayer,
+    RatingLedger,
     db,
+    generate_uuid,
 )  # 移除Room, RoomParticipant
+from .leaderboard import (
+    get_leaderboard,  # 排行榜读取物化榜单，见 leaderboard.py
+    sync_leaderboard_entries,
+)
+from game.battle_result import BattleResult
 
 # 配置 Logger
 logger = logging.getLogger(__name__)
@@ -278,26 +286,24 @@ def get_active_ai_codes_by_ranking_ids(ranking_ids: list[int] = None) -> list[AI
     else:
         normalized_ranking_ids = sorted(list(set(ranking_ids)))  # 去重并排序
 
-    active_ai_codes = []
     try:
         if not normalized_ranking_ids:
             # 如果未指定ranking_ids或为空列表，则获取所有用户的激活AI代码
             logger.info("获取所有用户的激活AI代码")
             return AICode.query.filter_by(is_active=True).all()
-        else:
-            # 遍历每个排名ID
-            for ranking_id in normalized_ranking_ids:
-                logger.info(f"获取排名ID为 {ranking_id} 的用户激活AI代码")
-                # 查询该排名下的所有用户ID
-                game_stats_list = GameStats.query.filter_by(ranking_id=ranking_id).all()
-                # 获取每个用户的激活AI代码
-                for game_stats in game_stats_list:
-                    user_id = game_stats.user_id
-                    ai_code = get_user_active_ai_code(user_id)
-                    if ai_code:
-                        active_ai_codes.append(ai_code)
-                    elif ranking_id != 0:
-                        safe_delete(game_stats)
+
+        # 单次连接查询：榜单成员 (GameStats) ⋈ 激活AI (idx_aicodes_user_active)
+        # 没有激活AI的过期成员由 cleanup_stale_game_stats 单独清理
+        logger.info(f"获取排名ID为 {normalized_ranking_ids} 的用户激活AI代码")
+        active_ai_codes = (
+            AICode.query.join(GameStats, GameStats.user_id == AICode.user_id)
+            .filter(
+                GameStats.ranking_id.in_(normalized_ranking_ids),
+                AICode.is_active == True,
+            )
+            .order_by(GameStats.ranking_id)
+            .all()
+        )
 
         logger.info(f"成功获取 {len(active_ai_codes)} 个激活的AI代码")
         return active_ai_codes
@@ -310,6 +316,39 @@ def get_active_ai_codes_by_ranking_ids(ranking_ids: list[int] = None) -> list[AI
         return []
 
 
+def cleanup_stale_game_stats(ranking_ids=None):
+    """
+    清理没有激活AI的用户在天梯榜单 (ranking_id != 0) 中的统计记录。
+    作为独立的维护任务运行，不再在获取参与者时顺带删除。
+
+    参数:
+        ranking_ids (list[int], optional): 只清理这些榜单，默认清理所有非 0 榜单。
+
+    返回:
+        int: 删除的记录数，失败返回 -1。
+    """
+    try:
+        has_active_ai = (
+            select(AICode.id)
+            .where(AICode.user_id == GameStats.user_id, AICode.is_active == True)
+            .exists()
+        )
+        query = GameStats.query.filter(GameStats.ranking_id != 0, ~has_active_ai)
+        if ranking_ids:
+            query = query.filter(GameStats.ranking_id.in_(list(ranking_ids)))
+
+        deleted = query.delete(synchronize_session=False)
+        if not safe_commit():
+            return -1
+        if deleted:
+            logger.info(f"已清理 {deleted} 条无激活AI用户的榜单统计记录")
+        return deleted
+    except Exception as e:
+        logger.error(f"清理过期榜单统计记录失败: {e}", exc_info=True)
+        db.session.rollback()
+        return -1
+
+
 def get_user_ai_codes(user_id):
     """获取用户的所有AI代码记录。"""
     try:
@@ -455,6 +494,36 @@ def set_active_ai_code(user_id, ai_code_id):
         return False
 
 
+def set_ai_code_validation(ai_code_id, status, error=None, code_hash=None):
+    """
+    记录AI代码的校验结论 (见 game/code_validator.py)。
+
+    参数:
+        ai_code_id (str): AI代码ID。
+        status (str): pending / valid / invalid。
+        error (str, optional): 校验未通过的原因。
+        code_hash (str, optional): 源码 sha256，为 None 时保持不变。
+
+    返回:
+        bool: 操作是否成功。
+    """
+    try:
+        ai_code = db.session.get(AICode, ai_code_id)
+        if not ai_code:
+            logger.warning(f"记录校验结论时AI代码 {ai_code_id} 不存在")
+            return False
+        ai_code.validation_status = status
+        ai_code.validation_error = error
+        ai_code.validated_at = None if status == "pending" else datetime.now()
+        if code_hash is not None:
+            ai_code.code_hash = code_hash
+        return safe_commit()
+    except Exception as e:
+        logger.error(f"记录AI代码 {ai_code_id} 校验结论失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
 def get_ai_code_path_full(ai_code_id):
     """
     根据ai_code_id获取AI代码文件在文件系统中的完整路径。
@@ -581,78 +650,31 @@ def update_game_stats(stats, **kwargs):
         return False
 
 
-def get_leaderboard(ranking_id=0, page=1, per_page=15, min_games_played=0):
-    """获取排行榜数据，支持分页"""
-    # 基本查询条件
-    base_query = GameStats.query.filter_by(ranking_id=ranking_id)
-
-    if min_games_played > 0:
-        base_query = base_query.filter(GameStats.games_played >= min_games_played)
-
-    # 计算总记录数
-    total_count = base_query.count()
-
-    # 先执行JOIN，再做排序和分页
-    query = (
-        base_query.join(User)  # 先JOIN再分页
-        .with_entities(
-            GameStats.user_id,
-            User.username,
-            GameStats.elo_score,
-            GameStats.wins,
-            GameStats.losses,
-            GameStats.draws,
-            GameStats.games_played,
-        )
-        .order_by(GameStats.elo_score.desc())  # 排序
-    )
+def get_ranking_rating_snapshot(ranking_id=0):
+    """
+    一次查询获取某排行榜全部用户的评分快照，供自动对战选择阵容。
 
-    # 然后应用分页
-    offset = (page - 1) * per_page
-    paginated_query = query.offset(offset).limit(per_page)
-
-    # 获取结果
-    stats_with_users = paginated_query.all()
-
-    # 格式化返回数据
-    result = []
-    for rank, (
-        user_id,
-        username,
-        elo_score,
-        wins,
-        losses,
-        draws,
-        games_played,
-    ) in enumerate(stats_with_users, start=offset + 1):
-        win_rate = round(wins / (losses + wins) * 100, 1) if (losses + wins) > 0 else 0
-        win_rate_for_container = (
-            round(wins / games_played * 100, 1) if games_played > 0 else 0
-        )
-        loss_rate_for_container = (
-            round(losses / games_played * 100, 1) if games_played > 0 else 0
-        )
-        draw_rate_for_container = (
-            round(draws / games_played * 100, 1) if games_played > 0 else 0
-        )
-        result.append(
-            {
-                "rank": rank,
-                "user_id": user_id,
-                "username": username,
-                "elo_score": elo_score,
-                "wins": wins,
-                "losses": losses,
-                "draws": draws,
-                "games_played": games_played,
-                "win_rate": win_rate,
-                "draw_rate_for_container": draw_rate_for_container,
-                "loss_rate_for_container": loss_rate_for_container,
-                "win_rate_for_container": win_rate_for_container,
-            }
-        )
+    参数:
+        ranking_id (int): 排行榜ID。
 
-    return result, total_count
+    返回:
+        dict: {user_id: (elo_score, games_played)}，失败返回空字典。
+    """
+    try:
+        rows = (
+            db.session.query(
+                GameStats.user_id, GameStats.elo_score, GameStats.games_played
+            )
+            .filter(GameStats.ranking_id == ranking_id)
+            .all()
+        )
+        return {
+            user_id: (elo_score or 1200, games_played or 0)
+            for user_id, elo_score, games_played in rows
+        }
+    except Exception as e:
+        logger.error(f"获取排行榜 {ranking_id} 的评分快照失败: {e}", exc_info=True)
+        return {}
 
 
 # -----------------------------------------------------------------------------------------
@@ -676,71 +698,106 @@ def create_battle(
     返回:
         Battle: 创建成功的对战对象，失败则返回None。
     """
+    if not participant_data_list:
+        logger.error("创建对战失败: 参与者列表为空。")
+        return None
+    return create_battles([participant_data_list], ranking_id, status)[0]
+
+
+def create_battles(lineups, ranking_id=0, status="waiting"):
+    """
+    批量创建对战记录及参与者记录 (自动对战一次补满多个空位时使用)。
+
+    参与者校验和 initial_elo 快照都用集合查询一次完成，
+    所有 Battle 与 BattlePlayer 在同一个事务中插入。
+
+    参数:
+        lineups (list): 阵容列表，每个阵容是 create_battle 的 participant_data_list。
+        ranking_id (int): 对战所属的排行榜ID。默认为0。
+        status (str): 初始状态。默认为 'waiting'。
+
+    返回:
+        list: 与 lineups 一一对应的 Battle 对象，无效阵容或提交失败的位置为 None。
+    """
+    results = [None] * len(lineups)
+    if not lineups:
+        return results
     try:
-        if not participant_data_list:
-            logger.error("创建对战失败: 参与者列表为空。")
-            return None
+        user_ids = {data.get("user_id") for lineup in lineups for data in lineup}
+        ai_code_ids = {data.get("ai_code_id") for lineup in lineups for data in lineup}
 
-        # 确保所有参与者都存在且选择了AI (根据 BattlePlayer 模型 nullable=False 的定义)
-        for data in participant_data_list:
-            user = get_user_by_id(data.get("user_id"))
-            # 使用 'ai_code_id' 作为键
-            ai_code = get_ai_code_by_id(data.get("ai_code_id"))  # <--- 修改这里
-            if not user or not ai_code or ai_code.user_id != user.id:
-                # 记录更详细的错误原因
-                reason = ""
-                if not user:
-                    reason = "用户不存在"
-                elif not ai_code:
-                    reason = "AI代码不存在"
-                elif ai_code.user_id != user.id:
-                    reason = "AI代码不属于该用户"
+        # 集合查询: 存在的用户、AI代码归属、当前 ELO
+        existing_users = {
+            user_id
+            for (user_id,) in db.session.query(User.id).filter(User.id.in_(user_ids))
+        }
+        ai_code_owners = dict(
+            db.session.query(AICode.id, AICode.user_id).filter(
+                AICode.id.in_(ai_code_ids)
+            )
+        )
+        elo_snapshot = dict(
+            db.session.query(GameStats.user_id, GameStats.elo_score).filter(
+                GameStats.ranking_id == ranking_id, GameStats.user_id.in_(user_ids)
+            )
+        )
+
+        now = datetime.now()
+        created = []
+        for index, lineup in enumerate(lineups):
+            invalid = None
+            for data in lineup:
+                # 确保所有参与者都存在且选择了AI (BattlePlayer.selected_ai_code_id 不可为空)
+                user_id, ai_code_id = data.get("user_id"), data.get("ai_code_id")
+                if user_id not in existing_users:
+                    invalid = (data, "用户不存在")
+                elif ai_code_id not in ai_code_owners:
+                    invalid = (data, "AI代码不存在")
+                elif ai_code_owners[ai_code_id] != user_id:
+                    invalid = (data, "AI代码不属于该用户")
+                if invalid:
+                    break
+            if not lineup or invalid:
                 logger.error(
-                    f"创建对战失败: 无效的参与者或AI代码数据 {data} (原因: {reason})"
+                    f"创建对战失败: 无效的参与者或AI代码数据 "
+                    f"{invalid[0] if invalid else lineup} "
+                    f"(原因: {invalid[1] if invalid else '参与者列表为空'})"
                 )
-                return None
-
-        battle = Battle(
-            status=status,
-            ranking_id=ranking_id,
-            created_at=datetime.now(),  # 开始时间戳,
-            # started_at 在对战真正开始时设置
-            # results 在对战结束时设置
-            # game_log_uuid 在对战结束时设置
-        )
-        db.session.add(battle)
-        db.session.flush()  # 确保 battle 有了 ID
-
-        battle_players = []
-        for i, data in enumerate(participant_data_list):
-            # 获取玩家当前的ELO作为 initial_elo 快照
-            user_stats = get_game_stats_by_user_id(data["user_id"], ranking_id)
-            initial_elo = (
-                user_stats.elo_score if user_stats else 1200
-            )  # 默认或从 GameStats 获取
-
-            bp = BattlePlayer(
-                battle_id=battle.id,
-                user_id=data["user_id"],
-                # 使用 'ai_code_id' 作为键
-                selected_ai_code_id=data["ai_code_id"],  # <--- 修改这里
-                position=i + 1,  # 简单设置位置
-                initial_elo=initial_elo,
-                join_time=datetime.now(),  # 开始时间戳,
+                continue
+
+            # 预先生成 ID，避免逐条 flush
+            battle = Battle(
+                id=generate_uuid(),
+                status=status,
+                ranking_id=ranking_id,
+                created_at=now,
+            )
+            db.session.add(battle)
+            db.session.add_all(
+                BattlePlayer(
+                    battle_id=battle.id,
+                    user_id=data["user_id"],
+                    selected_ai_code_id=data["ai_code_id"],
+                    position=i + 1,
+                    initial_elo=elo_snapshot.get(data["user_id"]) or 1200,
+                    join_time=now,
+                    battle_created_at=now,
+                )
+                for i, data in enumerate(lineup)
             )
-            battle_players.append(bp)
-            db.session.add(bp)  # 添加BattlePlayer 记录
+            created.append((index, battle))
 
+        if not created:
+            return results
         if safe_commit():
-            logger.info(
-                f"对战 {battle.id} 创建成功，包含 {len(battle_players)} 位玩家。"
-            )
-            return battle
-        return None
+            for index, battle in created:
+                results[index] = battle
+            logger.info(f"批量创建 {len(created)} 场对战成功 (排行榜 {ranking_id})。")
+        return results
     except Exception as e:
-        logger.error(f"创建对战失败: {e}", exc_info=True)
+        logger.error(f"批量创建对战失败: {e}", exc_info=True)
         db.session.rollback()
-        return None
+        return [None] * len(lineups)
 
 
 def get_battle_by_id(battle_id):
@@ -763,6 +820,30 @@ def get_battle_by_id(battle_id):
         return None
 
 
+def get_battle_statuses(battle_ids):
+    """
+    批量获取多个对战的状态 (单次查询)。
+
+    参数:
+        battle_ids (list): 对战ID列表。
+
+    返回:
+        dict: {battle_id: status}，不存在的对战不会出现在结果中。
+    """
+    if not battle_ids:
+        return {}
+    try:
+        rows = (
+            db.session.query(Battle.id, Battle.status)
+            .filter(Battle.id.in_(list(battle_ids)))
+            .all()
+        )
+        return {battle_id: status for battle_id, status in rows}
+    except Exception as e:
+        logger.error(f"批量获取对战状态失败: {e}", exc_info=True)
+        return {}
+
+
 def update_battle(battle, **kwargs):
     """
     更新对战记录 (Battle) 的通用方法。
@@ -802,6 +883,57 @@ def update_battle(battle, **kwargs):
         return False
 
 
+def update_battle_statuses(status_updates):
+    """
+    在一个事务中批量更新多场对战的状态 (供状态写线程合并高频写入)。
+    与 update_battle 相同：进入 playing 时记录开始时间，进入结束状态时记录结束时间。
+
+    参数:
+        status_updates (dict): {battle_id: 新状态}
+
+    返回:
+        dict: {battle_id: 是否更新成功}，对战不存在或已取消时为 False；出错时全部为 False。
+    """
+    if not status_updates:
+        return {}
+    try:
+        by_status = {}
+        for battle_id, status in status_updates.items():
+            by_status.setdefault(status, []).append(battle_id)
+
+        now = datetime.now()
+        updated = set()
+        for status, battle_ids in by_status.items():
+            values = {"status": status}
+            if status == "playing":
+                values["started_at"] = func.coalesce(Battle.started_at, now)
+            elif status in ["completed", "error", "cancelled"]:
+                values["ended_at"] = func.coalesce(Battle.ended_at, now)
+            # 已取消的对战不再被执行中的工作者改回其他状态
+            db.session.execute(
+                update(Battle)
+                .where(Battle.id.in_(battle_ids), Battle.status != "cancelled")
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            # 同一事务内回读：被取消过滤掉或不存在的对战不算成功
+            updated.update(
+                db.session.execute(
+                    select(Battle.id).where(
+                        Battle.id.in_(battle_ids), Battle.status == status
+                    )
+                ).scalars()
+            )
+
+        if not safe_commit():
+            return {battle_id: False for battle_id in status_updates}
+        return {battle_id: battle_id in updated for battle_id in status_updates}
+    except Exception as e:
+        logger.error(f"批量更新对战状态失败: {e}", exc_info=True)
+        db.session.rollback()
+        return {battle_id: False for battle_id in status_updates}
+
+
 def delete_battle(battle):
     """
     删除对战记录。
@@ -846,704 +978,640 @@ def get_battle_players_for_battle(battle_id):
         return []
 
 
-def process_battle_results_and_update_stats(battle_id, results_data):
+def get_battle_players_for_battles(battle_ids):
     """
-    处理4v3对战结果，更新玩家对战记录及ELO评分。
-
-    改进：
-    1. 更准确地识别玩家错误
-    2. 基于错误类型和方法实现差异化的ELO惩罚
-    3. 提供更详细的日志记录
-    4. 支持多排行榜 (ranking_id)
+    一次查询获取多场对战的参与者 (连同用户和所选 AI)，避免逐场查询。
 
     参数:
-        battle_id (str): 对战的唯一标识符
-        results_data (dict): 包含对战结果的数据，格式为:
-            {
-                "winner": "red"|"blue",  # 获胜队伍
-                "error": bool,           # 新增错误标识（可选）
-                "public_log_file": str,  # 新增公共日志路径（可选）
-                "roles": {...},          # 角色分配信息
-                # 其他可选字段（如game_log_uuid等）
-            }
+        battle_ids (list): 对战ID列表。
 
     返回:
-        bool: 处理成功返回True，否则False
+        dict: {battle_id: [BattlePlayer, ...]} (每场按position排序)，出错则返回空字典。
     """
-
-    RED_TEAM = "red"
-    BLUE_TEAM = "blue"
-    BLUE_ROLES = ["Merlin", "Percival", "Knight"]  # 蓝方角色
-    RED_ROLES = ["Morgana", "Assassin", "Oberon"]  # 红方角色
-
+    if not battle_ids:
+        return {}
     try:
-        # ----------------------------------
-        # 阶段1：获取基础数据并验证
-        # ----------------------------------
-        battle = get_battle_by_id(battle_id)
-        if not battle:
-            logger.error(f"[Battle {battle_id}] 对战记录不存在")
-            return False
-
-        # --- 新增检查 ---
-        if battle.is_elo_exempt:
-            logger.info(
-                f"[Battle {battle_id}] 此对战 (类型: {battle.battle_type}) 被标记为ELO豁免，将跳过ELO和统计更新。"
-            )
-            # 只需要更新battle的状态和结果，不进行统计和ELO计算
-            battle.status = "completed"  # 或者根据results_data判断是否error
-            if "error" in results_data:  # 确保result_data被正确解析
-                try:
-                    parsed_results = (
-                        json.loads(results_data)
-                        if isinstance(results_data, str)
-                        else results_data
-                    )
-                    if "error" in parsed_results:
-                        battle.status = "error"
-                except:
-                    pass  # 保持completed
-
-            battle.ended_at = (
-                datetime.now()
-            )  # 开始时间戳  # 使用 datetime.datetime.utcnow() 如果你的时间都是UTC
-            battle.results = (
-                json.dumps(results_data)
-                if not isinstance(results_data, str)
-                else results_data
-            )
-            battle.game_log_uuid = (
-                results_data.get("game_log_uuid")
-                if isinstance(results_data, dict)
-                else None
+        players = {battle_id: [] for battle_id in battle_ids}
+        for bp in db.session.scalars(
+            select(BattlePlayer)
+            .options(
+                joinedload(BattlePlayer.user), joinedload(BattlePlayer.selected_ai_code)
             )
+            .where(BattlePlayer.battle_id.in_(battle_ids))
+            .order_by(BattlePlayer.battle_id, BattlePlayer.position)
+        ):
+            players[bp.battle_id].append(bp)
+        return players
+    except Exception as e:
+        logger.error(f"批量获取对战参与者失败: {e}", exc_info=True)
+        return {}
+
+
+RED_TEAM = "red"
+BLUE_TEAM = "blue"
+BLUE_ROLES = ["Merlin", "Percival", "Knight"]  # 蓝方角色
+RED_ROLES = ["Morgana", "Assassin", "Oberon"]  # 红方角色
+ELO_K_FACTOR = 30
+MIN_ELO = 10
+# 代码报错惩罚：按错误类型的系数、按出错方法的额外扣分
+ERROR_TYPE_MULTIPLIERS = {
+    "critical_player_ERROR": 1.5,  # 严重错误
+    "player_ruturn_ERROR": 1.2,  # 返回值错误
+}
+ERROR_METHOD_PENALTIES = {
+    "walk": 10,  # 移动错误
+    "decide_mission_member": 15,  # 队伍选择错误
+    "mission_vote2": 20,  # 投票错误
+}
+
+
+def _team_geometric_mean(scores):
+    """队伍平均ELO (几何平均，缓和低分玩家的影响)，空队伍为 1200"""
+    if not scores:
+        return 1200
+    product = 1
+    for score in scores:
+        product *= score
+    return product ** (1 / len(scores))
+
+
+def token_proportions(tokens):
+    """
+    各玩家 token 用量 (输入 + 3×输出，取 1/4) 相对全局均值的比例，
+    均值低于 MAX_TOKEN_ALLOWED 时按 MAX_TOKEN_ALLOWED 计算。
 
-            # 对于BattlePlayer，我们可能仍想记录他们的outcome (win/loss/draw)但没有elo_change
-            battle_players = get_battle_players_for_battle(battle_id)
-            roles_data = (
-                results_data.get("roles", {}) if isinstance(results_data, dict) else {}
-            )
-            # ... (可以复用之前的 player_roles 和 team_map, user_outcomes 的逻辑来确定 outcome) ...
-            # 例如:
-            # player_roles = {} ...
-            # team_map = {} ...
-            # user_outcomes = {} ... (基于 winner_team)
-            winner_team = (
-                results_data.get("winner") if isinstance(results_data, dict) else None
-            )
-            if winner_team:
-                team_outcomes = {
-                    RED_TEAM: "win" if winner_team == RED_TEAM else "loss",
-                    BLUE_TEAM: "win" if winner_team == BLUE_TEAM else "loss",
-                }
-                # 假设可以获取到角色和队伍映射
-                # user_outcomes = { bp.user_id: team_outcomes[get_team_for_user(bp.user_id, roles_data)] for bp in battle_players }
-
-                for bp in battle_players:
-                    # outcome = user_outcomes.get(bp.user_id, "draw") # 默认为平局如果无法确定
-                    # bp.outcome = outcome
-                    if bp.initial_elo is None:
-                        user_stats = get_game_stats_by_user_id(
-                            bp.user_id, battle.ranking_id
-                        )
-                        bp.initial_elo = (
-                            user_stats.elo_score if user_stats else 1200
-                        )  # Fallback to default
-
-                    bp.elo_change = 0  # 明确ELO变化为0 for exempt battles
-                    db.session.add(bp)
-
-            if safe_commit():
-                logger.info(
-                    f"[Battle {battle_id}] ELO豁免的对战结果已记录，无统计更新。"
-                )
-                return True
-            else:
-                logger.error(
-                    f"[Battle {battle_id}] ELO豁免的对战结果记录失败（数据库提交错误）。"
-                )
-                return False
-        # --- 结束新增检查 ---
-        battle_ranking_id = battle.ranking_id  # 获取对战的排行榜ID
-
-        if battle.status == "completed":
-            logger.info(f"[Battle {battle_id}] 对战已处理，跳过重复操作")
-            return True  # 幂等性处理
-
-        # 获取对战玩家记录（按加入顺序排列）
-        battle_players = get_battle_players_for_battle(battle_id)
-        if len(battle_players) != 7:
-            logger.error(
-                f"[Battle {battle_id}] 玩家数量异常（预期7人，实际{len(battle_players)}人）"
-            )
-            return False
-
-        # 初始化错误处理相关变量
-        err_user_id = None
-        error_pid_in_game = None
-        error_type = None
-        error_code_method = None
-        error_msg = None
-
-        # 验证公共日志文件路径
-        PUBLIC_LIB_FILE_DIR = results_data.get("public_log_file")
-        if not PUBLIC_LIB_FILE_DIR:
-            logger.error(f"[Battle {battle_id}] 缺少公共日志文件路径")
-            return False
+    参数:
+        tokens (list): 按 player_id 1-7 排列的 [{"input": .., "output": ..}, ...]，
+                       不足 7 个时全部按 0 处理。
 
-        # 读取公共日志获取错误玩家
+    返回:
+        list: 7 个比例值。
+    """
+    if len(tokens) < 7:
+        tokens = []
+    tokens_standard = []
+    for idx in range(7):
+        token_data = tokens[idx] if tokens else {"input": 0, "output": 0}
+        tokens_standard.append((token_data["input"] + 3 * token_data["output"]) / 4)
+    tokens_avg = max(
+        MAX_TOKEN_ALLOWED, sum(tokens_standard) / 7
+    )  # 均值, 该常量以下必不惩罚
+    return [token / tokens_avg for token in tokens_standard]
+
+
+def _record_elo_exempt_result(battle, results_data):
+    """记录ELO豁免对战的结果，不进行统计和ELO计算"""
+    battle_id = battle.id
+    logger.info(
+        f"[Battle {battle_id}] 此对战 (类型: {battle.battle_type}) 被标记为ELO豁免，将跳过ELO和统计更新。"
+    )
+    # 只需要更新battle的状态和结果，不进行统计和ELO计算
+    battle.status = "completed"  # 或者根据results_data判断是否error
+    if "error" in results_data:  # 确保result_data被正确解析
         try:
-            with open(PUBLIC_LIB_FILE_DIR, "r", encoding="utf-8") as plib:
-                data = json.load(plib)
-                # 遍历日志条目，查找错误记录
-                for record in reversed(data):  # 从最新记录开始查找
-                    # 检查是否是错误记录
-                    if "type" in record and record["type"] in [
-                        "critical_player_ERROR",
-                        "player_ruturn_ERROR",
-                    ]:
-                        error_type = record.get("type")
-                        error_pid_in_game = record.get("error_code_pid")
-                        error_code_method = record.get("error_code_method")
-                        error_msg = record.get("error_msg")
-
-                        # 检查错误玩家ID有效性
-                        if (
-                            error_pid_in_game is not None
-                            and 1 <= error_pid_in_game <= 7
-                        ):
-                            logger.info(
-                                f"[Battle {battle_id}] 找到错误玩家PID: {error_pid_in_game}, 错误类型: {error_type}, 错误方法: {error_code_method}"
-                            )
-                            break
-
-                # 如果没有找到有效的错误记录
-                if error_pid_in_game is None or not (1 <= error_pid_in_game <= 7):
-                    # 检查最后一条记录是否有错误信息但格式不同
-                    last_record = data[-1] if data else None
-                    if last_record and "error" in last_record:
-                        logger.warning(
-                            f"[Battle {battle_id}] 找到非标准错误记录: {last_record}"
-                        )
-                        # 尝试从非标准错误记录中提取信息
-                        if isinstance(
-                            last_record.get("error"), str
-                        ) and "Player" in last_record.get("error"):
-                            # 尝试从错误消息中提取玩家ID
-                            import re
-
-                            match = re.search(r"Player (\d+)", last_record.get("error"))
-                            if match:
-                                error_pid_in_game = int(match.group(1))
-                                error_type = "extracted_error"
-                                error_msg = last_record.get("error")
-
-                                # 尝试提取错误方法
-                                method_match = re.search(
-                                    r"method '([^']+)'|executing ([^ ]+)",
-                                    last_record.get("error"),
-                                )
-                                if method_match:
-                                    error_code_method = method_match.group(
-                                        1
-                                    ) or method_match.group(2)
-
-                                logger.info(
-                                    f"[Battle {battle_id}] 从错误消息中提取出玩家ID: {error_pid_in_game}, 方法: {error_code_method}"
-                                )
-
-                    # 如果仍然没有找到错误玩家
-                    if error_pid_in_game is None or not (1 <= error_pid_in_game <= 7):
-                        logger.error(f"[Battle {battle_id}] 无法找到有效的错误玩家PID")
-                        # 此时不返回False，而是继续处理，但不执行ELO扣分
-        except Exception as e:
-            logger.error(
-                f"[Battle {battle_id}] 读取公共日志失败: {str(e)}", exc_info=True
+            parsed_results = (
+                json.loads(results_data)
+                if isinstance(results_data, str)
+                else results_data
             )
-            # 继续处理，但不执行ELO扣分
+            if "error" in parsed_results:
+                battle.status = "error"
+        except:
+            pass  # 保持completed
+
+    battle.ended_at = datetime.now()
+    battle.results = (
+        json.dumps(results_data) if not isinstance(results_data, str) else results_data
+    )
+    battle.game_log_uuid = (
+        results_data.get("game_log_uuid") if isinstance(results_data, dict) else None
+    )
 
-        # 获取错误玩家信息
-        if error_pid_in_game is not None and 1 <= error_pid_in_game <= 7:
-            err_player_index = error_pid_in_game - 1
-            if err_player_index < len(battle_players):
-                err_user_id = battle_players[err_player_index].user_id
-                logger.info(
-                    f"[Battle {battle_id}] 错误玩家用户ID: {err_user_id} (游戏中的PID: {error_pid_in_game})"
-                )
-            else:
-                logger.error(f"[Battle {battle_id}] 错误玩家索引超出范围")
+    # 对于BattlePlayer，我们可能仍想记录他们的outcome (win/loss/draw)但没有elo_change
+    battle_players = get_battle_players_for_battle(battle_id)
+    winner_team = results_data.get("winner") if isinstance(results_data, dict) else None
+    if winner_team:
+        for bp in battle_players:
+            if bp.initial_elo is None:
+                user_stats = get_game_stats_by_user_id(bp.user_id, battle.ranking_id)
+                bp.initial_elo = (
+                    user_stats.elo_score if user_stats else 1200
+                )  # Fallback to default
 
-        # ----------------------------------
-        # 阶段2：基础数据更新
-        # ----------------------------------
-        battle.status = "completed" if err_user_id is None else "error"
-        battle.ended_at = datetime.now()  # 开始时间戳
-        battle.results = json.dumps(results_data)
-        battle.game_log_uuid = results_data.get("game_log_uuid")
-
-        # ----------------------------------
-        # 阶段3：生成核心映射关系 - 修复部分
-        # ----------------------------------
-        # 获取角色信息，处理不同格式的roles数据
-        roles_data = results_data.get("roles", {})
-        logger.info(f"[Battle {battle_id}] 从结果数据中获取角色信息: {roles_data}")
-
-        # 创建player_id到角色的映射
-        player_roles = {}
-
-        # 尝试多种方式从结果数据中提取角色信息
-        if isinstance(roles_data, dict):
-            # 如果roles是字典格式
-            for pid_str, role in roles_data.items():
-                try:
-                    # 尝试将键转换为整数（处理字符串键的情况）
-                    pid = int(pid_str) if isinstance(pid_str, str) else pid_str
-                    player_roles[pid] = role
-                except (ValueError, TypeError):
-                    logger.warning(
-                        f"[Battle {battle_id}] 无法解析角色数据键: {pid_str}"
-                    )
+            bp.elo_change = 0  # 明确ELO变化为0 for exempt battles
+            db.session.add(bp)
 
-        # 如果无法从结果数据中获取角色信息，我们将基于最终获胜方推断队伍
-        if not player_roles and "winner" in results_data:
-            logger.warning(
-                f"[Battle {battle_id}] 无法从结果中获取角色信息，将基于最终胜负推断队伍"
-            )
 
-            # 根据最终获胜方分配角色（简化处理）
-            winner_team = results_data.get("winner")
-
-            # 模拟一个基础的角色分配
-            # 前4个玩家是蓝队，后3个玩家是红队（这是一种简化处理）
-            for i in range(1, 8):
-                if i <= 4:  # 前4个玩家属于蓝队
-                    player_roles[i] = "Knight"  # 默认蓝队角色
-                else:  # 后3个玩家属于红队
-                    player_roles[i] = "Assassin"  # 默认红队角色
-
-        # 在没有任何角色信息的情况下，记录警告并继续
-        if not player_roles:
-            logger.warning(f"[Battle {battle_id}] 无法确定角色分配，将默认分配角色")
-            # 创建默认角色映射
-            for i in range(1, 8):
-                player_roles[i] = "Knight" if i <= 4 else "Assassin"
-
-        # 打印获取到的角色信息进行调试
-        logger.info(f"[Battle {battle_id}] 获取到的角色映射: {player_roles}")
-
-        # 定义获取队伍的函数
-        def _get_team_assignment(player_index: int) -> str:
-            """返回玩家的队伍 (player_index 取1-7)"""
-            role = player_roles.get(player_index)
-            if role in RED_ROLES:
-                return RED_TEAM
-            else:
-                return BLUE_TEAM
+def _prepare_battle_result(battle_id, results_data):
+    """
+    记录对战结果 (对战状态、玩家胜负)，并整理出计算 ELO 所需的数据。
+    只修改会话中的对象，不提交。报错玩家和 token 用量直接取自裁判交来的
+    结果对象，不读取日志文件。
 
-        # 生成用户ID到队伍的映射
-        # 修复：使用position作为player_id，而不是enumerate的索引
-        team_map = {}
-        for bp in battle_players:
-            if bp.position is not None:
-                team_map[bp.user_id] = _get_team_assignment(bp.position)
-            else:
-                # 如果position为None，记录警告并跳过
-                logger.warning(
-                    f"[Battle {battle_id}] 玩家 {bp.user_id} 的position为None，跳过队伍分配"
-                )
+    参数:
+        battle_id (str): 对战ID。
+        results_data (BattleResult | dict): 裁判返回的结果，字典会按旧格式转换。
 
-        logger.info(f"[Battle {battle_id}] 生成的队伍映射: {team_map}")
+    返回:
+        tuple: (是否成功, 评分数据)。评分数据为 None 表示无需更新 ELO
+               (ELO豁免或已处理过的对战)。
+    """
+    # ----------------------------------
+    # 阶段1：获取基础数据并验证
+    # ----------------------------------
+    result = (
+        results_data
+        if isinstance(results_data, BattleResult)
+        else BattleResult.from_dict(results_data)
+    )
+    results_dict = result.to_dict()
 
-        # 生成用户结果映射
-        if err_user_id is not None:
-            # 有错误玩家，该玩家为失败，其他为平局
-            user_outcomes = {
-                user_id: "loss" if user_id == err_user_id else "draw"
-                for user_id in team_map.keys()
-            }
-        else:
-            # 正常情况，根据胜负判断
-            winner_team = results_data.get("winner")
-            if winner_team not in (RED_TEAM, BLUE_TEAM):
-                logger.error(f"[Battle {battle_id}] 无效的获胜队伍标识: {winner_team}")
-                return False
-
-            team_outcomes = {
-                RED_TEAM: "win" if winner_team == RED_TEAM else "loss",
-                BLUE_TEAM: "win" if winner_team == BLUE_TEAM else "loss",
-            }
-            user_outcomes = {
-                user_id: team_outcomes[team] for user_id, team in team_map.items()
-            }
+    battle = get_battle_by_id(battle_id)
+    if not battle:
+        logger.error(f"[Battle {battle_id}] 对战记录不存在")
+        return False, None
 
-        # ----------------------------------
-        # 阶段4：更新玩家对战记录
-        # ----------------------------------
-        for bp in battle_players:
-            outcome = user_outcomes.get(bp.user_id)
-            if outcome:
-                bp.outcome = outcome.lower()
-                db.session.add(bp)
-            else:
-                logger.warning(f"[Battle {battle_id}] 玩家 {bp.user_id} 无结果记录")
-        db.session.flush()
+    if battle.status == "cancelled":
+        logger.warning(f"[Battle {battle_id}] 对战已取消，不记录结果")
+        return False, None
 
-        # ----------------------------------
-        # 阶段5：ELO评分计算
-        # ----------------------------------
+    if battle.is_elo_exempt:
+        _record_elo_exempt_result(battle, results_dict)
+        return True, None
 
-        # 这里获取对局token数
-        tokens = []
-        try:
-            with open(PUBLIC_LIB_FILE_DIR, "r", encoding="utf-8") as plib:
-                data = json.load(plib)
-                for line in data[::-1]:
-                    if line.get("type") == "tokens":
-                        tokens = line.get(
-                            "result", []
-                        )  # [{"input": 0, "output": 0} for i in range(7)]
-                        break
-            logger.info(f"[Battle {battle_id}] 获取到的tokens数据: {tokens}")
-        except Exception as e:
-            logger.warning(f"[Battle {battle_id}] 获取tokens数据失败: {str(e)}")
-            # 创建默认tokens
-            tokens = [{"input": 0, "output": 0} for i in range(7)]
-
-        involved_user_ids = list(user_outcomes.keys())
-        user_stats_map = {
-            stats.user_id: stats
-            for stats in GameStats.query.filter(
-                GameStats.user_id.in_(involved_user_ids),
-                GameStats.ranking_id == battle_ranking_id,  # 使用对战的排行榜ID
-            ).all()
-        }
+    if battle.status == "completed":
+        logger.info(f"[Battle {battle_id}] 对战已处理，跳过重复操作")
+        return True, None  # 幂等性处理
 
-        # 缺失的统计记录
-        for user_id in involved_user_ids:
-            if user_id not in user_stats_map:
-                logger.error(f"玩家 {user_id} 已从榜单{battle_ranking_id}中注销")
-
-        # 错误处理分支 - 代码错误的玩家将受到ELO扣除
-        if err_user_id is not None:
-            # 计算队伍平均ELO
-            team_elos = {RED_TEAM: [], BLUE_TEAM: []}
-            for user_id, stats in user_stats_map.items():
-                team = team_map.get(user_id)
-                if team in team_elos:
-                    team_elos[team].append(stats.elo_score)
-
-            team_avg = {
-                team: (
-                    (scores[0] * scores[1] * scores[2] * scores[3]) ** (1 / len(scores))
-                    if len(scores) == 4
-                    else (
-                        (scores[0] * scores[1] * scores[2]) ** (1 / len(scores))
-                        if len(scores) == 3
-                        else (
-                            scores[0]
-                            if len(scores) == 1
-                            else (
-                                1200
-                                if len(scores) == 0  # 默认值
-                                else (
-                                    (scores[0] * scores[1]) ** (1 / len(scores))
-                                    if len(scores) == 2
-                                    else 0
-                                )
-                            )
-                        )
-                    )
-                )  # 几何平均，缓和低分玩家的影响
-                for team, scores in team_elos.items()
-            }  # 这里改为几何平均，给有大蠢蛋参与队伍的强者发点补助
-
-            # 计算惩罚值 - 改进的惩罚计算逻辑
-            # 对于代码错误，基础惩罚为30分，加上队伍差距的10%
-            base_penalty = 30
-            team_diff_penalty = abs(team_avg[BLUE_TEAM] - team_avg[RED_TEAM]) * 0.1
-
-            # 根据错误类型调整惩罚
-            error_type_multiplier = 1.0
-            if error_type == "critical_player_ERROR":
-                error_type_multiplier = 1.5  # 严重错误
-            elif error_type == "player_ruturn_ERROR":
-                error_type_multiplier = 1.2  # 返回值错误
-
-            # 根据错误方法调整惩罚
-            method_penalty = 0
-            if error_code_method == "walk":  # 移动错误
-                method_penalty = 10
-            elif error_code_method == "decide_mission_member":  # 队伍选择错误
-                method_penalty = 15
-            elif error_code_method == "mission_vote2":  # 投票错误
-                method_penalty = 20
-
-            total_reduction = round(
-                (base_penalty + team_diff_penalty) * error_type_multiplier
-                + method_penalty
+    # 获取对战玩家记录（按加入顺序排列）
+    battle_players = get_battle_players_for_battle(battle_id)
+    if len(battle_players) != 7:
+        logger.error(
+            f"[Battle {battle_id}] 玩家数量异常（预期7人，实际{len(battle_players)}人）"
+        )
+        return False, None
+
+    # 裁判记录的报错玩家 (只有玩家代码引起的错误才扣分)
+    player_error = result.player_error
+    error_pid_in_game, error_type, error_code_method = None, None, None
+    if player_error is not None:
+        error_type, error_code_method = player_error.error_type, player_error.method
+        if player_error.is_player_fault:
+            error_pid_in_game = player_error.pid
+            logger.info(
+                f"[Battle {battle_id}] 错误玩家PID: {error_pid_in_game}, 错误类型: {error_type}, 错误方法: {error_code_method}"
             )
-
-            # 确保惩罚至少为20分，最多为100分
-            total_reduction = max(20, min(total_reduction, 100))
-
+        else:
             logger.info(
-                f"[Battle {battle_id}] 错误惩罚计算: 基础={base_penalty}, 队伍差异={team_diff_penalty:.1f}, "
-                + f"类型系数={error_type_multiplier}, 方法惩罚={method_penalty}, 总计={total_reduction}"
+                f"[Battle {battle_id}] 报错不归咎于玩家 (PID: {player_error.pid}, 类型: {error_type})，不执行ELO扣分"
             )
 
-            # 计算其他玩家应该获得的补偿分数
-            other_players = [
-                user_id for user_id in user_stats_map.keys() if user_id != err_user_id
-            ]
-            compensation_per_player = 0
-            if other_players:
-                # 使用四舍五入计算每个玩家的补偿分数
-                compensation_per_player = round(total_reduction / len(other_players))
-            else:
-                # 如果没有其他玩家，记录警告
-                logger.warning(
-                    f"[Battle {battle_id}] 错误玩家 {err_user_id} 不在user_stats_map中，无法进行补偿计算"
-                )
-
+    # 获取错误玩家信息
+    err_user_id = None
+    if error_pid_in_game is not None:
+        err_player_index = error_pid_in_game - 1
+        if err_player_index < len(battle_players):
+            err_user_id = battle_players[err_player_index].user_id
             logger.info(
-                f"[Battle {battle_id}] 补偿分配: 错误玩家扣分={total_reduction}, "
-                + f"其他玩家数量={len(other_players)}, 每人补偿={compensation_per_player}"
+                f"[Battle {battle_id}] 错误玩家用户ID: {err_user_id} (游戏中的PID: {error_pid_in_game})"
+            )
+        else:
+            logger.error(f"[Battle {battle_id}] 错误玩家索引超出范围")
+
+    # 正常结束的对战必须有有效的获胜方 (在修改任何记录之前检查)
+    winner_team = result.winner
+    if err_user_id is None and winner_team not in (RED_TEAM, BLUE_TEAM):
+        logger.error(f"[Battle {battle_id}] 无效的获胜队伍标识: {winner_team}")
+        return False, None
+
+    # ----------------------------------
+    # 阶段2：基础数据更新
+    # ----------------------------------
+    battle.status = "completed" if err_user_id is None else "error"
+    battle.ended_at = datetime.now()
+    battle.results = json.dumps(results_dict)
+    battle.game_log_uuid = result.game_log_uuid
+
+    # ----------------------------------
+    # 阶段3：生成核心映射关系
+    # ----------------------------------
+    # 获取角色信息，处理不同格式的roles数据
+    roles_data = result.roles
+    logger.info(f"[Battle {battle_id}] 从结果数据中获取角色信息: {roles_data}")
+
+    # 创建player_id到角色的映射
+    player_roles = {}
+
+    # 尝试多种方式从结果数据中提取角色信息
+    if isinstance(roles_data, dict):
+        # 如果roles是字典格式
+        for pid_str, role in roles_data.items():
+            try:
+                # 尝试将键转换为整数（处理字符串键的情况）
+                pid = int(pid_str) if isinstance(pid_str, str) else pid_str
+                player_roles[pid] = role
+            except (ValueError, TypeError):
+                logger.warning(f"[Battle {battle_id}] 无法解析角色数据键: {pid_str}")
+
+    # 如果无法从结果数据中获取角色信息，我们将基于最终获胜方推断队伍
+    if not player_roles and winner_team is not None:
+        logger.warning(
+            f"[Battle {battle_id}] 无法从结果中获取角色信息，将基于最终胜负推断队伍"
+        )
+        # 模拟一个基础的角色分配
+        # 前4个玩家是蓝队，后3个玩家是红队（这是一种简化处理）
+        for i in range(1, 8):
+            if i <= 4:  # 前4个玩家属于蓝队
+                player_roles[i] = "Knight"  # 默认蓝队角色
+            else:  # 后3个玩家属于红队
+                player_roles[i] = "Assassin"  # 默认红队角色
+
+    # 在没有任何角色信息的情况下，记录警告并继续
+    if not player_roles:
+        logger.warning(f"[Battle {battle_id}] 无法确定角色分配，将默认分配角色")
+        # 创建默认角色映射
+        for i in range(1, 8):
+            player_roles[i] = "Knight" if i <= 4 else "Assassin"
+
+    logger.info(f"[Battle {battle_id}] 获取到的角色映射: {player_roles}")
+
+    # 生成用户ID到队伍的映射 (position 即游戏中的 player_id)
+    team_map = {}
+    for bp in battle_players:
+        if bp.position is not None:
+            role = player_roles.get(bp.position)
+            team_map[bp.user_id] = RED_TEAM if role in RED_ROLES else BLUE_TEAM
+        else:
+            # 如果position为None，记录警告并跳过
+            logger.warning(
+                f"[Battle {battle_id}] 玩家 {bp.user_id} 的position为None，跳过队伍分配"
             )
 
-            # 更新所有玩家数据
-            for user_id, stats in user_stats_map.items():
-                bp = next((p for p in battle_players if p.user_id == user_id), None)
-                if not bp:
-                    continue
-
-                # 通用更新
-                stats.games_played += 1
-                bp.initial_elo = stats.elo_score
-
-                # 错误玩家特殊处理
-                if user_id == err_user_id:
-                    stats.losses += 1
-                    new_elo = max(round(stats.elo_score - total_reduction), 10)
-                    bp.elo_change = new_elo - stats.elo_score
-                    stats.elo_score = new_elo
-                    logger.info(
-                        f"[Battle {battle_id}] [ERROR] 扣除ELO: 玩家 {user_id} | {bp.initial_elo} -> {new_elo} (减少: {total_reduction}分)"
-                    )
-                else:
-                    # 其他玩家获得相同的补偿分数
-                    stats.draws += 1
-                    new_elo = max(round(stats.elo_score + compensation_per_player), 10)
-                    bp.elo_change = new_elo - stats.elo_score
-                    stats.elo_score = new_elo
-                    logger.info(
-                        f"[Battle {battle_id}] 补偿ELO: 玩家 {user_id} | {bp.initial_elo} -> {new_elo} (增加: {compensation_per_player}分)"
-                    )
+    logger.info(f"[Battle {battle_id}] 生成的队伍映射: {team_map}")
 
-                db.session.add(stats)
-                db.session.add(bp)
+    # 生成用户结果映射
+    if err_user_id is not None:
+        # 有错误玩家，该玩家为失败，其他为平局
+        user_outcomes = {
+            user_id: "loss" if user_id == err_user_id else "draw"
+            for user_id in team_map.keys()
+        }
+    else:
+        # 正常情况，根据胜负判断
+        team_outcomes = {
+            RED_TEAM: "win" if winner_team == RED_TEAM else "loss",
+            BLUE_TEAM: "win" if winner_team == BLUE_TEAM else "loss",
+        }
+        user_outcomes = {
+            user_id: team_outcomes[team] for user_id, team in team_map.items()
+        }
 
-        # 正常处理分支
+    # ----------------------------------
+    # 阶段4：更新玩家对战记录
+    # ----------------------------------
+    for bp in battle_players:
+        outcome = user_outcomes.get(bp.user_id)
+        if outcome:
+            bp.outcome = outcome.lower()
+            db.session.add(bp)
         else:
-            # ELO计算逻辑
-            # 看玩家tokens数占全局tokens比例proportion,
-            # 若proportion<1,按照1计算，>1,
-            # 则胜率 = min{1, 胜率 * (1 + (max{proportion,1} - 1) / 3)}
-            team_elos = {RED_TEAM: [], BLUE_TEAM: []}
-            for user_id, stats in user_stats_map.items():
-                team = team_map.get(user_id)
-                if team in team_elos:
-                    team_elos[team].append(stats.elo_score)
-
-            # 修复：构建按position映射的tokens，确保索引对应正确
-            tokens_by_position = {}
-            if len(tokens) >= 7:
-                # tokens数组按player_id(1-7)顺序排列
-                for i in range(7):
-                    player_id = i + 1  # player_id从1开始
-                    tokens_by_position[player_id] = tokens[i]
-                logger.info(
-                    f"[Battle {battle_id}] 使用完整tokens数据: {len(tokens)}个记录"
-                )
-            else:
-                # 如果tokens数据不足，创建默认值
-                logger.warning(
-                    f"[Battle {battle_id}] tokens数据不足，预期7个，实际{len(tokens)}个，使用默认值"
-                )
-                for i in range(1, 8):
-                    tokens_by_position[i] = {"input": 0, "output": 0}
+            logger.warning(f"[Battle {battle_id}] 玩家 {bp.user_id} 无结果记录")
+
+    return True, {
+        "battle_id": battle_id,
+        "ranking_id": battle.ranking_id,
+        "battle_players": battle_players,
+        "team_map": team_map,
+        "user_outcomes": user_outcomes,
+        "err_user_id": err_user_id,
+        "error_type": error_type,
+        "error_code_method": error_code_method,
+        "winner": winner_team,
+        "tokens": result.tokens if err_user_id is None else [],
+    }
+
+
+def _compute_elo_deltas(rating_data, elo_scores):
+    """
+    计算一场对战各玩家的 ELO 变化 (未取整)。
 
-            tokens_standard = []
-            for player_id in range(1, 8):
-                token_data = tokens_by_position.get(
-                    player_id, {"input": 0, "output": 0}
-                )
-                standard_token = (token_data["input"] + 3 * token_data["output"]) / 4
-                tokens_standard.append(standard_token)
-
-            tokens_avg = max(
-                MAX_TOKEN_ALLOWED, sum(tokens_standard) / 7
-            )  # 均值, 该常量以下必不惩罚
-
-            proportion = [token / tokens_avg for token in tokens_standard]  # 比例
-
-            team_avg = {
-                team: (
-                    (scores[0] * scores[1] * scores[2] * scores[3]) ** (1 / len(scores))
-                    if len(scores) == 4
-                    else (
-                        (scores[0] * scores[1] * scores[2]) ** (1 / len(scores))
-                        if len(scores) == 3
-                        else (
-                            scores[0]
-                            if len(scores) == 1
-                            else (
-                                1200
-                                if len(scores) == 0  # 默认值
-                                else (
-                                    (scores[0] * scores[1]) ** (1 / len(scores))
-                                    if len(scores) == 2
-                                    else 0
-                                )
-                            )
-                        )
-                    )
-                )  # 几何平均，缓和低分玩家的影响
-                for team, scores in team_elos.items()
-            }  # 这里改为几何平均，给有大蠢蛋参与队伍的强者发点补助
+    参数:
+        rating_data (dict): _prepare_battle_result 返回的评分数据。
+        elo_scores (dict): {user_id: 当前ELO}，只包含仍在该榜单中的玩家。
+
+    返回:
+        dict: {user_id: ELO 变化}
+    """
+    battle_id = rating_data["battle_id"]
+    team_map = rating_data["team_map"]
+    err_user_id = rating_data["err_user_id"]
+    players_by_user = {bp.user_id: bp for bp in rating_data["battle_players"]}
+
+    team_elos = {RED_TEAM: [], BLUE_TEAM: []}
+    for user_id, elo in elo_scores.items():
+        team = team_map.get(user_id)
+        if team in team_elos:
+            team_elos[team].append(elo)
+    # 这里改为几何平均，给有大蠢蛋参与队伍的强者发点补助
+    team_avg = {
+        team: _team_geometric_mean(scores) for team, scores in team_elos.items()
+    }
+
+    # 错误处理分支 - 代码错误的玩家将受到ELO扣除
+    if err_user_id is not None:
+        # 计算惩罚值 - 对于代码错误，基础惩罚为30分，加上队伍差距的10%
+        base_penalty = 30
+        team_diff_penalty = abs(team_avg[BLUE_TEAM] - team_avg[RED_TEAM]) * 0.1
+
+        # 根据错误类型和出错方法调整惩罚
+        error_type_multiplier = ERROR_TYPE_MULTIPLIERS.get(
+            rating_data["error_type"], 1.0
+        )
+        method_penalty = ERROR_METHOD_PENALTIES.get(rating_data["error_code_method"], 0)
 
-            K_FACTOR = 30
-            red_expected = 1 / (
-                1 + 10 ** ((team_avg[BLUE_TEAM] - team_avg[RED_TEAM]) / 400)
+        total_reduction = round(
+            (base_penalty + team_diff_penalty) * error_type_multiplier + method_penalty
+        )
+        # 确保惩罚至少为20分，最多为100分
+        total_reduction = max(20, min(total_reduction, 100))
+
+        logger.info(
+            f"[Battle {battle_id}] 错误惩罚计算: 基础={base_penalty}, 队伍差异={team_diff_penalty:.1f}, "
+            + f"类型系数={error_type_multiplier}, 方法惩罚={method_penalty}, 总计={total_reduction}"
+        )
+
+        # 其他玩家平分扣除的分数
+        other_players = [
+            user_id
+            for user_id in elo_scores
+            if user_id != err_user_id and user_id in players_by_user
+        ]
+        compensation_per_player = 0
+        if other_players:
+            compensation_per_player = round(total_reduction / len(other_players))
+        else:
+            logger.warning(
+                f"[Battle {battle_id}] 错误玩家 {err_user_id} 不在榜单统计中，无法进行补偿计算"
             )
-            blue_expected = 1 / (
-                1 + 10 ** ((team_avg[RED_TEAM] - team_avg[BLUE_TEAM]) / 400)
+
+        logger.info(
+            f"[Battle {battle_id}] 补偿分配: 错误玩家扣分={total_reduction}, "
+            + f"其他玩家数量={len(other_players)}, 每人补偿={compensation_per_player}"
+        )
+
+        deltas = {user_id: compensation_per_player for user_id in other_players}
+        if err_user_id in elo_scores and err_user_id in players_by_user:
+            deltas[err_user_id] = -total_reduction
+        return deltas
+
+    # 正常处理分支
+    # 看玩家tokens数占全局tokens比例proportion,
+    # 若proportion<1,按照1计算，>1,
+    # 则胜率 = min{1, 胜率 * (1 + (max{proportion,1} - 1) / 3)}
+    tokens = rating_data["tokens"]
+    # tokens数组按player_id(1-7)顺序排列
+    if len(tokens) < 7:
+        logger.warning(
+            f"[Battle {battle_id}] tokens数据不足，预期7个，实际{len(tokens)}个，使用默认值"
+        )
+    proportion = token_proportions(tokens)  # 比例
+
+    red_expected = 1 / (1 + 10 ** ((team_avg[BLUE_TEAM] - team_avg[RED_TEAM]) / 400))
+    blue_expected = 1 / (1 + 10 ** ((team_avg[RED_TEAM] - team_avg[BLUE_TEAM]) / 400))
+    actual_score = {
+        RED_TEAM: 1.0 if rating_data["winner"] == RED_TEAM else 0.0,
+        BLUE_TEAM: 1.0 if rating_data["winner"] == BLUE_TEAM else 0.0,
+    }
+
+    deltas = {}
+    for user_id in elo_scores:
+        bp = players_by_user.get(user_id)
+        if not bp or bp.position is None:
+            continue
+        idx = bp.position - 1  # position为1~7，proportion下标为0~6
+        team = team_map[user_id]
+        expected = red_expected if team == RED_TEAM else blue_expected
+        deltas[user_id] = ELO_K_FACTOR * (
+            actual_score[team]
+            - min(1, expected * (0.9 + (max(proportion[idx] - 1, 0) / 3)))
+        )
+
+    # 归一化：确保所有ELO变化之和为0
+    if deltas:
+        adjustment = sum(deltas.values()) / len(deltas)
+        deltas = {user_id: delta - adjustment for user_id, delta in deltas.items()}
+        total_adjusted = sum(deltas.values())
+        # 如果仍有误差，将误差分配给第一个玩家
+        if abs(total_adjusted) > 0.01:  # 允许0.01的误差
+            first_user = next(iter(deltas))
+            deltas[first_user] -= total_adjusted
+            logger.info(
+                f"[Battle {battle_id}] 归一化调整误差: {total_adjusted:.6f}，分配给玩家 {first_user}"
             )
+    return deltas
 
-            actual_score = {
-                RED_TEAM: 1.0 if results_data.get("winner") == RED_TEAM else 0.0,
-                BLUE_TEAM: 1.0 if results_data.get("winner") == BLUE_TEAM else 0.0,
-            }
 
-            # 计算所有玩家的ELO变化
-            player_deltas = {}
-            total_delta = 0
-
-            for user_id, stats in user_stats_map.items():
-                bp = next((p for p in battle_players if p.user_id == user_id), None)
-                if not bp or bp.position is None:
-                    continue
-                idx = bp.position - 1  # position为1~7，proportion下标为0~6
-                team = team_map[user_id]
-                expected = red_expected if team == RED_TEAM else blue_expected
-                delta = K_FACTOR * (
-                    actual_score[team]
-                    - min(1, expected * (0.9 + (max(proportion[idx] - 1, 0) / 3)))
-                )
-                player_deltas[user_id] = delta
-                total_delta += delta
-
-            # 归一化：确保所有ELO变化之和为0
-            if len(player_deltas) > 0:
-                adjustment = total_delta / len(player_deltas)
-                # 使用更精确的调整方法，避免累积误差
-                adjusted_deltas = {}
-                total_adjusted = 0
-                for user_id, delta in player_deltas.items():
-                    adjusted_delta = delta - adjustment
-                    adjusted_deltas[user_id] = adjusted_delta
-                    total_adjusted += adjusted_delta
-
-                # 如果仍有误差，将误差分配给第一个玩家
-                if abs(total_adjusted) > 0.01:  # 允许0.01的误差
-                    first_user = list(adjusted_deltas.keys())[0]
-                    adjusted_deltas[first_user] -= total_adjusted
-                    logger.info(
-                        f"[Battle {battle_id}] 归一化调整误差: {total_adjusted:.6f}，分配给玩家 {first_user}"
-                    )
+def apply_battle_results_batch(items):
+    """
+    在一个事务中处理一批对战结果，更新玩家对战记录、ELO 评分并写入评分流水。
 
-                player_deltas = adjusted_deltas
+    - 本批涉及的 ELO 用一次查询读出，按对战顺序在内存中依次计算
+    - GameStats 以增量方式原子更新 (elo_score = elo_score + delta)，
+      不会覆盖其他进程同时写入的结果
+    - 每位玩家每场对战追加一条 RatingLedger 记录
+    批量提交失败时逐场重试，避免一场异常数据拖累整批。
 
-            # 应用ELO变化
-            for user_id, stats in user_stats_map.items():
-                bp = next((p for p in battle_players if p.user_id == user_id), None)
-                if not bp or bp.position is None:
-                    continue
+    参数:
+        items (list): [(battle_id, results_data), ...]，results_data 格式见
+                      process_battle_results_and_update_stats。
 
-                delta = player_deltas.get(user_id, 0)
+    返回:
+        dict: {battle_id: 是否处理成功}
+    """
+    outcomes = {}
+    try:
+        rating_batch = []
+        for battle_id, results_data in items:
+            try:
+                success, rating_data = _prepare_battle_result(battle_id, results_data)
+            except Exception as e:
+                logger.error(f"[Battle {battle_id}] 处理异常: {str(e)}", exc_info=True)
+                success, rating_data = False, None
+            outcomes[battle_id] = success
+            if rating_data:
+                rating_batch.append(rating_data)
+
+        # 一次查询读取本批涉及的全部 ELO: {(user_id, ranking_id): elo}
+        elo_map = {}
+        if rating_batch:
+            user_ids = {uid for data in rating_batch for uid in data["team_map"]}
+            ranking_ids = {data["ranking_id"] for data in rating_batch}
+            elo_map = {
+                (user_id, ranking_id): elo_score
+                for user_id, ranking_id, elo_score in db.session.query(
+                    GameStats.user_id, GameStats.ranking_id, GameStats.elo_score
+                ).filter(
+                    GameStats.user_id.in_(user_ids),
+                    GameStats.ranking_id.in_(ranking_ids),
+                )
+            }
 
-                stats.games_played += 1
-                team = team_map[user_id]
-                if team_outcomes[team] == "win":
-                    stats.wins += 1
+        now = datetime.now()
+        totals = {}  # {(user_id, ranking_id): {字段: 增量}}
+        for rating_data in rating_batch:
+            battle_id = rating_data["battle_id"]
+            ranking_id = rating_data["ranking_id"]
+            elo_scores = {}
+            for user_id in rating_data["team_map"]:
+                if (user_id, ranking_id) in elo_map:
+                    elo_scores[user_id] = elo_map[(user_id, ranking_id)]
                 else:
-                    stats.losses += 1
-
-                new_elo = max(round(stats.elo_score + delta), 10)
-                bp.initial_elo = stats.elo_score
-                bp.elo_change = new_elo - stats.elo_score
-                stats.elo_score = new_elo
+                    logger.error(f"玩家 {user_id} 已从榜单{ranking_id}中注销")
+
+            deltas = _compute_elo_deltas(rating_data, elo_scores)
+            players_by_user = {bp.user_id: bp for bp in rating_data["battle_players"]}
+            for user_id, delta in deltas.items():
+                bp = players_by_user[user_id]
+                outcome = rating_data["user_outcomes"].get(user_id)
+                elo_before = elo_scores[user_id]
+                elo_after = max(round(elo_before + delta), MIN_ELO)
+                bp.initial_elo = elo_before
+                bp.elo_change = elo_after - elo_before
+                elo_map[(user_id, ranking_id)] = elo_after
                 logger.info(
-                    f"[Battle {battle_id}] 更新ELO: 玩家 {user_id} | {bp.initial_elo} -> {new_elo} (变化: {bp.elo_change:+d})"
+                    f"[Battle {battle_id}] 更新ELO: 玩家 {user_id} | {elo_before} -> {elo_after} (变化: {bp.elo_change:+d})"
                 )
 
-                db.session.add(stats)
+                total = totals.setdefault(
+                    (user_id, ranking_id),
+                    {
+                        "elo_score": 0,
+                        "games_played": 0,
+                        "wins": 0,
+                        "losses": 0,
+                        "draws": 0,
+                    },
+                )
+                total["elo_score"] += bp.elo_change
+                total["games_played"] += 1
+                if outcome == "win":
+                    total["wins"] += 1
+                elif outcome == "loss":
+                    total["losses"] += 1
+                else:
+                    total["draws"] += 1
+
                 db.session.add(bp)
+                db.session.add(
+                    RatingLedger(
+                        battle_id=battle_id,
+                        user_id=user_id,
+                        ranking_id=ranking_id,
+                        elo_before=elo_before,
+                        elo_change=bp.elo_change,
+                        elo_after=elo_after,
+                        outcome=outcome,
+                        created_at=now,
+                    )
+                )
 
-        # ----------------------------------
-        # 阶段6：最终提交
-        # ----------------------------------
-        if safe_commit():
-            logger.info(f"[Battle {battle_id}] 处理成功")
-            return True
-        else:
-            db.session.rollback()
-            logger.error(f"[Battle {battle_id}] 数据库提交失败")
-            return False
+        # 增量原子更新，每位玩家一条 UPDATE
+        for (user_id, ranking_id), total in totals.items():
+            new_elo = GameStats.elo_score + total["elo_score"]
+            db.session.execute(
+                update(GameStats)
+                .where(GameStats.user_id == user_id, GameStats.ranking_id == ranking_id)
+                .values(
+                    elo_score=case((new_elo < MIN_ELO, MIN_ELO), else_=new_elo),
+                    games_played=GameStats.games_played + total["games_played"],
+                    wins=GameStats.wins + total["wins"],
+                    losses=GameStats.losses + total["losses"],
+                    draws=GameStats.draws + total["draws"],
+                )
+                .execution_options(synchronize_session=False, leaderboard_synced=True)
+            )
 
+        # 物化排行榜在同一事务中增量维护
+        synced_users = {}
+        for user_id, ranking_id in totals:
+            synced_users.setdefault(ranking_id, []).append(user_id)
+        for ranking_id, user_ids in synced_users.items():
+            sync_leaderboard_entries(ranking_id, user_ids)
+
+        if safe_commit():
+            logger.info(
+                f"批量处理 {len(items)} 场对战结果完成，更新 {len(totals)} 条玩家统计"
+            )
+            return outcomes
     except Exception as e:
         db.session.rollback()
-        logger.error(f"[Battle {battle_id}] 处理异常: {str(e)}", exc_info=True)
-        return False
+        logger.error(f"批量处理对战结果异常: {str(e)}", exc_info=True)
 
+    if len(items) <= 1:
+        return {battle_id: False for battle_id, _ in items}
+    # 整批失败时逐场重试
+    logger.warning(f"批量处理 {len(items)} 场对战结果失败，改为逐场处理")
+    outcomes = {}
+    for item in items:
+        outcomes.update(apply_battle_results_batch([item]))
+    return outcomes
 
-def get_user_battle_history(user_id, page=1, per_page=10):
+
+def process_battle_results_and_update_stats(battle_id, results_data):
     """
-    获取用户参与过的对战历史记录 (分页)。
+    处理4v3对战结果，更新玩家对战记录及ELO评分。
+
+    改进：
+    1. 更准确地识别玩家错误
+    2. 基于错误类型和方法实现差异化的ELO惩罚
+    3. 提供更详细的日志记录
+    4. 支持多排行榜 (ranking_id)
+    5. ELO 以增量方式原子更新，并写入评分流水 (见 apply_battle_results_batch)
 
     参数:
-        user_id (str): 用户ID。
-        page (int): 当前页码 (从1开始)。
-        per_page (int): 每页记录数。
+        battle_id (str): 对战的唯一标识符
+        results_data (BattleResult | dict): 裁判返回的对战结果。字典格式为
+            BattleResult.to_dict() 的输出:
+            {
+                "winner": "red"|"blue",  # 获胜队伍
+                "error": str,            # 错误信息（可选）
+                "roles": {...},          # 角色分配信息
+                "tokens": [...],         # 各玩家 token 用量
+                "player_error": {...},   # suspend_game 记录的报错（可选）
+                # 其他可选字段（如game_log_uuid等）
+            }
 
     返回:
-        tuple: (对战列表, 总记录数)。出错返回 ([], 0)。
+        bool: 处理成功返回True，否则False
     """
-    try:
-        # 查询 BattlePlayer 记录，筛选出指定用户的参与记录
-        # 然后加载关联的 Battle 和 User (为了获取用户名)
-        # 使用 joinedload 可以减少查询次数
-        query = (
-            BattlePlayer.query.filter_by(user_id=user_id)
-            .join(BattlePlayer.battle)
-            .order_by(Battle.created_at.desc())
-        )
+    return apply_battle_results_batch([(battle_id, results_data)])[battle_id]
 
-        # 获取总数
-        total = query.count()
 
-        # 应用分页
-        battle_players_page = query.offset((page - 1) * per_page).limit(per_page).all()
+def get_rating_ledger(user_id=None, ranking_id=None, battle_id=None, limit=100):
+    """
+    查询评分流水，按时间倒序。
 
-        # 提取关联的 Battle 对象
-        # 使用 set 去重，因为一个 Battle 可能有多个 BattlePlayer (不是 1v1 的情况)
-        # 但实际上这里因为是按 BattlePlayer 查，每个 BattlePlayer 只对应一个 Battle。
-        # 转换为 battle 列表方便处理
-        battles = [bp.battle for bp in battle_players_page if bp.battle]
+    参数:
+        user_id (str, optional): 按用户筛选。
+        ranking_id (int, optional): 按排行榜筛选。
+        battle_id (str, optional): 按对战筛选。
+        limit (int): 最多返回的条数。
 
-        return battles, total
+    返回:
+        list: RatingLedger 对象列表，出错返回空列表。
+    """
+    try:
+        query = RatingLedger.query
+        if user_id is not None:
+            query = query.filter(RatingLedger.user_id == user_id)
+        if ranking_id is not None:
+            query = query.filter(RatingLedger.ranking_id == ranking_id)
+        if battle_id is not None:
+            query = query.filter(RatingLedger.battle_id == battle_id)
+        return query.order_by(RatingLedger.created_at.desc()).limit(limit).all()
     except Exception as e:
-        logger.error(f"获取用户 {user_id} 的对战历史失败: {e}", exc_info=True)
-        return [], 0
+        logger.error(f"查询评分流水失败: {e}", exc_info=True)
+        return []
 
 
 def get_recent_battles(limit=20):
@@ -1757,94 +1825,6 @@ def handle_cancelled_battle_stats(battle_id):
         return False
 
 
-from sqlalchemy import desc, or_, and_  # Import and_ if needed, or_ is key here
-
-
-def get_battles_paginated_filtered(filters=None, page=1, per_page=10, error_out=False):
-    """
-    Fetches battles with optional filters and pagination. Supports multi-player filtering.
-
-    :param filters: A dictionary with possible keys: 'status', 'date_from', 'date_to', 'players'.
-    :param page: Current page number.
-    :param per_page: Items per page.
-    :param error_out: If True, raises an error for invalid page numbers.
-    :return: A Flask-SQLAlchemy Pagination object.
-    """
-    query = Battle.query
-
-    # 默认不显示 'ready' 状态的对局，除非过滤器明确要求
-    # (这种方式可能更复杂，取决于你如何组合查询)
-    # 一个简单的方法是，如果状态过滤器不是 'ready'，则排除 'ready'
-    status_filter_value = filters.get("status") if filters else None
-
-    if status_filter_value and status_filter_value.lower() == "ready":
-        query = query.filter(Battle.status == "ready")
-    elif status_filter_value and status_filter_value.lower() != "all":
-        query = query.filter(Battle.status == status_filter_value)
-        # 如果不是 'all' 也不是 'ready'，我们可能仍想排除 ready，但这取决于需求
-        # query = query.filter(Battle.status != 'ready') # 如果总是想排除ready，除非明确选择
-    elif not status_filter_value or status_filter_value.lower() == "all":
-        # 当选择 "all" 或没有状态过滤器时，默认排除 "ready"
-        query = query.filter(Battle.status != "ready")
-
-    if filters:
-        # Apply status filter
-        if "status" in filters and filters["status"] and filters["status"] != "all":
-            query = query.filter(Battle.status == filters["status"])
-
-        # Apply date filters
-        if "date_from" in filters and filters["date_from"]:
-            query = query.filter(Battle.created_at >= filters["date_from"])
-        if "date_to" in filters and filters["date_to"]:
-            query = query.filter(Battle.created_at <= filters["date_to"])
-
-        # Apply multiple player filters
-        if "players" in filters and filters["players"]:
-            player_list = filters["players"]
-            player_ids = []
-
-            # Find all user IDs for the player names/IDs in the list
-            for player_identifier in player_list:
-                # Construct conditions for user identification
-                user_conditions = [User.username == player_identifier]
-                if player_identifier.isdigit():
-                    try:
-                        user_conditions.append(User.id == int(player_identifier))
-                    except ValueError:
-                        pass
-
-                user = User.query.filter(or_(*user_conditions)).first()
-                if user:
-                    player_ids.append(user.id)
-
-            if player_ids:
-                # Create a subquery to find battles where any of these players participated
-                subquery = (
-                    db.session.query(BattlePlayer.battle_id)
-                    .filter(BattlePlayer.user_id.in_(player_ids))
-                    .group_by(BattlePlayer.battle_id)
-                )
-
-                # If we want to find battles where ALL specified players participated, we need to count
-                if len(player_ids) > 1:
-                    subquery = subquery.having(
-                        func.count(BattlePlayer.user_id.distinct()) == len(player_ids)
-                    )
-
-                subquery = subquery.subquery()
-
-                # Join with the main query
-                query = query.join(subquery, Battle.id == subquery.c.battle_id)
-            else:
-                # No valid players found, return no results
-                query = query.filter(False)
-
-    # Default ordering
-    query = query.order_by(desc(Battle.created_at))
-
-    return query.paginate(page=page, per_page=per_page, error_out=error_out)
-
-
 def create_battle_instance(created_by, ranking_id=0):
     """
     创建新的对战实例
@@ -1931,6 +1911,7 @@ def add_player_to_battle(battle_id, position, user_id, ai_code_id=None):
             position=position,
             selected_ai_code_id=ai_code_id,
             join_time=datetime.now(),
+            battle_created_at=battle.created_at,
         )
 
         # 保存到数据库
@@ -0,0 +1,310 @@
+"""
+这个模块实现管理后台任务的持久化队列 (admin_jobs 表)。
+
+与对战队列 (battle_queue.py) 相同，工作线程用带条件的 UPDATE 原子领取任务，
+执行期间由所在进程心跳续约并写回进度；取消请求记录在任务上，
+由心跳带回给执行任务的进程。
+
+管理操作大多不是幂等的 (晋级、删除对局等)，租约过期 (进程崩溃或重启) 的任务
+不会重新执行，而是标记为 failed，由管理员确认后重新提交。
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from .models import AdminJob
+from .action import safe_commit
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+# 默认租约时长 (秒)
+DEFAULT_LEASE_SECONDS = 120
+# 每次领取时扫描的候选任务数量
+CLAIM_CANDIDATES = 5
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+
+def enqueue_admin_job(kind, name, params=None, created_by=None):
+    """
+    提交管理后台任务。
+
+    参数:
+        kind (str): 处理函数的注册名
+        name (str): 显示给管理员的任务名称
+        params (dict): 传给处理函数的关键字参数 (需可 JSON 序列化)
+        created_by (str): 提交任务的管理员ID
+
+    返回:
+        dict: 任务信息，失败返回 None
+    """
+    try:
+        job = AdminJob(
+            kind=kind,
+            name=name,
+            params=json.dumps(params or {}),
+            created_by=created_by,
+        )
+        db.session.add(job)
+        if not safe_commit():
+            return None
+        return job.to_dict()
+    except Exception as e:
+        logger.error(f"提交后台任务 {name} 失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def claim_admin_job(worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    原子地领取一个排队中的任务并加上租约。
+
+    参数:
+        worker_id (str): 工作者标识 (作为租约持有者)
+        lease_seconds (int): 租约时长
+
+    返回:
+        dict: {"id", "kind", "name", "params"}，没有可领取任务时返回 None
+    """
+    try:
+        now = datetime.now()
+        candidate_ids = (
+            db.session.execute(
+                select(AdminJob.id)
+                .where(AdminJob.status == "queued")
+                .order_by(AdminJob.created_at)
+                .limit(CLAIM_CANDIDATES)
+            )
+            .scalars()
+            .all()
+        )
+
+        for job_id in candidate_ids:
+            result = db.session.execute(
+                update(AdminJob)
+                .where(AdminJob.id == job_id, AdminJob.status == "queued")
+                .values(
+                    status="running",
+                    lease_owner=worker_id,
+                    lease_expires_at=now + timedelta(seconds=lease_seconds),
+                    started_at=now,
+                )
+            )
+            if result.rowcount == 1:
+                if not safe_commit():
+                    return None
+                job = db.session.get(AdminJob, job_id, populate_existing=True)
+                if job is None:
+                    return None
+                return {
+                    "id": job.id,
+                    "kind": job.kind,
+                    "name": job.name,
+                    "params": json.loads(job.params or "{}"),
+                }
+
+        db.session.rollback()
+        return None
+    except Exception as e:
+        logger.error(f"领取后台任务失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def heartbeat_admin_jobs(worker_id, progress, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    为工作者执行中的任务续约并写回进度。
+
+    参数:
+        worker_id (str): 工作者标识
+        progress (dict): 任务ID -> (完成百分比, 进度说明)
+        lease_seconds (int): 新的租约时长
+
+    返回:
+        set: 其中已被请求取消的任务ID，失败返回 None
+    """
+    if not progress:
+        return set()
+    try:
+        expires_at = datetime.now() + timedelta(seconds=lease_seconds)
+        for job_id, (percent, message) in progress.items():
+            db.session.execute(
+                update(AdminJob)
+                .where(
+                    AdminJob.id == job_id,
+                    AdminJob.lease_owner == worker_id,
+                    AdminJob.status == "running",
+                )
+                .values(
+                    progress=percent,
+                    message=message[:255] if message else message,
+                    lease_expires_at=expires_at,
+                )
+            )
+        cancelled = set(
+            db.session.execute(
+                select(AdminJob.id).where(
+                    AdminJob.id.in_(list(progress)), AdminJob.cancel_requested
+                )
+            ).scalars()
+        )
+        if not safe_commit():
+            return None
+        return cancelled
+    except Exception as e:
+        logger.error(f"后台任务心跳失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def finish_admin_job(job_id, worker_id, status, result=None, error=None):
+    """
+    记录任务结束。只有当前租约持有者的记录才会生效。
+
+    参数:
+        job_id (str): 任务ID
+        worker_id (str): 工作者标识
+        status (str): done / failed / cancelled
+        result: 任务结果 (需可 JSON 序列化)
+        error (str): 出错或取消的原因
+
+    返回:
+        bool: 是否记录成功
+    """
+    try:
+        values = {
+            "status": status,
+            "result": json.dumps(result) if result is not None else None,
+            "error": error,
+            "lease_expires_at": None,
+            "finished_at": datetime.now(),
+        }
+        if status == "done":
+            values["progress"] = 100.0
+        outcome = db.session.execute(
+            update(AdminJob)
+            .where(
+                AdminJob.id == job_id,
+                AdminJob.lease_owner == worker_id,
+                AdminJob.status == "running",
+            )
+            .values(**values)
+        )
+        if not safe_commit():
+            return False
+        if outcome.rowcount != 1:
+            logger.warning(f"记录后台任务 {job_id} 结束时租约已不属于 {worker_id}")
+            return False
+        return True
+    except Exception as e:
+        logger.error(f"记录后台任务 {job_id} 结束失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
+def cancel_admin_job(job_id):
+    """
+    取消任务: 排队中的任务直接取消，执行中的任务标记取消请求，
+    由执行它的进程在下一次报告进度时中止。
+
+    参数:
+        job_id (str): 任务ID
+
+    返回:
+        dict: 更新后的任务信息；任务不存在或已结束返回 None
+    """
+    try:
+        now = datetime.now()
+        cancelled = db.session.execute(
+            update(AdminJob)
+            .where(AdminJob.id == job_id, AdminJob.status == "queued")
+            .values(
+                status="cancelled",
+                cancel_requested=True,
+                error="执行前被取消",
+                finished_at=now,
+            )
+        ).rowcount
+        if not cancelled:
+            cancelled = db.session.execute(
+                update(AdminJob)
+                .where(AdminJob.id == job_id, AdminJob.status == "running")
+                .values(cancel_requested=True)
+            ).rowcount
+        if not safe_commit():
+            return None
+        if not cancelled:
+            return None
+        job = db.session.get(AdminJob, job_id, populate_existing=True)
+        return job.to_dict() if job else None
+    except Exception as e:
+        logger.error(f"取消后台任务 {job_id} 失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def recover_admin_jobs():
+    """
+    将租约已过期 (执行它的进程已退出) 的任务标记为 failed，在启动时及运行中定期调用。
+
+    返回:
+        int: 标记的任务数量，失败返回 -1
+    """
+    try:
+        now = datetime.now()
+        result = db.session.execute(
+            update(AdminJob)
+            .where(AdminJob.status == "running", AdminJob.lease_expires_at < now)
+            .values(
+                status="failed",
+                error="执行任务的进程已退出，任务中断",
+                lease_expires_at=None,
+                finished_at=now,
+            )
+        )
+        if not safe_commit():
+            return -1
+        if result.rowcount:
+            logger.warning(f"{result.rowcount} 个后台任务因进程退出而中断")
+        return result.rowcount
+    except Exception as e:
+        logger.error(f"恢复后台任务失败: {e}", exc_info=True)
+        db.session.rollback()
+        return -1
+
+
+def get_admin_job(job_id):
+    """
+    按ID获取后台任务。
+
+    返回:
+        dict: 任务信息，不存在或出错返回 None
+    """
+    try:
+        job = db.session.get(AdminJob, job_id, populate_existing=True)
+        return job.to_dict() if job else None
+    except Exception as e:
+        logger.error(f"获取后台任务 {job_id} 失败: {e}", exc_info=True)
+        return None
+
+
+def list_admin_jobs(limit=20, status=None):
+    """
+    最近提交的后台任务，新的在前。
+
+    参数:
+        limit (int): 返回数量
+        status (str, optional): 只返回该状态的任务
+
+    返回:
+        list: 任务信息列表，出错则返回空列表
+    """
+    try:
+        query = select(AdminJob).order_by(AdminJob.created_at.desc()).limit(limit)
+        if status:
+            query = query.where(AdminJob.status == status)
+        return [job.to_dict() for job in db.session.scalars(query)]
+    except Exception as e:
+        logger.error(f"获取后台任务列表失败: {e}", exc_info=True)
+        return []
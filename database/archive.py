@@ -0,0 +1,205 @@
+"""
+已结束对战的冷热分离与归档
+
+battles / battle_players 只增不减，大厅和排行页面的过滤查询大部分时间花在几个月前的
+自动对战上。结束超过 BATTLE_ARCHIVE_AFTER_DAYS 天的对战 (completed / error / cancelled)
+连同参与者移入 battles_archive / battle_players_archive (结果 JSON 压缩存储)，
+热表和它们的索引只保留近期对战:
+- archive_battles: 按对战ID分批搬运，每批一个事务 (写入归档表、删除热表中的对战、
+  参与者、结果摘要和队列任务)，由 services/battle_archiver.py 定期执行
+- get_archived_battle / get_archived_seat_usernames: 旧链接与回放页的读穿透
+- 评分重放 (rating_replay) 和分组统计 (battle_stats) 同时读取热表和归档表，结果不受归档影响
+- 大厅列表和个人对战历史只显示热表中的近期对战
+
+结果摘要 (battle_summaries) 随对战一起删除，需要时可以从归档的结果重新派生；
+回放文件在磁盘上按对战ID保存，不受归档影响。
+"""
+
+import logging
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, insert, or_, select
+
+from .models import (
+    ArchivedBattle,
+    ArchivedBattlePlayer,
+    Battle,
+    BattleJob,
+    BattlePlayer,
+    BattleSummary,
+    User,
+)
+from .battle_summary import FINISHED_STATUSES
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 200
+COMPRESS_LEVEL = 6
+
+# 与归档表同名的列 (除结果外原样复制)
+BATTLE_COLUMNS = [
+    c.name for c in ArchivedBattle.__table__.columns if c.name in Battle.__table__.c
+]
+PLAYER_COLUMNS = [c.name for c in ArchivedBattlePlayer.__table__.columns]
+
+
+def _compress(text):
+    return zlib.compress(text.encode(), COMPRESS_LEVEL) if text else None
+
+
+def archive_battles(older_than_days=None, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+    """
+    把结束超过 older_than_days 天的对战及其参与者移入归档表，按对战ID分批提交。
+
+    参数:
+        older_than_days (float, optional): 归档阈值 (天)，默认 BATTLE_ARCHIVE_AFTER_DAYS，
+            未开启定期归档时为 DEFAULT_ARCHIVE_AFTER_DAYS。
+        batch_size (int): 每个事务搬运的对战数。
+        progress (callable, optional): 进度回调 progress(已归档, 总数, 说明)，每批提交后调用。
+
+    返回:
+        int: 归档的对战数；失败返回 None (已提交的批次保留)。
+    """
+    if older_than_days is None:
+        from flask import current_app
+
+        # 未开启定期归档 (0) 时不能把 0 当作阈值，否则会归档所有已结束的对战
+        older_than_days = (
+            current_app.config.get("BATTLE_ARCHIVE_AFTER_DAYS")
+            or DEFAULT_ARCHIVE_AFTER_DAYS
+        )
+    cutoff = datetime.now() - timedelta(days=float(older_than_days))
+    battle_table = Battle.__table__
+    player_table = BattlePlayer.__table__
+    finished_before_cutoff = and_(
+        battle_table.c.status.in_(FINISHED_STATUSES),
+        or_(
+            battle_table.c.ended_at < cutoff,
+            # 没有结束时间的 (如开始前被取消) 按创建时间
+            (battle_table.c.ended_at.is_(None)) & (battle_table.c.created_at < cutoff),
+        ),
+    )
+    archived = 0
+    last_id = ""
+    try:
+        total = None
+        if progress is not None:
+            total = db.session.scalar(
+                select(func.count())
+                .select_from(battle_table)
+                .where(finished_before_cutoff)
+            )
+            progress(0, total, "正在归档对战")
+        while True:
+            rows = (
+                db.session.execute(
+                    select(*(battle_table.c[name] for name in BATTLE_COLUMNS))
+                    .add_columns(battle_table.c.results)
+                    .where(battle_table.c.id > last_id, finished_before_cutoff)
+                    .order_by(battle_table.c.id)
+                    .limit(batch_size)
+                )
+                .mappings()
+                .all()
+            )
+            if not rows:
+                break
+            ids = [row["id"] for row in rows]
+            now = datetime.now()
+            db.session.execute(
+                insert(ArchivedBattle.__table__),
+                [
+                    {
+                        **{name: row[name] for name in BATTLE_COLUMNS},
+                        "results_z": _compress(row["results"]),
+                        "archived_at": now,
+                    }
+                    for row in rows
+                ],
+            )
+            db.session.execute(
+                insert(ArchivedBattlePlayer.__table__).from_select(
+                    PLAYER_COLUMNS,
+                    select(*(player_table.c[name] for name in PLAYER_COLUMNS)).where(
+                        player_table.c.battle_id.in_(ids)
+                    ),
+                )
+            )
+            for table, column in (
+                (BattleSummary.__table__, "battle_id"),
+                (BattleJob.__table__, "battle_id"),
+                (player_table, "battle_id"),
+                (battle_table, "id"),
+            ):
+                db.session.execute(delete(table).where(table.c[column].in_(ids)))
+            db.session.commit()
+            archived += len(ids)
+            last_id = ids[-1]
+            if progress is not None:
+                progress(archived, max(total, archived), f"已归档 {archived} 场对战")
+        if archived:
+            logger.info(f"已归档 {archived} 场结束于 {cutoff:%Y-%m-%d} 之前的对战")
+        return archived
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"归档对战失败 (已归档 {archived} 场): {e}", exc_info=True)
+        return None
+
+
+# -----------------------------------------------------------------------------------------
+# 读穿透
+
+
+def get_archived_battle(battle_id):
+    """
+    按ID获取已归档的对战。
+
+    返回:
+        ArchivedBattle: 存根 (results 属性为解压后的结果)，不存在或出错返回 None。
+    """
+    try:
+        return db.session.get(ArchivedBattle, battle_id)
+    except Exception as e:
+        logger.error(f"获取归档对战 {battle_id} 失败: {e}", exc_info=True)
+        return None
+
+
+def get_archived_battle_players(battle_id):
+    """
+    获取已归档对战的参与者，按position排序。
+
+    返回:
+        list: ArchivedBattlePlayer 列表，出错则返回空列表。
+    """
+    try:
+        return list(
+            db.session.scalars(
+                select(ArchivedBattlePlayer)
+                .where(ArchivedBattlePlayer.battle_id == battle_id)
+                .order_by(ArchivedBattlePlayer.position)
+            )
+        )
+    except Exception as e:
+        logger.error(f"获取归档对战 {battle_id} 的参与者失败: {e}", exc_info=True)
+        return []
+
+
+def get_archived_seat_usernames(battle_id):
+    """
+    已归档对战的座位与用户名 (一次联表查询)，供回放页显示玩家。
+
+    返回:
+        list: [(position, username)]；已删除的用户不出现，出错则返回空列表。
+    """
+    try:
+        return db.session.execute(
+            select(ArchivedBattlePlayer.position, User.username)
+            .join(User, User.id == ArchivedBattlePlayer.user_id)
+            .where(ArchivedBattlePlayer.battle_id == battle_id)
+        ).all()
+    except Exception as e:
+        logger.error(f"获取归档对战 {battle_id} 的玩家失败: {e}", exc_info=True)
+        return []
@@ -0,0 +1,243 @@
+"""
+对战列表与用户对战历史的游标 (keyset) 分页
+
+两种列表都按 (created_at, id) 降序排列，翻页条件是 (created_at, id) < 游标，
+由复合索引 (created_at, id) / (status, created_at, id) / BattlePlayer (user_id,
+battle_created_at, battle_id) 直接定位，不再 OFFSET 跳过前面的行，翻到多深都一样快。
+
+- 游标是上一页最后 (或第一) 一行的 (created_at, id)，编码成不透明的字符串
+- after 取下一页，before 取上一页；都不给时为第一页
+- 总数默认是封顶计数 (最多数到 COUNT_CAP 行，超过即视为估计值)，
+  需要精确总数时传 total="exact"，不需要时传 total=None
+"""
+
+import base64
+import logging
+from datetime import datetime
+
+from sqlalchemy import and_, exists, false, func, or_, select, tuple_
+
+from .models import Battle, BattlePlayer, User
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+COUNT_CAP = 10000  # 估计总数时最多数到的行数
+MAX_PAGE_SIZE = 100
+
+
+# -----------------------------------------------------------------------------------------
+# 游标
+
+
+def encode_cursor(created_at, battle_id):
+    """(created_at, id) -> 不透明的游标字符串"""
+    raw = f"{created_at.isoformat()}|{battle_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    游标字符串 -> (created_at, id)。
+
+    异常:
+        ValueError: 游标无效。
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, battle_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), battle_id
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def _count(stmt, total):
+    """按 total 模式统计 stmt 的行数，返回 (总数, 是否为估计值)"""
+    if total is None:
+        return None, False
+    stmt = stmt.order_by(None)
+    if total == "exact":
+        return (
+            db.session.scalar(select(func.count()).select_from(stmt.subquery())),
+            False,
+        )
+    count = db.session.scalar(
+        select(func.count()).select_from(stmt.limit(COUNT_CAP + 1).subquery())
+    )
+    if count > COUNT_CAP:
+        return COUNT_CAP, True
+    return count, False
+
+
+def _keyset_page(stmt, key, limit, after, before, total):
+    """
+    对按 key (created_at 列, id 列) 降序排列的 stmt 取一页。
+
+    返回:
+        dict: {"rows", "next_cursor", "prev_cursor", "has_next", "has_prev",
+               "total", "total_is_estimate"}
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    count, is_estimate = _count(stmt, total)
+    key_tuple = tuple_(*key)
+    if before:
+        # 上一页: 升序取游标之后的 limit + 1 行，再翻转
+        stmt = stmt.where(key_tuple > tuple(decode_cursor(before)))
+        rows = db.session.execute(
+            stmt.order_by(*(col.asc() for col in key)).limit(limit + 1)
+        ).all()
+        has_prev = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        has_next = True
+    else:
+        if after:
+            stmt = stmt.where(key_tuple < tuple(decode_cursor(after)))
+        rows = db.session.execute(
+            stmt.order_by(*(col.desc() for col in key)).limit(limit + 1)
+        ).all()
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        has_prev = bool(after)
+
+    def cursor_of(row):
+        return encode_cursor(row.created_at, row.battle_id)
+
+    return {
+        "rows": rows,
+        "next_cursor": cursor_of(rows[-1]) if rows and has_next else None,
+        "prev_cursor": cursor_of(rows[0]) if rows and has_prev else None,
+        "has_next": has_next,
+        "has_prev": has_prev,
+        "total": count,
+        "total_is_estimate": is_estimate,
+    }
+
+
+def _with_battles(page):
+    """把一页的 (created_at, battle_id) 行换成 Battle 对象 (一次主键 IN 查询)"""
+    ids = [row.battle_id for row in page.pop("rows")]
+    battles = {
+        b.id: b for b in db.session.scalars(select(Battle).where(Battle.id.in_(ids)))
+    }
+    page["items"] = [battles[i] for i in ids if i in battles]
+    return page
+
+
+# -----------------------------------------------------------------------------------------
+# 对战列表
+
+
+def _resolve_players(identifiers):
+    """用户名或用户ID -> 用户ID 列表 (一次查询)"""
+    identifiers = [i for i in identifiers if i]
+    if not identifiers:
+        return []
+    return list(
+        db.session.scalars(
+            select(User.id).where(
+                or_(User.username.in_(identifiers), User.id.in_(identifiers))
+            )
+        )
+    )
+
+
+def get_battle_page(filters=None, limit=10, after=None, before=None, total="estimate"):
+    """
+    按创建时间倒序分页获取对战 (游标分页)。
+
+    参数:
+        filters (dict, optional): 可选键 'status' (默认排除 'ready'，"all" 同不过滤)、
+                                  'ranking_id'、'date_from'、'date_to'、
+                                  'players' (用户名或用户ID列表，需全部参与)。
+        limit (int): 每页条数 (最多 MAX_PAGE_SIZE)。
+        after (str, optional): 下一页游标。
+        before (str, optional): 上一页游标。
+        total (str, optional): "estimate" (封顶计数，默认)、"exact" 或 None (不统计)。
+
+    返回:
+        dict: {"items": [Battle], "next_cursor", "prev_cursor", "has_next", "has_prev",
+               "total", "total_is_estimate"}；查询失败返回 None。
+
+    异常:
+        ValueError: 游标无效。
+    """
+    filters = filters or {}
+    conditions = []
+    status = filters.get("status")
+    if status and status.lower() != "all":
+        conditions.append(Battle.status == status)
+    else:
+        # 默认不显示 'ready' 状态的对局
+        conditions.append(Battle.status != "ready")
+    if filters.get("ranking_id") is not None:
+        conditions.append(Battle.ranking_id == filters["ranking_id"])
+    if filters.get("date_from"):
+        conditions.append(Battle.created_at >= filters["date_from"])
+    if filters.get("date_to"):
+        conditions.append(Battle.created_at <= filters["date_to"])
+    if filters.get("players"):
+        player_ids = _resolve_players(filters["players"])
+        if not player_ids:
+            conditions.append(false())  # 没有找到任何指定玩家
+        # 每位玩家一个 EXISTS，沿 (battle_id, user_id) 索引逐场探测
+        for user_id in player_ids:
+            conditions.append(
+                exists().where(
+                    BattlePlayer.battle_id == Battle.id,
+                    BattlePlayer.user_id == user_id,
+                )
+            )
+
+    key = (Battle.created_at, Battle.id)
+    stmt = select(
+        Battle.created_at.label("created_at"), Battle.id.label("battle_id")
+    ).where(and_(*conditions))
+    try:
+        return _with_battles(_keyset_page(stmt, key, limit, after, before, total))
+    except ValueError:
+        raise
+    except Exception as e:
+        logger.error(f"分页获取对战列表失败: {e}", exc_info=True)
+        return None
+
+
+# -----------------------------------------------------------------------------------------
+# 用户对战历史
+
+
+def get_user_battle_page(user_id, limit=10, after=None, before=None, total="estimate"):
+    """
+    按对战创建时间倒序分页获取用户参与过的对战 (游标分页)。
+
+    走 BattlePlayer (user_id, battle_created_at, battle_id) 索引，一次查询取出本页对战；
+    同一场对战中占多个座位时只算一场。
+
+    参数同 get_battle_page (无 filters)。
+
+    返回:
+        dict: 同 get_battle_page；查询失败返回 None。
+
+    异常:
+        ValueError: 游标无效。
+    """
+    key = (BattlePlayer.battle_created_at, BattlePlayer.battle_id)
+    # 同一用户在一场对战中占多个座位时，DISTINCT 后每场对战只算一行
+    # (每页条数和总数都按对战而不是座位计算)
+    stmt = (
+        select(
+            BattlePlayer.battle_created_at.label("created_at"),
+            BattlePlayer.battle_id.label("battle_id"),
+        )
+        .where(
+            BattlePlayer.user_id == user_id,
+            BattlePlayer.battle_created_at.is_not(None),
+        )
+        .distinct()
+    )
+    try:
+        return _with_battles(_keyset_page(stmt, key, limit, after, before, total))
+    except ValueError:
+        raise
+    except Exception as e:
+        logger.error(f"分页获取用户 {user_id} 的对战历史失败: {e}", exc_info=True)
+        return None
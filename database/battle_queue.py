@@ -0,0 +1,428 @@
+"""
+这个模块实现基于数据库的持久化对战队列。
+
+对战任务写入 battle_jobs 表，工作线程通过带租约的原子领取获得任务，
+执行期间定期心跳续约，结束后确认 (ack)。进程崩溃后租约自然过期，
+任务会被其他工作线程重新领取，或在超过最大尝试次数后判定失败。
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, and_, or_, func
+from .models import Battle, BattleJob, BattlePlayer
+from .action import safe_commit
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+# 默认租约时长 (秒)，工作线程需在此时间内心跳续约
+DEFAULT_LEASE_SECONDS = 120
+# 单个任务的默认最大尝试次数
+DEFAULT_MAX_ATTEMPTS = 3
+# 每次领取时扫描的候选任务数量，降低多进程争抢同一行的概率
+CLAIM_CANDIDATES = 5
+# 孤儿对战的宽限期 (秒)，避免误伤刚创建、尚未入队的对战
+ORPHAN_GRACE_SECONDS = 60
+# 启动时恢复 (含孤儿对战) 的维护租约：多个进程同时启动时只有一个执行
+STARTUP_RECOVERY_LEASE = "battle_queue_recovery"
+STARTUP_RECOVERY_LEASE_SECONDS = 300
+
+
+def _claimable_condition(now):
+    """可被领取的任务：排队中，或租约已过期且仍有剩余尝试次数"""
+    return or_(
+        BattleJob.status == "queued",
+        and_(
+            BattleJob.status == "leased",
+            BattleJob.lease_expires_at < now,
+            BattleJob.attempts < BattleJob.max_attempts,
+        ),
+    )
+
+
+def enqueue_battle_job(battle_id, participant_data, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    将对战写入持久化队列。若该对战已有任务，则重置为排队状态。
+
+    参数:
+        battle_id (str): 对战ID
+        participant_data (list): 补全 position 后的参与者数据
+        max_attempts (int): 最大尝试次数
+
+    返回:
+        dict: 队列任务信息，失败返回 None
+    """
+    try:
+        job = BattleJob.query.filter_by(battle_id=battle_id).first()
+        if job is None:
+            job = BattleJob(battle_id=battle_id)
+            db.session.add(job)
+        job.status = "queued"
+        job.payload = json.dumps(participant_data)
+        job.attempts = 0
+        job.max_attempts = max_attempts
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.heartbeat_at = None
+        job.last_error = None
+        if not safe_commit():
+            return None
+        return job.to_dict()
+    except Exception as e:
+        logger.error(f"对战 {battle_id} 入队失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def claim_battle_job(worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    原子地领取一个可执行的队列任务并加上租约。
+
+    先读取少量候选任务，再用带条件的 UPDATE 抢占；只有 rowcount 为 1
+    的那一行才算领取成功，因此多个进程同时领取也不会重复执行。
+
+    参数:
+        worker_id (str): 工作者标识 (作为租约持有者)
+        lease_seconds (int): 租约时长
+
+    返回:
+        dict: 领取到的任务信息，没有可领取任务时返回 None
+    """
+    try:
+        now = datetime.now()
+        candidate_ids = (
+            db.session.execute(
+                select(BattleJob.id)
+                .where(_claimable_condition(now))
+                .order_by(BattleJob.created_at)
+                .limit(CLAIM_CANDIDATES)
+            )
+            .scalars()
+            .all()
+        )
+
+        for job_id in candidate_ids:
+            result = db.session.execute(
+                update(BattleJob)
+                .where(BattleJob.id == job_id, _claimable_condition(now))
+                .values(
+                    status="leased",
+                    lease_owner=worker_id,
+                    lease_expires_at=now + timedelta(seconds=lease_seconds),
+                    heartbeat_at=now,
+                    attempts=BattleJob.attempts + 1,
+                    updated_at=now,
+                )
+            )
+            if result.rowcount == 1:
+                if not safe_commit():
+                    return None
+                job = db.session.get(BattleJob, job_id, populate_existing=True)
+                return job.to_dict() if job else None
+
+        db.session.rollback()
+        return None
+    except Exception as e:
+        logger.error(f"领取对战队列任务失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def heartbeat_battle_jobs(worker_id, job_ids, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    为工作者持有的任务续约。
+
+    参数:
+        worker_id (str): 工作者标识
+        job_ids (list): 需要续约的任务ID列表
+        lease_seconds (int): 新的租约时长
+
+    返回:
+        int: 成功续约的任务数量，失败返回 -1
+    """
+    if not job_ids:
+        return 0
+    try:
+        now = datetime.now()
+        result = db.session.execute(
+            update(BattleJob)
+            .where(
+                BattleJob.id.in_(list(job_ids)),
+                BattleJob.lease_owner == worker_id,
+                BattleJob.status == "leased",
+            )
+            .values(
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                heartbeat_at=now,
+            )
+        )
+        if not safe_commit():
+            return -1
+        return result.rowcount
+    except Exception as e:
+        logger.error(f"对战队列任务心跳失败: {e}", exc_info=True)
+        db.session.rollback()
+        return -1
+
+
+def ack_battle_job(job_id, worker_id, success=True, error=None):
+    """
+    确认任务执行结束。只有当前租约持有者的确认才会生效。
+
+    参数:
+        job_id (str): 任务ID
+        worker_id (str): 工作者标识
+        success (bool): 是否正常结束 (对战本身报错也算正常结束)
+        error (str): 失败原因
+
+    返回:
+        bool: 确认是否成功
+    """
+    try:
+        result = db.session.execute(
+            update(BattleJob)
+            .where(
+                BattleJob.id == job_id,
+                BattleJob.lease_owner == worker_id,
+                BattleJob.status == "leased",
+            )
+            .values(
+                status="done" if success else "failed",
+                lease_expires_at=None,
+                last_error=error,
+                updated_at=datetime.now(),
+            )
+        )
+        if not safe_commit():
+            return False
+        if result.rowcount != 1:
+            status = db.session.execute(
+                select(BattleJob.status).where(BattleJob.id == job_id)
+            ).scalar()
+            if status == "cancelled":
+                logger.info(f"任务 {job_id} 已在执行期间被取消")
+            else:
+                logger.warning(f"确认任务 {job_id} 时租约已不属于 {worker_id}")
+            return False
+        return True
+    except Exception as e:
+        logger.error(f"确认对战队列任务 {job_id} 失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
+def cancel_battle_job(battle_id):
+    """
+    取消尚未执行完毕的对战任务。
+
+    参数:
+        battle_id (str): 对战ID
+
+    返回:
+        bool: 是否有任务被取消
+    """
+    try:
+        result = db.session.execute(
+            update(BattleJob)
+            .where(
+                BattleJob.battle_id == battle_id,
+                BattleJob.status.in_(["queued", "leased"]),
+            )
+            .values(
+                status="cancelled", lease_expires_at=None, updated_at=datetime.now()
+            )
+        )
+        if not safe_commit():
+            return False
+        return result.rowcount > 0
+    except Exception as e:
+        logger.error(f"取消对战 {battle_id} 的队列任务失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
+def _build_participant_data(battle_id):
+    """根据 BattlePlayer 记录重建参与者数据"""
+    battle_players = (
+        BattlePlayer.query.filter_by(battle_id=battle_id)
+        .order_by(BattlePlayer.position)
+        .all()
+    )
+    return [
+        {
+            "user_id": bp.user_id,
+            "ai_code_id": bp.selected_ai_code_id,
+            "position": bp.position,
+        }
+        for bp in battle_players
+    ]
+
+
+def _update_expired_job(job_id, now, **values):
+    """只有任务仍处于过期租约时才更新，返回是否更新成功"""
+    result = db.session.execute(
+        update(BattleJob)
+        .where(
+            BattleJob.id == job_id,
+            BattleJob.status == "leased",
+            BattleJob.lease_expires_at < now,
+        )
+        .values(updated_at=now, **values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def recover_battle_queue(include_orphans=True, grace_seconds=ORPHAN_GRACE_SECONDS):
+    """
+    恢复崩溃工作者遗留的任务和对战，在启动时及运行中定期调用。
+
+    - 租约过期且仍有尝试次数的任务：重新排队，对战状态回到 waiting
+    - 租约过期且尝试次数耗尽的任务：标记为 failed，对战标记为 error
+    - 处于 waiting/playing 却没有活动任务的对战：根据 BattlePlayer 重新入队
+
+    任务的更新都带上读取时的状态条件，其他工作者在此期间领取的任务不会被覆盖；
+    启动时的孤儿恢复由调用方在维护租约下执行 (见 service_lease.py)。
+
+    参数:
+        include_orphans (bool): 是否处理没有活动任务的孤儿对战 (仅启动时需要)
+        grace_seconds (int): 对战创建后多少秒内不视为孤儿
+
+    返回:
+        dict: 各类恢复操作的数量
+    """
+    summary = {"requeued": 0, "failed": 0, "orphans_requeued": 0, "orphans_failed": 0}
+    try:
+        now = datetime.now()
+        expired_jobs = BattleJob.query.filter(
+            BattleJob.status == "leased", BattleJob.lease_expires_at < now
+        ).all()
+
+        for job in expired_jobs:
+            battle = job.battle
+            if battle is None or battle.status not in ["waiting", "playing"]:
+                # 对战已经结束 (例如确认前进程退出)，直接收尾
+                _update_expired_job(job.id, now, status="done", lease_expires_at=None)
+                continue
+            if job.attempts < job.max_attempts:
+                # 读取后任务可能已被其他工作者重新领取，只有仍处于过期租约时才重置
+                if _update_expired_job(
+                    job.id,
+                    now,
+                    status="queued",
+                    lease_owner=None,
+                    lease_expires_at=None,
+                ):
+                    battle.status = "waiting"
+                    summary["requeued"] += 1
+            elif _update_expired_job(
+                job.id,
+                now,
+                status="failed",
+                lease_expires_at=None,
+                last_error="租约过期且超过最大尝试次数",
+            ):
+                battle.status = "error"
+                battle.ended_at = now
+                battle.results = json.dumps(
+                    {"error": f"对战执行 {job.attempts} 次均未完成，已放弃"}
+                )
+                summary["failed"] += 1
+
+        if include_orphans:
+            # 没有活动任务的 waiting/playing 对战 (例如旧版本内存队列遗留)
+            active_job_battle_ids = select(BattleJob.battle_id).where(
+                BattleJob.status.in_(["queued", "leased"])
+            )
+            orphan_battles = Battle.query.filter(
+                Battle.status.in_(["waiting", "playing"]),
+                Battle.created_at < now - timedelta(seconds=grace_seconds),
+                Battle.id.not_in(active_job_battle_ids),
+            ).all()
+
+            for battle in orphan_battles:
+                participant_data = _build_participant_data(battle.id)
+                if len(participant_data) != 7 or any(
+                    p["position"] is None for p in participant_data
+                ):
+                    battle.status = "error"
+                    battle.ended_at = now
+                    battle.results = json.dumps(
+                        {"error": "对战参与者数据不完整，无法恢复"}
+                    )
+                    summary["orphans_failed"] += 1
+                    continue
+
+                values = dict(
+                    status="queued",
+                    payload=json.dumps(participant_data),
+                    attempts=0,
+                    max_attempts=DEFAULT_MAX_ATTEMPTS,
+                    lease_owner=None,
+                    lease_expires_at=None,
+                    updated_at=now,
+                )
+                job_id = db.session.execute(
+                    select(BattleJob.id).where(BattleJob.battle_id == battle.id)
+                ).scalar()
+                if job_id is None:
+                    db.session.add(BattleJob(battle_id=battle.id, **values))
+                else:
+                    # 查询后任务可能已被重新入队或领取，此时不再覆盖
+                    requeued = db.session.execute(
+                        update(BattleJob)
+                        .where(
+                            BattleJob.id == job_id,
+                            BattleJob.status.not_in(["queued", "leased"]),
+                        )
+                        .values(**values)
+                        .execution_options(synchronize_session=False)
+                    ).rowcount
+                    if requeued != 1:
+                        continue
+                battle.status = "waiting"
+                summary["orphans_requeued"] += 1
+
+        if not safe_commit():
+            return None
+        if any(summary.values()):
+            logger.warning(f"对战队列恢复完成: {summary}")
+        return summary
+    except Exception as e:
+        logger.error(f"恢复对战队列失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def get_battle_queue_stats():
+    """
+    获取持久化队列的统计信息。
+
+    返回:
+        dict: 各状态任务数量及最早排队任务的等待秒数
+    """
+    try:
+        counts = dict(
+            db.session.execute(
+                select(BattleJob.status, func.count(BattleJob.id)).group_by(
+                    BattleJob.status
+                )
+            ).all()
+        )
+        oldest_queued = db.session.execute(
+            select(func.min(BattleJob.created_at)).where(BattleJob.status == "queued")
+        ).scalar()
+        return {
+            "queued": counts.get("queued", 0),
+            "leased": counts.get("leased", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "cancelled": counts.get("cancelled", 0),
+            "oldest_queued_seconds": (
+                (datetime.now() - oldest_queued).total_seconds() if oldest_queued else 0
+            ),
+        }
+    except Exception as e:
+        logger.error(f"获取对战队列统计失败: {e}", exc_info=True)
+        return {}
@@ -0,0 +1,272 @@
+"""
+角色、座位与胜负的分组统计
+
+对战结束时 battle_summary.py 把结果中的胜方、胜因写入 Battle.winner / win_reason，
+把每位玩家的角色、阵营写入 BattlePlayer.role / team (分析列)。下面的统计都是一条
+GROUP BY 查询，不再逐场加载并解析 Battle.results:
+- get_player_stats: 按玩家 / AI / 角色 / 阵营 / 座位 / 榜单分组的场次、胜负和胜率，
+  例如 "AI X 作为 Merlin 的胜率"
+- get_outcome_stats: 按榜单 / 胜方 / 胜因分组的对战数及其在分组榜单中的占比，
+  例如 "各榜单红方靠刺杀获胜的比例"
+
+分析列是后加的: 已有数据库由 schema_upgrade.upgrade_schema 补列和索引，
+backfill_battle_analytics 按已有结果补填。统计同时包含已归档的对战 (见 archive.py)，
+热表与归档表各自按条件过滤后 UNION ALL 再分组。
+"""
+
+import logging
+
+from sqlalchemy import and_, case, exists, func, select, union_all
+
+from .models import ArchivedBattle, ArchivedBattlePlayer, Battle, BattlePlayer
+from .battle_summary import FINISHED_STATUSES, _parse_results, fill_battle_analytics
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 500
+
+# 热表与归档表: (对战模型, 参与者模型)，两者列名相同
+SOURCES = ((Battle, BattlePlayer), (ArchivedBattle, ArchivedBattlePlayer))
+
+# 分组维度 -> (输出字段名, 所在表 "battle" / "player", 列名)
+PLAYER_GROUP_COLUMNS = {
+    "user": ("user_id", "player", "user_id"),
+    "ai_code": ("ai_code_id", "player", "selected_ai_code_id"),
+    "role": ("role", "player", "role"),
+    "team": ("team", "player", "team"),
+    "position": ("position", "player", "position"),
+    "ranking": ("ranking_id", "battle", "ranking_id"),
+}
+OUTCOME_GROUP_COLUMNS = {
+    "ranking": ("ranking_id", "battle", "ranking_id"),
+    "winner": ("winner", "battle", "winner"),
+    "win_reason": ("win_reason", "battle", "win_reason"),
+    "battle_type": ("battle_type", "battle", "battle_type"),
+}
+
+
+# -----------------------------------------------------------------------------------------
+# 补填
+
+
+def backfill_battle_analytics(batch_size=BACKFILL_BATCH_SIZE):
+    """
+    按已有结果补填已结束对战的分析列 (有座位但没有角色的参与者所在的对战)，
+    按对战ID分批提交。
+
+    返回:
+        int: 补填的对战数；失败返回 None。
+    """
+    missing_role = exists().where(
+        BattlePlayer.battle_id == Battle.id,
+        BattlePlayer.position.is_not(None),
+        BattlePlayer.role.is_(None),
+    )
+    filled = 0
+    last_id = ""
+    try:
+        while True:
+            battles = db.session.scalars(
+                select(Battle)
+                .where(
+                    Battle.id > last_id,
+                    Battle.status.in_(FINISHED_STATUSES),
+                    Battle.results.is_not(None),
+                    missing_role,
+                )
+                .order_by(Battle.id)
+                .limit(batch_size)
+            ).all()
+            if not battles:
+                break
+            players = {}
+            for bp in db.session.scalars(
+                select(BattlePlayer).where(
+                    BattlePlayer.battle_id.in_([b.id for b in battles])
+                )
+            ):
+                players.setdefault(bp.battle_id, []).append(bp)
+            for battle in battles:
+                fill_battle_analytics(
+                    battle, _parse_results(battle.results), players.get(battle.id, [])
+                )
+            db.session.commit()
+            filled += len(battles)
+            last_id = battles[-1].id
+        if filled:
+            logger.info(f"已补填 {filled} 场对战的分析列")
+        return filled
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"补填对战分析列失败: {e}", exc_info=True)
+        return None
+
+
+# -----------------------------------------------------------------------------------------
+# 分组统计
+
+
+def _group_columns(group_by, columns):
+    """校验分组维度，返回 [(输出字段名, 所在表, 列名)]"""
+    unknown = [name for name in group_by if name not in columns]
+    if unknown:
+        raise ValueError(
+            f"不支持的分组维度: {', '.join(unknown)} (可选: {', '.join(columns)})"
+        )
+    return [columns[name] for name in dict.fromkeys(group_by)]
+
+
+def _count_if(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+def _source_columns(battle_model, player_model, keys):
+    models = {"battle": battle_model, "player": player_model}
+    return models, [
+        getattr(models[table], column).label(name) for name, table, column in keys
+    ]
+
+
+def get_player_stats(
+    group_by=("role",),
+    ranking_id=None,
+    user_id=None,
+    ai_code_id=None,
+    role=None,
+    team=None,
+):
+    """
+    已完成对战中参与者的分组胜负统计 (一条 GROUP BY 查询)。
+
+    参数:
+        group_by (tuple): 分组维度，取自 PLAYER_GROUP_COLUMNS，如 ("ai_code", "role")。
+        ranking_id (int, optional): 只统计该榜单。
+        user_id (str, optional): 只统计该玩家。
+        ai_code_id (str, optional): 只统计该 AI 代码。
+        role (str, optional): 只统计该角色。
+        team (str, optional): 只统计该阵营 ("red" / "blue")。
+
+    返回:
+        list: [{分组字段..., "games", "wins", "losses", "draws", "win_rate",
+               "avg_elo_change"}]，按分组字段排序；查询失败返回 None。
+
+    异常:
+        ValueError: 分组维度无效。
+    """
+    keys = _group_columns(group_by, PLAYER_GROUP_COLUMNS)
+    filters = (
+        ("battle", "ranking_id", ranking_id),
+        ("player", "user_id", user_id),
+        ("player", "selected_ai_code_id", ai_code_id),
+        ("player", "role", role),
+        ("player", "team", team),
+    )
+    parts = []
+    for battle_model, player_model in SOURCES:
+        models, columns = _source_columns(battle_model, player_model, keys)
+        conditions = [
+            battle_model.status == "completed",
+            player_model.role.is_not(None),
+        ]
+        for table, column, value in filters:
+            if value is not None:
+                conditions.append(getattr(models[table], column) == value)
+        parts.append(
+            select(*columns, player_model.outcome, player_model.elo_change)
+            .join_from(
+                player_model, battle_model, battle_model.id == player_model.battle_id
+            )
+            .where(and_(*conditions))
+        )
+    source = union_all(*parts).subquery()
+    key_columns = [source.c[name] for name, _, _ in keys]
+    stmt = (
+        select(
+            *key_columns,
+            func.count().label("games"),
+            _count_if(source.c.outcome == "win").label("wins"),
+            _count_if(source.c.outcome == "loss").label("losses"),
+            _count_if(source.c.outcome == "draw").label("draws"),
+            func.avg(source.c.elo_change).label("avg_elo_change"),
+        )
+        .select_from(source)
+        .group_by(*key_columns)
+        .order_by(*key_columns)
+    )
+    try:
+        rows = db.session.execute(stmt).all()
+    except Exception as e:
+        logger.error(f"查询玩家分组统计失败: {e}", exc_info=True)
+        return None
+    stats = []
+    for row in rows:
+        item = {name: row[i] for i, (name, _, _) in enumerate(keys)}
+        games = row.games or 0
+        item.update(
+            {
+                "games": games,
+                "wins": row.wins or 0,
+                "losses": row.losses or 0,
+                "draws": row.draws or 0,
+                "win_rate": round((row.wins or 0) / games, 4) if games else 0,
+                "avg_elo_change": (
+                    round(row.avg_elo_change, 2)
+                    if row.avg_elo_change is not None
+                    else None
+                ),
+            }
+        )
+        stats.append(item)
+    return stats
+
+
+def get_outcome_stats(group_by=("ranking", "winner", "win_reason"), ranking_id=None):
+    """
+    已完成对战按胜方、胜因等分组的对战数 (一条 GROUP BY 查询)。
+
+    share 为该组占同一榜单 (分组含 ranking 时) 或全部对战的比例，由窗口函数在同一查询中算出。
+
+    参数:
+        group_by (tuple): 分组维度，取自 OUTCOME_GROUP_COLUMNS。
+        ranking_id (int, optional): 只统计该榜单。
+
+    返回:
+        list: [{分组字段..., "battles", "share"}]；查询失败返回 None。
+
+    异常:
+        ValueError: 分组维度无效。
+    """
+    keys = _group_columns(group_by, OUTCOME_GROUP_COLUMNS)
+    parts = []
+    for battle_model, player_model in SOURCES:
+        _, columns = _source_columns(battle_model, player_model, keys)
+        conditions = [battle_model.status == "completed"]
+        if ranking_id is not None:
+            conditions.append(battle_model.ranking_id == ranking_id)
+        parts.append(select(*columns, battle_model.id).where(and_(*conditions)))
+    source = union_all(*parts).subquery()
+    key_columns = [source.c[name] for name, _, _ in keys]
+    partition = [source.c.ranking_id] if "ranking" in group_by else None
+    stmt = (
+        select(
+            *key_columns,
+            func.count().label("battles"),
+            func.sum(func.count()).over(partition_by=partition).label("total"),
+        )
+        .select_from(source)
+        .group_by(*key_columns)
+        .order_by(*key_columns)
+    )
+    try:
+        rows = db.session.execute(stmt).all()
+    except Exception as e:
+        logger.error(f"查询对战结果分组统计失败: {e}", exc_info=True)
+        return None
+    stats = []
+    for row in rows:
+        item = {name: row[i] for i, (name, _, _) in enumerate(keys)}
+        item["battles"] = row.battles
+        item["share"] = round(row.battles / row.total, 4) if row.total else 0
+        stats.append(item)
+    return stats
@@ -0,0 +1,354 @@
+"""
+对战结果摘要
+
+对战进入 completed / error / cancelled 时，会话事件 (before_flush) 从 Battle.results
+派生一条 BattleSummary，与状态变更在同一事务中写入: 胜方、胜因、回合数、各轮任务结果、
+刺杀结果、报错玩家 (PID、用户、方法、信息、traceback)、token 用量和对局时长。
+同时填写对战的胜方、胜因和参与者的角色、阵营 (分析列，分组统计见 battle_stats.py)。
+对战详情页和对战列表按主键读取摘要，不再解析结果 JSON，也不再回读公共日志文件。
+
+本模块上线前结束的对战没有摘要，读取时由 ensure_battle_summaries 补建一次
+(旧格式的报错对战结果中没有报错玩家，此时读取一次公共日志)。
+"""
+
+import json
+import logging
+import os
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from .models import Battle, BattlePlayer, BattleSummary
+from .action import BLUE_ROLES, BLUE_TEAM, RED_ROLES, RED_TEAM
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("completed", "error", "cancelled")
+
+# 由玩家代码引起的错误类型 (与 game/battle_result.py 一致)
+PLAYER_ERROR_TYPES = ("critical_player_ERROR", "player_ruturn_ERROR")
+
+
+def _parse_results(results):
+    """Battle.results -> dict，无法解析时返回空字典"""
+    if isinstance(results, dict):
+        return results
+    try:
+        data = json.loads(results) if results else {}
+    except (TypeError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _sum_tokens(tokens, key):
+    total = 0
+    for item in tokens if isinstance(tokens, list) else ():
+        if isinstance(item, dict):
+            total += int(item.get(key) or 0)
+    return total
+
+
+def _player_error_from_log(results, battle_id):
+    """
+    从公共日志中找出报错记录和 traceback (只用于补建旧格式的报错对战)。
+
+    返回:
+        tuple: (报错记录字典或 None, traceback 或 None)
+    """
+    path = results.get("public_log_file") or os.path.join(
+        ".", "data", battle_id, f"public_game_{battle_id}.json"
+    )
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    error_record = None
+    traceback = None
+    for record in reversed(records if isinstance(records, list) else []):
+        if not isinstance(record, dict):
+            continue
+        if error_record is None and record.get("type") in PLAYER_ERROR_TYPES:
+            error_record = record
+        if traceback is None:
+            result = record.get("result")
+            if isinstance(result, dict) and result.get("traceback"):
+                traceback = result["traceback"]
+            elif record.get("traceback"):
+                traceback = record["traceback"]
+        if error_record is not None and traceback is not None:
+            break
+    return error_record, traceback
+
+
+def _text(value):
+    """文本列的值: 非字符串 (例如嵌套的字典) 序列化为 JSON"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _cancellation_reason(results):
+    reason = results.get("cancellation_reason")
+    # BattleService 取消对战时传入的是 {"cancellation_reason": ...}，结果中会嵌套一层
+    if isinstance(reason, dict) and "cancellation_reason" in reason:
+        reason = reason["cancellation_reason"]
+    return _text(reason)
+
+
+def fill_battle_summary(summary, battle, results, error_user_id=None):
+    """
+    按对战和结果字典填写摘要的各列。
+
+    参数:
+        summary (BattleSummary): 要填写的摘要 (新建或已有)。
+        battle (Battle): 对战。
+        results (dict): 结果字典 (BattleResult.to_dict() 的格式，兼容旧格式)。
+        error_user_id (str, optional): 报错玩家的用户ID。
+    """
+    roles = results.get("roles") or {}
+    assassination = results.get("assassination") or {}
+    player_error = results.get("player_error") or {}
+
+    summary.status = battle.status
+    summary.winner = results.get("winner")
+    summary.win_reason = results.get("win_reason")
+    summary.blue_wins = results.get("blue_wins") or 0
+    summary.red_wins = results.get("red_wins") or 0
+    summary.rounds_played = results.get("rounds_played") or 0
+    summary.mission_results = "".join(
+        "S" if ok else "F" for ok in results.get("mission_results") or []
+    )
+    summary.roles = ",".join(
+        str(roles.get(pid) or roles.get(str(pid)) or "") for pid in range(1, 8)
+    ).rstrip(",")
+    summary.assassin_pid = assassination.get("assassin")
+    summary.assassination_target = assassination.get("target")
+    summary.assassination_success = assassination.get("success")
+    summary.error = _text(results.get("error"))
+    summary.error_type = player_error.get("type")
+    summary.error_pid = player_error.get("error_code_pid")
+    summary.error_user_id = error_user_id
+    summary.error_method = player_error.get("error_code_method")
+    summary.error_message = _text(player_error.get("error_msg"))
+    summary.traceback = _text(results.get("traceback"))
+    summary.cancellation_reason = _cancellation_reason(results)
+    summary.input_tokens = _sum_tokens(results.get("tokens"), "input")
+    summary.output_tokens = _sum_tokens(results.get("tokens"), "output")
+    summary.duration_seconds = (
+        (battle.ended_at - battle.started_at).total_seconds()
+        if battle.started_at and battle.ended_at
+        else None
+    )
+
+
+def _role_team(role):
+    if role in RED_ROLES:
+        return RED_TEAM
+    if role in BLUE_ROLES:
+        return BLUE_TEAM
+    return None
+
+
+def fill_battle_analytics(battle, results, players):
+    """
+    按结果字典填写对战和参与者的分析列 (胜方、胜因、角色、阵营)。
+
+    参数:
+        battle (Battle): 对战。
+        results (dict): 结果字典。
+        players (list[BattlePlayer]): 该对战的参与者。
+    """
+    roles = results.get("roles") or {}
+    battle.winner = results.get("winner")
+    battle.win_reason = results.get("win_reason")
+    for bp in players:
+        role = None
+        if bp.position is not None:
+            role = roles.get(bp.position) or roles.get(str(bp.position))
+        bp.role = role
+        bp.team = _role_team(role)
+
+
+def _error_pid(results):
+    pid = (results.get("player_error") or {}).get("error_code_pid")
+    return pid if isinstance(pid, int) and 1 <= pid <= 7 else None
+
+
+def _write_summaries(session, battles_results):
+    """
+    在 session 中新建或更新一组对战的摘要及分析列 (不提交)。已有摘要和参与者各一次 IN 查询。
+
+    参数:
+        session: 数据库会话。
+        battles_results (list[tuple]): [(Battle, 结果字典)]。
+
+    返回:
+        dict: {battle_id: BattleSummary}
+    """
+    ids = [battle.id for battle, _ in battles_results if battle.id is not None]
+    existing = {}
+    if ids:
+        existing = {
+            summary.battle_id: summary
+            for summary in session.scalars(
+                select(BattleSummary).where(BattleSummary.battle_id.in_(ids))
+            )
+        }
+    players = {}
+    if ids:
+        for bp in session.scalars(
+            select(BattlePlayer).where(BattlePlayer.battle_id.in_(ids))
+        ):
+            players.setdefault(bp.battle_id, []).append(bp)
+
+    summaries = {}
+    for battle, results in battles_results:
+        summary = existing.get(battle.id)
+        if summary is None:
+            summary = BattleSummary(battle_id=battle.id)
+            if battle.id is None:
+                battle.summary = summary  # 新对战的 ID 在插入时才生成
+            else:
+                session.add(summary)
+        battle_players = players.get(battle.id, [])
+        # 报错玩家的 PID 即 BattlePlayer.position
+        error_pid = _error_pid(results)
+        error_user_id = next(
+            (
+                bp.user_id
+                for bp in battle_players
+                if error_pid and bp.position == error_pid
+            ),
+            None,
+        )
+        fill_battle_summary(summary, battle, results, error_user_id)
+        fill_battle_analytics(battle, results, battle_players)
+        summaries[battle.id] = summary
+    return summaries
+
+
+# -----------------------------------------------------------------------------------------
+# 读取
+
+
+def get_battle_summaries(battle_ids):
+    """
+    按对战ID批量读取摘要 (一次主键 IN 查询)。
+
+    返回:
+        dict: {battle_id: BattleSummary}，没有摘要的对战不在其中；失败返回空字典。
+    """
+    if not battle_ids:
+        return {}
+    try:
+        rows = db.session.scalars(
+            select(BattleSummary).where(BattleSummary.battle_id.in_(list(battle_ids)))
+        ).all()
+        return {summary.battle_id: summary for summary in rows}
+    except Exception as e:
+        logger.error(f"读取对战摘要失败: {e}", exc_info=True)
+        return {}
+
+
+def ensure_battle_summaries(battles):
+    """
+    读取一组对战的摘要，已结束但缺少摘要的对战 (本功能上线前结束的) 补建并提交。
+
+    参数:
+        battles (list[Battle]): 对战对象。
+
+    返回:
+        dict: {battle_id: BattleSummary}；未结束的对战不在其中。
+    """
+    finished = [b for b in battles if b.status in FINISHED_STATUSES]
+    summaries = get_battle_summaries([b.id for b in finished])
+    missing = [b for b in finished if b.id not in summaries]
+    if not missing:
+        return summaries
+    try:
+        battles_results = []
+        for battle in missing:
+            results = _parse_results(battle.results)
+            if battle.status == "error" and not results.get("player_error"):
+                error_record, traceback = _player_error_from_log(results, battle.id)
+                if error_record is not None:
+                    results["player_error"] = error_record
+                if traceback and not results.get("traceback"):
+                    results["traceback"] = traceback
+            battles_results.append((battle, results))
+        with db.session.no_autoflush:
+            summaries.update(_write_summaries(db.session, battles_results))
+        db.session.commit()
+        logger.info(f"已补建 {len(missing)} 条对战摘要")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"补建对战摘要失败: {e}", exc_info=True)
+        return get_battle_summaries([b.id for b in finished])
+    return summaries
+
+
+def get_battle_summary(battle):
+    """
+    对战的摘要，必要时补建 (见 ensure_battle_summaries)。
+
+    返回:
+        BattleSummary 或 None (对战未结束或补建失败)。
+    """
+    return ensure_battle_summaries([battle]).get(battle.id)
+
+
+# -----------------------------------------------------------------------------------------
+# 会话事件: 对战结束时写入摘要
+
+
+def _status_or_results_changed(battle):
+    state = inspect(battle)
+    return (
+        state.pending
+        or state.attrs.status.history.has_changes()
+        or state.attrs.results.history.has_changes()
+        or state.attrs.ended_at.history.has_changes()
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def _summarize_on_flush(session, flush_context, instances):
+    """对战进入结束状态 (或结束后结果被改写) 时写入摘要；回到未结束状态时删除摘要、清空分析列"""
+    battles = [
+        obj
+        for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, Battle) and _status_or_results_changed(obj)
+    ]
+    if not battles:
+        return
+    finished = [b for b in battles if b.status in FINISHED_STATUSES]
+    # 从结束状态改回未结束状态 (例如管理员重置) 的对战
+    reopened = [
+        b.id
+        for b in battles
+        if b.status not in FINISHED_STATUSES
+        and any(
+            status in FINISHED_STATUSES
+            for status in inspect(b).attrs.status.history.deleted
+        )
+    ]
+    with session.no_autoflush:
+        if finished:
+            _write_summaries(
+                session, [(b, _parse_results(b.results)) for b in finished]
+            )
+        if reopened:
+            for summary in session.scalars(
+                select(BattleSummary).where(BattleSummary.battle_id.in_(reopened))
+            ):
+                session.delete(summary)
+            reopened_players = {}
+            for bp in session.scalars(
+                select(BattlePlayer).where(BattlePlayer.battle_id.in_(reopened))
+            ):
+                reopened_players.setdefault(bp.battle_id, []).append(bp)
+            for b in battles:
+                if b.id in reopened:
+                    fill_battle_analytics(b, {}, reopened_players.get(b.id, []))
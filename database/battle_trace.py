@@ -0,0 +1,135 @@
+"""
+这个模块保存对战调用追踪的设置 (battle_traces 表)。
+
+追踪记录在执行对战的进程内存中 (见 game/decorator.py)，而管理接口可能落在任意进程。
+管理员设置的采样率和导出请求写在这里，执行对战 (或持有其追踪记录) 的进程
+定期同步 (BattleManager._sync_traces)，导出后写回文件路径。
+"""
+
+import logging
+from datetime import datetime
+from sqlalchemy import select
+from .models import BattleTrace
+from .action import safe_commit
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+
+def _get_or_create(battle_id):
+    trace = db.session.get(BattleTrace, battle_id)
+    if trace is None:
+        trace = BattleTrace(battle_id=battle_id, sample_rate=0.0)
+        db.session.add(trace)
+    return trace
+
+
+def set_battle_trace(battle_id, sample_rate):
+    """
+    设置对战的追踪采样率。
+
+    参数:
+        battle_id (str): 对战ID
+        sample_rate (float): 0 ~ 1，0 为关闭
+
+    返回:
+        dict: 更新后的追踪设置，失败返回 None
+    """
+    try:
+        trace = _get_or_create(battle_id)
+        trace.sample_rate = sample_rate
+        if not safe_commit():
+            return None
+        return trace.to_dict()
+    except Exception as e:
+        logger.error(f"设置对战 {battle_id} 的追踪失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def request_battle_trace_dump(battle_id):
+    """
+    请求导出对战的追踪记录，由持有记录的进程在下一次同步时导出。
+
+    参数:
+        battle_id (str): 对战ID
+
+    返回:
+        dict: 更新后的追踪设置，失败返回 None
+    """
+    try:
+        trace = _get_or_create(battle_id)
+        trace.dump_requested_at = datetime.now()
+        if not safe_commit():
+            return None
+        return trace.to_dict()
+    except Exception as e:
+        logger.error(f"请求导出对战 {battle_id} 的追踪失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def record_battle_trace_dump(battle_id, path, records):
+    """
+    记录追踪已导出 (管理员请求或对战出错时)。
+
+    参数:
+        battle_id (str): 对战ID
+        path (str): 导出文件路径
+        records (int): 导出的记录条数
+
+    返回:
+        bool: 是否记录成功
+    """
+    try:
+        trace = _get_or_create(battle_id)
+        trace.dumped_at = datetime.now()
+        trace.dump_path = path
+        trace.dump_records = records
+        return safe_commit()
+    except Exception as e:
+        logger.error(f"记录对战 {battle_id} 的追踪导出失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
+def get_battle_trace(battle_id):
+    """
+    获取对战的追踪设置。
+
+    返回:
+        dict: 追踪设置，没有设置过或出错返回 None
+    """
+    try:
+        trace = db.session.get(BattleTrace, battle_id, populate_existing=True)
+        return trace.to_dict() if trace else None
+    except Exception as e:
+        logger.error(f"获取对战 {battle_id} 的追踪设置失败: {e}", exc_info=True)
+        return None
+
+
+def get_battle_traces(battle_ids):
+    """
+    批量获取对战的追踪设置 (执行对战的进程同步时调用)。
+
+    参数:
+        battle_ids (list): 对战ID列表
+
+    返回:
+        dict: 对战ID -> 追踪设置，出错返回 None
+    """
+    if not battle_ids:
+        return {}
+    try:
+        traces = db.session.scalars(
+            select(BattleTrace)
+            .where(BattleTrace.battle_id.in_(list(battle_ids)))
+            .execution_options(populate_existing=True)
+        )
+        result = {trace.battle_id: trace.to_dict() for trace in traces}
+        db.session.rollback()  # 结束只读事务，下次同步读到最新设置
+        return result
+    except Exception as e:
+        logger.error(f"获取对战追踪设置失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
@@ -0,0 +1,170 @@
+"""
+SQLite 写入并发基准：比较默认配置、性能配置和状态写线程下的每秒提交数
+
+用法:
+    python -m database.bench_sqlite --threads 64 --writes 20
+
+模拟方式:
+- 在临时目录中新建数据库，预先创建 threads × writes 场对战
+- 每个线程像对战线程一样，在自己的应用上下文中逐场把对战标记为 playing
+  (update_battle，一次写入一次提交)，同时有 --readers 个线程持续查询对战状态
+- baseline: 不启用 DB_PERFORMANCE_PROFILE (默认连接池、rollback 日志、默认 busy 超时)
+- profile: WAL + synchronous=NORMAL + busy_timeout + mmap，连接池按配置放大
+- profile+writer: 在 profile 基础上经由 BattleStatusWriter 合并提交
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from flask import Flask
+
+MODES = ("baseline", "profile", "profile+writer")
+
+
+def _create_app(db_path, mode, pool_size, max_overflow):
+    from . import initialize_database
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    app.config["SECRET_KEY"] = "bench"
+    app.config["DB_PERFORMANCE_PROFILE"] = mode != "baseline"
+    app.config["SQLALCHEMY_POOL_SIZE"] = pool_size
+    app.config["SQLALCHEMY_MAX_OVERFLOW"] = max_overflow
+    initialize_database(app)
+    return app
+
+
+def _seed(app, count):
+    from .base import db
+    from .models import Battle
+
+    with app.app_context():
+        db.create_all()
+        battle_ids = []
+        for _ in range(count):
+            battle = Battle(status="waiting")
+            db.session.add(battle)
+            db.session.flush()
+            battle_ids.append(battle.id)
+        db.session.commit()
+    return battle_ids
+
+
+def run_mode(mode, threads, writes, readers, pool_size, max_overflow):
+    """
+    运行一种模式。
+
+    返回:
+        dict: commits_per_sec, p50_ms, p99_ms, errors
+    """
+    from .action import get_battle_by_id, update_battle
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _create_app(os.path.join(tmp, "bench.db"), mode, pool_size, max_overflow)
+        battle_ids = _seed(app, threads * writes)
+
+        writer = None
+        if mode == "profile+writer":
+            from services.status_writer import BattleStatusWriter
+
+            writer = BattleStatusWriter(app)
+
+        latencies, errors = [], []
+        lock = threading.Lock()
+        stop_readers = threading.Event()
+
+        def mark_playing(battle_id):
+            if writer is not None:
+                return writer.submit(battle_id, "playing")
+            with app.app_context():
+                return update_battle(get_battle_by_id(battle_id), status="playing")
+
+        def worker(index):
+            own = battle_ids[index * writes : (index + 1) * writes]
+            for battle_id in own:
+                started = time.perf_counter()
+                try:
+                    ok = mark_playing(battle_id)
+                except Exception:
+                    ok = False
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    if not ok:
+                        errors.append(battle_id)
+
+        def reader():
+            while not stop_readers.is_set():
+                with app.app_context():
+                    for battle_id in battle_ids[:: max(1, len(battle_ids) // 50)]:
+                        try:
+                            get_battle_by_id(battle_id)
+                        except Exception:
+                            pass
+
+        reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+        for t in reader_threads:
+            t.start()
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        total = time.perf_counter() - started
+        stop_readers.set()
+        for t in reader_threads:
+            t.join()
+        if writer is not None:
+            writer.shutdown()
+
+        with app.app_context():
+            from .base import db
+
+            db.engine.dispose()
+
+    latencies.sort()
+    return {
+        "commits_per_sec": (len(latencies) - len(errors)) / total,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": len(errors),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SQLite 写入并发基准")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--writes", type=int, default=20, help="每个线程的写入次数")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--max-overflow", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    args = parser.parse_args(argv)
+
+    print(
+        f"threads={args.threads} writes={args.writes} readers={args.readers} "
+        f"pool={args.pool_size}+{args.max_overflow}"
+    )
+    for mode in args.modes:
+        result = run_mode(
+            mode,
+            args.threads,
+            args.writes,
+            args.readers,
+            args.pool_size,
+            args.max_overflow,
+        )
+        print(
+            f"{mode:>15}: {result['commits_per_sec']:8.1f} commits/s  "
+            f"p50={result['p50_ms']:.1f}ms  p99={result['p99_ms']:.1f}ms  "
+            f"errors={result['errors']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+这个模块实现跨进程共享的数据版本号。
+
+写入相关数据的事务内会递增对应键的版本号 (与数据变更一起提交)，
+读取方 (例如自动对战的参与者列表) 只需用一次主键查询比较版本号，
+版本不变时即可继续使用本地缓存。
+
+当前维护的版本键:
+- ACTIVE_PARTICIPANTS: AI 激活状态或榜单成员 (GameStats 行) 发生变化
+"""
+
+import logging
+from datetime import datetime
+from sqlalchemy import event, inspect, insert, update
+from sqlalchemy.orm import Session
+from .models import AICode, DataVersion, GameStats
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+# 榜单参与者 (激活AI + 榜单成员) 版本
+ACTIVE_PARTICIPANTS = "active_participants"
+
+
+def get_data_version(key):
+    """
+    获取指定键的当前版本号。
+
+    参数:
+        key (str): 版本键。
+
+    返回:
+        int: 版本号，从未变更过为 0；查询失败返回 None (调用方应视为已过期)。
+    """
+    try:
+        version = (
+            db.session.query(DataVersion.version)
+            .filter(DataVersion.key == key)
+            .scalar()
+        )
+        return version or 0
+    except Exception as e:
+        logger.error(f"获取数据版本 {key} 失败: {e}", exc_info=True)
+        return None
+
+
+def bump_data_version(key, connection=None):
+    """
+    在当前事务中递增指定键的版本号 (不提交，随调用方的事务一起提交)。
+
+    参数:
+        key (str): 版本键。
+        connection: 可选的数据库连接，默认使用当前会话的连接。
+    """
+    connection = connection or db.session.connection()
+    now = datetime.now()
+    result = connection.execute(
+        update(DataVersion)
+        .where(DataVersion.key == key)
+        .values(version=DataVersion.version + 1, updated_at=now)
+    )
+    if result.rowcount == 0:
+        connection.execute(
+            insert(DataVersion).values(key=key, version=1, updated_at=now)
+        )
+
+
+def _touches_participants(session):
+    """本次 flush 是否改变了 AI 激活状态、校验结论或榜单成员"""
+    for obj in session.new:
+        if isinstance(obj, GameStats) or (isinstance(obj, AICode) and obj.is_active):
+            return True
+    for obj in session.deleted:
+        if isinstance(obj, (GameStats, AICode)):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, AICode):
+            changed = ("is_active", "user_id", "validation_status")
+        elif isinstance(obj, GameStats):
+            changed = ("ranking_id", "user_id")
+        else:
+            continue
+        state = inspect(obj)
+        if any(state.attrs[name].history.has_changes() for name in changed):
+            return True
+    return False
+
+
+@event.listens_for(Session, "before_flush")
+def _bump_on_flush(session, flush_context, instances):
+    if _touches_participants(session):
+        bump_data_version(ACTIVE_PARTICIPANTS, session.connection())
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bump_on_bulk_statement(orm_execute_state):
+    """批量 query.update()/delete() 不经过 flush，需要单独处理"""
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None:
+        return
+    # GameStats 的批量更新 (ELO 等) 不改变成员关系，只关心批量删除
+    if (orm_execute_state.is_delete and mapper.class_ in (AICode, GameStats)) or (
+        orm_execute_state.is_update and mapper.class_ is AICode
+    ):
+        bump_data_version(ACTIVE_PARTICIPANTS, orm_execute_state.session.connection())
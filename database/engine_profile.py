@@ -0,0 +1,137 @@
+"""
+数据库引擎性能配置
+
+- 连接池: 按配置设置 pool_size / max_overflow / pool_timeout，
+  默认的 5+10 个连接在上百个对战线程下很快耗尽，请求会卡在等待连接上
+- SQLite: 每个新连接上执行 PRAGMA
+    journal_mode=WAL     读写互不阻塞，只有写写互斥
+    synchronous=NORMAL   WAL 下只在检查点时 fsync，掉电最多丢失最近的事务，不会损坏数据库
+    busy_timeout         遇到写锁时等待而不是立刻报 "database is locked"
+    mmap_size            读取走内存映射，减少系统调用
+内存数据库 (测试用) 不支持 WAL，只设置 busy_timeout。
+"""
+
+import logging
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 20
+DEFAULT_POOL_TIMEOUT = 30  # 秒
+DEFAULT_POOL_RECYCLE = 1800  # 秒，仅用于 MySQL/PostgreSQL 等服务端数据库
+DEFAULT_SQLITE_BUSY_TIMEOUT_MS = 15000
+DEFAULT_SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+
+def _is_sqlite(uri):
+    return uri is not None and make_url(uri).get_backend_name() == "sqlite"
+
+
+def _is_memory_sqlite(uri):
+    database = make_url(uri).database
+    return (
+        not database or database == ":memory:" or database.startswith("file::memory:")
+    )
+
+
+def sqlite_pragmas(config, in_memory=False):
+    """
+    根据配置生成每个 SQLite 连接上要执行的 PRAGMA。
+
+    参数:
+        config (dict): 应用配置。
+        in_memory (bool): 是否为内存数据库。
+
+    返回:
+        list: [(pragma, value), ...]，按执行顺序排列。
+    """
+    pragmas = [
+        (
+            "busy_timeout",
+            int(config.get("SQLITE_BUSY_TIMEOUT_MS", DEFAULT_SQLITE_BUSY_TIMEOUT_MS)),
+        )
+    ]
+    if in_memory:
+        return pragmas
+    pragmas.extend(
+        [
+            ("journal_mode", config.get("SQLITE_JOURNAL_MODE", "WAL")),
+            ("synchronous", config.get("SQLITE_SYNCHRONOUS", "NORMAL")),
+            (
+                "mmap_size",
+                int(config.get("SQLITE_MMAP_SIZE", DEFAULT_SQLITE_MMAP_SIZE)),
+            ),
+        ]
+    )
+    return pragmas
+
+
+def build_engine_options(config):
+    """
+    生成 SQLALCHEMY_ENGINE_OPTIONS 的默认值 (配置中显式给出的选项优先)。
+
+    参数:
+        config (dict): 应用配置。
+
+    返回:
+        dict: 引擎选项。
+    """
+    uri = config.get("SQLALCHEMY_DATABASE_URI")
+    if _is_sqlite(uri) and _is_memory_sqlite(uri):
+        # 内存数据库由 Flask-SQLAlchemy 使用 StaticPool，不设置连接池大小
+        options = {}
+    else:
+        options = {
+            "pool_size": int(config.get("SQLALCHEMY_POOL_SIZE", DEFAULT_POOL_SIZE)),
+            "max_overflow": int(
+                config.get("SQLALCHEMY_MAX_OVERFLOW", DEFAULT_MAX_OVERFLOW)
+            ),
+            "pool_timeout": int(
+                config.get("SQLALCHEMY_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT)
+            ),
+        }
+        if not _is_sqlite(uri):
+            options["pool_pre_ping"] = True
+            options["pool_recycle"] = DEFAULT_POOL_RECYCLE
+    options.update(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    return options
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """在引擎的每个新连接上执行给定的 PRAGMA"""
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    return _set_sqlite_pragmas
+
+
+def configure_engine_options(app):
+    """在 db.init_app 之前调用，写入连接池等引擎选项"""
+    if not app.config.get("DB_PERFORMANCE_PROFILE", True):
+        return
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = build_engine_options(app.config)
+
+
+def apply_engine_profile(app):
+    """在 db.init_app 之后调用，为 SQLite 引擎注册连接 PRAGMA"""
+    uri = app.config.get("SQLALCHEMY_DATABASE_URI")
+    if not app.config.get("DB_PERFORMANCE_PROFILE", True) or not _is_sqlite(uri):
+        return
+    pragmas = sqlite_pragmas(app.config, in_memory=_is_memory_sqlite(uri))
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine, pragmas)
+    logger.info(
+        "SQLite 性能配置: "
+        + ", ".join(f"{name}={value}" for name, value in pragmas)
+        + f", 连接池: {app.config['SQLALCHEMY_ENGINE_OPTIONS']}"
+    )
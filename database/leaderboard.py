@@ -0,0 +1,629 @@
+"""
+物化排行榜
+
+每个榜单的名次物化在 leaderboard_entries 中，排序键为 (elo_score 降序, user_id 升序)，
+名次 (position) 从 1 开始连续编号:
+- 查询玩家的名次和百分位: 主键查询 + 索引取最大名次，O(log n)
+- 翻页: 按名次区间读取 (keyset)，不需要 count() 和 OFFSET；筛选场次时按名次游标翻页
+- 附近的玩家: 名次区间 [p - window, p + window]
+
+维护方式:
+- 对战结算 (apply_battle_results_batch) 在同一事务中调用 sync_leaderboard_entries，
+  只平移新旧 ELO 之间那部分玩家的名次
+- 其他修改 GameStats 的途径 (管理员改分、晋级、重置、重放写回、删除成员等) 由会话事件
+  递增版本号；读取时发现榜单落后于 GameStats 就整榜重建 (一条 INSERT ... SELECT ROW_NUMBER())
+
+事务提交后，本事务中 GameStats 的变动 (榜单 -> 玩家) 会通知 add_game_stats_listener
+注册的回调，例如失效排行榜的响应缓存。
+"""
+
+import logging
+from datetime import datetime
+from sqlalchemy import and_, delete, event, func, insert, inspect, or_, select, update
+from sqlalchemy.orm import Session
+from .models import DataVersion, GameStats, LeaderboardEntry, User
+from .data_version import bump_data_version
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+# GameStats 版本键: 单个榜单的变更 / 无法确定榜单的批量语句
+GAME_STATS_VERSION = "game_stats:{}"
+GAME_STATS_ALL_VERSION = "game_stats:*"
+# 物化榜单构建时对应的 GameStats 版本 (两者之和 + 1，0 表示从未构建)
+LEADERBOARD_VERSION = "leaderboard:{}"
+
+# 结算路径自己维护榜单，带上该执行选项的 GameStats 批量语句不使榜单过期
+LEADERBOARD_SYNCED = "leaderboard_synced"
+
+# 会话 info 中记录本事务 GameStats 变动的键: {ranking_id: 用户ID集合 或 None (整个榜单)}，
+# ranking_id 为 None 表示无法确定榜单的批量语句
+_CHANGES_KEY = "game_stats_changes"
+_listeners = []
+
+_TRACKED_COLUMNS = (
+    "elo_score",
+    "games_played",
+    "wins",
+    "losses",
+    "draws",
+    "ranking_id",
+    "user_id",
+)
+
+
+# -----------------------------------------------------------------------------------------
+# 版本与重建
+
+
+def mark_leaderboard_stale(ranking_id, connection=None):
+    """
+    在当前事务中标记榜单需要重建 (用于不经过 ORM 修改 GameStats 的语句)。
+
+    参数:
+        ranking_id (int): 榜单ID。
+        connection: 可选的数据库连接，默认使用当前会话的连接。
+    """
+    bump_data_version(GAME_STATS_VERSION.format(ranking_id), connection)
+    _record_changes(db.session(), ranking_id)
+
+
+def _read_versions(ranking_id):
+    """返回 (GameStats 版本之和, 榜单构建版本)"""
+    keys = [
+        GAME_STATS_VERSION.format(ranking_id),
+        GAME_STATS_ALL_VERSION,
+        LEADERBOARD_VERSION.format(ranking_id),
+    ]
+    versions = dict(
+        db.session.execute(
+            select(DataVersion.key, DataVersion.version).where(
+                DataVersion.key.in_(keys)
+            )
+        ).all()
+    )
+    stats_version = versions.get(keys[0], 0) + versions.get(keys[1], 0)
+    return stats_version, versions.get(keys[2], 0)
+
+
+def _set_version(key, version):
+    now = datetime.now()
+    result = db.session.execute(
+        update(DataVersion)
+        .where(DataVersion.key == key)
+        .values(version=version, updated_at=now)
+    )
+    if result.rowcount == 0:
+        db.session.execute(
+            insert(DataVersion).values(key=key, version=version, updated_at=now)
+        )
+
+
+def rebuild_leaderboard(ranking_id):
+    """
+    按 GameStats 整榜重建物化排行榜。
+
+    参数:
+        ranking_id (int): 榜单ID。
+
+    返回:
+        bool: 重建是否成功。
+    """
+    try:
+        # 先删除以取得写锁，之后读到的版本号与 GameStats 一致
+        db.session.execute(
+            delete(LeaderboardEntry).where(LeaderboardEntry.ranking_id == ranking_id)
+        )
+        stats_version, _ = _read_versions(ranking_id)
+        elo = func.coalesce(GameStats.elo_score, 1200)
+        db.session.execute(
+            insert(LeaderboardEntry).from_select(
+                [
+                    "ranking_id",
+                    "user_id",
+                    "position",
+                    "elo_score",
+                    "games_played",
+                    "wins",
+                    "losses",
+                    "draws",
+                ],
+                select(
+                    GameStats.ranking_id,
+                    GameStats.user_id,
+                    func.row_number().over(order_by=(elo.desc(), GameStats.user_id)),
+                    elo,
+                    func.coalesce(GameStats.games_played, 0),
+                    func.coalesce(GameStats.wins, 0),
+                    func.coalesce(GameStats.losses, 0),
+                    func.coalesce(GameStats.draws, 0),
+                ).where(GameStats.ranking_id == ranking_id),
+            )
+        )
+        _set_version(LEADERBOARD_VERSION.format(ranking_id), stats_version + 1)
+        db.session.commit()
+        logger.info(f"榜单 {ranking_id} 物化排行榜已重建")
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"重建榜单 {ranking_id} 物化排行榜失败: {e}", exc_info=True)
+        return False
+
+
+def ensure_leaderboard(ranking_id):
+    """
+    确保物化排行榜与 GameStats 一致，落后时整榜重建。
+
+    参数:
+        ranking_id (int): 榜单ID。
+
+    返回:
+        bool: 榜单是否可用。
+    """
+    try:
+        stats_version, built_version = _read_versions(ranking_id)
+    except Exception as e:
+        logger.error(f"读取榜单 {ranking_id} 版本失败: {e}", exc_info=True)
+        return False
+    if built_version == stats_version + 1:
+        return True
+    return rebuild_leaderboard(ranking_id)
+
+
+# -----------------------------------------------------------------------------------------
+# 结算时的增量维护
+
+
+def _key_before(elo_score, user_id):
+    """排序键严格排在 (elo_score, user_id) 之前的条件"""
+    return or_(
+        LeaderboardEntry.elo_score > elo_score,
+        and_(
+            LeaderboardEntry.elo_score == elo_score,
+            LeaderboardEntry.user_id < user_id,
+        ),
+    )
+
+
+def _key_after(elo_score, user_id):
+    """排序键严格排在 (elo_score, user_id) 之后的条件"""
+    return or_(
+        LeaderboardEntry.elo_score < elo_score,
+        and_(
+            LeaderboardEntry.elo_score == elo_score,
+            LeaderboardEntry.user_id > user_id,
+        ),
+    )
+
+
+def _move_entry(ranking_id, user_id, position, old_elo, new_elo):
+    """
+    把玩家从 old_elo 移到 new_elo，平移两者之间玩家的名次。
+
+    返回:
+        int: 玩家的新名次。
+    """
+    if new_elo == old_elo:
+        return position
+    low, high = min(old_elo, new_elo), max(old_elo, new_elo)
+    if new_elo > old_elo:
+        # 上升: 排在新位置之后、旧位置之前的玩家各后移一名
+        between = and_(_key_after(new_elo, user_id), _key_before(old_elo, user_id))
+    else:
+        between = and_(_key_after(old_elo, user_id), _key_before(new_elo, user_id))
+    passed = db.session.execute(
+        select(func.count())
+        .select_from(LeaderboardEntry)
+        .where(
+            LeaderboardEntry.ranking_id == ranking_id,
+            LeaderboardEntry.elo_score.between(low, high),
+            between,
+        )
+    ).scalar()
+    if not passed:
+        return position
+
+    if new_elo > old_elo:
+        new_position = position - passed
+        shift = LeaderboardEntry.position + 1
+        window = LeaderboardEntry.position.between(new_position, position - 1)
+    else:
+        new_position = position + passed
+        shift = LeaderboardEntry.position - 1
+        window = LeaderboardEntry.position.between(position + 1, new_position)
+    db.session.execute(
+        update(LeaderboardEntry)
+        .where(LeaderboardEntry.ranking_id == ranking_id, window)
+        .values(position=shift)
+        .execution_options(synchronize_session=False)
+    )
+    return new_position
+
+
+def sync_leaderboard_entries(ranking_id, user_ids):
+    """
+    在当前事务中把指定玩家的 GameStats 同步到物化排行榜 (不提交)。
+
+    在 GameStats 更新之后调用；榜单中没有的玩家跳过 (尚未构建的榜单在读取时整榜重建)。
+
+    参数:
+        ranking_id (int): 榜单ID。
+        user_ids (iterable): 本次 GameStats 有变动的玩家ID。
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    _record_changes(db.session(), ranking_id, user_ids)
+    stats = db.session.execute(
+        select(
+            GameStats.user_id,
+            GameStats.elo_score,
+            GameStats.games_played,
+            GameStats.wins,
+            GameStats.losses,
+            GameStats.draws,
+        ).where(GameStats.ranking_id == ranking_id, GameStats.user_id.in_(user_ids))
+    ).all()
+    for user_id, elo_score, games_played, wins, losses, draws in stats:
+        # 每次都重新读取当前名次: 前一位玩家的移动可能已经平移过它
+        entry = db.session.execute(
+            select(LeaderboardEntry.position, LeaderboardEntry.elo_score).where(
+                LeaderboardEntry.ranking_id == ranking_id,
+                LeaderboardEntry.user_id == user_id,
+            )
+        ).first()
+        if entry is None:
+            continue
+        new_elo = elo_score if elo_score is not None else 1200
+        position = _move_entry(ranking_id, user_id, entry[0], entry[1], new_elo)
+        db.session.execute(
+            update(LeaderboardEntry)
+            .where(
+                LeaderboardEntry.ranking_id == ranking_id,
+                LeaderboardEntry.user_id == user_id,
+            )
+            .values(
+                position=position,
+                elo_score=new_elo,
+                games_played=games_played or 0,
+                wins=wins or 0,
+                losses=losses or 0,
+                draws=draws or 0,
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+
+# -----------------------------------------------------------------------------------------
+# 查询
+
+
+def _format_entry(entry, username):
+    """榜单条目转为排行榜页面使用的字典"""
+    wins, losses, draws = entry.wins, entry.losses, entry.draws
+    games_played = entry.games_played
+    return {
+        "rank": entry.position,
+        "user_id": entry.user_id,
+        "username": username,
+        "elo_score": entry.elo_score,
+        "wins": wins,
+        "losses": losses,
+        "draws": draws,
+        "games_played": games_played,
+        "win_rate": round(wins / (losses + wins) * 100, 1) if losses + wins else 0,
+        "draw_rate_for_container": (
+            round(draws / games_played * 100, 1) if games_played else 0
+        ),
+        "loss_rate_for_container": (
+            round(losses / games_played * 100, 1) if games_played else 0
+        ),
+        "win_rate_for_container": (
+            round(wins / games_played * 100, 1) if games_played else 0
+        ),
+    }
+
+
+def _entries_query(ranking_id, min_games_played=0):
+    query = (
+        db.session.query(LeaderboardEntry, User.username)
+        .join(User, User.id == LeaderboardEntry.user_id)
+        .filter(LeaderboardEntry.ranking_id == ranking_id)
+    )
+    if min_games_played > 0:
+        query = query.filter(LeaderboardEntry.games_played >= min_games_played)
+    return query
+
+
+def _ranking_size(ranking_id):
+    """榜单人数 (最大名次)，走 (ranking_id, position) 索引"""
+    return (
+        db.session.query(func.max(LeaderboardEntry.position))
+        .filter(LeaderboardEntry.ranking_id == ranking_id)
+        .scalar()
+        or 0
+    )
+
+
+def get_leaderboard(ranking_id=0, page=1, per_page=15):
+    """
+    获取排行榜数据，按页码分页。
+
+    名次连续，第 page 页就是名次区间 [(page - 1) * per_page + 1, page * per_page]，
+    总条数为最大名次，不需要 count() 和 OFFSET。筛选场次后名次不再连续，
+    按名次游标翻页 (get_filtered_leaderboard)。
+
+    参数:
+        ranking_id (int): 榜单ID。
+        page (int): 页码 (从1开始)。
+        per_page (int): 每页条数。
+
+    返回:
+        tuple: (条目字典列表, 总条数)，失败返回 ([], 0)。
+    """
+    try:
+        if not ensure_leaderboard(ranking_id):
+            return [], 0
+        first = (max(page, 1) - 1) * per_page + 1
+        rows = (
+            _entries_query(ranking_id)
+            .filter(LeaderboardEntry.position.between(first, first + per_page - 1))
+            .order_by(LeaderboardEntry.position)
+            .all()
+        )
+        total_count = _ranking_size(ranking_id)
+        return [_format_entry(entry, username) for entry, username in rows], total_count
+    except Exception as e:
+        logger.error(f"获取榜单 {ranking_id} 排行榜失败: {e}", exc_info=True)
+        return [], 0
+
+
+def get_filtered_leaderboard(
+    ranking_id, min_games_played, per_page=15, after=0, before=None
+):
+    """
+    获取筛选场次后的排行榜 (名次游标分页)。
+
+    沿 (ranking_id, position) 索引从游标处读取 per_page + 1 条满足场次的条目，
+    多出的一条只用来判断是否还有下一页 (上一页)；不统计总数。
+    返回的 rank 仍是玩家在整个榜单中的名次。
+
+    参数:
+        ranking_id (int): 榜单ID。
+        min_games_played (int): 最少对局数。
+        per_page (int): 每页条数。
+        after (int): 下一页游标 (上一页最后一名的名次)，0 表示从第一名开始。
+        before (int, optional): 上一页游标 (本页第一名的名次)，给出时忽略 after。
+
+    返回:
+        dict: {"items", "next_cursor", "prev_cursor", "has_next", "has_prev"}，
+              游标为名次；失败返回 None。
+    """
+    try:
+        if not ensure_leaderboard(ranking_id):
+            return None
+        query = _entries_query(ranking_id, min_games_played)
+        if before:
+            # 上一页: 倒序取游标之前的 per_page + 1 条，再翻转
+            rows = (
+                query.filter(LeaderboardEntry.position < before)
+                .order_by(LeaderboardEntry.position.desc())
+                .limit(per_page + 1)
+                .all()
+            )
+            has_prev = len(rows) > per_page
+            rows = list(reversed(rows[:per_page]))
+            has_next = True
+        else:
+            rows = (
+                query.filter(LeaderboardEntry.position > (after or 0))
+                .order_by(LeaderboardEntry.position)
+                .limit(per_page + 1)
+                .all()
+            )
+            has_next = len(rows) > per_page
+            rows = rows[:per_page]
+            has_prev = bool(after)
+        items = [_format_entry(entry, username) for entry, username in rows]
+        return {
+            "items": items,
+            "next_cursor": items[-1]["rank"] if items and has_next else None,
+            "prev_cursor": items[0]["rank"] if items and has_prev else None,
+            "has_next": has_next,
+            "has_prev": has_prev,
+        }
+    except Exception as e:
+        logger.error(f"获取榜单 {ranking_id} 排行榜失败: {e}", exc_info=True)
+        return None
+
+
+def get_leaderboard_page(ranking_id=0, after=0, limit=50, min_games_played=0):
+    """
+    按名次游标 (keyset) 获取排行榜。
+
+    参数:
+        ranking_id (int): 榜单ID。
+        after (int): 上一页最后一名的名次，0 表示从第一名开始。
+        limit (int): 条数。
+        min_games_played (int): 最少对局数。
+
+    返回:
+        tuple: (条目字典列表, 下一页游标)，没有下一页时游标为 None；失败返回 ([], None)。
+    """
+    try:
+        if not ensure_leaderboard(ranking_id):
+            return [], None
+        rows = (
+            _entries_query(ranking_id, min_games_played)
+            .filter(LeaderboardEntry.position > after)
+            .order_by(LeaderboardEntry.position)
+            .limit(limit)
+            .all()
+        )
+        items = [_format_entry(entry, username) for entry, username in rows]
+        next_cursor = items[-1]["rank"] if len(items) == limit else None
+        return items, next_cursor
+    except Exception as e:
+        logger.error(f"获取榜单 {ranking_id} 排行榜失败: {e}", exc_info=True)
+        return [], None
+
+
+def get_user_rank(ranking_id, user_id):
+    """
+    获取玩家在榜单中的名次和百分位。
+
+    参数:
+        ranking_id (int): 榜单ID。
+        user_id (str): 用户ID。
+
+    返回:
+        dict: rank, total, percentile (超过的玩家比例，0~100), top_percent (前百分之几)，
+              elo_score；玩家不在榜单中或查询失败返回 None。
+    """
+    try:
+        if not ensure_leaderboard(ranking_id):
+            return None
+        entry = db.session.get(LeaderboardEntry, (ranking_id, user_id))
+        if entry is None:
+            return None
+        total = _ranking_size(ranking_id)
+        rank = entry.position
+        return {
+            "ranking_id": ranking_id,
+            "user_id": user_id,
+            "rank": rank,
+            "total": total,
+            "percentile": (
+                round((total - rank) / (total - 1) * 100, 1) if total > 1 else 100.0
+            ),
+            "top_percent": round(rank / total * 100, 1),
+            "elo_score": entry.elo_score,
+        }
+    except Exception as e:
+        logger.error(
+            f"获取用户 {user_id} 在榜单 {ranking_id} 的名次失败: {e}", exc_info=True
+        )
+        return None
+
+
+def get_players_around(ranking_id, user_id, window=5):
+    """
+    获取玩家前后各 window 名的榜单条目 (包含玩家本人)。
+
+    参数:
+        ranking_id (int): 榜单ID。
+        user_id (str): 用户ID。
+        window (int): 前后各取的人数。
+
+    返回:
+        list: 条目字典列表 (按名次排列，本人带 is_self=True)；玩家不在榜单中或查询失败返回 None。
+    """
+    try:
+        if not ensure_leaderboard(ranking_id):
+            return None
+        entry = db.session.get(LeaderboardEntry, (ranking_id, user_id))
+        if entry is None:
+            return None
+        rows = (
+            _entries_query(ranking_id)
+            .filter(
+                LeaderboardEntry.position.between(
+                    entry.position - window, entry.position + window
+                )
+            )
+            .order_by(LeaderboardEntry.position)
+            .all()
+        )
+        items = []
+        for row, username in rows:
+            item = _format_entry(row, username)
+            item["is_self"] = row.user_id == user_id
+            items.append(item)
+        return items
+    except Exception as e:
+        logger.error(
+            f"获取用户 {user_id} 在榜单 {ranking_id} 附近的玩家失败: {e}", exc_info=True
+        )
+        return None
+
+
+# -----------------------------------------------------------------------------------------
+# 会话事件: 结算之外的 GameStats 修改使榜单过期
+
+
+def add_game_stats_listener(callback):
+    """
+    注册 GameStats 变动提交后的回调。
+
+    参数:
+        callback (callable): callback(changes)，changes 为 {ranking_id: 用户ID集合}；
+            用户集合为 None 表示整个榜单，ranking_id 为 None 表示所有榜单。
+    """
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def _record_changes(session, ranking_id, user_ids=None):
+    changes = session.info.setdefault(_CHANGES_KEY, {})
+    if user_ids is None:
+        changes[ranking_id] = None
+    elif changes.get(ranking_id, ()) is not None:
+        changes.setdefault(ranking_id, set()).update(user_ids)
+
+
+def _touched_game_stats(session):
+    """本次 flush 中 GameStats 有变动的 {榜单: 玩家集合}"""
+    touched = {}
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, GameStats):
+            touched.setdefault(obj.ranking_id or 0, set()).add(obj.user_id)
+    for obj in session.dirty:
+        if not isinstance(obj, GameStats):
+            continue
+        state = inspect(obj)
+        if any(state.attrs[name].history.has_changes() for name in _TRACKED_COLUMNS):
+            touched.setdefault(obj.ranking_id or 0, set()).add(obj.user_id)
+            for ranking_id in state.attrs.ranking_id.history.deleted or ():
+                touched.setdefault(ranking_id, set()).add(obj.user_id)
+    return touched
+
+
+@event.listens_for(Session, "before_flush")
+def _stale_on_flush(session, flush_context, instances):
+    touched = _touched_game_stats(session)
+    if touched:
+        connection = session.connection()
+        for ranking_id, user_ids in touched.items():
+            bump_data_version(GAME_STATS_VERSION.format(ranking_id), connection)
+            _record_changes(session, ranking_id, user_ids)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _stale_on_bulk_statement(orm_execute_state):
+    """批量 query.update()/delete() 无法确定涉及的榜单，使所有榜单过期"""
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not GameStats:
+        return
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if orm_execute_state.execution_options.get(LEADERBOARD_SYNCED):
+        return
+    bump_data_version(GAME_STATS_ALL_VERSION, orm_execute_state.session.connection())
+    _record_changes(orm_execute_state.session, None)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_after_commit(session):
+    changes = session.info.pop(_CHANGES_KEY, None)
+    if not changes:
+        return
+    for callback in list(_listeners):
+        try:
+            callback(changes)
+        except Exception as e:
+            logger.error(f"GameStats 变动回调 {callback} 出错: {e}", exc_info=True)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_CHANGES_KEY, None)
@@ -0,0 +1,393 @@
+"""
+LLM 调用耗时的时间序列存储与服务端聚合
+
+每次调用一行 (llm_usage_samples)，写入时按耗时算出对数分桶 latency_bin:
+- 聚合查询走 (started_at, client_id, model, latency_bin, completed, usage_time) 覆盖索引，
+  SQL 只返回 "时间桶 x 分组 x 耗时分桶" 的计数、求和与最值，行数与原始调用数无关
+- 分位数 (p50/p95/p99) 由分桶计数在 Python 中求出，桶内按该桶实际的最小/最大值线性插值，
+  相对误差不超过一个分桶的宽度 (LATENCY_BIN_RATIO)
+- 长时间范围按 choose_step 选取的步长降采样，时间桶对齐到步长的整数倍
+
+未正常结束 (超时、进程退出时未释放) 和出错的调用计入调用数和错误率，不计入耗时统计。
+"""
+
+import json
+import logging
+import math
+import os
+
+from sqlalchemy import Integer, cast, delete, func, insert, select
+
+from .models import LlmUsageSample
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+# 耗时分桶: 0 号桶为 (0, BASE)，k 号桶为 [BASE * RATIO^(k-1), BASE * RATIO^k)，最后一桶不设上限
+LATENCY_BIN_BASE = 0.01  # 秒
+LATENCY_BIN_RATIO = 1.2
+LATENCY_BIN_COUNT = 72  # 覆盖到约 1 小时
+_LOG_RATIO = math.log(LATENCY_BIN_RATIO)
+
+# 降采样步长 (秒)，按窗口长度 / 最大点数选取不小于它的第一个
+STEP_CHOICES = (10, 30, 60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 86400)
+DEFAULT_MAX_POINTS = 120
+PERCENTILES = (50, 95, 99)
+
+# 分组维度 -> 分组列
+GROUP_COLUMNS = {
+    "client": ("client_id",),
+    "model": ("model",),
+    "client_model": ("client_id", "model"),
+}
+
+
+def latency_bin(seconds):
+    """耗时所在的分桶编号"""
+    if seconds < LATENCY_BIN_BASE:
+        return 0
+    k = int(math.log(seconds / LATENCY_BIN_BASE) / _LOG_RATIO) + 1
+    return min(k, LATENCY_BIN_COUNT - 1)
+
+
+def latency_bin_bounds(k):
+    """分桶的 (下界, 上界)，最后一桶上界为 None"""
+    lower = 0.0 if k == 0 else LATENCY_BIN_BASE * LATENCY_BIN_RATIO ** (k - 1)
+    upper = (
+        None if k == LATENCY_BIN_COUNT - 1 else LATENCY_BIN_BASE * LATENCY_BIN_RATIO**k
+    )
+    return lower, upper
+
+
+def choose_step(window, max_points=DEFAULT_MAX_POINTS):
+    """按窗口长度选取降采样步长，使点数不超过 max_points"""
+    target = window / max(1, max_points)
+    for step in STEP_CHOICES:
+        if step >= target:
+            return step
+    return int(math.ceil(target / STEP_CHOICES[-1])) * STEP_CHOICES[-1]
+
+
+# -----------------------------------------------------------------------------------------
+# 写入
+
+
+def _sample_row(entry):
+    """把 ClientManager 的日志条目转换为表行，无效条目返回 None"""
+    try:
+        usage_time = float(entry["usage_time"])
+        started_at = float(entry["start_time"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (math.isfinite(usage_time) and math.isfinite(started_at)) or usage_time < 0:
+        return None
+    # 调用出错 (error 为异常类型名) 与未正常结束一样计入错误率、不计入耗时，和 /metrics 一致
+    error = entry.get("error")
+    completed = bool(entry.get("completed", True)) and error is None
+    reason = entry.get("reason") if error is None else str(error)
+    return {
+        "started_at": started_at,
+        "client_id": str(entry.get("client_id") or "unknown")[:64],
+        "model": str(entry.get("model") or "")[:128],
+        "session_id": entry.get("session_id"),
+        "usage_time": usage_time,
+        "latency_bin": latency_bin(usage_time),
+        "completed": completed,
+        "reason": reason[:32] if reason else None,
+    }
+
+
+def record_usage_samples(entries):
+    """
+    批量写入调用记录。
+
+    参数:
+        entries (list[dict]): ClientManager 的日志条目 (client_id, model, start_time, usage_time, completed, error ...)。
+
+    返回:
+        int: 写入的条数，失败返回 0。
+    """
+    rows = [row for row in map(_sample_row, entries) if row is not None]
+    if not rows:
+        return 0
+    try:
+        db.session.execute(insert(LlmUsageSample), rows)
+        db.session.commit()
+        return len(rows)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"写入 LLM 调用记录失败: {e}", exc_info=True)
+        return 0
+
+
+def prune_usage_samples(older_than):
+    """
+    删除开始时间早于 older_than (Unix 秒) 的调用记录。
+
+    返回:
+        int: 删除的条数，失败返回 0。
+    """
+    try:
+        result = db.session.execute(
+            delete(LlmUsageSample).where(LlmUsageSample.started_at < older_than)
+        )
+        db.session.commit()
+        return result.rowcount or 0
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"清理 LLM 调用记录失败: {e}", exc_info=True)
+        return 0
+
+
+def import_usage_log(path):
+    """
+    导入旧版 client_usage_times.json。文件先改名再导入，多个进程同时调用时只有一个会导入。
+
+    返回:
+        int: 导入的条数。
+    """
+    importing_path = f"{path}.importing"
+    try:
+        os.rename(path, importing_path)
+    except OSError:
+        return 0
+    try:
+        with open(importing_path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"无法读取旧版调用记录 {importing_path}: {e}")
+        return 0
+    if not isinstance(entries, list):
+        entries = []
+    imported = 0
+    for i in range(0, len(entries), 1000):
+        imported += record_usage_samples(
+            [e for e in entries[i : i + 1000] if isinstance(e, dict)]
+        )
+    os.replace(importing_path, f"{path}.imported")
+    logger.info(f"已从 {path} 导入 {imported} 条 LLM 调用记录")
+    return imported
+
+
+# -----------------------------------------------------------------------------------------
+# 聚合
+
+
+class _Accumulator:
+    """一个 (时间桶, 分组) 的聚合状态"""
+
+    __slots__ = ("count", "errors", "ok", "total", "min", "max", "bins")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.ok = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.bins = {}  # latency_bin -> [计数, 最小值, 最大值]
+
+    def add(self, k, completed, count, total, low, high):
+        self.count += count
+        if not completed:
+            self.errors += count
+            return
+        self.ok += count
+        self.total += total
+        self._add_bin(k, count, low, high)
+
+    def _add_bin(self, k, count, low, high):
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        b = self.bins.get(k)
+        if b is None:
+            self.bins[k] = [count, low, high]
+        else:
+            b[0] += count
+            b[1] = min(b[1], low)
+            b[2] = max(b[2], high)
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.ok += other.ok
+        self.total += other.total
+        for k, (count, low, high) in other.bins.items():
+            self._add_bin(k, count, low, high)
+
+    def percentile(self, q):
+        """q 分位数 (0-100)，与 numpy 默认的线性插值定义一致 (桶内近似)"""
+        if not self.ok:
+            return None
+        rank = q / 100 * (self.ok - 1)
+        seen = 0
+        for k in sorted(self.bins):
+            count, low, high = self.bins[k]
+            if rank < seen + count:
+                if count == 1:
+                    return low
+                return low + (high - low) * (rank - seen) / (count - 1)
+            seen += count
+        return self.max
+
+    def to_dict(self, seconds):
+        result = {
+            "count": self.count,
+            "errors": self.errors,
+            "error_rate": self.errors / self.count if self.count else 0.0,
+            "throughput_per_min": self.count * 60 / seconds if seconds else None,
+            "avg": self.total / self.ok if self.ok else None,
+            "min": self.min,
+            "max": self.max,
+        }
+        for q in PERCENTILES:
+            result[f"p{q}"] = self.percentile(q)
+        return result
+
+    def histogram(self):
+        return [
+            {
+                "bin": k,
+                "lower": latency_bin_bounds(k)[0],
+                "upper": latency_bin_bounds(k)[1],
+                "count": self.bins[k][0],
+            }
+            for k in sorted(self.bins)
+        ]
+
+
+def _aggregate(start, end, step, group_by, client_id, model):
+    """
+    一次 GROUP BY 查询，返回 {(时间桶, 分组值元组): _Accumulator}。
+    step 为 None 时整个窗口是一个时间桶 (编号 0)。
+    """
+    group_names = GROUP_COLUMNS.get(group_by, ())
+    group_cols = [getattr(LlmUsageSample, name) for name in group_names]
+    key_cols = list(group_cols)
+    if step:
+        bucket = cast((LlmUsageSample.started_at - start) / step, Integer)
+        key_cols.insert(0, bucket.label("bucket"))
+    stmt = select(
+        *key_cols,
+        LlmUsageSample.latency_bin,
+        LlmUsageSample.completed,
+        func.count(),
+        func.sum(LlmUsageSample.usage_time),
+        func.min(LlmUsageSample.usage_time),
+        func.max(LlmUsageSample.usage_time),
+    ).where(LlmUsageSample.started_at >= start, LlmUsageSample.started_at < end)
+    if client_id:
+        stmt = stmt.where(LlmUsageSample.client_id == client_id)
+    if model:
+        stmt = stmt.where(LlmUsageSample.model == model)
+    stmt = stmt.group_by(
+        *key_cols, LlmUsageSample.latency_bin, LlmUsageSample.completed
+    )
+
+    groups = {}
+    n = len(key_cols)
+    for row in db.session.execute(stmt):
+        keys = tuple(row[:n])
+        key = (keys[0], keys[1:]) if step else (0, keys)
+        acc = groups.get(key)
+        if acc is None:
+            acc = groups[key] = _Accumulator()
+        k, completed, count, total, low, high = row[n:]
+        acc.add(k, completed, count, total or 0.0, low, high)
+    return groups, group_names
+
+
+def get_usage_summary(start, end, group_by=None, client_id=None, model=None):
+    """
+    汇总时间窗口内的调用耗时、吞吐和错误率。
+
+    参数:
+        start (float): 窗口起点 (Unix 秒，含)。
+        end (float): 窗口终点 (Unix 秒，不含)。
+        group_by (str, optional): 分组维度 client / model / client_model，None 表示只汇总整体。
+        client_id (str, optional): 只统计该客户端。
+        model (str, optional): 只统计该模型。
+
+    返回:
+        dict: {"overall": 统计, "groups": [分组统计], "histogram": [耗时分桶计数]}，
+              统计包含 count、errors、error_rate、throughput_per_min、avg、min、max、p50、p95、p99；
+              失败返回 None。
+    """
+    try:
+        groups, group_names = _aggregate(start, end, None, group_by, client_id, model)
+        seconds = end - start
+        overall = _Accumulator()
+        items = []
+        for (_, keys), acc in groups.items():
+            overall.merge(acc)
+            if group_names:
+                item = dict(zip(group_names, keys))
+                item.update(acc.to_dict(seconds))
+                items.append(item)
+        items.sort(key=lambda item: -item["count"])
+        return {
+            "overall": overall.to_dict(seconds),
+            "groups": items,
+            "histogram": overall.histogram(),
+        }
+    except Exception as e:
+        logger.error(f"汇总 LLM 调用记录失败: {e}", exc_info=True)
+        return None
+
+
+def get_usage_timeseries(
+    start, end, step=None, group_by=None, client_id=None, model=None
+):
+    """
+    按时间桶降采样的调用统计。
+
+    参数:
+        start (float): 窗口起点 (Unix 秒)，会向下对齐到步长的整数倍。
+        end (float): 窗口终点 (Unix 秒，不含)。
+        step (int, optional): 时间桶长度 (秒)，默认由 choose_step 按窗口长度选取。
+        group_by (str, optional): 分组维度 client / model / client_model，None 表示只有一条整体序列。
+        client_id (str, optional): 只统计该客户端。
+        model (str, optional): 只统计该模型。
+
+    返回:
+        dict: {"start", "end", "step", "series": [{分组列..., "points": [{"t": 桶起点, 统计...}]}]}，
+              没有调用的时间桶不出现在 points 中；失败返回 None。
+    """
+    try:
+        step = int(step or choose_step(end - start))
+        start = math.floor(start / step) * step
+        groups, group_names = _aggregate(start, end, step, group_by, client_id, model)
+        series = {}
+        for (bucket, keys), acc in groups.items():
+            point = {"t": start + bucket * step}
+            point.update(acc.to_dict(step))
+            series.setdefault(keys, []).append(point)
+        items = []
+        for keys in sorted(series, key=lambda keys: tuple(map(str, keys))):
+            item = dict(zip(group_names, keys))
+            item["points"] = sorted(series[keys], key=lambda point: point["t"])
+            items.append(item)
+        return {"start": start, "end": end, "step": step, "series": items}
+    except Exception as e:
+        logger.error(f"按时间聚合 LLM 调用记录失败: {e}", exc_info=True)
+        return None
+
+
+def get_recent_usage_samples(limit=1000):
+    """
+    最近的调用记录 (按开始时间升序) 及记录总数。
+
+    返回:
+        tuple: (记录字典列表, 总数)，失败返回 ([], 0)。
+    """
+    try:
+        rows = db.session.scalars(
+            select(LlmUsageSample)
+            .order_by(LlmUsageSample.started_at.desc())
+            .limit(limit)
+        ).all()
+        total = db.session.scalar(select(func.count()).select_from(LlmUsageSample))
+        return [row.to_dict() for row in reversed(rows)], total or 0
+    except Exception as e:
+        logger.error(f"获取 LLM 调用记录失败: {e}", exc_info=True)
+        return [], 0
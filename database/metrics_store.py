@@ -0,0 +1,163 @@
+"""
+这个模块保存各进程监控指标的快照 (metric_snapshots 表)，并提供 /metrics 在抓取时
+直接从数据库统计的指标。
+
+gunicorn 的每个工作者 (以及独立的对战工作进程) 只在内存中累计自己的指标，
+定期把快照写入自己的一行 (见 services/metrics.py)；/metrics 无论落在哪个进程上，
+都合并所有行输出。已退出进程的行由存活的进程合并到 "retired" 行后删除，
+计数不会因为工作者重启 (max_requests) 而回退。
+"""
+
+import json
+import logging
+from datetime import datetime
+from sqlalchemy import delete, func, select
+from .models import Battle, MetricSnapshot
+from .action import safe_commit
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+# 已退出进程的计数合并到这一行
+RETIRED_WORKER_ID = "retired"
+ACTIVE_BATTLE_STATUSES = ("waiting", "playing")
+
+
+def save_metric_snapshot(worker_id, payload):
+    """
+    写入 (覆盖) 进程的指标快照。
+
+    参数:
+        worker_id (str): 进程标识
+        payload (dict): 指标快照 (需可 JSON 序列化)
+
+    返回:
+        str: "created" (新建了该进程的行，包括快照已被合并到 retired 行的情况) 或
+             "updated"，失败返回 None
+    """
+    try:
+        snapshot = db.session.get(MetricSnapshot, worker_id, populate_existing=True)
+        result = "updated"
+        if snapshot is None:
+            snapshot = MetricSnapshot(worker_id=worker_id)
+            db.session.add(snapshot)
+            result = "created"
+        snapshot.payload = json.dumps(payload)
+        snapshot.updated_at = datetime.now()
+        if not safe_commit():
+            return None
+        return result
+    except Exception as e:
+        logger.error(f"写入进程 {worker_id} 的指标快照失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def load_metric_snapshots():
+    """
+    读取所有进程的指标快照。
+
+    返回:
+        list: [{"worker_id", "payload" (dict), "updated_at" (datetime)}, ...]，出错返回空列表
+    """
+    try:
+        rows = db.session.execute(
+            select(
+                MetricSnapshot.worker_id,
+                MetricSnapshot.payload,
+                MetricSnapshot.updated_at,
+            )
+        ).all()
+        snapshots = []
+        for worker_id, payload, updated_at in rows:
+            try:
+                data = json.loads(payload) if payload else {}
+            except (TypeError, json.JSONDecodeError):
+                data = {}
+            snapshots.append(
+                {"worker_id": worker_id, "payload": data, "updated_at": updated_at}
+            )
+        return snapshots
+    except Exception as e:
+        logger.error(f"读取指标快照失败: {e}", exc_info=True)
+        db.session.rollback()
+        return []
+
+
+def retire_metric_snapshots(stale_before, merge):
+    """
+    把 stale_before 之后没有更新过的进程快照合并到 "retired" 行并删除。
+
+    删除带上读取时的 updated_at 条件，多个进程同时执行时每行只会被合并一次；
+    进程在此期间又写入了快照则跳过。
+
+    参数:
+        stale_before (datetime): 早于该时间的快照视为进程已退出
+        merge (callable): merge(retired, stale) 返回合并后的快照 (dict)
+
+    返回:
+        int: 合并的快照数，出错返回 0
+    """
+    try:
+        stale = db.session.execute(
+            select(
+                MetricSnapshot.worker_id,
+                MetricSnapshot.payload,
+                MetricSnapshot.updated_at,
+            ).where(
+                MetricSnapshot.updated_at < stale_before,
+                MetricSnapshot.worker_id != RETIRED_WORKER_ID,
+            )
+        ).all()
+        if not stale:
+            db.session.rollback()  # 结束只读事务
+            return 0
+
+        retired_count = 0
+        for worker_id, payload, updated_at in stale:
+            deleted = db.session.execute(
+                delete(MetricSnapshot).where(
+                    MetricSnapshot.worker_id == worker_id,
+                    MetricSnapshot.updated_at == updated_at,
+                )
+            ).rowcount
+            if deleted != 1:
+                continue
+            retired = db.session.get(
+                MetricSnapshot, RETIRED_WORKER_ID, populate_existing=True
+            )
+            if retired is None:
+                retired = MetricSnapshot(worker_id=RETIRED_WORKER_ID, payload="{}")
+                db.session.add(retired)
+            retired.payload = json.dumps(
+                merge(json.loads(retired.payload or "{}"), json.loads(payload or "{}"))
+            )
+            retired.updated_at = datetime.now()
+            retired_count += 1
+        if not safe_commit():
+            return 0
+        return retired_count
+    except Exception as e:
+        logger.error(f"合并已退出进程的指标快照失败: {e}", exc_info=True)
+        db.session.rollback()
+        return 0
+
+
+def get_active_battle_counts():
+    """
+    按榜单统计等待中和进行中的对战数。
+
+    返回:
+        list: [(ranking_id, status, 对战数), ...]，出错返回空列表
+    """
+    try:
+        rows = db.session.execute(
+            select(Battle.ranking_id, Battle.status, func.count(Battle.id))
+            .where(Battle.status.in_(ACTIVE_BATTLE_STATUSES))
+            .group_by(Battle.ranking_id, Battle.status)
+        ).all()
+        return [tuple(row) for row in rows]
+    except Exception as e:
+        logger.error(f"统计进行中的对战失败: {e}", exc_info=True)
+        db.session.rollback()
+        return []
@@ -8,7 +8,9 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 from .base import db, login_manager
 from datetime import datetime
+import json
 import uuid
+import zlib
 
 
 # 工具函数
@@ -104,6 +106,18 @@ class AICode(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     version = db.Column(db.Integer, default=1)
+    # 上传时的校验 (见 game/code_validator.py): pending / valid / invalid，
+    # 引入校验之前上传的代码为 NULL，视为可用
+    validation_status = db.Column(db.String(20), nullable=True)
+    validation_error = db.Column(db.Text, nullable=True)
+    validated_at = db.Column(db.DateTime, nullable=True)
+    code_hash = db.Column(db.String(64), nullable=True)  # 源码 sha256
+
+    __table_args__ = (
+        # 按用户查找激活AI (参与者解析、激活切换)
+        db.Index("idx_aicodes_user_active", user_id, is_active),
+    )
+
     # 关系:
     # user: 哪个用户拥有这个AI (backref="user" 在 User 模型中定义)
     # battle_players: 哪些 BattlePlayer 记录使用了这个AI (一对多 AICode -> BattlePlayer)
@@ -115,6 +129,11 @@ class AICode(db.Model):
         # 添加AI ID到 repr
         return f"<AICode {self.id}: {self.name} by User {self.user_id}>"
 
+    @property
+    def is_schedulable(self):
+        """是否可以参加自动对战 (校验通过或上传于引入校验之前)"""
+        return self.validation_status in (None, "valid")
+
     def to_dict(self):
         """将 AI 代码信息转换为字典"""
         return {
@@ -126,6 +145,11 @@ class AICode(db.Model):
             "is_active": self.is_active,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "version": self.version,
+            "validation_status": self.validation_status,
+            "validation_error": self.validation_error,
+            "validated_at": (
+                self.validated_at.isoformat() if self.validated_at else None
+            ),
         }
 
 
@@ -209,19 +233,40 @@ class Battle(db.Model):
     battle_type = db.Column(
         db.String(50), nullable=True
     )  # 例如 "standard", "ai_series_test"
+    # 分析列: 对战结束时由结果派生 (见 battle_summary.py)，用于分组统计
+    winner = db.Column(db.String(10), nullable=True)  # "red" / "blue"，未分胜负为 None
+    win_reason = db.Column(db.String(64), nullable=True)
     # 关系:
     # players: 参与这场对战的所有 BattlePlayer 记录 (一对多 Battle -> BattlePlayer)
     # cascade="all, delete-orphan": 当删除一个 Battle 时，相关的 BattlePlayer 记录也会被删除
     players = db.relationship(
         "BattlePlayer", backref="battle", lazy="dynamic", cascade="all, delete-orphan"
     )
+    # queue_job: 该对战在持久化队列中的任务 (一对一 Battle -> BattleJob)
+    queue_job = db.relationship(
+        "BattleJob",
+        backref="battle",
+        uselist=False,
+        cascade="all, delete-orphan",
+    )
+    # summary: 对战结束时写入的结果摘要 (一对一 Battle -> BattleSummary)
+    summary = db.relationship(
+        "BattleSummary",
+        backref="battle",
+        uselist=False,
+        cascade="all, delete-orphan",
+    )
 
     __table_args__ = (
         db.Index("idx_battles_status", status),
         db.Index("idx_battles_ranking", ranking_id),
-        db.Index("idx_battles_created_at", created_at.desc()),
+        # 按创建时间翻页 (keyset: created_at, id)，见 battle_list.py
+        db.Index("idx_battles_created_id", created_at, id),
+        db.Index("idx_battles_status_created", status, created_at, id),
         db.Index("idx_battles_ended_at", ended_at.desc()),
         db.Index("idx_battles_type", battle_type),
+        # 按榜单统计胜方与胜因
+        db.Index("idx_battles_ranking_winner", ranking_id, status, winner, win_reason),
     )
 
     def __repr__(self):
@@ -258,6 +303,93 @@ class Battle(db.Model):
         return self.players.filter_by(user_id=user_id).first()
 
 
+class BattleSummary(db.Model):
+    """
+    对战结果摘要：对战进入 completed / error / cancelled 时由 Battle.results 派生一次
+    (见 battle_summary.py)，对战详情页和列表直接读取，不再解析结果 JSON 或读取公共日志。
+    """
+
+    __tablename__ = "battle_summaries"
+
+    battle_id = db.Column(db.String(36), db.ForeignKey("battles.id"), primary_key=True)
+    status = db.Column(db.String(20), nullable=False)
+    winner = db.Column(db.String(10), nullable=True)  # "red" / "blue"，未分胜负为 None
+    win_reason = db.Column(db.String(64), nullable=True)
+    blue_wins = db.Column(db.Integer, nullable=False, default=0)
+    red_wins = db.Column(db.Integer, nullable=False, default=0)
+    rounds_played = db.Column(db.Integer, nullable=False, default=0)
+    # 各轮任务结果，按轮次排列: "S" 成功 / "F" 失败，如 "SFSS"
+    mission_results = db.Column(db.String(16), nullable=False, default="")
+    # 各玩家角色，按 player_id 1-7 排列，逗号分隔
+    roles = db.Column(db.String(160), nullable=False, default="")
+    # 刺杀阶段 (蓝方完成三次任务时才有)
+    assassin_pid = db.Column(db.Integer, nullable=True)
+    assassination_target = db.Column(db.Integer, nullable=True)
+    assassination_success = db.Column(db.Boolean, nullable=True)
+    # 对局错误 (error 为对局级错误信息，其余为报错玩家)
+    error = db.Column(db.Text, nullable=True)
+    error_type = db.Column(db.String(32), nullable=True)
+    error_pid = db.Column(db.Integer, nullable=True)
+    error_user_id = db.Column(db.String(36), nullable=True)
+    error_method = db.Column(db.String(64), nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    traceback = db.Column(db.Text, nullable=True)
+    cancellation_reason = db.Column(db.Text, nullable=True)
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    duration_seconds = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (
+        # 查询某玩家代码报错的对战
+        db.Index("idx_battle_summaries_error_user", error_user_id),
+        db.Index("idx_battle_summaries_winner", winner, win_reason),
+    )
+
+    def __repr__(self):
+        return f"<BattleSummary {self.battle_id}: {self.status} {self.winner}>"
+
+    def get_roles(self):
+        """角色字典 {player_id: 角色}"""
+        return {
+            pid: role for pid, role in enumerate(self.roles.split(","), start=1) if role
+        }
+
+    def to_dict(self):
+        """将结果摘要转换为字典"""
+        data = {
+            "battle_id": self.battle_id,
+            "status": self.status,
+            "winner": self.winner,
+            "win_reason": self.win_reason,
+            "blue_wins": self.blue_wins,
+            "red_wins": self.red_wins,
+            "rounds_played": self.rounds_played,
+            "mission_results": [r == "S" for r in self.mission_results],
+            "roles": self.get_roles(),
+            "assassination": None,
+            "error": self.error,
+            "player_error": None,
+            "cancellation_reason": self.cancellation_reason,
+            "tokens": {"input": self.input_tokens, "output": self.output_tokens},
+            "duration_seconds": self.duration_seconds,
+        }
+        if self.assassin_pid is not None:
+            data["assassination"] = {
+                "assassin": self.assassin_pid,
+                "target": self.assassination_target,
+                "success": self.assassination_success,
+            }
+        if self.error_type is not None:
+            data["player_error"] = {
+                "type": self.error_type,
+                "pid": self.error_pid,
+                "user_id": self.error_user_id,
+                "method": self.error_method,
+                "message": self.error_message,
+            }
+        return data
+
+
 # 对战参与者模型 (直接挂载在 Battle 下)
 class BattlePlayer(db.Model):
     __tablename__ = "battle_players"
@@ -293,6 +425,10 @@ class BattlePlayer(db.Model):
     # 使用这个字段来表示每个玩家在该对战中的胜负平状态
     outcome = db.Column(db.String(20), nullable=True)
 
+    # 分析列: 对战结束时由结果派生 (见 battle_summary.py)，用于分组统计
+    role = db.Column(db.String(20), nullable=True)  # Merlin, Assassin 等
+    team = db.Column(db.String(10), nullable=True)  # "red" / "blue"
+
     # 玩家在此对战开始前的 Elo 分数快照
     initial_elo = db.Column(db.Integer, nullable=False, default=1200)  # 设置默认值
     elo_change = db.Column(db.Integer, nullable=False, default=0)  # 设置默认值
@@ -302,6 +438,8 @@ class BattlePlayer(db.Model):
 
     # 记录加入对战的时间 (如果需要区分何时“加入”对战列表 vs 对战实际开始)
     join_time = db.Column(db.DateTime, default=datetime.now)
+    # 所属对战的创建时间 (冗余自 Battle.created_at)，用户对战历史按 (该列, battle_id) 翻页
+    battle_created_at = db.Column(db.DateTime, nullable=True)
 
     __table_args__ = (
         # 优化胜负查询
@@ -312,6 +450,14 @@ class BattlePlayer(db.Model):
         db.Index("idx_battleplayer_battle_user", battle_id, user_id),
         # 优化按位置查询
         db.Index("idx_battleplayer_position", battle_id, position),
+        # 按角色/阵营统计玩家或 AI 的胜负
+        db.Index("idx_battleplayer_user_role", user_id, role, outcome),
+        db.Index("idx_battleplayer_ai_role", selected_ai_code_id, role, outcome),
+        db.Index("idx_battleplayer_role_position", role, position, outcome),
+        # 用户对战历史翻页
+        db.Index(
+            "idx_battleplayer_user_created", user_id, battle_created_at, battle_id
+        ),
     )
 
     def to_dict(self):
@@ -326,6 +472,8 @@ class BattlePlayer(db.Model):
             "selected_ai_code_id": self.selected_ai_code_id,
             "position": self.position,
             "outcome": self.outcome,
+            "role": self.role,
+            "team": self.team,
             "initial_elo": self.initial_elo,
             "elo_change": self.elo_change,
             "join_time": (
@@ -347,6 +495,432 @@ class BattlePlayer(db.Model):
         return f"<BattlePlayer {self.id} for User {user_info} in Battle {battle_info} Outcome: {self.outcome}>"
 
 
+# 冷数据: 已归档的对战 (见 archive.py)
+class ArchivedBattle(db.Model):
+    """
+    超过 BATTLE_ARCHIVE_AFTER_DAYS 的已结束对战从 battles 移到这里，列与 Battle 相同，
+    结果 JSON 以 zlib 压缩存储。保留对战ID、榜单、时间和胜负，作为旧链接和回放的存根。
+    """
+
+    __tablename__ = "battles_archive"
+
+    id = db.Column(db.String(36), primary_key=True)
+    status = db.Column(db.String(20), nullable=True)
+    ranking_id = db.Column(db.Integer, nullable=False, default=0)
+    game_log_uuid = db.Column(db.String(36), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    ended_at = db.Column(db.DateTime, nullable=True)
+    results_z = db.Column(db.LargeBinary, nullable=True)  # zlib 压缩的 results
+    is_elo_exempt = db.Column(db.Boolean, default=False, nullable=False)
+    battle_type = db.Column(db.String(50), nullable=True)
+    winner = db.Column(db.String(10), nullable=True)
+    win_reason = db.Column(db.String(64), nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # 按榜单重放评分与分组统计
+        db.Index("idx_battles_archive_ranking_ended", ranking_id, ended_at),
+        db.Index("idx_battles_archive_created_id", created_at, id),
+    )
+
+    @property
+    def results(self):
+        """解压后的结果 JSON 字符串"""
+        return zlib.decompress(self.results_z).decode() if self.results_z else None
+
+    def __repr__(self):
+        return f"<ArchivedBattle {self.id} - Status: {self.status}>"
+
+
+class ArchivedBattlePlayer(db.Model):
+    """
+    已归档对战的参与者，列与 BattlePlayer 相同。
+    battle_id / user_id 不设外键，与 RatingLedger 一样只作为历史记录保留。
+    """
+
+    __tablename__ = "battle_players_archive"
+
+    id = db.Column(db.String(36), primary_key=True)
+    battle_id = db.Column(db.String(36), nullable=False)
+    user_id = db.Column(db.String(36), nullable=False)
+    selected_ai_code_id = db.Column(db.String(36), nullable=True)
+    position = db.Column(db.Integer, nullable=True)
+    outcome = db.Column(db.String(20), nullable=True)
+    role = db.Column(db.String(20), nullable=True)
+    team = db.Column(db.String(10), nullable=True)
+    initial_elo = db.Column(db.Integer, nullable=False, default=1200)
+    elo_change = db.Column(db.Integer, nullable=True)
+    join_time = db.Column(db.DateTime, nullable=True)
+    battle_created_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("idx_battleplayer_archive_battle", battle_id, position),
+        db.Index(
+            "idx_battleplayer_archive_user_created",
+            user_id,
+            battle_created_at,
+            battle_id,
+        ),
+    )
+
+    def __repr__(self):
+        return f"<ArchivedBattlePlayer {self.user_id} in Battle {self.battle_id}>"
+
+
+# 持久化对战队列任务 (替代 BattleManager 的内存队列，进程重启后不丢失)
+class BattleJob(db.Model):
+    __tablename__ = "battle_jobs"
+
+    id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
+    # 每场对战最多对应一个队列任务
+    battle_id = db.Column(
+        db.String(36), db.ForeignKey("battles.id"), nullable=False, unique=True
+    )
+    # queued: 等待领取, leased: 已被某个工作线程租用, done: 已确认完成,
+    # failed: 多次尝试仍失败, cancelled: 执行前被取消
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    # 参与者数据 (JSON)，即 start_battle 补全 position 后的 participant_data
+    payload = db.Column(db.Text, nullable=False)
+
+    # 租约信息
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    lease_owner = db.Column(db.String(128), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    # 时间戳
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        # 优化按入队顺序领取任务
+        db.Index("idx_battlejobs_status_created", status, created_at),
+        # 优化查找租约过期的任务
+        db.Index("idx_battlejobs_status_lease", status, lease_expires_at),
+    )
+
+    def to_dict(self):
+        """将队列任务转换为字典"""
+        try:
+            participant_data = json.loads(self.payload) if self.payload else []
+        except (TypeError, json.JSONDecodeError):
+            participant_data = []
+        return {
+            "id": self.id,
+            "battle_id": self.battle_id,
+            "status": self.status,
+            "participant_data": participant_data,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "lease_owner": self.lease_owner,
+            "lease_expires_at": (
+                self.lease_expires_at.isoformat() if self.lease_expires_at else None
+            ),
+            "heartbeat_at": (
+                self.heartbeat_at.isoformat() if self.heartbeat_at else None
+            ),
+            "last_error": self.last_error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+    def __repr__(self):
+        return f"<BattleJob {self.id} for Battle {self.battle_id}: {self.status}>"
+
+
+class BattleTrace(db.Model):
+    """
+    对战调用追踪的设置 (见 game/decorator.py)。对战可能在任意进程中执行，
+    管理员的开关和导出请求写在这里，由执行对战的进程同步。
+    """
+
+    __tablename__ = "battle_traces"
+
+    # 对战可能已归档，不设外键
+    battle_id = db.Column(db.String(36), primary_key=True)
+    sample_rate = db.Column(db.Float, nullable=False, default=0.0)  # 0 为关闭
+    dump_requested_at = db.Column(db.DateTime, nullable=True)
+    dumped_at = db.Column(db.DateTime, nullable=True)
+    dump_path = db.Column(db.String(255), nullable=True)
+    dump_records = db.Column(db.Integer, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    @property
+    def dump_pending(self):
+        """是否有尚未完成的导出请求"""
+        return self.dump_requested_at is not None and (
+            self.dumped_at is None or self.dumped_at < self.dump_requested_at
+        )
+
+    def to_dict(self):
+        """将追踪设置转换为字典"""
+        return {
+            "battle_id": self.battle_id,
+            "sample_rate": self.sample_rate,
+            "dump_requested_at": (
+                self.dump_requested_at.isoformat() if self.dump_requested_at else None
+            ),
+            "dump_pending": self.dump_pending,
+            "dumped_at": self.dumped_at.isoformat() if self.dumped_at else None,
+            "dump_path": self.dump_path,
+            "dump_records": self.dump_records,
+        }
+
+    def __repr__(self):
+        return f"<BattleTrace {self.battle_id}: {self.sample_rate}>"
+
+
+class ServiceLease(db.Model):
+    """
+    多个进程中只应由一个执行的维护任务 (启动时恢复对战队列、归档等) 的租约，
+    见 service_lease.py。
+    """
+
+    __tablename__ = "service_leases"
+
+    name = db.Column(db.String(64), primary_key=True)  # 维护任务名
+    owner = db.Column(db.String(128), nullable=True)  # 持有租约的进程
+    expires_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f"<ServiceLease {self.name}: {self.owner} until {self.expires_at}>"
+
+
+class AdminJob(db.Model):
+    """
+    管理后台的后台任务 (晋级、重置榜单、终止 / 删除对局等)，见 admin_job_queue.py。
+    任务按 kind 找到注册的处理函数，以 params (JSON) 为关键字参数执行。
+    """
+
+    __tablename__ = "admin_jobs"
+
+    id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
+    kind = db.Column(db.String(64), nullable=False)  # 处理函数的注册名
+    name = db.Column(db.String(128), nullable=False)  # 显示给管理员的名称
+    params = db.Column(db.Text, nullable=False, default="{}")
+    # queued: 等待执行, running: 执行中, done: 已完成, failed: 出错或工作进程中断,
+    # cancelled: 已取消
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # 完成百分比
+    message = db.Column(db.String(255), nullable=True)  # 当前进度说明
+    result = db.Column(db.Text, nullable=True)  # 任务结果 (JSON)
+    error = db.Column(db.Text, nullable=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_by = db.Column(db.String(36), nullable=True)  # 提交任务的管理员ID
+
+    # 租约信息 (执行中的任务由所在进程定期心跳续约)
+    lease_owner = db.Column(db.String(128), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+
+    # 时间戳
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # 优化按提交顺序领取任务
+        db.Index("idx_adminjobs_status_created", status, created_at),
+    )
+
+    def to_dict(self):
+        """将后台任务转换为字典"""
+        try:
+            result = json.loads(self.result) if self.result else None
+        except (TypeError, json.JSONDecodeError):
+            result = None
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "name": self.name,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "result": result,
+            "error": self.error,
+            "cancel_requested": self.cancel_requested,
+            "created_by": self.created_by,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f"<AdminJob {self.id} {self.kind}: {self.status}>"
+
+
+class MetricSnapshot(db.Model):
+    """
+    各进程监控指标的快照 (见 services/metrics.py)。每个进程定期写入自己的一行，
+    /metrics 合并所有行输出，不论请求落在哪个 gunicorn 工作者上。
+    """
+
+    __tablename__ = "metric_snapshots"
+
+    # 主机名:进程号:随机后缀；已退出进程的计数合并到 "retired" 行
+    worker_id = db.Column(db.String(128), primary_key=True)
+    payload = db.Column(db.Text, nullable=False, default="{}")  # 指标快照 (JSON)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f"<MetricSnapshot {self.worker_id}: {self.updated_at}>"
+
+
+# ELO 变动流水 (只追加)
+class RatingLedger(db.Model):
+    """
+    每场对战每位玩家一条 ELO 变动记录，由评分写线程与 GameStats 增量更新在同一事务中写入。
+    battle_id 不设外键，对战被删除后流水仍保留用于审计。
+    """
+
+    __tablename__ = "rating_ledger"
+
+    id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
+    battle_id = db.Column(db.String(36), nullable=False)
+    user_id = db.Column(db.String(36), db.ForeignKey("users.id"), nullable=False)
+    ranking_id = db.Column(db.Integer, nullable=False, default=0)
+    elo_before = db.Column(db.Integer, nullable=False)
+    elo_change = db.Column(db.Integer, nullable=False)
+    elo_after = db.Column(db.Integer, nullable=False)
+    outcome = db.Column(db.String(10), nullable=True)  # win, loss, draw
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # 同一场对战不会重复记账
+        db.UniqueConstraint("battle_id", "user_id", name="uq_ledger_battle_user"),
+        # 查询用户在某榜单的ELO历史
+        db.Index("idx_ledger_user_ranking_created", user_id, ranking_id, created_at),
+        # 按榜单回放
+        db.Index("idx_ledger_ranking_created", ranking_id, created_at),
+    )
+
+    def to_dict(self):
+        """将流水记录转换为字典"""
+        return {
+            "id": self.id,
+            "battle_id": self.battle_id,
+            "user_id": self.user_id,
+            "ranking_id": self.ranking_id,
+            "elo_before": self.elo_before,
+            "elo_change": self.elo_change,
+            "elo_after": self.elo_after,
+            "outcome": self.outcome,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+    def __repr__(self):
+        return f"<RatingLedger {self.battle_id} {self.user_id}: {self.elo_change:+d}>"
+
+
+# 数据版本计数器
+class LeaderboardEntry(db.Model):
+    """
+    物化排行榜：每个榜单按 (elo_score 降序, user_id 升序) 连续编号的名次。
+    由 GameStats 派生 (见 leaderboard.py)，user_id 不设外键，随时可以整榜重建。
+    """
+
+    __tablename__ = "leaderboard_entries"
+
+    ranking_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(36), primary_key=True)
+    position = db.Column(db.Integer, nullable=False)  # 名次，从 1 开始
+    elo_score = db.Column(db.Integer, nullable=False, default=1200)
+    games_played = db.Column(db.Integer, nullable=False, default=0)
+    wins = db.Column(db.Integer, nullable=False, default=0)
+    losses = db.Column(db.Integer, nullable=False, default=0)
+    draws = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # 按名次翻页、取附近玩家、取榜单人数 (最大名次)
+        db.Index("idx_leaderboard_ranking_position", ranking_id, position),
+        # 增量维护时统计新旧 ELO 之间的玩家
+        db.Index("idx_leaderboard_ranking_elo", ranking_id, elo_score, user_id),
+    )
+
+    def __repr__(self):
+        return f"<LeaderboardEntry {self.ranking_id}#{self.position}: {self.user_id}>"
+
+    def to_dict(self):
+        """将榜单条目转换为字典"""
+        return {
+            "ranking_id": self.ranking_id,
+            "user_id": self.user_id,
+            "rank": self.position,
+            "elo_score": self.elo_score,
+            "games_played": self.games_played,
+            "wins": self.wins,
+            "losses": self.losses,
+            "draws": self.draws,
+        }
+
+
+class LlmUsageSample(db.Model):
+    """
+    LLM 客户端的单次调用记录 (时间序列)，由 ClientManager 释放客户端时产生。
+    latency_bin 是耗时所在的对数分桶 (见 llm_usage.py)，聚合时按桶计数即可估算分位数。
+    """
+
+    __tablename__ = "llm_usage_samples"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    started_at = db.Column(db.Float, nullable=False)  # 调用开始时间 (Unix 秒)
+    client_id = db.Column(db.String(64), nullable=False)
+    model = db.Column(db.String(128), nullable=False, default="")
+    session_id = db.Column(db.String(64), nullable=True)
+    usage_time = db.Column(db.Float, nullable=False)  # 耗时 (秒)
+    latency_bin = db.Column(db.SmallInteger, nullable=False)
+    # False: 超时被强制回收、进程退出时未释放或调用出错
+    completed = db.Column(db.Boolean, nullable=False, default=True)
+    reason = db.Column(db.String(32), nullable=True)  # 未完成的原因或出错的异常类型名
+
+    __table_args__ = (
+        # 按时间窗口聚合: 覆盖索引，聚合查询不需要回表
+        db.Index(
+            "idx_llm_usage_started_client",
+            started_at,
+            client_id,
+            model,
+            latency_bin,
+            completed,
+            usage_time,
+        ),
+    )
+
+    def __repr__(self):
+        return f"<LlmUsageSample {self.client_id} {self.usage_time:.3f}s>"
+
+    def to_dict(self):
+        """转换为与 client_usage_times.json 相同格式的字典"""
+        return {
+            "client_id": self.client_id,
+            "session_id": self.session_id,
+            "model": self.model,
+            "start_time": self.started_at,
+            "end_time": self.started_at + self.usage_time,
+            "usage_time": self.usage_time,
+            "completed": self.completed,
+            "reason": self.reason,
+        }
+
+
+class DataVersion(db.Model):
+    """
+    跨进程共享的数据版本号。写入相关数据的事务内递增，
+    读取方比较版本号即可判断缓存是否过期 (见 data_version.py)。
+    """
+
+    __tablename__ = "data_versions"
+
+    key = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f"<DataVersion {self.key}: {self.version}>"
+
+
 # 用户加载函数 (用于 Flask-Login)
 @login_manager.user_loader
 def load_user(user_id):
@@ -1,17 +1,57 @@
 """
 这个模块用于处理晋级功能，将一个榜单的前50%玩家晋级到另一个榜单。
+
+晋级和重置都是集合操作，不逐个加载 GameStats 对象:
+- 选出前 N 名: 一次计数 + 一次 ORDER BY ... LIMIT N
+- 晋级: 目标榜单已有记录的玩家一条 UPDATE，其余玩家分块批量 INSERT
+- 清空榜单 / 重置战绩: 一条 DELETE / UPDATE
+这些语句不经过 ORM 对象，需要显式使物化排行榜过期 (mark_leaderboard_stale)；
+增删榜单成员时还要递增参与者版本，自动对战才会重新读取参与者列表。
+耗时较长的批量操作由管理后台放到后台任务中执行 (见 services/admin_jobs.py)，
+progress(已完成, 总数, 说明) 回调用于报告进度。
 """
 
 import logging
-from sqlalchemy import desc
-from .models import GameStats, User
-from .action import safe_delete
+from sqlalchemy import delete, desc, func, insert, select, update
+from .models import GameStats, generate_uuid
+from .leaderboard import mark_leaderboard_stale
+from .data_version import ACTIVE_PARTICIPANTS, bump_data_version
 from .base import db
 import math
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_NEW_ELO = 1200
+PROMOTION_CHUNK_SIZE = 500  # 每条 UPDATE / 批量 INSERT 处理的玩家数
+
+
+def _report(progress, done, total, message=None):
+    if progress is not None:
+        progress(done, total, message)
+
+
+def _top_players_query(source_ranking_id):
+    """榜单中至少赢过一场的玩家，按 ELO、胜率降序"""
+    return (
+        select(GameStats)
+        .where(GameStats.ranking_id == source_ranking_id, GameStats.wins > 0)
+        .order_by(
+            desc(GameStats.elo_score),
+            desc(GameStats.wins / (GameStats.games_played - GameStats.draws)),
+        )
+    )
+
+
+def _top_count(source_ranking_id, percentage):
+    """(需要选择的玩家数, 有效玩家总数)"""
+    total_players = db.session.scalar(
+        select(func.count())
+        .select_from(GameStats)
+        .where(GameStats.ranking_id == source_ranking_id, GameStats.wins > 0)
+    )
+    if not total_players:
+        return 0, 0
+    return max(1, math.ceil(total_players * percentage)), total_players
 
 
 def get_top_players_from_ranking(source_ranking_id, percentage=0.5):
@@ -26,25 +66,15 @@ def get_top_players_from_ranking(source_ranking_id, percentage=0.5):
         list: 符合条件的GameStats对象列表，包含用户ID和ELO分数
     """
     try:
-        # 从指定榜单中获取所有有效用户的游戏统计数据（按ELO降序排列）
-        all_stats = (
-            GameStats.query.filter_by(ranking_id=source_ranking_id)
-            .filter(GameStats.wins > 0)  # 确保只选择至少参与过一场比赛的玩家
-            .order_by(
-                desc(GameStats.elo_score),
-                desc(GameStats.wins / (GameStats.games_played - GameStats.draws)),
-            )
-            .all()
-        )
-
-        # 计算需要选择的玩家数量
-        total_players = len(all_stats)
+        players_to_select, total_players = _top_count(source_ranking_id, percentage)
         if total_players == 0:
             logger.warning(f"榜单 {source_ranking_id} 没有有效玩家数据")
             return []
 
-        players_to_select = max(1, math.ceil(total_players * percentage))
-        top_players = all_stats[:players_to_select]
+        # 只加载前 N 名
+        top_players = db.session.scalars(
+            _top_players_query(source_ranking_id).limit(players_to_select)
+        ).all()
 
         logger.info(
             f"从榜单 {source_ranking_id} 中选择了 {len(top_players)}/{total_players} 名顶尖玩家 (前 {percentage*100:.1f}%)"
@@ -58,109 +88,187 @@ def get_top_players_from_ranking(source_ranking_id, percentage=0.5):
         return []
 
 
+def get_top_player_ids_from_ranking(source_ranking_id, percentage=0.5):
+    """
+    同 get_top_players_from_ranking，但只返回用户ID (不加载 GameStats 对象)。
+
+    返回:
+        list: 用户ID列表，按排名先后；出错或没有有效玩家返回空列表。
+    """
+    try:
+        players_to_select, total_players = _top_count(source_ranking_id, percentage)
+        if total_players == 0:
+            logger.warning(f"榜单 {source_ranking_id} 没有有效玩家数据")
+            return []
+        query = (
+            _top_players_query(source_ranking_id)
+            .with_only_columns(GameStats.user_id)
+            .limit(players_to_select)
+        )
+        return list(db.session.scalars(query))
+    except Exception as e:
+        logger.error(
+            f"获取榜单 {source_ranking_id} 的顶尖玩家失败: {str(e)}", exc_info=True
+        )
+        return []
+
+
 def reset_ranking(ranking_id):
     """
-    清空榜单
+    清空榜单 (一条 DELETE)
     """
-    game_stats_list = GameStats.query.filter_by(ranking_id=ranking_id).all()
-    flag = True
-    for game_stats in game_stats_list:
-        if not safe_delete(game_stats):
-            flag = False
-    if flag:
-        logger.info(f"成功重置榜单 {ranking_id}.")
-    else:
-        logger.info(f"未成功重置榜单 {ranking_id}.")
-    return flag
+    try:
+        deleted = db.session.execute(
+            delete(GameStats.__table__).where(GameStats.ranking_id == ranking_id)
+        ).rowcount
+        mark_leaderboard_stale(ranking_id)
+        if deleted:
+            bump_data_version(ACTIVE_PARTICIPANTS)
+        db.session.commit()
+        logger.info(f"成功重置榜单 {ranking_id} (删除 {deleted} 条战绩).")
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"未成功重置榜单 {ranking_id}: {e}", exc_info=True)
+        return False
 
 
 def reset_stats(ranking_id):
     """
-    重置榜单中所有玩家的战绩
+    重置榜单中所有玩家的战绩 (一条 UPDATE)
     """
     try:
-        game_stats_list = GameStats.query.filter_by(ranking_id=ranking_id).all()
-        for game_stats in game_stats_list:
-            game_stats.elo_score = DEFAULT_NEW_ELO
-            game_stats.games_played = 0
-            game_stats.wins = 0
-            game_stats.losses = 0
-            game_stats.draws = 0
+        db.session.execute(
+            update(GameStats.__table__)
+            .where(GameStats.ranking_id == ranking_id)
+            .values(
+                elo_score=DEFAULT_NEW_ELO,
+                games_played=0,
+                wins=0,
+                losses=0,
+                draws=0,
+            )
+        )
+        mark_leaderboard_stale(ranking_id)
         db.session.commit()
         logger.info(f"成功重置榜单 {ranking_id}中所有玩家的战绩.")
         return True
     except Exception as e:
         db.session.rollback()
-        logger.info(f"未成功重置榜单 {ranking_id}中所有玩家的战绩.")
+        logger.error(f"未成功重置榜单 {ranking_id}中所有玩家的战绩: {e}", exc_info=True)
         return False
 
 
-def promote_players_to_ranking(players_stats, target_ranking_id):
+def reset_rankings(ranking_ids, clear=False, progress=None):
+    """
+    依次重置多个榜单 (每个榜单一个事务)，报告进度。
+
+    参数:
+        ranking_ids (iterable): 榜单ID。
+        clear (bool): True 时清空榜单 (reset_ranking)，否则只重置战绩 (reset_stats)。
+        progress (callable, optional): progress(已完成, 总数, 说明)。
+
+    返回:
+        dict: {榜单ID(str): "success" / "failure"}
+    """
+    ranking_ids = list(ranking_ids)
+    reset = reset_ranking if clear else reset_stats
+    results = {}
+    for done, ranking_id in enumerate(ranking_ids):
+        _report(progress, done, len(ranking_ids), f"正在重置榜单 {ranking_id}")
+        results[str(ranking_id)] = "success" if reset(ranking_id) else "failure"
+    _report(progress, len(ranking_ids), len(ranking_ids))
+    return results
+
+
+def promote_players_to_ranking(players_stats, target_ranking_id, progress=None):
     """
     将指定玩家列表晋级到目标榜单
 
+    目标榜单中已有记录的玩家 ELO 重置为初始值，其余玩家新建记录；
+    每 PROMOTION_CHUNK_SIZE 名玩家一条 UPDATE 和一次批量 INSERT，整体一个事务。
+
     参数:
-        players_stats (list): GameStats对象列表
+        players_stats (list): GameStats对象或用户ID列表
         target_ranking_id (int): 目标榜单ID
+        progress (callable, optional): progress(已处理, 总数, 说明)
 
     返回:
         tuple: (成功数, 总数, 错误信息)
     """
-    success_count = 0
+    user_ids = list(
+        dict.fromkeys(
+            stat if isinstance(stat, str) else stat.user_id for stat in players_stats
+        )
+    )
+    total = len(players_stats)
     errors = []
+    inserted = False
 
     try:
-        for stat in players_stats:
-            user_id = stat.user_id
-
+        for start in range(0, len(user_ids), PROMOTION_CHUNK_SIZE):
+            chunk = user_ids[start : start + PROMOTION_CHUNK_SIZE]
+            _report(progress, start, len(user_ids), f"晋级到榜单 {target_ranking_id}")
             # 检查用户在目标榜单中是否已有记录
-            existing_stat = GameStats.query.filter_by(
-                user_id=user_id, ranking_id=target_ranking_id
-            ).first()
-
-            if existing_stat:
-                # 如果已存在，更新为源榜单的ELO值
-                # 可以根据需要决定是否保留原有ELO或使用平均值等其他策略
-                existing_stat.elo_score = DEFAULT_NEW_ELO
-                db.session.add(existing_stat)
-                logger.info(
-                    f"更新用户 {user_id} 在榜单 {target_ranking_id} 的ELO为{DEFAULT_NEW_ELO}."
+            existing = set(
+                db.session.scalars(
+                    select(GameStats.user_id).where(
+                        GameStats.ranking_id == target_ranking_id,
+                        GameStats.user_id.in_(chunk),
+                    )
                 )
-            else:
-                # 如果不存在，创建新记录
-                new_stat = GameStats(
-                    user_id=user_id,
-                    ranking_id=target_ranking_id,
-                    elo_score=DEFAULT_NEW_ELO,
-                    games_played=0,  # 在新榜单中初始为0场比赛
-                    wins=0,
-                    losses=0,
-                    draws=0,
+            )
+            if existing:
+                # 如果已存在，重置为初始ELO
+                db.session.execute(
+                    update(GameStats.__table__)
+                    .where(
+                        GameStats.ranking_id == target_ranking_id,
+                        GameStats.user_id.in_(existing),
+                    )
+                    .values(elo_score=DEFAULT_NEW_ELO)
                 )
-                db.session.add(new_stat)
-                logger.info(
-                    f"将用户 {user_id} 晋级到榜单 {target_ranking_id}，初始ELO为{DEFAULT_NEW_ELO}."
+            new_ids = [user_id for user_id in chunk if user_id not in existing]
+            if new_ids:
+                # 如果不存在，创建新记录 (在新榜单中初始为0场比赛)
+                db.session.execute(
+                    insert(GameStats.__table__),
+                    [
+                        {
+                            "id": generate_uuid(),
+                            "user_id": user_id,
+                            "ranking_id": target_ranking_id,
+                            "elo_score": DEFAULT_NEW_ELO,
+                            "games_played": 0,
+                            "wins": 0,
+                            "losses": 0,
+                            "draws": 0,
+                        }
+                        for user_id in new_ids
+                    ],
                 )
-
-            success_count += 1
-
-        # 提交所有更改
+                inserted = True
+        if user_ids:
+            mark_leaderboard_stale(target_ranking_id)
+        if inserted:
+            bump_data_version(ACTIVE_PARTICIPANTS)
         db.session.commit()
+        _report(progress, len(user_ids), len(user_ids))
         logger.info(
-            f"成功将 {success_count}/{len(players_stats)} 名玩家晋级到榜单 {target_ranking_id}"
+            f"成功将 {len(user_ids)}/{total} 名玩家晋级到榜单 {target_ranking_id}，初始ELO为{DEFAULT_NEW_ELO}"
         )
+        return len(user_ids), total, errors
 
     except Exception as e:
         db.session.rollback()
         error_msg = f"晋级玩家到榜单 {target_ranking_id} 失败: {str(e)}"
         logger.error(error_msg, exc_info=True)
         errors.append(error_msg)
-
-    return success_count, len(players_stats), errors
+        return 0, total, errors
 
 
 def promote_from_multiple_rankings(
-    source_ranking_ids, target_ranking_id, percentage=0.5
+    source_ranking_ids, target_ranking_id, percentage=0.5, progress=None
 ):
     """
     将多个源榜单的前percentage玩家晋级到目标榜单
@@ -169,6 +277,7 @@ def promote_from_multiple_rankings(
         source_ranking_ids (list): 源榜单ID列表
         target_ranking_id (int): 目标榜单ID
         percentage (float): 每个榜单晋级的比例，默认0.5
+        progress (callable, optional): progress(已处理的源榜单数, 源榜单总数, 说明)
 
     返回:
         dict: 包含总结果和每个榜单的详细结果
@@ -177,12 +286,19 @@ def promote_from_multiple_rankings(
     total_players = 0
     all_errors = []
     ranking_results = {}
-
-    for ranking_id in source_ranking_ids:
+    source_ranking_ids = list(source_ranking_ids)
+
+    for done, ranking_id in enumerate(source_ranking_ids):
+        _report(
+            progress,
+            done,
+            len(source_ranking_ids),
+            f"正在从榜单 {ranking_id} 晋级到榜单 {target_ranking_id}",
+        )
         # 获取当前榜单的顶尖玩家
-        top_players = get_top_players_from_ranking(ranking_id, percentage)
+        top_player_ids = get_top_player_ids_from_ranking(ranking_id, percentage)
 
-        if not top_players:
+        if not top_player_ids:
             ranking_results[ranking_id] = {
                 "success": 0,
                 "total": 0,
@@ -193,7 +309,7 @@ def promote_from_multiple_rankings(
 
         # 晋级玩家到目标榜单
         success, total, errors = promote_players_to_ranking(
-            top_players, target_ranking_id
+            top_player_ids, target_ranking_id
         )
 
         # 记录结果
@@ -207,6 +323,7 @@ def promote_from_multiple_rankings(
             "errors": errors,
         }
 
+    _report(progress, len(source_ranking_ids), len(source_ranking_ids))
     return {
         "summary": {
             "success": total_success,
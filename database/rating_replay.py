@@ -0,0 +1,683 @@
+"""
+这个模块用于按对战历史重放榜单评分 (离线)。
+
+- 一次性把榜单的全部对战结果 (BattlePlayer 胜负、角色、token、报错信息) 读入 NumPy 数组
+- 按对战结束时间顺序重放；相邻且没有共同玩家的对战组成一个"批次"，
+  批次内的对战互不影响，可以整体向量化计算，结果与逐场重放完全一致
+- 评分引擎:
+    elo        线上公式 (K 值、几何/算术队伍均分可调)，见 action._compute_elo_deltas
+    glicko2    Glicko-2，每位玩家与对方队伍的合成对手进行一局
+    trueskill  TrueSkill 风格的两队更新 (队伍表现取成员均值)
+  代码报错的对战在 glicko2/trueskill 中视为报错玩家输给其余 6 人。
+- replay_ranking(dry-run) 只返回对比报告，apply=True 时把结果写回 GameStats。
+  写回是覆盖式的，应在该榜单没有进行中的对战时执行。
+"""
+
+import json
+import logging
+import math
+import zlib
+from time import perf_counter
+
+import numpy as np
+from sqlalchemy import bindparam, null, select, union_all
+
+from .base import db
+from .models import (
+    ArchivedBattle,
+    ArchivedBattlePlayer,
+    Battle,
+    BattlePlayer,
+    GameStats,
+    User,
+)
+from .leaderboard import mark_leaderboard_stale
+from .action import (
+    BLUE_ROLES,
+    ELO_K_FACTOR,
+    ERROR_METHOD_PENALTIES,
+    ERROR_TYPE_MULTIPLIERS,
+    MIN_ELO,
+    safe_commit,
+    token_proportions,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ELO = 1200
+PLAYER_COUNT = 7
+GLICKO2_SCALE = 173.7178
+
+
+class BattleHistory:
+    """
+    一个榜单的对战历史 (只包含可以计分的对战)，B 场对战、U 名玩家:
+
+    players (B, 7)         玩家下标 (对应 user_ids)，按座位 (position) 排列
+    winners (B, 7)         是否属于获胜一方；报错对战中除报错玩家外都为 True
+    blue (B, 7)            是否为蓝方 (来自结果中的角色)，has_roles 为 False 时无意义
+    has_roles (B,)         结果中是否有完整的角色信息
+    is_error (B,)          是否为代码报错的对战
+    error_slot (B,)        报错玩家的座位下标，非报错对战为 -1
+    error_multiplier (B,)  报错类型惩罚系数
+    method_penalty (B,)    出错方法的额外扣分
+    token_proportion (B, 7) token 用量比例 (见 action.token_proportions)
+    waves                  [(start, end), ...] 无共同玩家的连续对战区间
+    """
+
+    def __init__(self, ranking_id, battle_ids, user_ids, rows):
+        self.ranking_id = ranking_id
+        self.battle_ids = battle_ids
+        self.user_ids = user_ids
+        count = len(battle_ids)
+        self.players = np.zeros((count, PLAYER_COUNT), dtype=np.int64)
+        self.winners = np.zeros((count, PLAYER_COUNT), dtype=bool)
+        self.blue = np.zeros((count, PLAYER_COUNT), dtype=bool)
+        self.has_roles = np.zeros(count, dtype=bool)
+        self.is_error = np.zeros(count, dtype=bool)
+        self.error_slot = np.full(count, -1, dtype=np.int64)
+        self.error_multiplier = np.ones(count)
+        self.method_penalty = np.zeros(count)
+        self.token_proportion = np.zeros((count, PLAYER_COUNT))
+        for i, row in enumerate(rows):
+            self.players[i] = row["players"]
+            self.winners[i] = row["winners"]
+            self.blue[i] = row["blue"]
+            self.has_roles[i] = row["has_roles"]
+            self.is_error[i] = row["is_error"]
+            self.error_slot[i] = row["error_slot"]
+            self.error_multiplier[i] = row["error_multiplier"]
+            self.method_penalty[i] = row["method_penalty"]
+            self.token_proportion[i] = row["token_proportion"]
+
+        # 胜负统计与评分引擎无关，加载时一并算出
+        user_count = len(user_ids)
+        draws = self.is_error[:, None] & self.winners
+        losses = ~self.winners
+        wins = self.winners & ~draws
+        self.games_played = np.bincount(
+            self.players.ravel(), minlength=user_count
+        ).astype(np.int64)
+        self.wins = np.bincount(
+            self.players.ravel(), weights=wins.ravel(), minlength=user_count
+        ).astype(np.int64)
+        self.losses = np.bincount(
+            self.players.ravel(), weights=losses.ravel(), minlength=user_count
+        ).astype(np.int64)
+        self.draws = np.bincount(
+            self.players.ravel(), weights=draws.ravel(), minlength=user_count
+        ).astype(np.int64)
+        self.waves = self._split_waves()
+
+    def __len__(self):
+        return len(self.battle_ids)
+
+    def _split_waves(self):
+        waves = []
+        start = 0
+        seen = set()
+        for i, row in enumerate(self.players.tolist()):
+            if seen.intersection(row):
+                waves.append((start, i))
+                start = i
+                seen = set()
+            seen.update(row)
+        if len(self.battle_ids) > start:
+            waves.append((start, len(self.battle_ids)))
+        return waves
+
+
+def _parse_battle(status, results, players):
+    """
+    把一场对战整理为 BattleHistory 的一行，无法计分的对战返回 None。
+
+    参数:
+        status (str): 对战状态 (completed / error)。
+        results (str): Battle.results JSON。
+        players (list): [(position, user_index, outcome), ...]
+    """
+    if len(players) != PLAYER_COUNT:
+        return None
+    players = sorted(players)
+    if [p[0] for p in players] != list(range(1, PLAYER_COUNT + 1)):
+        return None
+    outcomes = [p[2] for p in players]
+
+    try:
+        results_data = json.loads(results) if results else {}
+    except (TypeError, ValueError):
+        results_data = {}
+    if not isinstance(results_data, dict):
+        results_data = {}
+
+    row = {
+        "players": [p[1] for p in players],
+        "is_error": False,
+        "error_slot": -1,
+        "error_multiplier": 1.0,
+        "method_penalty": 0.0,
+    }
+    if status == "error":
+        # 报错对战：报错玩家 loss，其余玩家 draw
+        if outcomes.count("loss") != 1 or outcomes.count("draw") != PLAYER_COUNT - 1:
+            return None
+        player_error = results_data.get("player_error") or {}
+        row["is_error"] = True
+        row["error_slot"] = outcomes.index("loss")
+        row["error_multiplier"] = ERROR_TYPE_MULTIPLIERS.get(
+            player_error.get("type"), 1.0
+        )
+        row["method_penalty"] = ERROR_METHOD_PENALTIES.get(
+            player_error.get("error_code_method"), 0
+        )
+        row["winners"] = [outcome != "loss" for outcome in outcomes]
+        row["token_proportion"] = [0.0] * PLAYER_COUNT
+    else:
+        if "win" not in outcomes or "loss" not in outcomes:
+            return None
+        row["winners"] = [outcome == "win" for outcome in outcomes]
+        row["token_proportion"] = token_proportions(results_data.get("tokens") or [])
+
+    roles = results_data.get("roles") or {}
+    roles = {str(pid): role for pid, role in roles.items()}
+    row["has_roles"] = all(str(pid) in roles for pid in range(1, PLAYER_COUNT + 1))
+    row["blue"] = [
+        roles.get(str(pid)) in BLUE_ROLES for pid in range(1, PLAYER_COUNT + 1)
+    ]
+    return row
+
+
+def load_ranking_history(ranking_id):
+    """
+    读取榜单中全部可计分的对战 (含已归档的，按结束时间排序)。
+
+    参数:
+        ranking_id (int): 榜单ID。
+
+    返回:
+        BattleHistory: 对战历史。
+    """
+    battle_parts, player_parts = [], []
+    # 热表与归档表 (见 archive.py) 一起读取，归档表中的结果是压缩存储的
+    for battle_model, player_model, results, results_z in (
+        (Battle, BattlePlayer, Battle.results, null()),
+        (ArchivedBattle, ArchivedBattlePlayer, null(), ArchivedBattle.results_z),
+    ):
+        battle_filter = (
+            battle_model.ranking_id == ranking_id,
+            battle_model.status.in_(["completed", "error"]),
+            battle_model.is_elo_exempt.is_(False),
+        )
+        battle_parts.append(
+            select(
+                battle_model.id,
+                battle_model.status,
+                results.label("results"),
+                results_z.label("results_z"),
+                battle_model.ended_at,
+            ).where(*battle_filter)
+        )
+        player_parts.append(
+            select(
+                player_model.battle_id,
+                player_model.position,
+                player_model.user_id,
+                player_model.outcome,
+            )
+            .join_from(
+                player_model, battle_model, battle_model.id == player_model.battle_id
+            )
+            .where(*battle_filter, player_model.outcome.isnot(None))
+        )
+    source = union_all(*battle_parts).subquery()
+    battles = db.session.execute(
+        select(
+            source.c.id, source.c.status, source.c.results, source.c.results_z
+        ).order_by(source.c.ended_at, source.c.id)
+    ).all()
+    player_rows = db.session.execute(union_all(*player_parts)).all()
+
+    user_index = {}
+    players_by_battle = {}
+    for battle_id, position, user_id, outcome in player_rows:
+        index = user_index.setdefault(user_id, len(user_index))
+        players_by_battle.setdefault(battle_id, []).append((position, index, outcome))
+
+    battle_ids, rows = [], []
+    for battle_id, status, results, results_z in battles:
+        if results_z is not None:
+            results = zlib.decompress(results_z).decode()
+        row = _parse_battle(status, results, players_by_battle.get(battle_id, []))
+        if row is not None:
+            battle_ids.append(battle_id)
+            rows.append(row)
+
+    user_ids = [None] * len(user_index)
+    for user_id, index in user_index.items():
+        user_ids[index] = user_id
+    return BattleHistory(ranking_id, battle_ids, user_ids, rows)
+
+
+def _side_mean(values, mask, geometric=False):
+    """按行对 mask 选中的元素求均值 (几何或算术)，没有元素时返回 DEFAULT_ELO"""
+    count = mask.sum(axis=1)
+    if geometric:
+        total = np.where(mask, np.log(values), 0.0).sum(axis=1)
+        mean = np.exp(total / np.maximum(count, 1))
+    else:
+        mean = np.where(mask, values, 0.0).sum(axis=1) / np.maximum(count, 1)
+    return np.where(count > 0, mean, DEFAULT_ELO)
+
+
+class RatingEngine:
+    """评分引擎基类：按批次依次更新，ratings 为展示/写回用的评分"""
+
+    name = "base"
+
+    def reset(self, user_count):
+        raise NotImplementedError
+
+    def update_wave(self, history, start, end):
+        raise NotImplementedError
+
+    def ratings(self):
+        raise NotImplementedError
+
+    def uncertainty(self):
+        """评分不确定度 (与评分同一尺度)，引擎没有该概念时为 None"""
+        return None
+
+    def params(self):
+        return {}
+
+    def replay(self, history):
+        self.reset(len(history.user_ids))
+        for start, end in history.waves:
+            self.update_wave(history, start, end)
+        return self.ratings()
+
+
+class EloEngine(RatingEngine):
+    """线上 ELO 公式 (含 token 修正、零和归一、代码报错惩罚)"""
+
+    name = "elo"
+
+    def __init__(self, k_factor=ELO_K_FACTOR, team_mean="geometric", min_elo=MIN_ELO):
+        if team_mean not in ("geometric", "arithmetic"):
+            raise ValueError(f"未知的队伍均分方式: {team_mean}")
+        self.k_factor = float(k_factor)
+        self.team_mean = team_mean
+        self.min_elo = float(min_elo)
+
+    def params(self):
+        return {
+            "k_factor": self.k_factor,
+            "team_mean": self.team_mean,
+            "min_elo": self.min_elo,
+        }
+
+    def reset(self, user_count):
+        self._elo = np.full(user_count, float(DEFAULT_ELO))
+
+    def update_wave(self, history, start, end):
+        players = history.players[start:end]
+        winners = history.winners[start:end]
+        geometric = self.team_mean == "geometric"
+        elo = self._elo[players]
+
+        # 正常对战
+        winner_avg = _side_mean(elo, winners, geometric)
+        loser_avg = _side_mean(elo, ~winners, geometric)
+        winner_expected = 1 / (1 + 10 ** ((loser_avg - winner_avg) / 400))
+        expected = np.where(
+            winners, winner_expected[:, None], 1 - winner_expected[:, None]
+        )
+        proportion = history.token_proportion[start:end]
+        deltas = self.k_factor * (
+            winners
+            - np.minimum(1, expected * (0.9 + np.maximum(proportion - 1, 0) / 3))
+        )
+        deltas -= deltas.mean(axis=1, keepdims=True)
+
+        # 代码报错：报错玩家扣分，其余玩家平分
+        is_error = history.is_error[start:end]
+        if is_error.any():
+            blue = history.blue[start:end]
+            team_diff = np.where(
+                history.has_roles[start:end],
+                np.abs(
+                    _side_mean(elo, blue, geometric) - _side_mean(elo, ~blue, geometric)
+                )
+                * 0.1,
+                0.0,
+            )
+            total_reduction = np.clip(
+                np.round(
+                    (30 + team_diff) * history.error_multiplier[start:end]
+                    + history.method_penalty[start:end]
+                ),
+                20,
+                100,
+            )
+            compensation = np.round(total_reduction / (PLAYER_COUNT - 1))
+            is_error_player = (
+                np.arange(PLAYER_COUNT)[None, :] == history.error_slot[start:end, None]
+            )
+            error_deltas = np.where(
+                is_error_player, -total_reduction[:, None], compensation[:, None]
+            )
+            deltas = np.where(is_error[:, None], error_deltas, deltas)
+
+        self._elo[players] = np.maximum(np.round(elo + deltas), self.min_elo)
+
+    def ratings(self):
+        return self._elo.copy()
+
+
+class Glicko2Engine(RatingEngine):
+    """
+    Glicko-2：每场对战中，玩家与对方队伍的合成对手 (均值 μ、均方 φ) 进行一局。
+    每场对战视为一个评分周期，不做未参赛玩家的 RD 增长。
+    """
+
+    name = "glicko2"
+
+    def __init__(self, rd=350.0, volatility=0.06, tau=0.5, epsilon=1e-6):
+        self.initial_phi = float(rd) / GLICKO2_SCALE
+        self.initial_sigma = float(volatility)
+        self.tau = float(tau)
+        self.epsilon = float(epsilon)
+
+    def params(self):
+        return {
+            "rd": self.initial_phi * GLICKO2_SCALE,
+            "volatility": self.initial_sigma,
+            "tau": self.tau,
+        }
+
+    def reset(self, user_count):
+        self._mu = np.zeros(user_count)
+        self._phi = np.full(user_count, self.initial_phi)
+        self._sigma = np.full(user_count, self.initial_sigma)
+
+    def _new_volatility(self, sigma, phi, v, delta):
+        """Glicko-2 第 5 步 (Illinois 迭代)，对所有元素同时迭代"""
+        tau2 = self.tau**2
+        a = np.log(sigma**2)
+        delta2, phi2 = delta**2, phi**2
+
+        def f(x):
+            ex = np.exp(x)
+            return (
+                ex * (delta2 - phi2 - v - ex) / (2 * (phi2 + v + ex) ** 2)
+                - (x - a) / tau2
+            )
+
+        large = delta2 > phi2 + v
+        A = a
+        B = np.where(
+            large, np.log(np.where(large, delta2 - phi2 - v, 1.0)), a - self.tau
+        )
+        for _ in range(100):
+            need = ~large & (f(B) < 0)
+            if not need.any():
+                break
+            B = np.where(need, B - self.tau, B)
+
+        fA, fB = f(A), f(B)
+        for _ in range(100):
+            active = np.abs(B - A) > self.epsilon
+            if not active.any():
+                break
+            C = A + (A - B) * fA / (fB - fA)
+            fC = f(C)
+            swap = fC * fB <= 0
+            A = np.where(active & swap, B, A)
+            fA = np.where(active, np.where(swap, fB, fA / 2), fA)
+            B = np.where(active, C, B)
+            fB = np.where(active, fC, fB)
+        return np.exp(A / 2)
+
+    def update_wave(self, history, start, end):
+        players = history.players[start:end]
+        winners = history.winners[start:end]
+        mu, phi, sigma = self._mu[players], self._phi[players], self._sigma[players]
+
+        # 对方队伍的合成对手
+        winner_mu = _side_mean(mu, winners)
+        loser_mu = _side_mean(mu, ~winners)
+        winner_phi = np.sqrt(_side_mean(phi**2, winners))
+        loser_phi = np.sqrt(_side_mean(phi**2, ~winners))
+        opp_mu = np.where(winners, loser_mu[:, None], winner_mu[:, None])
+        opp_phi = np.where(winners, loser_phi[:, None], winner_phi[:, None])
+        score = winners.astype(float)
+
+        g = 1 / np.sqrt(1 + 3 * opp_phi**2 / math.pi**2)
+        expected = 1 / (1 + np.exp(-g * (mu - opp_mu)))
+        v = 1 / (g**2 * expected * (1 - expected))
+        delta = v * g * (score - expected)
+
+        new_sigma = self._new_volatility(sigma, phi, v, delta)
+        phi_star = np.sqrt(phi**2 + new_sigma**2)
+        new_phi = 1 / np.sqrt(1 / phi_star**2 + 1 / v)
+        self._mu[players] = mu + new_phi**2 * g * (score - expected)
+        self._phi[players] = new_phi
+        self._sigma[players] = new_sigma
+
+    def ratings(self):
+        return DEFAULT_ELO + GLICKO2_SCALE * self._mu
+
+    def uncertainty(self):
+        return GLICKO2_SCALE * self._phi
+
+
+_erfc = np.vectorize(math.erfc, otypes=[float])
+
+
+class TrueSkillEngine(RatingEngine):
+    """
+    TrueSkill 风格的两队更新 (无平局)，直接使用 ELO 尺度:
+    队伍表现取成员均值，以适应 4 蓝 3 红的人数差；评分取 μ。
+    """
+
+    name = "trueskill"
+
+    def __init__(self, sigma=400.0, beta=200.0, tau=4.0):
+        self.initial_sigma = float(sigma)
+        self.beta = float(beta)
+        self.tau = float(tau)
+
+    def params(self):
+        return {"sigma": self.initial_sigma, "beta": self.beta, "tau": self.tau}
+
+    def reset(self, user_count):
+        self._mu = np.full(user_count, float(DEFAULT_ELO))
+        self._var = np.full(user_count, self.initial_sigma**2)
+
+    def update_wave(self, history, start, end):
+        players = history.players[start:end]
+        winners = history.winners[start:end]
+        mu = self._mu[players]
+        var = self._var[players] + self.tau**2
+
+        winner_count = winners.sum(axis=1)
+        loser_count = PLAYER_COUNT - winner_count
+        perf_var = var + self.beta**2
+        winner_var = np.where(winners, perf_var, 0).sum(axis=1) / winner_count**2
+        loser_var = np.where(~winners, perf_var, 0).sum(axis=1) / loser_count**2
+        c = np.sqrt(winner_var + loser_var)
+        t = np.maximum((_side_mean(mu, winners) - _side_mean(mu, ~winners)) / c, -25.0)
+        pdf = np.exp(-(t**2) / 2) / math.sqrt(2 * math.pi)
+        cdf = 0.5 * _erfc(-t / math.sqrt(2))
+        v = pdf / cdf
+        w = v * (v + t)
+
+        team_size = np.where(winners, winner_count[:, None], loser_count[:, None])
+        sign = np.where(winners, 1.0, -1.0)
+        self._mu[players] = mu + sign * var / (team_size * c[:, None]) * v[:, None]
+        self._var[players] = var * np.maximum(
+            1 - var / (team_size**2 * c[:, None] ** 2) * w[:, None], 1e-6
+        )
+
+    def ratings(self):
+        return self._mu.copy()
+
+    def uncertainty(self):
+        return np.sqrt(self._var)
+
+
+RATING_ENGINES = {
+    EloEngine.name: EloEngine,
+    Glicko2Engine.name: Glicko2Engine,
+    TrueSkillEngine.name: TrueSkillEngine,
+}
+
+
+def create_rating_engine(name, **params):
+    """按名称创建评分引擎，名称或参数无效时抛出 ValueError"""
+    engine_cls = RATING_ENGINES.get(name)
+    if engine_cls is None:
+        raise ValueError(f"未知的评分引擎 '{name}' (可选 {', '.join(RATING_ENGINES)})")
+    try:
+        return engine_cls(**params)
+    except TypeError as e:
+        raise ValueError(f"评分引擎 '{name}' 的参数无效 ({e})")
+
+
+def _rank_correlation(a, b):
+    """Spearman 秩相关系数 (不处理并列)"""
+    if len(a) < 2:
+        return None
+    rank_a = np.argsort(np.argsort(a))
+    rank_b = np.argsort(np.argsort(b))
+    if rank_a.std() == 0 or rank_b.std() == 0:
+        return None
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def _apply_replay(ranking_id, history, ratings, in_ranking):
+    """把重放结果写回 GameStats (只更新仍在榜单中的玩家)"""
+    stats_table = GameStats.__table__
+    stmt = (
+        stats_table.update()
+        .where(
+            stats_table.c.user_id == bindparam("b_user_id"),
+            stats_table.c.ranking_id == ranking_id,
+        )
+        .values(
+            elo_score=bindparam("b_elo"),
+            games_played=bindparam("b_games"),
+            wins=bindparam("b_wins"),
+            losses=bindparam("b_losses"),
+            draws=bindparam("b_draws"),
+        )
+    )
+    params = [
+        {
+            "b_user_id": user_id,
+            "b_elo": int(max(round(ratings[i]), MIN_ELO)),
+            "b_games": int(history.games_played[i]),
+            "b_wins": int(history.wins[i]),
+            "b_losses": int(history.losses[i]),
+            "b_draws": int(history.draws[i]),
+        }
+        for i, user_id in enumerate(history.user_ids)
+        if user_id in in_ranking
+    ]
+    if params:
+        db.session.execute(stmt, params)
+        # Core 语句不触发会话事件，需要显式使物化排行榜过期
+        mark_leaderboard_stale(ranking_id)
+    return safe_commit()
+
+
+def replay_ranking(ranking_id, engine="elo", apply=False, **params):
+    """
+    按对战历史重放榜单评分。
+
+    参数:
+        ranking_id (int): 榜单ID。
+        engine (str): 评分引擎名称，见 RATING_ENGINES。
+        apply (bool): 为 True 时把重放结果 (评分和胜负统计) 写回 GameStats；
+                      默认只返回报告 (dry-run)。
+        **params: 评分引擎参数，例如 elo 的 k_factor、team_mean。
+
+    返回:
+        dict: 报告 {ranking_id, engine, params, battles, waves, load_ms, replay_ms,
+              rank_correlation, applied, players: [...]}，players 按重放评分降序；
+              出错返回 None。引擎名称或参数无效时抛出 ValueError。
+    """
+    rating_engine = create_rating_engine(engine, **params)
+    try:
+        started = perf_counter()
+        history = load_ranking_history(ranking_id)
+        loaded = perf_counter()
+        ratings = rating_engine.replay(history)
+        replayed = perf_counter()
+        uncertainty = rating_engine.uncertainty()
+
+        current = {
+            user_id: (elo_score, username)
+            for user_id, elo_score, username in db.session.query(
+                GameStats.user_id, GameStats.elo_score, User.username
+            )
+            .join(User, User.id == GameStats.user_id)
+            .filter(GameStats.ranking_id == ranking_id)
+        }
+
+        players = []
+        for i, user_id in enumerate(history.user_ids):
+            current_elo, username = current.get(user_id, (None, None))
+            players.append(
+                {
+                    "user_id": user_id,
+                    "username": username,
+                    "in_ranking": user_id in current,
+                    "current_elo": current_elo,
+                    "replayed_rating": round(float(ratings[i]), 1),
+                    "uncertainty": (
+                        round(float(uncertainty[i]), 1)
+                        if uncertainty is not None
+                        else None
+                    ),
+                    "games_played": int(history.games_played[i]),
+                    "wins": int(history.wins[i]),
+                    "losses": int(history.losses[i]),
+                    "draws": int(history.draws[i]),
+                }
+            )
+        players.sort(key=lambda p: p["replayed_rating"], reverse=True)
+
+        ranked = [p for p in players if p["in_ranking"]]
+        report = {
+            "ranking_id": ranking_id,
+            "engine": rating_engine.name,
+            "params": rating_engine.params(),
+            "battles": len(history),
+            "waves": len(history.waves),
+            "load_ms": round((loaded - started) * 1000, 1),
+            "replay_ms": round((replayed - loaded) * 1000, 1),
+            "rank_correlation": _rank_correlation(
+                [p["current_elo"] for p in ranked],
+                [p["replayed_rating"] for p in ranked],
+            ),
+            "applied": False,
+            "players": players,
+        }
+        logger.info(
+            f"榜单 {ranking_id} 评分重放 ({rating_engine.name}): {len(history)} 场对战, "
+            f"{len(history.waves)} 个批次, 用时 {report['replay_ms']}ms"
+        )
+
+        if apply:
+            report["applied"] = _apply_replay(
+                ranking_id, history, ratings, set(current)
+            )
+            logger.info(
+                f"榜单 {ranking_id} 重放结果写回{'成功' if report['applied'] else '失败'}"
+            )
+        return report
+    except Exception as e:
+        logger.error(f"重放榜单 {ranking_id} 评分失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
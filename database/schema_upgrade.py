@@ -0,0 +1,81 @@
+"""
+已有数据库的增量升级
+
+本项目没有迁移工具，表由 db.create_all() 创建，而 create_all 不会为已有的表补列或补索引。
+后加到已有表上的列和索引登记在这里，应用启动时 upgrade_schema 补齐缺少的部分；
+可以由已有数据直接推导的新列，在补列的同一事务中执行回填语句
+(需要解析 JSON 的回填见 battle_stats.backfill_battle_analytics)。
+"""
+
+import logging
+
+from sqlalchemy import inspect, text
+
+from .models import AICode, Battle, BattlePlayer
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+# 后加的列: (列, 补列后执行的回填语句 或 None)
+ADDED_COLUMNS = (
+    (Battle.__table__.c.winner, None),
+    (Battle.__table__.c.win_reason, None),
+    (BattlePlayer.__table__.c.role, None),
+    (BattlePlayer.__table__.c.team, None),
+    (
+        BattlePlayer.__table__.c.battle_created_at,
+        "UPDATE battle_players SET battle_created_at = "
+        "(SELECT created_at FROM battles WHERE battles.id = battle_players.battle_id)",
+    ),
+    (AICode.__table__.c.validation_status, None),
+    (AICode.__table__.c.validation_error, None),
+    (AICode.__table__.c.validated_at, None),
+    (AICode.__table__.c.code_hash, None),
+)
+
+# 后加到已有表上的索引
+ADDED_INDEXES = (
+    "idx_battles_ranking_winner",
+    "idx_battles_created_id",
+    "idx_battles_status_created",
+    "idx_battleplayer_user_role",
+    "idx_battleplayer_ai_role",
+    "idx_battleplayer_role_position",
+    "idx_battleplayer_user_created",
+)
+
+
+def upgrade_schema():
+    """
+    为已有数据库补上登记的列和索引 (ALTER TABLE ADD COLUMN / CREATE INDEX)，已存在的跳过。
+
+    返回:
+        list: 新增的列，如 ["battles.winner"]。
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    columns = {}
+    added = []
+    with engine.begin() as conn:
+        for column, backfill in ADDED_COLUMNS:
+            table = column.table
+            if table.name not in columns:
+                columns[table.name] = {
+                    c["name"] for c in inspector.get_columns(table.name)
+                }
+            if column.name in columns[table.name]:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(
+                text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+            )
+            if backfill:
+                conn.execute(text(backfill))
+            added.append(f"{table.name}.{column.name}")
+        for table in (Battle.__table__, BattlePlayer.__table__):
+            for index in table.indexes:
+                if index.name in ADDED_INDEXES:
+                    index.create(conn, checkfirst=True)
+    if added:
+        logger.info(f"已为已有数据库补充列: {', '.join(added)}")
+    return added
@@ -0,0 +1,83 @@
+"""
+这个模块实现维护任务的租约 (service_leases 表)。
+
+gunicorn 的每个工作者和独立的对战工作进程都会执行启动恢复、归档等维护任务，
+同一时间只应有一个进程执行。执行前用带条件的 UPDATE (或首次 INSERT) 抢占租约，
+只有抢到的进程执行；租约到期 (持有者崩溃) 后其他进程可以接手。
+"""
+
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from .models import ServiceLease
+from .base import db
+
+logger = logging.getLogger(__name__)
+
+
+def acquire_service_lease(name, owner, lease_seconds):
+    """
+    抢占 (或续约) 维护任务的租约。
+
+    参数:
+        name (str): 维护任务名
+        owner (str): 进程标识
+        lease_seconds (float): 租约时长
+
+    返回:
+        bool: 是否持有租约
+    """
+    try:
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=lease_seconds)
+        result = db.session.execute(
+            update(ServiceLease)
+            .where(
+                ServiceLease.name == name,
+                or_(
+                    ServiceLease.owner == owner,
+                    ServiceLease.owner.is_(None),
+                    ServiceLease.expires_at.is_(None),
+                    ServiceLease.expires_at < now,
+                ),
+            )
+            .values(owner=owner, expires_at=expires_at, updated_at=now)
+        )
+        if result.rowcount == 1:
+            db.session.commit()
+            return True
+        if db.session.get(ServiceLease, name) is not None:
+            db.session.rollback()  # 其他进程持有租约
+            return False
+        db.session.add(ServiceLease(name=name, owner=owner, expires_at=expires_at))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()  # 其他进程同时创建了租约
+        return False
+    except Exception as e:
+        logger.error(f"抢占维护任务 {name} 的租约失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
+def release_service_lease(name, owner):
+    """
+    释放自己持有的租约，其他进程可以立即抢占。
+
+    返回:
+        bool: 是否释放成功
+    """
+    try:
+        result = db.session.execute(
+            update(ServiceLease)
+            .where(ServiceLease.name == name, ServiceLease.owner == owner)
+            .values(owner=None, expires_at=None, updated_at=datetime.now())
+        )
+        db.session.commit()
+        return result.rowcount == 1
+    except Exception as e:
+        logger.error(f"释放维护任务 {name} 的租约失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
@@ -0,0 +1,74 @@
+"""榜单参与者: 单次连接查询、过期成员的清理与参与者版本号"""
+
+from database import (
+    ACTIVE_PARTICIPANTS,
+    apply_battle_results_batch,
+    cleanup_stale_game_stats,
+    create_battles,
+    db,
+    get_active_ai_codes_by_ranking_ids,
+    get_data_version,
+)
+from database.models import AICode, GameStats
+from game.battle_result import BattleResult
+
+ROLES = {
+    1: "Merlin",
+    2: "Percival",
+    3: "Knight",
+    4: "Knight",
+    5: "Morgana",
+    6: "Assassin",
+    7: "Oberon",
+}
+
+
+def _deactivate(player):
+    db.session.get(AICode, player["ai_code_id"]).is_active = False
+    db.session.commit()
+
+
+def test_only_members_with_active_ai_are_returned(make_players):
+    ranked = make_players(3, ranking_id=1)
+    make_players(2, ranking_id=2)
+    _deactivate(ranked[0])
+
+    codes = get_active_ai_codes_by_ranking_ids([1])
+    assert sorted(c.id for c in codes) == sorted(p["ai_code_id"] for p in ranked[1:])
+    # 读取参与者不再顺带删除成员
+    assert GameStats.query.filter_by(ranking_id=1).count() == 3
+    assert len(get_active_ai_codes_by_ranking_ids([1, 2])) == 4
+
+
+def test_cleanup_removes_members_without_active_ai(make_players):
+    ranked = make_players(3, ranking_id=1)
+    _deactivate(ranked[0])
+
+    assert cleanup_stale_game_stats() == 1
+    assert {s.user_id for s in GameStats.query.filter_by(ranking_id=1)} == {
+        p["user_id"] for p in ranked[1:]
+    }
+    assert cleanup_stale_game_stats() == 0
+
+
+def test_version_tracks_membership_but_not_elo(make_players):
+    players = make_players(7)
+    version = get_data_version(ACTIVE_PARTICIPANTS)
+
+    (battle,) = create_battles([players], ranking_id=1)
+    result = BattleResult(
+        roles=dict(ROLES),
+        winner="blue",
+        tokens=[{"input": 1, "output": 1}] * 7,
+    )
+    assert apply_battle_results_batch([(battle.id, result)])[battle.id]
+    assert get_data_version(ACTIVE_PARTICIPANTS) == version
+
+    _deactivate(players[0])
+    assert get_data_version(ACTIVE_PARTICIPANTS) > version
+    version = get_data_version(ACTIVE_PARTICIPANTS)
+
+    # 批量删除成员同样递增
+    GameStats.query.filter_by(user_id=players[1]["user_id"]).delete()
+    db.session.commit()
+    assert get_data_version(ACTIVE_PARTICIPANTS) > version
@@ -0,0 +1,74 @@
+"""archive.py: 归档已结束的对战并从归档表读回；手动归档先抢占租约"""
+
+import json
+from datetime import datetime, timedelta
+
+from database import (
+    acquire_service_lease,
+    apply_battle_results_batch,
+    archive_battles,
+    create_battles,
+    db,
+)
+from database.archive import get_archived_battle, get_archived_seat_usernames
+from database.models import Battle, BattlePlayer
+from database.rating_replay import replay_ranking
+from game.battle_result import BattleResult
+from services.battle_archiver import ARCHIVE_LEASE, BattleArchiver
+
+ROLES = {
+    1: "Merlin",
+    2: "Percival",
+    3: "Knight",
+    4: "Knight",
+    5: "Morgana",
+    6: "Assassin",
+    7: "Oberon",
+}
+
+
+def _finished_battles(players, ages_in_days):
+    """结算若干场对战，结束时间分别为 ages_in_days 天前"""
+    battles = create_battles([players] * len(ages_in_days), ranking_id=1)
+    for battle in battles:
+        result = BattleResult(
+            roles=dict(ROLES), winner="red", tokens=[{"input": 1, "output": 1}] * 7
+        )
+        assert apply_battle_results_batch([(battle.id, result)])[battle.id]
+    for battle, age in zip(battles, ages_in_days):
+        battle.ended_at = datetime.now() - timedelta(days=age)
+    db.session.commit()
+    return [b.id for b in battles]
+
+
+def test_archive_and_read_back(make_players):
+    players = make_players(7)
+    old_id, recent_id = _finished_battles(players, [100, 1])
+    calls = []
+
+    assert archive_battles(30, progress=lambda *args: calls.append(args)) == 1
+    assert calls[0][:2] == (0, 1) and calls[-1][:2] == (1, 1)
+    db.session.expire_all()
+    assert db.session.get(Battle, old_id) is None
+    assert BattlePlayer.query.filter_by(battle_id=old_id).count() == 0
+    assert db.session.get(Battle, recent_id) is not None
+
+    archived = get_archived_battle(old_id)
+    assert archived.status == "completed"
+    assert archived.winner == "red"
+    assert json.loads(archived.results)["winner"] == "red"
+    assert sorted(p for p, _ in get_archived_seat_usernames(old_id)) == list(
+        range(1, 8)
+    )
+    # 评分重放同时读取归档表
+    assert replay_ranking(1)["battles"] == 2
+    assert archive_battles(30) == 0
+
+
+def test_manual_archive_needs_the_lease(app, make_players):
+    (old_id,) = _finished_battles(make_players(7), [100])
+    archiver = BattleArchiver(app)
+    assert acquire_service_lease(ARCHIVE_LEASE, "other-host:1", 60)
+
+    assert archiver.archive_now(30) is None
+    assert db.session.get(Battle, old_id) is not None
@@ -0,0 +1,80 @@
+"""battle_list.py: 游标编解码与对战列表、个人对战历史的 keyset 分页"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import create_battles, db
+from database.battle_list import (
+    decode_cursor,
+    encode_cursor,
+    get_battle_page,
+    get_user_battle_page,
+)
+from database.models import BattlePlayer
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2025, 5, 1, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(created_at, "battle-1")) == (
+        created_at,
+        "battle-1",
+    )
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "bm8tc2VwYXJhdG9y"])
+def test_invalid_cursor_raises(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def _battles(players, count):
+    """创建 count 场对战，创建时间逐场递增"""
+    battles = create_battles([players] * count, ranking_id=1, status="completed")
+    base = datetime(2025, 1, 1)
+    for i, battle in enumerate(battles):
+        battle.created_at = base + timedelta(minutes=i)
+        BattlePlayer.query.filter_by(battle_id=battle.id).update(
+            {"battle_created_at": battle.created_at}
+        )
+    db.session.commit()
+    # 按 (created_at, id) 降序
+    return [b.id for b in reversed(battles)]
+
+
+def _walk(fetch):
+    """沿 next_cursor 翻完所有页，再沿 prev_cursor 翻回来"""
+    pages = [fetch()]
+    while pages[-1]["has_next"]:
+        pages.append(fetch(after=pages[-1]["next_cursor"]))
+    back = [pages[-1]]
+    while back[-1]["has_prev"]:
+        back.append(fetch(before=back[-1]["prev_cursor"]))
+    return pages, back
+
+
+def test_battle_page_walks_forward_and_back(make_players):
+    expected = _battles(make_players(7), 7)
+
+    pages, back = _walk(lambda **kw: get_battle_page(limit=3, **kw))
+    assert [len(p["items"]) for p in pages] == [3, 3, 1]
+    assert [b.id for p in pages for b in p["items"]] == expected
+    assert pages[0]["total"] == 7 and not pages[0]["total_is_estimate"]
+    assert [[b.id for b in p["items"]] for p in reversed(back)] == [
+        [b.id for b in p["items"]] for p in pages
+    ]
+
+
+def test_user_history_counts_battles_not_seats(make_players):
+    players = make_players(7)
+    # 同一用户占两个座位
+    lineup = players[:6] + [players[0]]
+    expected = _battles(lineup, 5)
+    user_id = players[0]["user_id"]
+
+    pages, _ = _walk(
+        lambda **kw: get_user_battle_page(user_id, limit=2, total="exact", **kw)
+    )
+    assert [len(p["items"]) for p in pages] == [2, 2, 1]
+    assert [b.id for p in pages for b in p["items"]] == expected
+    assert pages[0]["total"] == 5
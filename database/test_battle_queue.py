@@ -0,0 +1,101 @@
+"""battle_queue.py: 领取、租约过期后重新领取、确认与启动恢复"""
+
+from datetime import datetime, timedelta
+
+from database import create_battles, db
+from database.battle_queue import (
+    ack_battle_job,
+    cancel_battle_job,
+    claim_battle_job,
+    enqueue_battle_job,
+    recover_battle_queue,
+)
+from database.models import Battle, BattleJob
+
+
+def _queued_battle(players, max_attempts=3):
+    (battle,) = create_battles([players], ranking_id=1)
+    participant_data = [
+        dict(player, position=i + 1) for i, player in enumerate(players)
+    ]
+    job = enqueue_battle_job(battle.id, participant_data, max_attempts=max_attempts)
+    return battle, job
+
+
+def _expire(job_id):
+    job = db.session.get(BattleJob, job_id)
+    job.lease_expires_at = datetime.now() - timedelta(seconds=1)
+    db.session.commit()
+
+
+def test_claim_is_exclusive(make_players):
+    _, job = _queued_battle(make_players(7))
+
+    claimed = claim_battle_job("worker-1", lease_seconds=60)
+    assert claimed["id"] == job["id"]
+    assert claimed["status"] == "leased"
+    assert claimed["lease_owner"] == "worker-1"
+    assert claimed["attempts"] == 1
+    # 租约有效期内其他工作者领取不到
+    assert claim_battle_job("worker-2", lease_seconds=60) is None
+
+
+def test_expired_lease_is_reclaimed(make_players):
+    _, job = _queued_battle(make_players(7))
+    claim_battle_job("worker-1", lease_seconds=60)
+    _expire(job["id"])
+
+    reclaimed = claim_battle_job("worker-2", lease_seconds=60)
+    assert reclaimed["id"] == job["id"]
+    assert reclaimed["lease_owner"] == "worker-2"
+    assert reclaimed["attempts"] == 2
+    # 原持有者的确认不再生效
+    assert not ack_battle_job(job["id"], "worker-1")
+    assert ack_battle_job(job["id"], "worker-2")
+    assert db.session.get(BattleJob, job["id"]).status == "done"
+
+
+def test_exhausted_attempts_are_not_claimed(make_players):
+    battle, job = _queued_battle(make_players(7), max_attempts=1)
+    claim_battle_job("worker-1", lease_seconds=60)
+    _expire(job["id"])
+
+    assert claim_battle_job("worker-2", lease_seconds=60) is None
+    summary = recover_battle_queue(include_orphans=False)
+    assert summary["failed"] == 1
+    assert db.session.get(BattleJob, job["id"]).status == "failed"
+    assert db.session.get(Battle, battle.id).status == "error"
+
+
+def test_recovery_requeues_expired_job(make_players):
+    battle, job = _queued_battle(make_players(7))
+    claim_battle_job("worker-1", lease_seconds=60)
+    _expire(job["id"])
+
+    assert recover_battle_queue(include_orphans=False)["requeued"] == 1
+    assert db.session.get(BattleJob, job["id"]).status == "queued"
+    # 再次恢复不会重复处理
+    assert recover_battle_queue(include_orphans=False)["requeued"] == 0
+    assert claim_battle_job("worker-2", lease_seconds=60)["id"] == job["id"]
+
+
+def test_recovery_requeues_orphan_battle(make_players):
+    players = make_players(7)
+    (battle,) = create_battles([players], ranking_id=1)
+    battle.created_at = datetime.now() - timedelta(hours=1)
+    db.session.commit()
+
+    summary = recover_battle_queue()
+    assert summary["orphans_requeued"] == 1
+    job = BattleJob.query.filter_by(battle_id=battle.id).one()
+    assert job.status == "queued"
+    assert recover_battle_queue()["orphans_requeued"] == 0
+
+
+def test_cancelled_job_is_not_acked(make_players):
+    battle, job = _queued_battle(make_players(7))
+    claim_battle_job("worker-1", lease_seconds=60)
+
+    assert cancel_battle_job(battle.id)
+    assert not ack_battle_job(job["id"], "worker-1")
+    assert db.session.get(BattleJob, job["id"]).status == "cancelled"
@@ -0,0 +1,124 @@
+"""action.py: 批量结算 (apply_battle_results_batch) 的 ELO 增量、幂等、豁免与取消"""
+
+from database import apply_battle_results_batch, create_battles, db
+from database.models import Battle, BattlePlayer, GameStats, RatingLedger
+from game.battle_result import BattleResult
+
+# 座位 1-4 为蓝方，5-7 为红方
+ROLES = {
+    1: "Merlin",
+    2: "Percival",
+    3: "Knight",
+    4: "Knight",
+    5: "Morgana",
+    6: "Assassin",
+    7: "Oberon",
+}
+BLUE_SEATS = (1, 2, 3, 4)
+
+
+def _result(winner="blue"):
+    return BattleResult(
+        roles=dict(ROLES),
+        winner=winner,
+        tokens=[{"input": 100, "output": 50} for _ in ROLES],
+    )
+
+
+def _stats(players):
+    return {
+        s.user_id: s
+        for s in GameStats.query.filter(
+            GameStats.ranking_id == 1,
+            GameStats.user_id.in_([p["user_id"] for p in players]),
+        )
+    }
+
+
+def _seats(battle_id):
+    return {
+        bp.position: bp
+        for bp in BattlePlayer.query.filter_by(battle_id=battle_id).all()
+    }
+
+
+def test_batch_applies_elo_deltas(make_players):
+    players = make_players(7)
+    (battle,) = create_battles([players], ranking_id=1)
+
+    assert apply_battle_results_batch([(battle.id, _result("blue"))]) == {
+        battle.id: True
+    }
+
+    assert db.session.get(Battle, battle.id).status == "completed"
+    stats = _stats(players)
+    for position, bp in _seats(battle.id).items():
+        won = position in BLUE_SEATS
+        assert bp.outcome == ("win" if won else "loss")
+        assert (bp.elo_change > 0) if won else (bp.elo_change < 0)
+        assert bp.initial_elo == 1200
+        # GameStats 按增量更新，与参与者记录的变化一致
+        assert stats[bp.user_id].elo_score == 1200 + bp.elo_change
+        assert stats[bp.user_id].games_played == 1
+        assert stats[bp.user_id].wins == int(won)
+
+    ledger = RatingLedger.query.filter_by(battle_id=battle.id).all()
+    assert len(ledger) == 7
+    assert all(e.elo_after == e.elo_before + e.elo_change for e in ledger)
+
+
+def test_batch_accumulates_across_battles(make_players):
+    players = make_players(7)
+    first, second = create_battles([players, players], ranking_id=1)
+
+    outcomes = apply_battle_results_batch(
+        [(first.id, _result("blue")), (second.id, _result("blue"))]
+    )
+    assert outcomes == {first.id: True, second.id: True}
+
+    stats = _stats(players)
+    first_seats, second_seats = _seats(first.id), _seats(second.id)
+    for position, bp in second_seats.items():
+        # 第二场以第一场结算后的 ELO 为起点
+        before = first_seats[position]
+        assert bp.initial_elo == before.initial_elo + before.elo_change
+        assert stats[bp.user_id].elo_score == bp.initial_elo + bp.elo_change
+        assert stats[bp.user_id].games_played == 2
+
+
+def test_batch_is_idempotent(make_players):
+    players = make_players(7)
+    (battle,) = create_battles([players], ranking_id=1)
+    apply_battle_results_batch([(battle.id, _result())])
+    scores = {uid: s.elo_score for uid, s in _stats(players).items()}
+
+    assert apply_battle_results_batch([(battle.id, _result())]) == {battle.id: True}
+    db.session.expire_all()
+    assert {uid: s.elo_score for uid, s in _stats(players).items()} == scores
+    assert RatingLedger.query.filter_by(battle_id=battle.id).count() == 7
+
+
+def test_exempt_battle_skips_elo(make_players):
+    players = make_players(7)
+    (battle,) = create_battles([players], ranking_id=1)
+    battle.is_elo_exempt = True
+    db.session.commit()
+
+    assert apply_battle_results_batch([(battle.id, _result())]) == {battle.id: True}
+
+    assert db.session.get(Battle, battle.id).status == "completed"
+    assert all(s.elo_score == 1200 for s in _stats(players).values())
+    assert all(s.games_played == 0 for s in _stats(players).values())
+    assert all(bp.elo_change == 0 for bp in _seats(battle.id).values())
+    assert RatingLedger.query.filter_by(battle_id=battle.id).count() == 0
+
+
+def test_cancelled_battle_is_not_settled(make_players):
+    players = make_players(7)
+    (battle,) = create_battles([players], ranking_id=1)
+    battle.status = "cancelled"
+    db.session.commit()
+
+    assert apply_battle_results_batch([(battle.id, _result())]) == {battle.id: False}
+    assert db.session.get(Battle, battle.id).status == "cancelled"
+    assert all(s.elo_score == 1200 for s in _stats(players).values())
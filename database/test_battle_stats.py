@@ -0,0 +1,80 @@
+"""battle_stats.py: 按角色 / 阵营分组的胜负统计、胜因占比与分析列补填"""
+
+import pytest
+
+from database import (
+    apply_battle_results_batch,
+    backfill_battle_analytics,
+    create_battles,
+    db,
+    get_outcome_stats,
+    get_player_stats,
+)
+from database.models import BattlePlayer
+from game.battle_result import BattleResult
+
+ROLES = {
+    1: "Merlin",
+    2: "Percival",
+    3: "Knight",
+    4: "Knight",
+    5: "Morgana",
+    6: "Assassin",
+    7: "Oberon",
+}
+
+
+def _settle(players, outcomes):
+    """按 [(胜方, 胜因)] 依次结算对战"""
+    battles = create_battles([players] * len(outcomes), ranking_id=1)
+    for battle, (winner, reason) in zip(battles, outcomes):
+        result = BattleResult(
+            roles=dict(ROLES),
+            winner=winner,
+            win_reason=reason,
+            tokens=[{"input": 1, "output": 1}] * 7,
+        )
+        assert apply_battle_results_batch([(battle.id, result)])[battle.id]
+    return battles
+
+
+def test_player_stats_by_team_and_role(make_players):
+    players = make_players(7)
+    _settle(players, [("red", "assassination_success"), ("blue", "missions_complete")])
+    _settle(players, [("red", "missions_failed")])
+
+    by_team = {s["team"]: s for s in get_player_stats(group_by=("team",))}
+    assert (by_team["red"]["games"], by_team["red"]["wins"]) == (9, 6)
+    assert by_team["blue"]["win_rate"] == pytest.approx(round(4 / 12, 4))
+
+    (knight,) = get_player_stats(
+        group_by=("user", "role"), user_id=players[2]["user_id"]
+    )
+    assert (knight["role"], knight["games"], knight["losses"]) == ("Knight", 3, 2)
+
+
+def test_outcome_share_per_ranking(make_players):
+    _settle(
+        make_players(7),
+        [("red", "assassination_success")] * 3 + [("blue", "missions_complete")],
+    )
+    stats = get_outcome_stats(group_by=("ranking", "winner"))
+    assert [(s["winner"], s["battles"], s["share"]) for s in stats] == [
+        ("blue", 1, 0.25),
+        ("red", 3, 0.75),
+    ]
+    with pytest.raises(ValueError):
+        get_outcome_stats(group_by=("no_such_column",))
+
+
+def test_backfill_fills_missing_roles(make_players):
+    _settle(make_players(7), [("blue", "missions_complete")])
+    # 模拟分析列上线前结束的对战
+    BattlePlayer.query.update({"role": None, "team": None})
+    db.session.commit()
+    assert get_player_stats(group_by=("team",)) == []
+
+    assert backfill_battle_analytics() == 1
+    assert backfill_battle_analytics() == 0
+    by_team = {s["team"]: s["wins"] for s in get_player_stats(group_by=("team",))}
+    assert by_team == {"blue": 4, "red": 0}
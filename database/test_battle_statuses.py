@@ -0,0 +1,38 @@
+"""update_battle_statuses: 批量状态更新只对实际写入的对战返回成功"""
+
+from database import (
+    create_battles,
+    db,
+    mark_battle_as_cancelled,
+    update_battle_statuses,
+)
+from database.models import Battle
+from services.status_writer import BattleStatusWriter
+
+
+def test_cancelled_and_missing_battles_are_not_updated(make_players):
+    waiting, cancelled = create_battles([make_players(7)] * 2, ranking_id=1)
+    assert mark_battle_as_cancelled(cancelled.id, "test")
+
+    outcomes = update_battle_statuses(
+        {waiting.id: "playing", cancelled.id: "playing", "missing": "playing"}
+    )
+    assert outcomes == {waiting.id: True, cancelled.id: False, "missing": False}
+    db.session.expire_all()
+    assert db.session.get(Battle, waiting.id).started_at is not None
+    assert db.session.get(Battle, cancelled.id).status == "cancelled"
+
+
+def test_writer_does_not_start_cancelled_battle(app, make_players):
+    waiting, cancelled = create_battles([make_players(7)] * 2, ranking_id=1)
+    assert mark_battle_as_cancelled(cancelled.id, "test")
+
+    writer = BattleStatusWriter(app)
+    try:
+        assert writer.submit(waiting.id, "playing")
+        assert not writer.submit(cancelled.id, "playing")
+    finally:
+        writer.shutdown()
+    db.session.expire_all()
+    assert db.session.get(Battle, waiting.id).status == "playing"
+    assert db.session.get(Battle, cancelled.id).status == "cancelled"
@@ -0,0 +1,114 @@
+"""battle_summary.py: 对战结束时写入摘要与分析列、补建旧对战的摘要、重新开始时删除摘要"""
+
+import json
+
+from database import (
+    apply_battle_results_batch,
+    create_battles,
+    db,
+    get_battle_summary,
+    mark_battle_as_cancelled,
+    update_battle,
+)
+from database.models import Battle, BattlePlayer, BattleSummary
+from game.battle_result import BattleResult, PlayerError
+
+ROLES = {
+    1: "Merlin",
+    2: "Percival",
+    3: "Knight",
+    4: "Knight",
+    5: "Morgana",
+    6: "Assassin",
+    7: "Oberon",
+}
+
+
+def _summary(battle_id):
+    db.session.expire_all()
+    return db.session.get(BattleSummary, battle_id)
+
+
+def test_completed_battle_gets_typed_summary(make_players):
+    (battle,) = create_battles([make_players(7)], ranking_id=1)
+    result = BattleResult(
+        blue_wins=3,
+        red_wins=1,
+        rounds_played=4,
+        roles=dict(ROLES),
+        winner="red",
+        win_reason="assassination_success",
+        tokens=[{"input": 10, "output": 5}] * 7,
+        mission_results=[True, False, True, True],
+        assassination={"assassin": 6, "target": 1, "success": True},
+    )
+    assert apply_battle_results_batch([(battle.id, result)])[battle.id]
+
+    summary = _summary(battle.id)
+    assert summary.status == "completed"
+    assert (summary.winner, summary.win_reason) == ("red", "assassination_success")
+    assert (summary.blue_wins, summary.red_wins, summary.rounds_played) == (3, 1, 4)
+    assert summary.mission_results == "SFSS"
+    assert summary.roles.split(",") == [ROLES[pid] for pid in range(1, 8)]
+    assert (summary.assassin_pid, summary.assassination_target) == (6, 1)
+    assert summary.assassination_success
+    assert (summary.input_tokens, summary.output_tokens) == (70, 35)
+    # 分析列
+    assert db.session.get(Battle, battle.id).winner == "red"
+    seats = {
+        bp.position: bp for bp in BattlePlayer.query.filter_by(battle_id=battle.id)
+    }
+    assert (seats[1].role, seats[1].team) == ("Merlin", "blue")
+    assert (seats[6].role, seats[6].team) == ("Assassin", "red")
+
+
+def test_error_summary_names_the_player(make_players):
+    players = make_players(7)
+    (battle,) = create_battles([players], ranking_id=1)
+    result = BattleResult(
+        roles=dict(ROLES),
+        tokens=[{"input": 0, "output": 0}] * 7,
+        player_error=PlayerError(3, "walk", "critical_player_ERROR", "boom"),
+        error="玩家 3 报错",
+        traceback="Traceback ...",
+    )
+    assert apply_battle_results_batch([(battle.id, result)])[battle.id]
+
+    summary = _summary(battle.id)
+    assert summary.status == "error"
+    assert (summary.error_pid, summary.error_method) == (3, "walk")
+    assert summary.error_user_id == players[2]["user_id"]
+    assert summary.error_message == "boom"
+    assert summary.traceback == "Traceback ..."
+
+
+def test_cancelled_with_nested_reason(make_players):
+    (battle,) = create_battles([make_players(7)], ranking_id=1)
+    # BattleService 传入的是字典，结果中嵌套一层
+    assert mark_battle_as_cancelled(battle.id, {"cancellation_reason": "手动取消"})
+    assert _summary(battle.id).cancellation_reason == "手动取消"
+
+
+def test_missing_summary_is_backfilled(make_players):
+    (battle,) = create_battles([make_players(7)], ranking_id=1)
+    result = BattleResult(
+        roles=dict(ROLES), winner="blue", tokens=[{"input": 1, "output": 1}] * 7
+    )
+    assert apply_battle_results_batch([(battle.id, result)])[battle.id]
+    # 模拟本功能上线前结束的对战
+    db.session.delete(_summary(battle.id))
+    db.session.commit()
+
+    battle = db.session.get(Battle, battle.id)
+    assert json.loads(battle.results)["winner"] == "blue"
+    assert get_battle_summary(battle).winner == "blue"
+    assert _summary(battle.id) is not None
+
+
+def test_reopened_battle_drops_summary(make_players):
+    (battle,) = create_battles([make_players(7)], ranking_id=1)
+    assert mark_battle_as_cancelled(battle.id, "test")
+    assert _summary(battle.id) is not None
+
+    assert update_battle(db.session.get(Battle, battle.id), status="waiting")
+    assert _summary(battle.id) is None
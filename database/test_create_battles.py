@@ -0,0 +1,47 @@
+"""action.py: 批量创建对战 (create_battles) 的校验、ELO 快照与查询次数"""
+
+from database import create_battles, db
+from database.models import Battle, BattlePlayer
+from utils.sql_profiler import SqlProfiler, profile_sql
+
+
+def test_invalid_lineups_are_skipped(make_players):
+    players = make_players(8, elo_scores=[1000 + 10 * i for i in range(8)])
+    other_users_code = dict(players[0], ai_code_id=players[7]["ai_code_id"])
+    lineups = [
+        players[:7],
+        [other_users_code] + players[1:7],
+        [dict(players[0], user_id="missing")] + players[1:7],
+        [],
+        players[1:8],
+    ]
+
+    battles = create_battles(lineups, ranking_id=1)
+    assert [b is not None for b in battles] == [True, False, False, False, True]
+    assert Battle.query.count() == 2
+
+    seats = (
+        BattlePlayer.query.filter_by(battle_id=battles[4].id)
+        .order_by(BattlePlayer.position)
+        .all()
+    )
+    assert [bp.position for bp in seats] == list(range(1, 8))
+    assert [bp.user_id for bp in seats] == [p["user_id"] for p in players[1:8]]
+    # initial_elo 是创建时所属榜单的 ELO
+    assert [bp.initial_elo for bp in seats] == [1000 + 10 * i for i in range(1, 8)]
+    assert all(bp.battle_created_at == battles[4].created_at for bp in seats)
+
+
+def _queries(app, lineups):
+    app.extensions["sql_profiler"] = profiler = SqlProfiler()
+    with profile_sql("create_battles", force=True):
+        assert all(create_battles(lineups, ranking_id=1))
+    (record,) = profiler.recent()
+    return record["queries"]
+
+
+def test_query_count_does_not_grow_with_lineups(app, make_players):
+    players = make_players(7)
+    one = _queries(app, [players])
+    db.session.expire_all()
+    assert _queries(app, [players] * 6) == one
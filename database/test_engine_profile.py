@@ -0,0 +1,33 @@
+"""engine_profile.py: SQLite 连接 PRAGMA 与连接池选项"""
+
+from sqlalchemy import text
+
+from database import db
+from database.engine_profile import build_engine_options, sqlite_pragmas
+
+
+def test_file_database_connections_use_wal(app):
+    with db.engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 15000
+        # NORMAL = 1
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+    assert db.engine.pool.size() == 10
+
+
+def test_memory_database_only_sets_busy_timeout():
+    assert sqlite_pragmas({}, in_memory=True) == [("busy_timeout", 15000)]
+    assert build_engine_options({"SQLALCHEMY_DATABASE_URI": "sqlite://"}) == {}
+
+
+def test_explicit_options_win():
+    options = build_engine_options(
+        {
+            "SQLALCHEMY_DATABASE_URI": "postgresql://u@h/db",
+            "SQLALCHEMY_POOL_SIZE": 3,
+            "SQLALCHEMY_ENGINE_OPTIONS": {"pool_timeout": 5},
+        }
+    )
+    assert options["pool_size"] == 3
+    assert options["pool_timeout"] == 5
+    assert options["pool_pre_ping"]
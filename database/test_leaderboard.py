@@ -0,0 +1,106 @@
+"""leaderboard.py: 结算时的增量名次平移、过期重建与名次分页"""
+
+from database import apply_battle_results_batch, create_battles, db
+from database.leaderboard import (
+    _read_versions,
+    ensure_leaderboard,
+    get_filtered_leaderboard,
+    get_leaderboard,
+    get_user_rank,
+)
+from database.models import GameStats, LeaderboardEntry
+from game.battle_result import BattleResult
+
+ROLES = {
+    1: "Merlin",
+    2: "Percival",
+    3: "Knight",
+    4: "Knight",
+    5: "Morgana",
+    6: "Assassin",
+    7: "Oberon",
+}
+
+
+def _assert_matches_game_stats(ranking_id):
+    """物化榜单应与按 (elo_score 降序, user_id 升序) 重新编号的 GameStats 一致"""
+    stats = sorted(
+        GameStats.query.filter_by(ranking_id=ranking_id).all(),
+        key=lambda s: (-s.elo_score, s.user_id),
+    )
+    expected = [
+        (i + 1, s.user_id, s.elo_score, s.games_played) for i, s in enumerate(stats)
+    ]
+    entries = (
+        LeaderboardEntry.query.filter_by(ranking_id=ranking_id)
+        .order_by(LeaderboardEntry.position)
+        .all()
+    )
+    assert [
+        (e.position, e.user_id, e.elo_score, e.games_played) for e in entries
+    ] == expected
+
+
+def test_settlement_moves_players_incrementally(make_players):
+    # 分数交错，结算后胜方要越过其他玩家
+    players = make_players(12, elo_scores=[1180 + 4 * i for i in range(12)])
+    assert ensure_leaderboard(1)
+    _assert_matches_game_stats(1)
+
+    lineups = [players[:7], players[5:], players[:7]]
+    battles = create_battles(lineups, ranking_id=1)
+    for battle, winner in zip(battles, ("blue", "red", "red")):
+        result = BattleResult(
+            roles=dict(ROLES), winner=winner, tokens=[{"input": 1, "output": 1}] * 7
+        )
+        assert apply_battle_results_batch([(battle.id, result)])[battle.id]
+        # 结算路径自己维护了榜单，不应使其过期 (否则读取时会整榜重建)
+        game_stats_version, built_version = _read_versions(1)
+        assert built_version == game_stats_version + 1
+        _assert_matches_game_stats(1)
+
+
+def test_out_of_band_change_triggers_rebuild(make_players):
+    players = make_players(5)
+    ensure_leaderboard(1)
+
+    stats = GameStats.query.filter_by(user_id=players[3]["user_id"]).one()
+    stats.elo_score = 2000
+    db.session.commit()
+
+    assert get_user_rank(1, players[3]["user_id"])["rank"] == 1
+    _assert_matches_game_stats(1)
+
+
+def test_page_by_position_range(make_players):
+    make_players(10, elo_scores=[1300 - i for i in range(10)])
+
+    items, total = get_leaderboard(1, page=2, per_page=4)
+    assert total == 10
+    assert [item["rank"] for item in items] == [5, 6, 7, 8]
+
+
+def test_filtered_view_pages_by_rank_cursor(make_players):
+    players = make_players(10, elo_scores=[1300 - i for i in range(10)])
+    # 只有偶数名次的玩家满足场次条件
+    for i, player in enumerate(players):
+        GameStats.query.filter_by(user_id=player["user_id"]).one().games_played = (
+            5 if i % 2 == 0 else 0
+        )
+    db.session.commit()
+
+    first = get_filtered_leaderboard(1, 5, per_page=2)
+    assert [item["rank"] for item in first["items"]] == [1, 3]
+    assert first["has_next"] and not first["has_prev"]
+
+    second = get_filtered_leaderboard(1, 5, per_page=2, after=first["next_cursor"])
+    assert [item["rank"] for item in second["items"]] == [5, 7]
+    assert second["has_next"] and second["has_prev"]
+
+    last = get_filtered_leaderboard(1, 5, per_page=2, after=second["next_cursor"])
+    assert [item["rank"] for item in last["items"]] == [9]
+    assert not last["has_next"]
+
+    back = get_filtered_leaderboard(1, 5, per_page=2, before=second["prev_cursor"])
+    assert back["items"] == first["items"]
+    assert not back["has_prev"]
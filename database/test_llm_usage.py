@@ -0,0 +1,86 @@
+"""llm_usage.py: 耗时分桶、服务端聚合的分位数与错误率、降采样时间序列"""
+
+import json
+
+import numpy as np
+import pytest
+
+from database import (
+    get_usage_summary,
+    get_usage_timeseries,
+    prune_usage_samples,
+    record_usage_samples,
+)
+from database.llm_usage import (
+    LATENCY_BIN_COUNT,
+    LATENCY_BIN_RATIO,
+    choose_step,
+    import_usage_log,
+    latency_bin,
+    latency_bin_bounds,
+)
+
+
+def _entry(start, usage, client="c1", model="m1", **extra):
+    return dict(
+        client_id=client, model=model, start_time=start, usage_time=usage, **extra
+    )
+
+
+def test_latency_bins_cover_their_values():
+    for seconds in (0.001, 0.01, 0.5, 3.7, 120.0):
+        lower, upper = latency_bin_bounds(latency_bin(seconds))
+        assert lower <= seconds < upper
+    assert latency_bin(1e9) == LATENCY_BIN_COUNT - 1
+    assert choose_step(3600) == 30
+    assert choose_step(30 * 86400) == 6 * 3600
+    assert choose_step(365 * 86400) == 4 * 86400
+
+
+def test_percentiles_within_one_bin_of_numpy(app):
+    rng = np.random.default_rng(0)
+    latencies = rng.lognormal(0, 1, 2000)
+    entries = [_entry(1000 + i, float(t)) for i, t in enumerate(latencies)]
+    # 出错和未正常结束的调用只计入错误率
+    entries.append(_entry(1000, 99.0, error="TimeoutError"))
+    entries.append(_entry(1001, 99.0, completed=False, reason="released"))
+    entries.append({"client_id": "c1", "usage_time": "bad"})
+    assert record_usage_samples(entries) == 2002
+
+    overall = get_usage_summary(0, 10000)["overall"]
+    assert (overall["count"], overall["errors"]) == (2002, 2)
+    assert overall["max"] == pytest.approx(latencies.max())
+    assert overall["avg"] == pytest.approx(latencies.mean())
+    for q in (50, 95, 99):
+        expected = np.percentile(latencies, q)
+        assert overall[f"p{q}"] == pytest.approx(expected, rel=LATENCY_BIN_RATIO - 1)
+
+
+def test_grouping_filtering_and_timeseries(app):
+    record_usage_samples(
+        [_entry(100, 1.0), _entry(105, 2.0, model="m2"), _entry(170, 3.0)]
+        + [_entry(110, 4.0, client="c2")]
+    )
+    groups = get_usage_summary(0, 1000, group_by="model")["groups"]
+    assert [(g["model"], g["count"]) for g in groups] == [("m1", 3), ("m2", 1)]
+    assert get_usage_summary(0, 1000, client_id="c2")["overall"]["count"] == 1
+
+    result = get_usage_timeseries(95, 200, step=60, group_by="client")
+    assert result["start"] == 60
+    c1, c2 = result["series"]
+    assert c1["client_id"] == "c1"
+    assert [(p["t"], p["count"]) for p in c1["points"]] == [(60, 2), (120, 1)]
+    assert [(p["t"], p["max"]) for p in c2["points"]] == [(60, 4.0)]
+
+    assert prune_usage_samples(105) == 1
+    assert get_usage_summary(0, 1000)["overall"]["count"] == 3
+
+
+def test_legacy_log_is_imported_once(app, tmp_path):
+    path = tmp_path / "client_usage_times.json"
+    path.write_text(json.dumps([_entry(100, 1.0), _entry(101, 2.0)]))
+
+    assert import_usage_log(str(path)) == 2
+    assert import_usage_log(str(path)) == 0
+    assert (tmp_path / "client_usage_times.json.imported").exists()
+    assert get_usage_summary(0, 1000)["overall"]["count"] == 2
@@ -0,0 +1,81 @@
+"""promotion.py: 批量晋级前 N 名、目标榜单已有记录时重置 ELO、批量重置榜单"""
+
+from database import (
+    ACTIVE_PARTICIPANTS,
+    db,
+    get_data_version,
+    promote_from_multiple_rankings,
+    reset_rankings,
+)
+from database.models import GameStats
+from database.promotion import DEFAULT_NEW_ELO
+
+
+def _set_record(players, ranking_id, records):
+    """records: [(elo, wins, games_played)]，与 players 一一对应"""
+    for player, (elo, wins, games) in zip(players, records):
+        stats = GameStats.query.filter_by(
+            user_id=player["user_id"], ranking_id=ranking_id
+        ).one()
+        stats.elo_score, stats.wins, stats.games_played = elo, wins, games
+        stats.losses = games - wins
+    db.session.commit()
+
+
+def _members(ranking_id):
+    db.session.expire_all()
+    return {
+        s.user_id: s.elo_score for s in GameStats.query.filter_by(ranking_id=ranking_id)
+    }
+
+
+def test_promote_top_half_of_each_source(make_players):
+    first = make_players(4, ranking_id=1)
+    second = make_players(3, ranking_id=2)
+    # 没赢过的玩家不参与晋级
+    _set_record(first, 1, [(1300, 3, 5), (1250, 2, 5), (1100, 1, 5), (1400, 0, 5)])
+    _set_record(second, 2, [(1500, 4, 5), (1200, 1, 5), (1000, 1, 5)])
+    # 目标榜单中已有记录的玩家只重置 ELO
+    db.session.add(GameStats(user_id=second[0]["user_id"], ranking_id=3, elo_score=900))
+    db.session.commit()
+    version = get_data_version(ACTIVE_PARTICIPANTS)
+    calls = []
+
+    result = promote_from_multiple_rankings(
+        [1, 2], 3, progress=lambda *args: calls.append(args)
+    )
+    assert result["summary"] == {"success": 4, "total": 4, "errors": []}
+    assert _members(3) == {
+        first[0]["user_id"]: DEFAULT_NEW_ELO,
+        first[1]["user_id"]: DEFAULT_NEW_ELO,
+        second[0]["user_id"]: DEFAULT_NEW_ELO,
+        second[1]["user_id"]: DEFAULT_NEW_ELO,
+    }
+    assert get_data_version(ACTIVE_PARTICIPANTS) > version
+    assert [c[:2] for c in calls] == [(0, 2), (1, 2), (2, 2)]
+
+
+def test_empty_source_is_reported(make_players):
+    make_players(2, ranking_id=1)
+    result = promote_from_multiple_rankings([1], 3)
+    assert result["summary"]["success"] == 0
+    assert result["details"][1]["errors"]
+    assert _members(3) == {}
+
+
+def test_reset_rankings_stats_or_clear(make_players):
+    players = make_players(2, ranking_id=1)
+    make_players(2, ranking_id=2)
+    _set_record(players, 1, [(1500, 3, 4), (900, 0, 4)])
+
+    assert reset_rankings([1]) == {"1": "success"}
+    db.session.expire_all()
+    for stats in GameStats.query.filter_by(ranking_id=1):
+        assert (stats.elo_score, stats.games_played, stats.wins) == (
+            DEFAULT_NEW_ELO,
+            0,
+            0,
+        )
+
+    assert reset_rankings([1, 2], clear=True) == {"1": "success", "2": "success"}
+    assert GameStats.query.count() == 0
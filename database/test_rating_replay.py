@@ -0,0 +1,63 @@
+"""rating_replay.py: elo 引擎按对战历史重放，结果与线上逐场结算一致"""
+
+import pytest
+
+from database import apply_battle_results_batch, create_battles, db
+from database.models import GameStats
+from database.rating_replay import create_rating_engine, replay_ranking
+from game.battle_result import BattleResult
+
+ROLES = {
+    1: "Merlin",
+    2: "Percival",
+    3: "Knight",
+    4: "Knight",
+    5: "Morgana",
+    6: "Assassin",
+    7: "Oberon",
+}
+
+
+def _play(players):
+    """按顺序结算几场阵容交错、token 用量不同的对战，返回线上评分"""
+    lineups = [players[:7], players[2:9], players[1:8], players[:7]]
+    battles = create_battles(lineups, ranking_id=1)
+    for i, (battle, winner) in enumerate(zip(battles, ("blue", "red", "red", "blue"))):
+        result = BattleResult(
+            roles=dict(ROLES),
+            winner=winner,
+            tokens=[{"input": 100 * (seat + i), "output": 40 * seat} for seat in ROLES],
+        )
+        assert apply_battle_results_batch([(battle.id, result)])[battle.id]
+    db.session.expire_all()
+    return {s.user_id: s.elo_score for s in GameStats.query.filter_by(ranking_id=1)}
+
+
+def test_elo_replay_matches_live_settlement(make_players):
+    live = _play(make_players(9))
+
+    report = replay_ranking(1)
+    assert report["battles"] == 4
+    assert not report["applied"]
+    replayed = {p["user_id"]: p["replayed_rating"] for p in report["players"]}
+    assert replayed.keys() == live.keys()
+    for user_id, elo in live.items():
+        assert replayed[user_id] == pytest.approx(elo, abs=0.1)
+
+
+def test_apply_writes_back_replayed_ratings(make_players):
+    live = _play(make_players(9))
+    GameStats.query.filter_by(ranking_id=1).update({"elo_score": 1200})
+    db.session.commit()
+
+    assert replay_ranking(1, apply=True)["applied"]
+    db.session.expire_all()
+    for stats in GameStats.query.filter_by(ranking_id=1):
+        assert stats.elo_score == pytest.approx(live[stats.user_id], abs=1)
+
+
+def test_invalid_engine_raises():
+    with pytest.raises(ValueError):
+        create_rating_engine("unknown")
+    with pytest.raises(ValueError):
+        create_rating_engine("elo", no_such_param=1)
@@ -1,21 +1,21 @@
 import logging
-from queue import (
-    Queue,
-    Empty,
-    Full,
-)  # Import Empty and Full for specific exception handling
 from time import sleep, time
-from random import sample
 from typing import Dict, Any, Optional, List, Tuple, Set, FrozenSet
 import threading
 
 from flask import Flask
 
 from database import (
-    create_battle as db_create_battle,
+    create_battles as db_create_battles,
     get_active_ai_codes_by_ranking_ids,
+    get_battle_statuses,
+    get_ranking_rating_snapshot,
+    get_data_version,
+    ACTIVE_PARTICIPANTS,
 )
 from database.models import AICode
+from game.matchmaker import create_matchmaker
+from services import metrics
 from utils.battle_manager_utils import get_battle_manager
 
 logger = logging.getLogger("AutoMatch")
@@ -23,15 +23,15 @@ logger = logging.getLogger("AutoMatch")
 # --- Constants ---
 MAX_RETRY_DELAY_SECONDS = 60
 INITIAL_RETRY_DELAY_SECONDS = 1
-PARTICIPANT_REFRESH_INTERVAL_BATTLES = 10  # Refresh participants every N battles
-LOOP_SHORT_SLEEP_SECONDS = 0.1  # Short sleep to prevent tight loops when no work
-LOOP_POST_BATCH_SLEEP_SECONDS = 1  # Sleep after creating a batch of battles
-QUEUE_WAIT_TIMEOUT_SECONDS = (
-    5  # Timeout for getting from queue if we expect it to unblock
-)
-BATTLE_STATUS_POLL_INTERVAL_SECONDS = (
-    0.5  # How often to check battle status when waiting
-)
+# Every N battles the rating snapshot is refreshed and the participant version is
+# checked; the participant list itself is only refetched when the version changed.
+PARTICIPANT_REFRESH_INTERVAL_BATTLES = 10
+# Completion events wake the loop immediately, including battles run by other
+# processes (broadcast over Redis, see services/battle_events.py); this is only the
+# fallback interval for reconciling active battles against the database, e.g. when
+# Redis is unavailable or an event was missed.
+ACTIVE_BATTLES_RECONCILE_INTERVAL_SECONDS = 5
+ACTIVE_BATTLE_STATUSES = ("waiting", "playing")
 
 MAX_AUTOMATCH_PARALLEL_GAMES_PER_RANKING = 20
 PARTICIPANTS = 7
@@ -43,14 +43,20 @@ class AutoMatchInstance:
         self.ranking_id = ranking_id
         self.is_on = False
         self.battle_count = 0  # Total battles created by this instance since start
-        self.battle_queue = Queue(
-            parallel_games
-        )  # Stores IDs of battles that are supposed to be running
+        self.parallel_games = parallel_games
+        # IDs of battles started by this instance that have not finished yet
+        self.active_battles: Set[str] = set()
+        # Notified whenever a slot frees up (completion event) or the loop should wake
+        self._slot_condition = threading.Condition()
         self.loop_thread: Optional[threading.Thread] = None
         self.min_participants = PARTICIPANTS
         self._instance_lock = threading.RLock()
         self.current_participants: List[AICode] = []
         self._battles_since_last_refresh = 0
+        # ACTIVE_PARTICIPANTS version the current participant list was loaded at
+        self._participants_version: Optional[int] = None
+        # Lineup selection strategy, see game/matchmaker.py
+        self.matchmaker = create_matchmaker(app.config.get("AUTOMATCH_MATCHMAKER"))
 
         # Load participants once during initialization (initial load)
         self._refresh_participants()  # Call the new refresh method
@@ -60,11 +66,23 @@ class AutoMatchInstance:
         with self.app.app_context():
             try:
                 logger.info(f"[Rank-{self.ranking_id}] Refreshing participant list...")
+                # Read the version first so changes made during the fetch trigger another refresh
+                version = get_data_version(ACTIVE_PARTICIPANTS)
                 fresh_participants = get_active_ai_codes_by_ranking_ids(
                     ranking_ids=[self.ranking_id]
                 )
+                # Skip AI codes that are still being validated or failed validation
+                schedulable = [ai for ai in fresh_participants if ai.is_schedulable]
+                if len(schedulable) != len(fresh_participants):
+                    logger.info(
+                        f"[Rank-{self.ranking_id}] Skipping {len(fresh_participants) - len(schedulable)} AI codes pending or failing validation."
+                    )
+                fresh_participants = schedulable
+                ratings = get_ranking_rating_snapshot(self.ranking_id)
                 with self._instance_lock:  # Protect assignment
                     self.current_participants = fresh_participants
+                    self._participants_version = version
+                    self.matchmaker.update_ratings(ratings)
                     self._battles_since_last_refresh = 0  # Reset counter
                 logger.info(
                     f"[Rank-{self.ranking_id}] Refreshed participants. Loaded {len(self.current_participants)} active AI codes."
@@ -78,15 +96,115 @@ class AutoMatchInstance:
                 # with self._instance_lock:
                 #     self.current_participants = [] # Example: clear on error
 
+    def _refresh_ratings(self):
+        """Refreshes only the matchmaker's rating snapshot (participants unchanged)."""
+        with self.app.app_context():
+            ratings = get_ranking_rating_snapshot(self.ranking_id)
+            with self._instance_lock:
+                self.matchmaker.update_ratings(ratings)
+                self._battles_since_last_refresh = 0
+
     def _should_refresh_participants(self) -> bool:
-        """Determines if participants should be refreshed."""
+        """Determines if the participant version should be checked."""
         with self._instance_lock:  # Access shared counter
-            if not self.current_participants:  # Always refresh if list is empty
+            # Not enough participants: keep checking so new activations are picked up
+            if len(self.current_participants) < self.min_participants:
                 return True
             if self._battles_since_last_refresh >= PARTICIPANT_REFRESH_INTERVAL_BATTLES:
                 return True
         return False
 
+    def _participants_changed(self) -> bool:
+        """True if AI activation or ranking membership changed since the last fetch."""
+        with self.app.app_context():
+            version = get_data_version(ACTIVE_PARTICIPANTS)
+        with self._instance_lock:
+            return version is None or version != self._participants_version
+
+    def _on_battle_finished(self, battle_id: str, status: Optional[str]):
+        """BattleManager completion event: free the slot and wake the loop."""
+        with self._slot_condition:
+            if battle_id in self.active_battles:
+                self.active_battles.discard(battle_id)
+                logger.debug(
+                    f"[Rank-{self.ranking_id}] Battle {battle_id} finished ({status}). Slot freed."
+                )
+                self._slot_condition.notify_all()
+
+    def _reconcile_active_battles(self):
+        """Drop active battles whose database status is no longer running."""
+        with self._slot_condition:
+            battle_ids = list(self.active_battles)
+        if not battle_ids:
+            return
+        statuses = get_battle_statuses(battle_ids)
+        finished = [
+            battle_id
+            for battle_id in battle_ids
+            if statuses.get(battle_id) not in ACTIVE_BATTLE_STATUSES
+        ]
+        if finished:
+            with self._slot_condition:
+                self.active_battles.difference_update(finished)
+            logger.debug(
+                f"[Rank-{self.ranking_id}] Reconciled {len(finished)} finished battle(s) from database."
+            )
+
+    def _free_slots(self) -> int:
+        with self._slot_condition:
+            return self.parallel_games - len(self.active_battles)
+
+    def _start_battles(self, battle_manager, count: int) -> int:
+        """Create up to `count` battles in one transaction and queue them. Returns the number started."""
+        with self._instance_lock:  # For reading current_participants
+            if len(self.current_participants) < self.min_participants:
+                return 0
+            lineups = [
+                [
+                    {"user_id": ai_code.user_id, "ai_code_id": ai_code.id}
+                    for ai_code in self.matchmaker.select_lineup(
+                        self.current_participants, self.min_participants
+                    )
+                ]
+                for _ in range(count)
+            ]
+
+        battles = db_create_battles(
+            lineups,
+            ranking_id=self.ranking_id,
+            status="waiting",
+        )
+        started = 0
+        for battle, participant_data in zip(battles, lineups):
+            if not battle:
+                logger.error(
+                    f"[Rank-{self.ranking_id}] Failed to create battle, db_create_battles returned None."
+                )
+                continue
+
+            # Register before starting so a fast completion event is not missed
+            with self._slot_condition:
+                self.active_battles.add(battle.id)
+            with self._instance_lock:
+                self.battle_count += 1
+                self._battles_since_last_refresh += 1
+
+            if not battle_manager.start_battle(battle.id, participant_data):
+                # start_battle already marked the battle as error
+                with self._slot_condition:
+                    self.active_battles.discard(battle.id)
+                logger.error(
+                    f"[Rank-{self.ranking_id}] Failed to start battle {battle.id}."
+                )
+                continue
+
+            started += 1
+            logger.info(
+                f"[Rank-{self.ranking_id}] Started auto-match battle {self.battle_count} (ID: {battle.id}). "
+                f"Active: {len(self.active_battles)}/{self.parallel_games}"
+            )
+        return started
+
     def _loop(self):
         """Single ranking's background battle loop."""
         with self.app.app_context():  # Ensure app context for the whole loop if db calls are frequent
@@ -94,142 +212,74 @@ class AutoMatchInstance:
                 f"[Rank-{self.ranking_id}] Auto-match loop thread '{threading.current_thread().name}' started."
             )
             battle_manager = get_battle_manager()
+            battle_manager.subscribe_completion(self._on_battle_finished)
             retry_delay = INITIAL_RETRY_DELAY_SECONDS
+            last_reconcile = time()
 
-            while self.is_on:
-                try:
-                    # 1. Refresh participants if needed
-                    if self._should_refresh_participants():
-                        self._refresh_participants()
-
-                    # 2. Check participant count
-                    with self._instance_lock:  # Access current_participants safely
-                        num_current_participants = len(self.current_participants)
-
-                    if num_current_participants < self.min_participants:
-                        logger.info(
-                            f"[Rank-{self.ranking_id}] Insufficient participants ({num_current_participants}/{self.min_participants}). "
-                            f"Waiting {retry_delay}s before retrying participant check."
-                        )
-                        sleep(retry_delay)
-                        retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY_SECONDS)
-                        continue  # Go to next iteration to re-check/refresh
-
-                    # Reset retry_delay if participant check was successful
-                    retry_delay = INITIAL_RETRY_DELAY_SECONDS
-
-                    # 3. Create battles in batch if queue has space
-                    batch_size = 5
-                    battles_created_in_batch = 0
-
-                    # We can only create battles if the queue is not full.
-                    # qsize() is approximate, so loop while !full() is safer for adding.
-                    while (
-                        battles_created_in_batch < batch_size
-                        and not self.battle_queue.full()
-                    ):
-                        with self._instance_lock:  # For reading current_participants
-                            if len(self.current_participants) < self.min_participants:
-                                break  # Not enough participants for another battle in this batch
-                            # Sample from a copy to avoid issues if list changes during sampling (though lock helps)
-                            participants_ai_codes = sample(
-                                list(self.current_participants), self.min_participants
-                            )
-
-                        participant_data = [
-                            {"user_id": ai_code.user_id, "ai_code_id": ai_code.id}
-                            for ai_code in participants_ai_codes
-                        ]
-
-                        battle = db_create_battle(
-                            participant_data,
-                            ranking_id=self.ranking_id,
-                            status="waiting",
-                        )
-
-                        if not battle:
-                            logger.error(
-                                f"[Rank-{self.ranking_id}] Failed to create battle, db_create_battle returned None."
-                            )
-                            continue  # Try next battle creation in batch
-
-                        try:
-                            self.battle_queue.put_nowait(battle.id)  # Add to queue
-                            battles_created_in_batch += 1
-                            with self._instance_lock:
-                                self.battle_count += 1
-                                self._battles_since_last_refresh += 1
-
+            try:
+                while self.is_on:
+                    try:
+                        # 1. Refetch participants only if activation changed,
+                        #    otherwise just refresh the rating snapshot
+                        if self._should_refresh_participants():
+                            if self._participants_changed():
+                                self._refresh_participants()
+                            else:
+                                self._refresh_ratings()
+
+                        # 2. Check participant count
+                        with self._instance_lock:  # Access current_participants safely
+                            num_current_participants = len(self.current_participants)
+
+                        if num_current_participants < self.min_participants:
                             logger.info(
-                                f"[Rank-{self.ranking_id}] Started auto-match battle {self.battle_count} (ID: {battle.id}). "
-                                f"Queue size: {self.battle_queue.qsize()}"
-                            )
-                            battle_manager.start_battle(battle.id, participant_data)
-                        except Full:
-                            logger.warning(
-                                f"[Rank-{self.ranking_id}] Queue became full while trying to add battle {battle.id}. Batch interrupted."
-                            )
-                            # If db_create_battle created a battle but we can't queue it, it's an orphan.
-                            # This scenario should be rare if `not self.battle_queue.full()` check is effective.
-                            # Consider how to handle such an orphaned battle (e.g., try to cancel it).
-                            break  # Exit batch creation loop
-
-                    # 4. If queue is full, wait for a slot to free up.
-                    if self.battle_queue.full():
-                        logger.debug(
-                            f"[Rank-{self.ranking_id}] Battle queue is full ({self.battle_queue.qsize()}). Waiting for a slot..."
-                        )
-                        try:
-                            # Get a battle ID from the queue. This blocks until an item is available.
-                            # This ID represents a battle that *was* considered active.
-                            finished_battle_id = self.battle_queue.get(
-                                block=True, timeout=QUEUE_WAIT_TIMEOUT_SECONDS
-                            )
-
-                            # Now, explicitly wait for this specific battle to finish if it's still running.
-                            # The slot in the queue is already "freed" by the .get() call.
-                            status = battle_manager.get_battle_status(
-                                finished_battle_id
-                            )
-                            logger.debug(
-                                f"[Rank-{self.ranking_id}] Polled battle {finished_battle_id} from queue (status: {status})."
+                                f"[Rank-{self.ranking_id}] Insufficient participants ({num_current_participants}/{self.min_participants}). "
+                                f"Waiting {retry_delay}s before retrying participant check."
                             )
-
-                            while self.is_on and status in ["playing", "waiting"]:
-                                sleep(BATTLE_STATUS_POLL_INTERVAL_SECONDS)
-                                status = battle_manager.get_battle_status(
-                                    finished_battle_id
+                            sleep(retry_delay)
+                            retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY_SECONDS)
+                            continue  # Go to next iteration to re-check/refresh
+
+                        # 3. Refill every free slot immediately, as one batch
+                        free_slots = self._free_slots()
+                        if self.is_on and free_slots > 0:
+                            if not self._start_battles(battle_manager, free_slots):
+                                # Nothing could be started; back off instead of spinning
+                                sleep(retry_delay)
+                                retry_delay = min(
+                                    retry_delay * 2, MAX_RETRY_DELAY_SECONDS
                                 )
-                            logger.debug(
-                                f"[Rank-{self.ranking_id}] Battle {finished_battle_id} (final status: {status}) finished processing. Slot available."
-                            )
-                        except Empty:
-                            logger.warning(
-                                f"[Rank-{self.ranking_id}] Timed out waiting for item from supposedly full queue. Inconsistency?"
+                                continue
+
+                        # Reset retry_delay once participants are sufficient and slots are filled
+                        retry_delay = INITIAL_RETRY_DELAY_SECONDS
+
+                        # 4. Wait until a completion event frees a slot, falling back
+                        #    to a periodic reconciliation against the database.
+                        with self._slot_condition:
+                            self._slot_condition.wait_for(
+                                lambda: not self.is_on
+                                or len(self.active_battles) < self.parallel_games,
+                                timeout=ACTIVE_BATTLES_RECONCILE_INTERVAL_SECONDS,
                             )
-                            # This case implies the queue became not-full while we were waiting, or qsize/full is tricky.
-                        # No need to put the ID back. .get() removes it.
-
-                    # 5. Brief sleep
-                    if not self.is_on:
-                        break  # Check before sleep
-
-                    if battles_created_in_batch > 0:
-                        sleep(LOOP_POST_BATCH_SLEEP_SECONDS)
-                    else:
-                        # If no battles were created (e.g. queue was full, or not enough participants for a full batch but more than min)
-                        # Sleep a very short time to prevent tight spinning if conditions don't change immediately.
-                        sleep(LOOP_SHORT_SLEEP_SECONDS)
-
-                except Exception as e:
-                    logger.error(
-                        f"[Rank-{self.ranking_id}] Error in auto-match loop: {e}",
-                        exc_info=True,
-                    )
-                    if not self.is_on:
-                        break  # Check before sleep
-                    sleep(retry_delay)
-                    retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY_SECONDS)
+                        if (
+                            time() - last_reconcile
+                            >= ACTIVE_BATTLES_RECONCILE_INTERVAL_SECONDS
+                        ):
+                            last_reconcile = time()
+                            self._reconcile_active_battles()
+
+                    except Exception as e:
+                        logger.error(
+                            f"[Rank-{self.ranking_id}] Error in auto-match loop: {e}",
+                            exc_info=True,
+                        )
+                        if not self.is_on:
+                            break  # Check before sleep
+                        sleep(retry_delay)
+                        retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY_SECONDS)
+            finally:
+                battle_manager.unsubscribe_completion(self._on_battle_finished)
 
             logger.info(
                 f"[Rank-{self.ranking_id}] Auto-match loop thread '{threading.current_thread().name}' normally ended."
@@ -266,6 +316,8 @@ class AutoMatchInstance:
             return False
 
         self.is_on = False  # Signal the loop to stop
+        with self._slot_condition:
+            self._slot_condition.notify_all()  # Wake the loop if it is waiting
         logger.info(f"[Rank-{self.ranking_id}] Stopping auto-match...")
         if self.loop_thread and self.loop_thread.is_alive():
             self.loop_thread.join(timeout=10)  # Wait for the thread to finish
@@ -280,15 +332,18 @@ class AutoMatchInstance:
         with self._instance_lock:  # Ensure consistent read of shared data
             participants_count = len(self.current_participants)
             battle_c = self.battle_count
+        with self._slot_condition:
+            active_count = len(self.active_battles)
 
         return {
             "ranking_id": self.ranking_id,
             "is_on": self.is_on,
             "battle_count": battle_c,
-            "queue_size": self.battle_queue.qsize(),  # qsize is approximate but ok for status
-            "queue_max_size": self.battle_queue.maxsize,
+            "queue_size": active_count,  # battles started and not yet finished
+            "queue_max_size": self.parallel_games,
             "thread_alive": self.loop_thread.is_alive() if self.loop_thread else False,
             "current_participants_count": participants_count,
+            "matchmaker": self.matchmaker.name,
             "battles_since_last_refresh": self._battles_since_last_refresh,  # May need lock if read/write are not atomic
         }
 
@@ -301,6 +356,21 @@ class AutoMatchManager:
         self.app = app
         self.instances: Dict[int, AutoMatchInstance] = {}
         self.lock = threading.Lock()  # 用于同步对 instances 字典的访问
+        # 并发槽占用随本进程的指标快照上报 (自动对战只在启动它的进程中运行)
+        metrics.AUTOMATCH_SLOTS_USED.set_collector(self._slots_used)
+        metrics.AUTOMATCH_SLOTS_TOTAL.set_collector(self._slots_total)
+
+    def _slots_used(self) -> Dict[Tuple[int], int]:
+        return {
+            (ranking_id,): status["queue_size"]
+            for ranking_id, status in self.get_all_statuses().items()
+        }
+
+    def _slots_total(self) -> Dict[Tuple[int], int]:
+        return {
+            (ranking_id,): status["queue_max_size"] if status["is_on"] else 0
+            for ranking_id, status in self.get_all_statuses().items()
+        }
 
     def start_automatch_for_ranking(
         self,
@@ -310,7 +310,9 @@ class GameHelper:
                 # 发生异常时立即释放客户端
                 if client_id is not None:
                     try:
-                        self.client_manager.release_client(client_id)
+                        self.client_manager.release_client(
+                            client_id, error=type(e).__name__
+                        )
                         logger.info(f"Released client {client_id} after exception")
                         client_id = None  # 避免重复释放
                     except Exception as release_e:
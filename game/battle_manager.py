@@ -5,35 +5,36 @@
 
 import os
 import uuid
+import socket
 import logging
 import threading
 import multiprocessing
 import time
-import queue  # 确保在文件顶部已导入
-from queue import Queue
-from typing import Dict, Any, Optional, List, Tuple
+from datetime import datetime
+from typing import Callable, Dict, Any, Optional, List, Tuple
 
 # 导入裁判和观察者
 from .referee import AvalonReferee  # 确保导入正确
 from .observer import Observer  # 确保导入正确
 from services.battle_service import BattleService
+from services.battle_events import create_battle_event_bus
+from .concurrency_controller import ConcurrencyController
+from services import metrics
 
-# 导入装饰器
-from .decorator import DebugDecorator, settings
+# 导入调用追踪装饰器
+from .decorator import (
+    DebugDecorator,
+    dump_trace,
+    has_trace,
+    set_trace_sample_rate,
+    traced_battle_ids,
+)
 
 
 # 配置日志 (BattleManager 自身的日志)
 logger = logging.getLogger("BattleManager")
 
 
-try:
-    import psutil
-
-    PSUTIL_AVAILABLE = True
-except ImportError:
-    PSUTIL_AVAILABLE = False
-
-
 def calculate_optimal_threads():
     """根据CPU核心数计算最佳线程数量"""
     cpu_count = multiprocessing.cpu_count()
@@ -44,59 +45,14 @@ def calculate_optimal_threads():
 
 MAX_CONCURRENT_BATTLES = calculate_optimal_threads()  # 默认最大并发对战数
 
-
-# 添加自适应线程控制类
-class AdaptiveThreadPool:
-    """自适应线程池控制器"""
-
-    def __init__(self, initial_threads, min_threads=4, max_threads=32):
-        self.current_max_threads = initial_threads
-        self.min_threads = min_threads
-        self.max_threads = max_threads
-        self.active_threads = 0
-        self.last_adjustment_time = time.time()
-
-    def adjust_thread_limit(self):
-        """根据系统负载调整线程限制"""
-        if not PSUTIL_AVAILABLE:
-            return
-
-        # 限制调整频率
-        current_time = time.time()
-        if current_time - self.last_adjustment_time < 30:  # 至少30秒一次调整
-            return
-
-        self.last_adjustment_time = current_time
-
-        # 获取系统负载
-        cpu_usage = psutil.cpu_percent(interval=0.5)
-        memory_percent = psutil.virtual_memory().percent
-
-        # 根据负载调整线程数
-        if cpu_usage > 75 or memory_percent > 80:  # 高负载，减少线程
-            self._decrease_threads()
-        elif cpu_usage < 30 and memory_percent < 60:  # 低负载，增加线程
-            self._increase_threads()
-
-    def _increase_threads(self):
-        """增加线程数上限"""
-        if self.current_max_threads < self.max_threads:
-            self.current_max_threads = min(
-                self.current_max_threads + 2, self.max_threads
-            )
-            logger.info(f"系统负载低，增加最大线程数至 {self.current_max_threads}")
-
-    def _decrease_threads(self):
-        """减少线程数上限"""
-        if self.current_max_threads > self.min_threads:
-            self.current_max_threads = max(
-                self.current_max_threads - 2, self.min_threads
-            )
-            logger.info(f"系统负载高，减少最大线程数至 {self.current_max_threads}")
-
-    def get_max_threads(self):
-        """获取当前最大线程数"""
-        return self.current_max_threads
+# 持久化队列相关参数
+QUEUE_POLL_INTERVAL_SECONDS = 1.0  # 队列为空时工作线程的轮询间隔
+JOB_LEASE_SECONDS = 120  # 队列任务租约时长
+JOB_HEARTBEAT_INTERVAL_SECONDS = 30  # 心跳续约间隔，需明显小于租约时长
+CONCURRENCY_ADJUST_INTERVAL_SECONDS = 15  # 并发上限调整周期
+QUEUE_RECOVERY_INTERVAL_SECONDS = 60  # 回收过期租约的周期
+TRACE_SYNC_INTERVAL_SECONDS = 5  # 同步管理员设置的对战追踪开关和导出请求的周期
+MIN_CONCURRENT_BATTLES = 4
 
 
 class BattleManager:
@@ -109,6 +65,7 @@ class BattleManager:
         cls,
         battle_service: BattleService = None,
         max_concurrent_battles: int = MAX_CONCURRENT_BATTLES,
+        run_workers: bool = True,
     ):
         with cls._lock:
             if cls._instance is None:
@@ -121,6 +78,7 @@ class BattleManager:
                 # 将 service 存储在实例上，以便 __init__ 可以访问
                 cls._instance._battle_service = battle_service
                 cls._instance._max_concurrent_battles = max_concurrent_battles
+                cls._instance._run_workers = run_workers
                 cls._instance._initialized = False
             # 如果实例已存在，确保 service 一致性或忽略新的 service？
             elif (
@@ -136,6 +94,7 @@ class BattleManager:
         self,
         battle_service: BattleService = None,
         max_concurrent_battles: int = MAX_CONCURRENT_BATTLES,
+        run_workers: bool = True,
     ):
         if hasattr(self, "_initialized") and self._initialized:
             return
@@ -143,31 +102,69 @@ class BattleManager:
         # 从 _instance 获取 service
         self.battle_service: BattleService = self._instance._battle_service
         self.max_concurrent_battles = self._instance._max_concurrent_battles
+        # 为 False 时只入队和读取状态，对战由独立工作进程执行
+        self.run_workers = self._instance._run_workers
 
         # 初始化对战管理器
         self.battles: Dict[str, threading.Thread] = {}
         self.battle_results: Dict[str, Dict] = {}
         self.battle_status: Dict[str, str] = {}
         self.battle_observers: Dict[str, Observer] = {}
+        # 对战结束事件订阅者: callback(battle_id, status)
+        self._completion_subscribers: List[Callable[[str, Optional[str]], None]] = []
+        self._subscribers_lock = threading.Lock()
         self.data_dir = os.environ.get("AVALON_DATA_DIR", "./data")
 
-        # 添加线程控制信号量
+        # 关闭信号
         self._shutdown_event = threading.Event()
-        self._thread_lock = threading.Lock()
 
-        # 修改：限制队列大小为100
-        self.battle_queue = Queue(maxsize=100)
-        self.worker_threads = []
+        # 对战队列持久化在数据库中 (battle_jobs 表)，进程重启后不会丢失
+        # worker_id 作为租约持有者标识，区分不同进程及同一进程的不同生命周期
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leased_jobs: Dict[str, str] = {}  # job_id -> battle_id
+        self._leased_jobs_lock = threading.Lock()
+
+        # 对战结束事件经 Redis 广播，其他进程 (如仅入队模式的 Web 进程) 的订阅者也能收到
+        self.event_bus = create_battle_event_bus(
+            self.battle_service.app.config,
+            origin=self.worker_id,
+            on_event=self._notify_subscribers,
+        )
 
-        # 添加自适应线程池控制
-        self.thread_pool = AdaptiveThreadPool(
-            initial_threads=max_concurrent_battles,
-            min_threads=4,
-            max_threads=max_concurrent_battles,
+        # 并发控制：令牌池限制实际运行的对战数，上限由 AIMD 控制律动态调整
+        # max_concurrent_battles 只是硬上限
+        self.concurrency = ConcurrencyController(
+            max_limit=self.max_concurrent_battles,
+            min_limit=MIN_CONCURRENT_BATTLES,
         )
 
-        # 启动工作线程池
-        self._start_worker_threads()
+        self.dispatcher_thread = None
+        self.monitor_thread = None
+        self.heartbeat_thread = None
+        self.trace_thread = None
+        if self.run_workers:
+            self._start_worker_threads()
+
+        os.makedirs(self.data_dir, exist_ok=True)
+        if self.run_workers:
+            logger.info(
+                f"对战管理器初始化完成，数据目录：{self.data_dir}，最大并发对战数：{self.max_concurrent_battles}，初始并发上限：{self.concurrency.limit}"
+            )
+        else:
+            logger.info(
+                f"对战管理器初始化完成 (仅入队模式，对战由独立工作进程执行)，数据目录：{self.data_dir}"
+            )
+        self._initialized = True
+
+    def _start_worker_threads(self):
+        """启动调度、负载监控和租约心跳线程"""
+        self._register_llm_latency_source()
+
+        # 调度线程：获取令牌后领取队列任务，每个任务一个工作线程
+        self.dispatcher_thread = threading.Thread(
+            target=self._dispatch_loop, daemon=True, name="BattleDispatcher"
+        )
+        self.dispatcher_thread.start()
 
         # 添加监控线程
         self.monitor_thread = threading.Thread(
@@ -175,100 +172,235 @@ class BattleManager:
         )
         self.monitor_thread.start()
 
-        os.makedirs(self.data_dir, exist_ok=True)
-        logger.info(
-            f"对战管理器初始化完成，数据目录：{self.data_dir}，最大并发对战数：{self.max_concurrent_battles}"
+        # 租约心跳线程
+        self.heartbeat_thread = threading.Thread(
+            target=self._heartbeat_leases, daemon=True, name="LeaseHeartbeat"
         )
-        self._initialized = True
+        self.heartbeat_thread.start()
 
-    def _start_worker_threads(self):
-        """启动工作线程池处理对战队列"""
-        with self._thread_lock:
-            for i in range(self.max_concurrent_battles):
-                thread = threading.Thread(
-                    target=self._battle_worker,
-                    name=f"BattleWorker-{i}",
-                    daemon=True,  # 设为守护线程，随主程序退出
-                )
-                thread.start()
-                self.worker_threads.append(thread)
-                logger.info(f"工作线程 {thread.name} 已启动")
+        # 对战追踪同步线程
+        self.trace_thread = threading.Thread(
+            target=self._sync_traces_loop, daemon=True, name="TraceSync"
+        )
+        self.trace_thread.start()
 
-    def _battle_worker(self):
-        """工作线程：从队列获取对战任务并执行"""
-        # 设置较低的线程优先级
+    def _register_llm_latency_source(self):
+        """将 LLM 调用耗时接入并发控制器和调用记录写线程"""
         try:
-            import os
+            from .client_manager import get_client_manager
+
+            client_manager = get_client_manager()
+            client_manager.add_usage_listener(self._record_llm_latency)
+            client_manager.add_usage_listener(metrics.record_llm_usage)
+            # 调用记录写入数据库后不再追加 client_usage_times.json
+            client_manager.add_usage_listener(self.battle_service.usage_recorder.submit)
+            client_manager.set_file_logging(False)
+        except Exception as e:
+            logger.warning(f"无法接入 LLM 延迟信号，并发控制仅参考系统负载: {e}")
+
+    def _record_llm_latency(self, entry: Dict[str, Any]):
+        # 超时被强制回收的会话不作为延迟信号
+        if entry.get("completed", True):
+            self.concurrency.record_llm_latency(entry["usage_time"])
+
+    def _dispatch_loop(self):
+        """调度线程：按并发令牌从持久化队列领取对战任务"""
+        while not self._shutdown_event.is_set():
+            # 使用超时，以便线程能够定期检查关闭信号
+            if not self.concurrency.acquire(timeout=1.0):
+                continue
+            job = self.battle_service.claim_battle_job(
+                self.worker_id, JOB_LEASE_SECONDS
+            )
+            if job is None:
+                # 队列为空，归还令牌并等待一段时间
+                self.concurrency.release()
+                self._shutdown_event.wait(QUEUE_POLL_INTERVAL_SECONDS)
+                continue
+            # 令牌数即并发上限，这里按任务创建线程，线程随任务结束退出
+            thread = threading.Thread(
+                target=self._run_job,
+                args=(job,),
+                name=f"BattleWorker-{job['battle_id'][:8]}",
+                daemon=True,  # 设为守护线程，随主程序退出
+            )
+            thread.start()
 
+    def _run_job(self, job: Dict[str, Any]):
+        """工作线程：执行任务，结束后归还并发令牌"""
+        # 设置较低的线程优先级
+        try:
             os.nice(10)  # 增加nice值，降低优先级（仅限UNIX系统）
         except:
             pass
 
-        while not self._shutdown_event.is_set():
+        try:
+            self._process_job(job)
+        finally:
+            self.concurrency.release()
+
+    def _process_job(self, job: Dict[str, Any]):
+        """执行一个已领取的队列任务，并在结束后确认"""
+        job_id = job["id"]
+        battle_id = job["battle_id"]
+        participant_data = job["participant_data"]
+        error_message = None
+        started_at = None
+
+        with self._leased_jobs_lock:
+            self._leased_jobs[job_id] = battle_id
+
+        try:
+            # 对战可能在排队期间被取消或已由其他工作者完成，此时只需确认任务
+            db_status = self.battle_service.get_battle_db_status(battle_id)
+            if db_status not in ["waiting", "playing"]:
+                logger.info(f"对战 {battle_id} 状态为 {db_status}，跳过执行")
+                return
+
+            if job["attempts"] > 1:
+                logger.warning(
+                    f"对战 {battle_id} 第 {job['attempts']} 次尝试执行 (上次租约已过期)"
+                )
+
+            ranking = metrics.ranking_label(
+                self.battle_service.get_battle_ranking_id(battle_id)
+            )
+            if job.get("created_at"):
+                metrics.BATTLE_QUEUE_WAIT.observe(
+                    (
+                        datetime.now() - datetime.fromisoformat(job["created_at"])
+                    ).total_seconds(),
+                    ranking=ranking,
+                )
+
+            self.battles[battle_id] = True
+            self.battle_status[battle_id] = "waiting"
+            logger.info(f"工作线程开始处理对战 {battle_id}")
+            started_at = time.time()
+            self._execute_battle(battle_id, participant_data)
+        except Exception as e:
+            logger.exception(f"处理对战 {battle_id} 时发生异常: {str(e)}")
+            error_message = str(e)
+            # 确保对战状态被标记为错误
+            self.battle_status[battle_id] = "error"
+            self.battle_results[battle_id] = {
+                "error": f"处理对战任务时发生异常: {str(e)}"
+            }
+            self.battle_service.mark_battle_as_error(
+                battle_id, {"error": f"对战任务处理异常: {str(e)}"}
+            )
+            metrics.BATTLE_ERRORS.inc(error_type="exception")
+        finally:
+            if started_at is not None:
+                metrics.BATTLE_DURATION.observe(
+                    time.time() - started_at, ranking=ranking
+                )
+                metrics.BATTLES_FINISHED.inc(
+                    ranking=ranking,
+                    status=self.battle_status.get(battle_id) or "unknown",
+                )
+            self.battle_service.ack_battle_job(
+                job_id, self.worker_id, error_message is None, error_message
+            )
+            with self._leased_jobs_lock:
+                self._leased_jobs.pop(job_id, None)
+            logger.info(f"完成对战 {battle_id} 处理")
+            self._publish_completion(battle_id, self.battle_status.get(battle_id))
+
+    def subscribe_completion(self, callback: Callable[[str, Optional[str]], None]):
+        """订阅对战结束事件 (完成、出错或取消)，回调参数为 (battle_id, status)"""
+        with self._subscribers_lock:
+            if callback not in self._completion_subscribers:
+                self._completion_subscribers.append(callback)
+
+    def unsubscribe_completion(self, callback: Callable[[str, Optional[str]], None]):
+        """取消订阅对战结束事件"""
+        with self._subscribers_lock:
+            if callback in self._completion_subscribers:
+                self._completion_subscribers.remove(callback)
+
+    def _publish_completion(self, battle_id: str, status: Optional[str]):
+        """向本进程的订阅者发布对战结束事件，并广播给其他进程"""
+        self._notify_subscribers(battle_id, status)
+        self.event_bus.publish(battle_id, status)
+
+    def _notify_subscribers(self, battle_id: str, status: Optional[str]):
+        """回调在工作线程 (或事件订阅线程) 中执行，应尽快返回"""
+        with self._subscribers_lock:
+            subscribers = list(self._completion_subscribers)
+        for callback in subscribers:
             try:
-                # 使用超时，以便线程能够定期检查关闭信号
-                battle_id, participant_data = self.battle_queue.get(timeout=1.0)
-                try:
-                    logger.info(f"工作线程开始处理对战 {battle_id}")
-                    self._execute_battle(battle_id, participant_data)
-                except Exception as e:
-                    logger.exception(f"处理对战 {battle_id} 时发生异常: {str(e)}")
-                    # 确保对战状态被标记为错误
-                    self.battle_status[battle_id] = "error"
-                    self.battle_results[battle_id] = {
-                        "error": f"处理对战任务时发生异常: {str(e)}"
-                    }
-                    self.battle_service.mark_battle_as_error(
-                        battle_id, {"error": f"对战任务处理异常: {str(e)}"}
-                    )
-                finally:
-                    self.battle_queue.task_done()
-                    logger.info(f"完成对战 {battle_id} 处理")
-            except queue.Empty:  # 使用queue.Empty
-                # 队列为空，继续等待
+                callback(battle_id, status)
+            except Exception as e:
+                logger.warning(f"对战 {battle_id} 结束事件回调出错: {e}")
+
+    def _heartbeat_leases(self):
+        """定期为本进程持有的任务续约，进程崩溃后租约会自然过期"""
+        while not self._shutdown_event.wait(JOB_HEARTBEAT_INTERVAL_SECONDS):
+            with self._leased_jobs_lock:
+                job_ids = list(self._leased_jobs.keys())
+            if not job_ids:
                 continue
+            renewed = self.battle_service.heartbeat_battle_jobs(
+                self.worker_id, job_ids, JOB_LEASE_SECONDS
+            )
+            if renewed != len(job_ids):
+                logger.warning(
+                    f"租约续约不完整: 持有 {len(job_ids)} 个任务，续约成功 {renewed} 个"
+                )
 
-    def _adjust_worker_threads(self, target_count):
-        """根据目标线程数调整工作线程数量"""
-        with self._thread_lock:
-            current_count = len(self.worker_threads)
-
-            # 移除不活跃线程
-            self.worker_threads = [t for t in self.worker_threads if t.is_alive()]
-
-            if len(self.worker_threads) < target_count:
-                # 需要增加线程
-                for i in range(len(self.worker_threads), target_count):
-                    thread = threading.Thread(
-                        target=self._battle_worker,
-                        name=f"BattleWorker-{i}",
-                        daemon=True,
-                    )
-                    thread.start()
-                    self.worker_threads.append(thread)
-                    logger.info(
-                        f"已增加工作线程 {thread.name}，当前线程数: {len(self.worker_threads)}"
-                    )
+    def _sync_traces_loop(self):
+        """定期同步本进程执行的对战 (及保留追踪记录的对战) 的追踪设置"""
+        while not self._shutdown_event.wait(TRACE_SYNC_INTERVAL_SECONDS):
+            with self._leased_jobs_lock:
+                running = list(self._leased_jobs.values())
+            self._sync_traces(running, traced_battle_ids())
+
+    def _sync_traces(self, running: List[str], traced: List[str] = ()):
+        """应用管理员设置的采样率，处理未完成的导出请求"""
+        battle_ids = set(running) | set(traced)
+        if not battle_ids:
+            return
+        traces = self.battle_service.get_battle_traces(battle_ids)
+        if traces is None:
+            return
+        for battle_id in running:
+            trace = traces.get(battle_id)
+            set_trace_sample_rate(battle_id, trace["sample_rate"] if trace else None)
+        for battle_id, trace in traces.items():
+            if trace["dump_pending"] and has_trace(battle_id):
+                self.dump_battle_trace(battle_id)
+
+    def dump_battle_trace(self, battle_id: str) -> Optional[str]:
+        """导出本进程中对战的追踪记录，返回文件路径 (没有记录时返回 None)"""
+        try:
+            path, records = dump_trace(battle_id, self.data_dir)
+        except OSError as e:
+            logger.error(f"导出对战 {battle_id} 的追踪记录失败: {e}")
+            return None
+        if path is not None:
+            logger.info(f"对战 {battle_id} 的 {records} 条追踪记录已导出到 {path}")
+            self.battle_service.record_battle_trace_dump(battle_id, path, records)
+        return path
+
+    def _create_observer(self, battle_id: str) -> Observer:
+        """创建对战观察者并登记到内存中"""
+        battle_observer = Observer(battle_id)
 
-            # 注意：不主动终止线程，而是让它们自然结束
-            # 当线程池缩小时，多余的线程会在处理完当前任务后自动退出
+        # 调用追踪 (按对战的采样率记录，默认关闭)
+        battle_observer = DebugDecorator(battle_id).decorate_instance(battle_observer)
+
+        self.battle_observers[battle_id] = battle_observer
+        return battle_observer
 
     def start_battle(
         self, battle_id: str, participant_data: List[Dict[str, str]]
     ) -> bool:
         """
-        将对战添加到队列中等待处理
+        将对战添加到持久化队列中等待处理
         返回：是否成功加入队列
         """
-        battle_observer = Observer(battle_id)
-
-        # 装饰器
-        if settings["observer.Observer"] == 1:
-            # 装饰实例
-            dec = DebugDecorator(battle_id)
-            battle_observer = dec.decorate_instance(battle_observer)
-
-        self.battle_observers[battle_id] = battle_observer
+        self._create_observer(battle_id)
 
         self.battle_observers[battle_id].make_snapshot(
             "BattleManager", (0, "adding battle to queue")
@@ -351,17 +483,18 @@ class BattleManager:
             )
             return False
 
-        # 添加到队列 - 使用补全后的参与者数据
-        self.battle_queue.put((battle_id, enhanced_participant_data))
-        self.battle_status[battle_id] = "waiting"
-        self.battles[battle_id] = True  # 标记为有效对战，但不再存储线程对象
+        # 添加到持久化队列 - 使用补全后的参与者数据
+        if not self.battle_service.enqueue_battle(battle_id, enhanced_participant_data):
+            logger.error(f"对战 {battle_id} 写入持久化队列失败")
+            self.battle_service.mark_battle_as_error(
+                battle_id, {"error": "对战写入队列失败"}
+            )
+            return False
+        # 不缓存 "waiting"：任务可能由其他进程领取，状态以数据库为准
 
-        logger.info(
-            f"对战 {battle_id} 已加入队列，当前队列大小: {self.battle_queue.qsize()}"
-        )
+        logger.info(f"对战 {battle_id} 已加入持久化队列")
         self.battle_observers[battle_id].make_snapshot(
-            "BattleManager",
-            (0, f"对战已加入队列，等待处理。队列大小: {self.battle_queue.qsize()}"),
+            "BattleManager", (0, "对战已加入队列，等待处理。")
         )
         return True
 
@@ -370,7 +503,12 @@ class BattleManager:
         执行对战的核心逻辑
         由工作线程调用，不直接暴露给外部
         """
+        # 任务可能由其他进程入队 (或重启后恢复)，此时本进程尚无观察者
         battle_observer = self.battle_observers.get(battle_id)
+        if battle_observer is None:
+            battle_observer = self._create_observer(battle_id)
+        # 对战开始前应用管理员预先设置的追踪采样率
+        self._sync_traces([battle_id])
 
         try:
             # 1. 更新状态为 playing
@@ -418,20 +556,25 @@ class BattleManager:
                 battle_service=self.battle_service,  # 服务对象
             )
 
-            # 装饰器
-            if settings["referee.AvalonReferee"] == 1:
-                # 装饰实例
-                dec = DebugDecorator(battle_id)
-                referee = dec.decorate_instance(referee)
+            # 调用追踪 (按对战的采样率记录，默认关闭)
+            referee = DebugDecorator(battle_id).decorate_instance(referee)
 
             # 4. 运行游戏
-            result_data = referee.run_game()
+            result = referee.run_game()
+
+            # 对战可能在执行期间被其他进程取消，不再写入结果
+            if self.battle_service.get_battle_db_status(battle_id) == "cancelled":
+                logger.info(f"对战 {battle_id} 已在执行期间被取消，不写入结果")
+                self.battle_status[battle_id] = "cancelled"
+                return
 
             # 5. 记录内存结果
-            self.battle_results[battle_id] = result_data
+            self.battle_results[battle_id] = result.to_dict()
+            if result.player_error is not None:
+                metrics.BATTLE_SUSPENDED.inc(error_type=result.player_error.error_type)
 
             # 检查结果是否正常完成
-            if "error" not in result_data and result_data.get("winner") is not None:
+            if not result.is_error and result.winner is not None:
                 # 正常完成
                 self.battle_status[battle_id] = "completed"
                 self.get_snapshots_archive(battle_id)  # 保存快照
@@ -440,7 +583,7 @@ class BattleManager:
                 )
 
                 # 更新数据库
-                if self.battle_service.mark_battle_as_completed(battle_id, result_data):
+                if self.battle_service.mark_battle_as_completed(battle_id, result):
                     self.battle_service.log_info(f"对战 {battle_id} 完成，结果已处理")
                 else:
                     self.battle_service.log_error(
@@ -454,9 +597,18 @@ class BattleManager:
                 self.get_snapshots_archive(battle_id)
 
                 # 错误处理
-                if "error" in result_data:
+                if result.is_error:
                     self.battle_status[battle_id] = "error"
-                    self.battle_service.mark_battle_as_error(battle_id, result_data)
+                    self.battle_service.mark_battle_as_error(battle_id, result)
+                    metrics.BATTLE_ERRORS.inc(
+                        error_type=(
+                            result.player_error.error_type
+                            if result.player_error is not None
+                            else "referee"
+                        )
+                    )
+                    if has_trace(battle_id):
+                        self.dump_battle_trace(battle_id)
                 else:
                     self.battle_service.log_info(
                         f"对战 {battle_id} 非正常结束，但未发现错误，保持原状态"
@@ -472,9 +624,13 @@ class BattleManager:
             error_result = {"error": f"对战执行失败: {str(e)}"}
             self.battle_results[battle_id] = error_result
             self.battle_service.mark_battle_as_error(battle_id, error_result)
+            metrics.BATTLE_ERRORS.inc(error_type="exception")
+            if has_trace(battle_id):
+                self.dump_battle_trace(battle_id)
 
         finally:
-            # 清理
+            # 清理 (追踪记录保留在内存中，可按需导出)
+            set_trace_sample_rate(battle_id, None)
             if battle_id in self.battles:
                 del self.battles[battle_id]
             self.battle_service.log_info(f"对战 {battle_id} 处理完成")
@@ -485,12 +641,6 @@ class BattleManager:
 
                 helper = get_current_helper()
 
-                # 装饰器
-                if settings["avalon_game_helper.GameHelper"] == 1:
-                    # 装饰实例
-                    dec = DebugDecorator(battle_id)
-                    helper = dec.decorate_instance(helper)
-
                 if hasattr(helper, "client_manager"):
                     # 获取当前线程ID，清理相关会话
                     current_thread_id = threading.current_thread().ident
@@ -500,16 +650,40 @@ class BattleManager:
 
     def get_queue_status(self) -> dict:
         """获取队列状态信息"""
+        queue_stats = self.battle_service.get_battle_queue_stats()
+        with self._leased_jobs_lock:
+            leased_here = len(self._leased_jobs)
         return {
-            "queue_size": self.battle_queue.qsize(),
-            "worker_threads": len(self.worker_threads),
+            "queue_size": queue_stats.get("queued", 0),
+            "leased_jobs": queue_stats.get("leased", 0),
+            "leased_jobs_local": leased_here,
+            "oldest_queued_seconds": queue_stats.get("oldest_queued_seconds", 0),
+            "worker_id": self.worker_id,
+            "run_workers": self.run_workers,
+            "running_battles": self.concurrency.in_flight,
+            "concurrency_limit": self.concurrency.limit,
             "max_concurrent_battles": self.max_concurrent_battles,
         }
 
-    # 以下方法保持不变
+    def _is_leased_here(self, battle_id: str) -> bool:
+        """本进程是否持有该对战的队列任务租约 (即对战在本进程中执行)"""
+        with self._leased_jobs_lock:
+            return battle_id in self._leased_jobs.values()
+
     def get_battle_status(self, battle_id: str) -> Optional[str]:
-        """获取对战状态 (优先从内存获取)"""
-        return self.battle_status.get(battle_id)
+        """
+        获取对战状态
+
+        内存中的状态只在对战由本进程执行 (持有租约) 或已结束时可信；
+        对战可能被其他进程 (其他 gunicorn 工作者、独立工作进程) 领取，
+        此时从数据库读取。
+        """
+        status = self.battle_status.get(battle_id)
+        if status in ("completed", "error", "cancelled") or self._is_leased_here(
+            battle_id
+        ):
+            return status
+        return self.battle_service.get_battle_db_status(battle_id) or status
 
     def get_snapshots_queue(self, battle_id: str) -> List[Dict[str, Any]]:
         """获取并清空游戏快照队列"""
@@ -567,54 +741,43 @@ class BattleManager:
             logger.error(f"对战 {battle_id} 取消失败：无法更新数据库状态")
             return False
 
+        # 尚未执行的队列任务不再被领取
+        self.battle_service.cancel_battle_job(battle_id)
+
         # 更新内存状态
         self.battle_status[battle_id] = "cancelled"
         self.battle_results[battle_id] = cancel_data
 
         logger.info(f"对战 {battle_id} 已成功取消：{reason}")
+        self._publish_completion(battle_id, "cancelled")
         return True
 
     def _monitor_system_load(self):
-        """监控系统负载并调整线程池大小"""
-        while True:
+        """监控负载并调整并发上限，同时定期回收过期租约"""
+        last_recovery = time.time()
+        while not self._shutdown_event.wait(CONCURRENCY_ADJUST_INTERVAL_SECONDS):
             try:
-                self.thread_pool.adjust_thread_limit()
-                # 动态调整工作线程数量
-                current_max = self.thread_pool.get_max_threads()
-                if current_max != self.max_concurrent_battles:
-                    old_max = self.max_concurrent_battles
-                    self.max_concurrent_battles = current_max
-                    logger.info(
-                        f"调整最大并发对战数：{old_max} -> {self.max_concurrent_battles}"
-                    )
-
-                    # 调整实际工作线程数量
-                    self._adjust_worker_threads(self.max_concurrent_battles)
+                self.concurrency.adjust()
 
-                # 定期清理已结束的线程
-                if len(self.worker_threads) > self.max_concurrent_battles:
-                    with self._thread_lock:
-                        self.worker_threads = [
-                            t for t in self.worker_threads if t.is_alive()
-                        ]
-                    logger.info(f"清理后的工作线程数量: {len(self.worker_threads)}")
-
-                time.sleep(60)  # 每分钟检查一次
+                # 回收其他进程遗留的过期租约
+                if time.time() - last_recovery >= QUEUE_RECOVERY_INTERVAL_SECONDS:
+                    last_recovery = time.time()
+                    self.battle_service.recover_battle_queue(include_orphans=False)
             except Exception as e:
                 logger.error(f"监控系统负载时出错: {str(e)}")
-                time.sleep(120)  # 出错时延长休眠时间
+
+    def get_concurrency_status(self) -> dict:
+        """获取并发控制器状态及最近的调整决策"""
+        return self.concurrency.get_status()
 
     def shutdown(self):
         """优雅关闭对战管理器"""
         logger.info("正在关闭对战管理器...")
         self._shutdown_event.set()
 
-        # 等待所有任务完成
-        self.battle_queue.join()
-
-        # 等待所有线程结束
-        for thread in self.worker_threads:
-            if thread.is_alive():
-                thread.join(timeout=1.0)
+        # 正在执行的任务不等待完成：租约过期后会由其他工作者重新领取
+        if self.dispatcher_thread:
+            self.dispatcher_thread.join(timeout=2.0)
+        self.event_bus.shutdown()
 
         logger.info("对战管理器已关闭")
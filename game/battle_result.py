@@ -0,0 +1,120 @@
+"""
+对战结果对象 - 裁判直接交给结算流程的结构化结果
+
+裁判在对局过程中已经掌握胜负、角色、报错玩家和 token 用量，
+结算 (ELO、玩家胜负) 只依赖这里的字段，不再回读公共日志文件。
+to_dict() 的输出保持原有结果字典的键，写入 Battle.results 和前端接口。
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# 由玩家代码引起、需要对该玩家扣分的错误类型
+PLAYER_ERROR_TYPES = ("critical_player_ERROR", "player_ruturn_ERROR")
+
+PLAYER_COUNT = 7
+
+
+@dataclass
+class PlayerError:
+    """suspend_game 记录的报错信息，pid 为 0 表示裁判自身出错"""
+
+    pid: int
+    method: str
+    error_type: str
+    message: str = ""
+
+    @property
+    def is_player_fault(self) -> bool:
+        """是否应归咎于某个玩家 (影响 ELO 扣分)"""
+        return self.error_type in PLAYER_ERROR_TYPES and 1 <= self.pid <= PLAYER_COUNT
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "type": self.error_type,
+            "error_code_pid": self.pid,
+            "error_code_method": self.method,
+            "error_msg": self.message,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PlayerError":
+        return cls(
+            pid=data.get("error_code_pid") or 0,
+            method=data.get("error_code_method"),
+            error_type=data.get("type"),
+            message=data.get("error_msg", ""),
+        )
+
+
+@dataclass
+class BattleResult:
+    """一局游戏的结果"""
+
+    blue_wins: int = 0
+    red_wins: int = 0
+    rounds_played: int = 0
+    roles: Dict[int, str] = field(default_factory=dict)
+    public_log_file: Optional[str] = None
+    winner: Optional[str] = None  # "red" / "blue"，未分出胜负为 None
+    win_reason: Optional[str] = None
+    # 各玩家 token 用量，按 player_id 1-7 排列: [{"input": 0, "output": 0}, ...]
+    tokens: List[Dict[str, int]] = field(default_factory=list)
+    # 各轮任务是否成功，按轮次排列
+    mission_results: List[bool] = field(default_factory=list)
+    # 刺杀阶段结果 {"assassin": pid, "target": pid, "success": bool}，未进入刺杀为 None
+    assassination: Optional[Dict[str, Any]] = None
+    player_error: Optional[PlayerError] = None
+    error: Optional[str] = None
+    traceback: Optional[str] = None
+    game_log_uuid: Optional[str] = None
+
+    @property
+    def is_error(self) -> bool:
+        return self.error is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为原有格式的结果字典 (可 JSON 序列化)"""
+        data = {
+            "blue_wins": self.blue_wins,
+            "red_wins": self.red_wins,
+            "rounds_played": self.rounds_played,
+            "roles": dict(self.roles),
+            "public_log_file": self.public_log_file,
+            "tokens": list(self.tokens),
+            "mission_results": list(self.mission_results),
+        }
+        if self.assassination is not None:
+            data["assassination"] = dict(self.assassination)
+        if self.error is None:
+            data["winner"] = self.winner
+            data["win_reason"] = self.win_reason
+        else:
+            data["error"] = self.error
+            data["traceback"] = self.traceback
+        if self.player_error is not None:
+            data["player_error"] = self.player_error.to_dict()
+        if self.game_log_uuid is not None:
+            data["game_log_uuid"] = self.game_log_uuid
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BattleResult":
+        """从结果字典构造 (兼容旧格式，缺失字段取默认值)"""
+        player_error = data.get("player_error")
+        return cls(
+            blue_wins=data.get("blue_wins", 0),
+            red_wins=data.get("red_wins", 0),
+            rounds_played=data.get("rounds_played", 0),
+            roles=data.get("roles") or {},
+            public_log_file=data.get("public_log_file"),
+            winner=data.get("winner"),
+            win_reason=data.get("win_reason"),
+            tokens=data.get("tokens") or [],
+            mission_results=data.get("mission_results") or [],
+            assassination=data.get("assassination"),
+            player_error=PlayerError.from_dict(player_error) if player_error else None,
+            error=data.get("error"),
+            traceback=data.get("traceback"),
+            game_log_uuid=data.get("game_log_uuid"),
+        )
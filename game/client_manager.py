@@ -102,6 +102,8 @@ class ClientManager:
             )
             self._log_write_interval = 10  # 每10次释放操作写入一次文件
             self._log_write_counter = 0
+            self._usage_listeners = []  # 使用记录监听者，例如并发控制器
+            self._file_logging = True  # 为 False 时使用记录只交给监听者，不写入文件
 
             # 注册退出处理函数
             atexit.register(self._write_logs_on_exit)
@@ -314,8 +316,8 @@ class ClientManager:
                 client_item.client_model_name,
             )
 
-    def release_client(self, client_id_with_session):
-        """释放一个client实例"""
+    def release_client(self, client_id_with_session, error=None):
+        """释放一个client实例，error 为调用出错时的异常类型名 (记录在使用记录中)"""
         with self._lock:
             # 解析client_id和session_id
             try:
@@ -356,7 +358,9 @@ class ClientManager:
                     "usage_time": usage_time,
                     "completed": True,  # 标记为正常完成
                 }
-                self._usage_time_log.append(log_entry)
+                if error is not None:
+                    log_entry["error"] = error
+                self._record_usage(log_entry)
 
                 # 立即写入日志文件，确保不会丢失
                 try:
@@ -385,6 +389,33 @@ class ClientManager:
             else:
                 logger.warning(f"Client {client_id} already has zero active count")
 
+    def add_usage_listener(self, callback):
+        """注册使用记录监听者，每次释放客户端时以日志条目回调"""
+        with self._lock:
+            if callback not in self._usage_listeners:
+                self._usage_listeners.append(callback)
+
+    def set_file_logging(self, enabled):
+        """设置是否把使用记录写入 client_usage_times.json (由监听者持久化时可关闭)"""
+        with self._lock:
+            self._file_logging = enabled
+            if not enabled:
+                self._usage_time_log = []
+
+    def _record_usage(self, log_entry):
+        """记录一条使用记录并通知监听者"""
+        if self._file_logging:
+            self._usage_time_log.append(log_entry)
+        self._notify_usage_listeners(log_entry)
+
+    def _notify_usage_listeners(self, log_entry):
+        """通知所有使用记录监听者"""
+        for callback in self._usage_listeners:
+            try:
+                callback(log_entry)
+            except Exception as e:
+                logger.warning(f"Usage listener failed: {e}")
+
     def _write_logs_to_file(self):
         """将使用时间记录写入文件"""
         try:
@@ -426,7 +457,7 @@ class ClientManager:
             for session_id, session_data in list(self._usage_sessions.items()):
                 # 为未完成的会话创建记录，标记为未完成
                 usage_time = current_time - session_data["start_time"]
-                self._usage_time_log.append(
+                self._record_usage(
                     {
                         "client_id": session_data["client_id"],
                         "session_id": session_id,
@@ -476,7 +507,7 @@ class ClientManager:
                             "completed": False,  # 标记为强制结束
                             "reason": "timeout",
                         }
-                        self._usage_time_log.append(log_entry)
+                        self._record_usage(log_entry)
 
                         # 减少客户端活跃计数
                         client_id = session_data["client_id"]
@@ -0,0 +1,337 @@
+"""
+上传时的AI代码校验
+
+语法错误、缺少 Player 方法、导入白名单外的模块等问题原本要到对战中
+(_load_player_instances / safe_execute) 才暴露，整场 7 人对战作废，其他六个 AI 的
+LLM 调用也白白浪费。上传时依次执行:
+1. check_source: 编译源码，并用 AST 静态检查 Player 类、裁判会调用的方法和导入
+   (白名单与 restrictor 相同)
+2. compile_artifact: 字节码写入 __pycache__ (按源码哈希校验)，对战准备 AI 模块时
+   install_compiled_artifact 直接复用，不再重复编译
+3. run_smoke_game: 在独立的子进程中与 6 个 idiot_player 进行一局冒烟对局
+   (askLLM 返回固定文本，有超时和内存限制)，确认代码能完整跑完一局
+
+静态检查在上传请求中同步执行，冒烟对局由后台任务执行 (见 blueprints/ai.py)，
+结论保存在 AICode.validation_status，自动对战只调度校验通过的 AI。
+
+子进程入口:
+    python -m game.code_validator <AI代码路径> <对战ID> <日志目录>
+"""
+
+import ast
+import importlib.util
+import json
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
+
+from .restrictor import ALLOWED_MODULES, HELPER_ATTRS, HELPER_MODULE
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SMOKE_OPPONENT_PATH = os.path.join(PROJECT_ROOT, "aicode", "idiot_player.py")
+
+# 裁判会调用的 Player 方法
+REQUIRED_METHODS = (
+    "set_player_index",
+    "set_role_type",
+    "pass_role_sight",
+    "pass_message",
+    "pass_mission_members",
+    "decide_mission_member",
+    "say",
+    "mission_vote1",
+    "mission_vote2",
+    "assass",
+)
+
+SMOKE_SEAT = 1  # 被测AI的座位，其余座位为 idiot_player
+SMOKE_TIMEOUT_SECONDS = 60
+SMOKE_MEMORY_BYTES = 2 * 1024**3  # 子进程地址空间上限
+SMOKE_LLM_REPLY = "冒烟测试中不调用LLM"
+RESULT_MARKER = "SMOKE_RESULT"
+
+
+# -----------------------------------------------------------------------------------------
+# 静态检查
+
+
+def check_source(source, filename="<upload>"):
+    """
+    编译源码并静态检查 Player 类和导入。
+
+    参数:
+        source (str): AI代码源码。
+        filename (str): 错误信息中显示的文件名。
+
+    返回:
+        list: 问题描述列表，空列表表示通过。
+    """
+    try:
+        tree = ast.parse(source, filename)
+        compile(tree, filename, "exec", dont_inherit=True)
+    except SyntaxError as e:
+        return [f"第 {e.lineno} 行语法错误: {e.msg}"]
+    except ValueError as e:  # 源码包含空字节等
+        return [f"无法编译: {e}"]
+    return _check_imports(tree) + _check_player(tree)
+
+
+def _check_imports(tree):
+    errors = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name not in ALLOWED_MODULES and alias.name != HELPER_MODULE:
+                    errors.append(
+                        f"第 {node.lineno} 行: 模块不在白名单中: {alias.name}"
+                    )
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                errors.append(f"第 {node.lineno} 行: 不允许相对导入")
+            elif node.module == HELPER_MODULE:
+                for alias in node.names:
+                    if alias.name != "*" and alias.name not in HELPER_ATTRS:
+                        errors.append(
+                            f"第 {node.lineno} 行: {HELPER_MODULE} 没有公开接口 {alias.name}"
+                        )
+            elif node.module not in ALLOWED_MODULES:
+                errors.append(f"第 {node.lineno} 行: 模块不在白名单中: {node.module}")
+    return errors
+
+
+def _class_members(node):
+    """类体中定义的方法和类属性名"""
+    names = set()
+    for item in node.body:
+        if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            names.add(item.name)
+        elif isinstance(item, ast.Assign):
+            names.update(t.id for t in item.targets if isinstance(t, ast.Name))
+    return names
+
+
+def _check_player(tree):
+    classes = {node.name: node for node in tree.body if isinstance(node, ast.ClassDef)}
+    player = classes.get("Player")
+    if player is None:
+        return ["缺少 Player 类"]
+
+    errors = []
+    init = next(
+        (
+            item
+            for item in player.body
+            if isinstance(item, ast.FunctionDef) and item.name == "__init__"
+        ),
+        None,
+    )
+    if init is not None:
+        args = init.args
+        positional = args.posonlyargs + args.args
+        required = len(positional) - len(args.defaults) - 1  # 除去 self
+        required += sum(1 for d in args.kw_defaults if d is None)
+        if required > 0:
+            errors.append("Player.__init__ 不能有必填参数 (裁判以 Player() 实例化)")
+
+    # 合并同一文件中定义的基类的方法；继承自其他来源时无法静态确定，跳过方法检查
+    members, pending, seen = set(), [player], set()
+    while pending:
+        cls = pending.pop()
+        if cls.name in seen:
+            continue
+        seen.add(cls.name)
+        members |= _class_members(cls)
+        for base in cls.bases:
+            if isinstance(base, ast.Name) and base.id in classes:
+                pending.append(classes[base.id])
+            elif not (isinstance(base, ast.Name) and base.id == "object"):
+                return errors
+    missing = [name for name in REQUIRED_METHODS if name not in members]
+    if missing:
+        errors.append(f"Player 类缺少方法: {', '.join(missing)}")
+    return errors
+
+
+# -----------------------------------------------------------------------------------------
+# 字节码缓存
+
+
+def compile_artifact(path):
+    """
+    把字节码写入 path 对应的 __pycache__ 文件。按源码哈希校验 (与修改时间无关)，
+    复制到对战目录后仍然有效。
+
+    返回:
+        str: 字节码文件路径。
+
+    异常:
+        py_compile.PyCompileError: 编译失败。
+    """
+    return py_compile.compile(
+        path,
+        doraise=True,
+        invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH,
+    )
+
+
+def install_compiled_artifact(source_path, destination_path):
+    """
+    把 source_path 已缓存的字节码复制到 destination_path (源码的副本) 对应的位置，
+    导入时直接使用。源码与字节码不一致时解释器会忽略它重新编译。
+
+    返回:
+        bool: 是否找到并复制了字节码。
+    """
+    artifact = importlib.util.cache_from_source(source_path)
+    if not os.path.exists(artifact):
+        return False
+    target = importlib.util.cache_from_source(destination_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.copyfile(artifact, target)
+    return True
+
+
+# -----------------------------------------------------------------------------------------
+# 冒烟对局
+
+
+def run_smoke_game(path, timeout=SMOKE_TIMEOUT_SECONDS):
+    """
+    在子进程中让 path 的AI与 idiot_player 进行一局对局。
+
+    参数:
+        path (str): AI代码的完整路径。
+        timeout (float): 超时 (秒)，超时视为未通过。
+
+    返回:
+        tuple: (是否通过, 未通过的原因)。
+    """
+    from .referee import BATTLE_AI_ABSOLUTE_BASE_DIR
+
+    # 对战ID同时作为结果行的标记 (被测代码无法预知)；子进程被强制结束时由这里清理目录
+    battle_id = f"smoke_{uuid.uuid4().hex}"
+    data_dir = tempfile.mkdtemp(prefix="avalon_smoke_")
+    try:
+        completed = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "game.code_validator",
+                os.path.abspath(path),
+                battle_id,
+                data_dir,
+            ],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return False, f"冒烟对局超过 {timeout:g} 秒未结束"
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        shutil.rmtree(
+            os.path.join(BATTLE_AI_ABSOLUTE_BASE_DIR, battle_id), ignore_errors=True
+        )
+
+    marker = f"{RESULT_MARKER}:{battle_id} "
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(marker):
+            result = json.loads(line[len(marker) :])
+            return result["ok"], result.get("error")
+    last_lines = completed.stderr.strip().splitlines()[-3:]
+    return False, (
+        f"冒烟对局进程异常退出 (退出码 {completed.returncode}): " + " ".join(last_lines)
+    )
+
+
+class _SmokeBattleService:
+    """裁判所需的最小 BattleService 接口 (不访问数据库)"""
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def get_ai_code_path(self, ai_code_id):
+        return self.paths[ai_code_id]
+
+    def get_battle_db_status(self, battle_id):
+        return "playing"
+
+
+class _NullObserver:
+    def make_snapshot(self, event_type, event_data):
+        pass
+
+
+def _limit_resources():
+    try:
+        import resource
+    except ImportError:  # 非 Unix 平台
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (SMOKE_MEMORY_BYTES, SMOKE_MEMORY_BYTES))
+
+
+def _smoke_game(path, battle_id, data_dir):
+    """在当前进程中执行冒烟对局，返回 (是否通过, 原因)"""
+    from . import avalon_game_helper
+    from .referee import AvalonReferee
+
+    # 冒烟对局不调用LLM
+    avalon_game_helper.get_client_manager = lambda: None
+    avalon_game_helper.GameHelper._fetch_LLM_reply = (
+        lambda self, history, prompt: SMOKE_LLM_REPLY
+    )
+
+    participant_data = [
+        {
+            "position": seat,
+            "user_id": f"smoke_{seat}",
+            "ai_code_id": "candidate" if seat == SMOKE_SEAT else "opponent",
+        }
+        for seat in range(1, 8)
+    ]
+    service = _SmokeBattleService({"candidate": path, "opponent": SMOKE_OPPONENT_PATH})
+    os.makedirs(os.path.join(data_dir, battle_id), exist_ok=True)
+    referee = None
+    try:
+        referee = AvalonReferee(
+            battle_id,
+            participant_data,
+            {"data_dir": data_dir},
+            _NullObserver(),
+            service,
+        )
+        if len(referee.players) == 7:
+            referee.run_game()
+    except Exception as e:
+        if referee is None or referee.player_error is None:
+            return False, f"{type(e).__name__}: {e}"
+
+    error = referee.player_error
+    if error is not None and error.pid in (SMOKE_SEAT, 0, None):
+        return False, f"{error.method}: {error.message}"
+    if len(referee.players) != 7:
+        return False, "加载AI失败"
+    return True, None
+
+
+def main(argv=None):
+    path, battle_id, data_dir = sys.argv[1:] if argv is None else argv
+    _limit_resources()
+    try:
+        ok, error = _smoke_game(path, battle_id, data_dir)
+    except BaseException as e:  # 被测代码可能调用 exit 等
+        ok, error = False, f"{type(e).__name__}: {e}"
+    print(
+        f"{RESULT_MARKER}:{battle_id} "
+        + json.dumps({"ok": ok, "error": error}, ensure_ascii=False),
+        flush=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
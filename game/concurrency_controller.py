@@ -0,0 +1,217 @@
+"""
+对战并发控制器 - 用令牌池限制实际运行的对战数量
+按 AIMD (加性增、乘性减) 规则根据 LLM 排队延迟、CPU 与内存负载调整上限
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("ConcurrencyController")
+
+try:
+    import psutil
+
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+
+# 控制律参数
+INCREASE_STEP = 2  # 加性增步长
+DECREASE_FACTOR = 0.75  # 乘性减系数
+UTILIZATION_TO_GROW = 0.8  # 令牌使用率达到该比例才继续加，避免空闲时上限虚高
+CPU_HIGH_PERCENT = 85
+MEMORY_HIGH_PERCENT = 85
+LLM_QUEUE_DELAY_TARGET_SECONDS = 3.0  # 可接受的 LLM 排队延迟
+LLM_RECENT_WINDOW_SECONDS = 60  # 估算当前延迟的窗口
+LLM_BASELINE_WINDOW_SECONDS = 1800  # 估算无排队基线延迟的窗口
+LLM_MIN_SAMPLES = 10  # 样本不足时不使用 LLM 信号
+MAX_LATENCY_SAMPLES = 5000
+MAX_DECISIONS = 100
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """对已排序的列表取分位数 (最近秩法)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(q * len(sorted_values))))
+    return sorted_values[index]
+
+
+class ConcurrencyController:
+    """
+    令牌池 + AIMD 控制律
+
+    - acquire/release: 运行对战前获取令牌，结束后归还；上限下调时，
+      已在运行的对战不受影响，新对战需等待令牌数降到上限以下，从而真正收缩并发
+    - record_llm_latency: 记录每次 LLM 调用耗时
+    - adjust: 周期性调用，计算负载信号并调整上限，决策通过日志、
+      get_status() 和订阅回调对外发布
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 4,
+        initial_limit: Optional[int] = None,
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        if initial_limit is None:
+            initial_limit = self.max_limit // 4
+        self.limit = max(self.min_limit, min(initial_limit, self.max_limit))
+        self.in_flight = 0
+
+        self._cond = threading.Condition()
+        self._latencies: Deque[Tuple[float, float]] = deque(maxlen=MAX_LATENCY_SAMPLES)
+        self._latency_lock = threading.Lock()
+        self._decisions: Deque[Dict] = deque(maxlen=MAX_DECISIONS)
+        self._subscribers: List[Callable[[Dict], None]] = []
+
+        if PSUTIL_AVAILABLE:
+            # 首次调用 cpu_percent(None) 返回 0，先预热一次
+            psutil.cpu_percent(interval=None)
+
+    # ------------------------------------------------------------------
+    # 令牌池
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """获取一个运行令牌，超时返回 False"""
+        with self._cond:
+            acquired = self._cond.wait_for(
+                lambda: self.in_flight < self.limit, timeout=timeout
+            )
+            if acquired:
+                self.in_flight += 1
+            return acquired
+
+    def release(self):
+        """归还运行令牌"""
+        with self._cond:
+            if self.in_flight > 0:
+                self.in_flight -= 1
+            else:
+                logger.warning("归还令牌时 in_flight 已为 0")
+            self._cond.notify()
+
+    # ------------------------------------------------------------------
+    # 负载信号
+
+    def record_llm_latency(self, seconds: float):
+        """记录一次 LLM 调用耗时 (秒)"""
+        with self._latency_lock:
+            self._latencies.append((time.time(), seconds))
+
+    def _llm_signal(self) -> Dict[str, Optional[float]]:
+        """
+        估算 LLM 排队延迟：近期中位延迟减去长窗口的低分位延迟 (视为无排队基线)
+        """
+        now = time.time()
+        with self._latency_lock:
+            baseline_values = sorted(
+                v for t, v in self._latencies if now - t <= LLM_BASELINE_WINDOW_SECONDS
+            )
+            recent_values = sorted(
+                v for t, v in self._latencies if now - t <= LLM_RECENT_WINDOW_SECONDS
+            )
+
+        if len(recent_values) < LLM_MIN_SAMPLES:
+            return {"llm_p50": None, "llm_p95": None, "llm_queue_delay": None}
+
+        p50 = _percentile(recent_values, 0.5)
+        baseline = _percentile(baseline_values, 0.1)
+        return {
+            "llm_p50": round(p50, 3),
+            "llm_p95": round(_percentile(recent_values, 0.95), 3),
+            "llm_queue_delay": round(max(0.0, p50 - baseline), 3),
+        }
+
+    def _system_signal(self) -> Dict[str, Optional[float]]:
+        """CPU 与内存使用率"""
+        if not PSUTIL_AVAILABLE:
+            return {"cpu": None, "memory": None}
+        return {
+            "cpu": psutil.cpu_percent(interval=None),
+            "memory": psutil.virtual_memory().percent,
+        }
+
+    # ------------------------------------------------------------------
+    # 控制律
+
+    def adjust(self) -> Dict:
+        """根据当前信号执行一次 AIMD 调整，返回本次决策"""
+        signals = {**self._system_signal(), **self._llm_signal()}
+
+        reasons = []
+        if signals["cpu"] is not None and signals["cpu"] > CPU_HIGH_PERCENT:
+            reasons.append(f"cpu {signals['cpu']:.0f}%")
+        if signals["memory"] is not None and signals["memory"] > MEMORY_HIGH_PERCENT:
+            reasons.append(f"memory {signals['memory']:.0f}%")
+        if (
+            signals["llm_queue_delay"] is not None
+            and signals["llm_queue_delay"] > LLM_QUEUE_DELAY_TARGET_SECONDS
+        ):
+            reasons.append(f"llm queue delay {signals['llm_queue_delay']:.1f}s")
+
+        with self._cond:
+            old_limit = self.limit
+            in_flight = self.in_flight
+            if reasons:
+                action = "decrease"
+                self.limit = max(self.min_limit, int(self.limit * DECREASE_FACTOR))
+                reason = ", ".join(reasons)
+            elif in_flight >= self.limit * UTILIZATION_TO_GROW:
+                action = "increase"
+                self.limit = min(self.max_limit, self.limit + INCREASE_STEP)
+                reason = "no overload and limit is binding"
+            else:
+                action = "hold"
+                reason = "limit not binding"
+            new_limit = self.limit
+            if new_limit > old_limit:
+                self._cond.notify(new_limit - old_limit)
+
+        decision = {
+            "time": time.time(),
+            "action": action if new_limit != old_limit else "hold",
+            "reason": reason,
+            "old_limit": old_limit,
+            "new_limit": new_limit,
+            "in_flight": in_flight,
+            **signals,
+        }
+        self._publish(decision)
+        return decision
+
+    def _publish(self, decision: Dict):
+        """记录并发布决策"""
+        self._decisions.append(decision)
+        if decision["new_limit"] != decision["old_limit"]:
+            logger.info(
+                f"并发上限调整 {decision['old_limit']} -> {decision['new_limit']} "
+                f"({decision['reason']})，运行中 {decision['in_flight']}"
+            )
+        for callback in list(self._subscribers):
+            try:
+                callback(decision)
+            except Exception as e:
+                logger.warning(f"并发决策订阅回调出错: {e}")
+
+    def subscribe(self, callback: Callable[[Dict], None]):
+        """订阅并发决策，每次 adjust 后回调"""
+        self._subscribers.append(callback)
+
+    def get_status(self, recent_decisions: int = 10) -> Dict:
+        """获取控制器当前状态及最近的决策"""
+        with self._cond:
+            status = {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+            }
+        status["recent_decisions"] = list(self._decisions)[-recent_decisions:]
+        return status
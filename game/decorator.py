@@ -1,119 +1,253 @@
-import threading
-import os
-from datetime import datetime
-from inspect import getfile
-
-
-settings = {
-    "referee.AvalonReferee": 0,
-    "observer.Observer": 0,
-    "avalon_game_helper.GameHelper": 0,
-    "1": 0,
-    "2": 0,
-    "3": 0,
-    "4": 0,
-    "5": 0,
-    "6": 0,
-    "7": 0,
-    "8": 0,
-    "9": 0,
-    "10": 0,
-    "11": 0,
-    "12": 0,
-}
-
-
-class DebugDecorator:
-    def __init__(self, battle_id):
-        # 获取当前脚本的绝对路径
-        current_file = os.path.abspath(__file__)
-        filename = f"_decorator_out_{battle_id}.log"  # 日志文件名
-
-        # 增强路径安全性检测
-        current_file = os.path.abspath(
-            getfile(self.__class__)
-        )  # 准确获取类定义文件路径
-        target_dir = os.path.abspath(  # 构造绝对路径
-            os.path.join(os.path.dirname(current_file), "..", "data", str(battle_id))
-        )
-
-        # 路径验证与创建
-        self.filename = os.path.join(target_dir, filename)
-        os.makedirs(target_dir, exist_ok=True)  # 自动创建所有缺失目录
-
-        print(f"✅ 目标目录确认：{os.path.abspath(target_dir)}")
-        print(f"📁 日志文件将保存至：{os.path.abspath(self.filename)}")
-
-        self.local_data = threading.local()
-        self.lock = threading.RLock()
-
-    def _log(self, event_type, func_name, stack, args, result=None):
-        """日志处理方法"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        thread_id = threading.get_ident()
-
-        # 控制台输出(有颜色)
-        console_msg = (
-            f"[{timestamp}] [Thread-{thread_id}] "
-            f"[{event_type}] 函数名: \033[34m{func_name}\033[0m\n"
-            f"      嵌套层级: {len(stack)}\n"
-            f"      调用关系: \033[33m{' → '.join(stack)}\033[0m\n"
-            f"      接收参数: args={args}\n"
-            f"      返回值: \033[32m{result}\033[0m\n"
-        )
-        print(console_msg)
-
-        # 文件输出（无颜色）
-        file_msg = (
-            f"[{timestamp}] [Thread-{thread_id}] [{event_type}] "
-            f"函数名: {func_name} | 层级: {len(stack)} | "
-            f"调用链: {'→'.join(stack)} | 参数: args={args} | "
-            f"返回值: {result}\n"
-        )
-
-        with self.lock:
-            with open(self.filename, "a", encoding="utf-8") as f:
-                f.write(file_msg)
-
-    def __call__(self, func):
-        def wrapper(*args):
-
-            # 初始化result，设置未initial，与None区分开，同时避免未定义
-            result = "initial"
-
-            if not hasattr(self.local_data, "stack"):
-                self.local_data.stack = []
-
-            self.local_data.stack.append(func.__name__)
-            current_stack = self.local_data.stack.copy()
-
-            self._log("Call", func.__name__, current_stack, args)
-
-            try:
-                result = func(*args)
-            finally:
-                self.local_data.stack.pop()
-                self._log("Done", func.__name__, current_stack, args, result=result)
-
-            return result
-
-        return wrapper
-
-    def decorate_instance(self, instance):
-        """动态装饰一个实例的所有非私有方法"""
-        for name in dir(instance):
-            if not name.startswith("_"):  # 跳过私有方法
-                attr = getattr(instance, name)
-                if callable(attr):
-                    setattr(instance, name, self(attr))  # 用__call__装饰方法
-        return instance
-
-    # 会报错目前
-    def _decorate_instance(self, instance):
-        """动态装饰一个实例的所有私有方法"""
-        for name in dir(instance):
-            if name.startswith("_"):  # 跳过非私有方法
-                attr = getattr(instance, name)
-                if callable(attr):
-                    setattr(instance, name, self(attr))  # 用__call__装饰方法
-        return instance
+"""
+对战调用追踪
+
+DebugDecorator 包装裁判 (AvalonReferee)、观察者 (Observer) 和 GameHelper 实例的公开方法，
+记录调用、返回和异常。记录以元组形式追加到每个线程自己的环形缓冲区 (deque(maxlen))，
+调用路径上没有锁和文件 IO，参数和返回值只对采样到的调用截断 repr；缓冲区写满后
+丢弃最旧的记录，需要时 dump_trace 合并各线程的缓冲区，按时间顺序写入对战数据目录。
+
+- 采样率按对战在运行时设置 (set_trace_sample_rate，管理接口见 blueprints/admin.py)，
+  没有设置的对战使用 settings 中组件的默认采样率 (0 为关闭，1 为记录全部调用)
+- 每次调用独立采样；抛出异常的调用不论是否被采样都会记录
+- 对战出错时由 BattleManager 自动导出
+"""
+
+import functools
+import inspect
+import os
+import random
+import reprlib
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+# 组件 -> 默认采样率 (对所有对战生效)
+settings = {
+    "referee.AvalonReferee": 0,
+    "observer.Observer": 0,
+    "avalon_game_helper.GameHelper": 0,
+    "1": 0,
+    "2": 0,
+    "3": 0,
+    "4": 0,
+    "5": 0,
+    "6": 0,
+    "7": 0,
+    "8": 0,
+    "9": 0,
+    "10": 0,
+    "11": 0,
+    "12": 0,
+}
+
+TRACE_BUFFER_SIZE = 4096  # 每个线程每场对战保留的记录数
+MAX_TRACED_BATTLES = 256  # 内存中保留追踪记录的对战数，超出时丢弃最早的
+
+# 对战ID -> 采样率 (覆盖 settings 中的默认值)
+_sample_rates = {}
+# 对战ID -> [(线程名, 缓冲区), ...]；只在创建缓冲区时加锁
+_buffers = OrderedDict()
+_buffers_lock = threading.Lock()
+_local = threading.local()
+# 独立的随机数生成器，采样不影响游戏使用的全局随机状态
+_sampler = random.Random()
+
+_repr = reprlib.Repr()
+_repr.maxstring = 120
+_repr.maxother = 120
+_repr.maxlist = _repr.maxtuple = _repr.maxdict = _repr.maxset = 8
+_repr.maxlevel = 3
+
+
+def set_trace_sample_rate(battle_id, sample_rate):
+    """
+    设置对战的采样率，None 表示恢复 settings 中的默认值。
+    对已在执行的对战立即生效。
+    """
+    if sample_rate is None:
+        _sample_rates.pop(battle_id, None)
+    else:
+        _sample_rates[battle_id] = max(0.0, min(1.0, float(sample_rate)))
+
+
+def get_trace_sample_rates():
+    """当前设置了采样率的对战 (对战ID -> 采样率)"""
+    return dict(_sample_rates)
+
+
+def traced_battle_ids():
+    """内存中有追踪记录的对战ID"""
+    with _buffers_lock:
+        return list(_buffers)
+
+
+def has_trace(battle_id):
+    """对战在本进程中是否有追踪记录"""
+    with _buffers_lock:
+        threads = list(_buffers.get(battle_id, ()))
+    return any(buffer for _, buffer in threads)
+
+
+def discard_trace(battle_id):
+    """丢弃对战的追踪记录"""
+    with _buffers_lock:
+        _buffers.pop(battle_id, None)
+
+
+def _thread_buffer(battle_id):
+    """当前线程在对战中的缓冲区 (首次使用时创建)"""
+    cache = getattr(_local, "buffers", None)
+    if cache is None:
+        cache = _local.buffers = {}
+    threads, buffer = cache.get(battle_id, (None, None))
+    # 对战的记录被丢弃 (discard_trace 或超出保留数量) 后重新登记
+    if threads is None or _buffers.get(battle_id) is not threads:
+        buffer = deque(maxlen=TRACE_BUFFER_SIZE)
+        with _buffers_lock:
+            threads = _buffers.get(battle_id)
+            if threads is None:
+                threads = _buffers[battle_id] = []
+                while len(_buffers) > MAX_TRACED_BATTLES:
+                    _buffers.popitem(last=False)
+            threads.append((threading.current_thread().name, buffer))
+        cache[battle_id] = (threads, buffer)
+    return buffer
+
+
+def get_trace(battle_id):
+    """
+    合并对战各线程的追踪记录，按时间排序。
+
+    返回:
+        list: [{"time", "thread", "event", "method", "depth", "detail"}, ...]
+    """
+    with _buffers_lock:
+        threads = list(_buffers.get(battle_id, ()))
+    records = []
+    for thread_name, buffer in threads:
+        # 其他线程可能仍在追加，复制时遇到修改则重试
+        while True:
+            try:
+                entries = list(buffer)
+                break
+            except RuntimeError:
+                continue
+        records.extend(
+            {
+                "time": timestamp,
+                "thread": thread_name,
+                "event": event,
+                "method": method,
+                "depth": depth,
+                "detail": detail,
+            }
+            for timestamp, event, method, depth, detail in entries
+        )
+    records.sort(key=lambda record: record["time"])
+    return records
+
+
+def dump_trace(battle_id, data_dir):
+    """
+    把对战的追踪记录写入 <data_dir>/<battle_id>/trace_<battle_id>.log。
+
+    返回:
+        tuple: (文件路径, 记录条数)，没有记录时返回 (None, 0)。
+    """
+    records = get_trace(battle_id)
+    if not records:
+        return None, 0
+    target_dir = os.path.abspath(os.path.join(data_dir, str(battle_id)))
+    os.makedirs(target_dir, exist_ok=True)
+    path = os.path.join(target_dir, f"trace_{battle_id}.log")
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            timestamp = datetime.fromtimestamp(record["time"]).strftime(
+                "%Y-%m-%d %H:%M:%S.%f"
+            )[:-3]
+            indent = "  " * record["depth"]
+            f.write(
+                f"[{timestamp}] [{record['thread']}] {record['event']:<6} "
+                f"{indent}{record['method']} {record['detail']}\n"
+            )
+    return path, len(records)
+
+
+def _format_args(args, kwargs):
+    parts = [_repr.repr(arg) for arg in args]
+    parts.extend(f"{key}={_repr.repr(value)}" for key, value in kwargs.items())
+    return f"({', '.join(parts)})"
+
+
+class DebugDecorator:
+    """按对战记录实例方法调用的装饰器"""
+
+    def __init__(self, battle_id, component=None):
+        self.battle_id = battle_id
+        self.component = component
+
+    def __call__(self, func):
+        battle_id = self.battle_id
+        component = self.component
+        method = getattr(func, "__qualname__", repr(func))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rate = _sample_rates.get(battle_id)
+            if rate is None:
+                rate = settings.get(component, 0)
+            if not rate:
+                return func(*args, **kwargs)
+
+            buffer = _thread_buffer(battle_id)
+            depth = getattr(_local, "depth", 0)
+            _local.depth = depth + 1
+            sampled = rate >= 1 or _sampler.random() < rate
+            start = time.time()
+            if sampled:
+                buffer.append(
+                    (start, "call", method, depth, _format_args(args, kwargs))
+                )
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                buffer.append(
+                    (
+                        time.time(),
+                        "error",
+                        method,
+                        depth,
+                        f"{type(e).__name__}: {str(e)[:200]}",
+                    )
+                )
+                raise
+            finally:
+                _local.depth = depth
+            if sampled:
+                end = time.time()
+                buffer.append(
+                    (
+                        end,
+                        "return",
+                        method,
+                        depth,
+                        f"{(end - start) * 1000:.2f}ms -> {_repr.repr(result)}",
+                    )
+                )
+            return result
+
+        wrapper.__traced__ = True
+        return wrapper
+
+    def decorate_instance(self, instance):
+        """动态装饰一个实例的所有非私有方法"""
+        if self.component is None:
+            cls = type(instance)
+            self.component = f"{cls.__module__.rsplit('.', 1)[-1]}.{cls.__qualname__}"
+        for name in dir(instance):
+            if not name.startswith("_"):  # 跳过私有方法
+                attr = getattr(instance, name)
+                if inspect.ismethod(attr) and not getattr(attr, "__traced__", False):
+                    setattr(instance, name, self(attr))  # 用__call__装饰方法
+        return instance
@@ -0,0 +1,180 @@
+"""
+自动对战的阵容选择策略 (matchmaker)
+
+- RandomMatchmaker: 随机抽取 7 个参与者 (原有行为，默认)
+- InformationGainMatchmaker (需配置 AUTOMATCH_MATCHMAKER=information_gain): 优先选择对局数少、评分不确定度高的 AI，
+  并在候选阵容中挑选胜负预测最接近五五开的阵容，使每局对排名收敛提供更多信息
+
+阵容中的阵营由裁判随机分配 (3 红 4 蓝)，因此"胜负预测"是对全部
+C(7,3)=35 种分法取平均，队伍分数与 ELO 结算一致采用几何平均。
+"""
+
+import math
+import random
+import logging
+from itertools import combinations
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("Matchmaker")
+
+LINEUP_SIZE = 7
+RED_TEAM_SIZE = 3
+DEFAULT_ELO = 1200
+CANDIDATE_LINEUPS = 64  # 每次评估的候选阵容数量
+MIN_SAMPLING_WEIGHT = 0.05  # 老玩家的最低抽样权重，保证仍有机会上场
+
+# (rating, games_played)
+RatingInfo = Tuple[float, int]
+
+
+def rating_uncertainty(games_played: int) -> float:
+    """评分不确定度的近似：随对局数按 1/sqrt(n) 收缩，取值 (0, 1]"""
+    return 1.0 / math.sqrt(1 + max(0, games_played))
+
+
+def team_rating(ratings: Sequence[float]) -> float:
+    """队伍评分 (几何平均)，与 process_battle_results_and_update_stats 保持一致"""
+    if not ratings:
+        return DEFAULT_ELO
+    return math.exp(sum(math.log(max(r, 1)) for r in ratings) / len(ratings))
+
+
+def blue_win_probability(red: Sequence[float], blue: Sequence[float]) -> float:
+    """按 ELO 期望公式估计蓝方获胜概率"""
+    return 1 / (1 + 10 ** ((team_rating(red) - team_rating(blue)) / 400))
+
+
+# 7 人中红方 3 人的全部分法 (下标组合)，预先计算
+_RED_SPLITS = list(combinations(range(LINEUP_SIZE), RED_TEAM_SIZE))
+
+
+def lineup_balance(ratings: Sequence[float]) -> float:
+    """
+    阵容的平衡度：对所有阵营分法取 4·p·(1-p) 的平均，1 表示完全五五开。
+    伯努利结果的信息量与 p·(1-p) 成正比。
+    """
+    logs = [math.log(max(r, 1)) for r in ratings]
+    total_log = sum(logs)
+    blue_size = len(logs) - RED_TEAM_SIZE
+    total = 0.0
+    for red_indexes in _RED_SPLITS:
+        red_log = sum(logs[i] for i in red_indexes)
+        red = math.exp(red_log / RED_TEAM_SIZE)
+        blue = math.exp((total_log - red_log) / blue_size)
+        p = 1 / (1 + 10 ** ((red - blue) / 400))
+        total += 4 * p * (1 - p)
+    return total / len(_RED_SPLITS)
+
+
+class Matchmaker:
+    """阵容选择策略基类"""
+
+    name = "base"
+
+    def __init__(self, rng: Optional[random.Random] = None):
+        self.rng = rng or random.Random()
+        self.ratings: Dict[str, RatingInfo] = {}
+
+    def update_ratings(self, ratings: Dict[str, RatingInfo]):
+        """更新参与者的评分快照: {user_id: (elo, games_played)}"""
+        self.ratings = dict(ratings)
+
+    def select_lineup(self, participants: Sequence, size: int = LINEUP_SIZE) -> List:
+        """从参与者 (带 user_id 属性) 中选出一个阵容，顺序即座位顺序"""
+        raise NotImplementedError
+
+
+class RandomMatchmaker(Matchmaker):
+    """随机抽取阵容"""
+
+    name = "random"
+
+    def select_lineup(self, participants: Sequence, size: int = LINEUP_SIZE) -> List:
+        return self.rng.sample(list(participants), size)
+
+
+class InformationGainMatchmaker(Matchmaker):
+    """
+    按信息增益选择阵容
+
+    1. 以不确定度为权重做不放回加权抽样，生成若干候选阵容
+    2. 候选得分 = 阵容总不确定度 × 平衡度，取最高者
+    本次刷新后已被选中的场次计入对局数，避免同一新人被连续塞进并行的多局
+    """
+
+    name = "information_gain"
+
+    def __init__(
+        self,
+        rng: Optional[random.Random] = None,
+        candidate_lineups: int = CANDIDATE_LINEUPS,
+    ):
+        super().__init__(rng)
+        self.candidate_lineups = candidate_lineups
+        self._selected_since_update: Dict[str, int] = {}
+
+    def update_ratings(self, ratings: Dict[str, RatingInfo]):
+        super().update_ratings(ratings)
+        self._selected_since_update = {}
+
+    def _rating(self, user_id: str) -> float:
+        return self.ratings.get(user_id, (DEFAULT_ELO, 0))[0]
+
+    def _uncertainty(self, user_id: str) -> float:
+        games = self.ratings.get(user_id, (DEFAULT_ELO, 0))[1]
+        return rating_uncertainty(games + self._selected_since_update.get(user_id, 0))
+
+    def _weighted_sample(self, participants: List, weights: List[float], size: int):
+        """Efraimidis-Spirakis 不放回加权抽样"""
+        keyed = [
+            (self.rng.random() ** (1.0 / w), p) for p, w in zip(participants, weights)
+        ]
+        keyed.sort(key=lambda item: item[0], reverse=True)
+        return [p for _, p in keyed[:size]]
+
+    def score_lineup(self, lineup: Sequence) -> float:
+        """候选阵容得分"""
+        ratings = [self._rating(p.user_id) for p in lineup]
+        uncertainty = sum(self._uncertainty(p.user_id) for p in lineup)
+        return uncertainty * lineup_balance(ratings)
+
+    def select_lineup(self, participants: Sequence, size: int = LINEUP_SIZE) -> List:
+        participants = list(participants)
+        if len(participants) <= size:
+            lineup = participants[:]
+            self.rng.shuffle(lineup)
+            return lineup
+
+        weights = [
+            max(self._uncertainty(p.user_id), MIN_SAMPLING_WEIGHT) for p in participants
+        ]
+        best_lineup, best_score = None, -1.0
+        for _ in range(self.candidate_lineups):
+            lineup = self._weighted_sample(participants, weights, size)
+            score = self.score_lineup(lineup)
+            if score > best_score:
+                best_lineup, best_score = lineup, score
+
+        for p in best_lineup:
+            self._selected_since_update[p.user_id] = (
+                self._selected_since_update.get(p.user_id, 0) + 1
+            )
+        # 座位顺序随机
+        self.rng.shuffle(best_lineup)
+        return best_lineup
+
+
+MATCHMAKERS = {
+    RandomMatchmaker.name: RandomMatchmaker,
+    InformationGainMatchmaker.name: InformationGainMatchmaker,
+}
+DEFAULT_MATCHMAKER = RandomMatchmaker.name
+
+
+def create_matchmaker(name: Optional[str] = None, **kwargs) -> Matchmaker:
+    """按名称创建 matchmaker，未知名称回退到默认策略"""
+    matchmaker_cls = MATCHMAKERS.get(name or DEFAULT_MATCHMAKER)
+    if matchmaker_cls is None:
+        logger.warning(f"未知的 matchmaker '{name}'，使用默认策略 {DEFAULT_MATCHMAKER}")
+        matchmaker_cls = MATCHMAKERS[DEFAULT_MATCHMAKER]
+    return matchmaker_cls(**kwargs)
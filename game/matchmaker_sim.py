@@ -0,0 +1,173 @@
+"""
+matchmaker 离线模拟器：比较不同阵容策略使前 N 名稳定所需的对局数
+
+用法:
+    python -m game.matchmaker_sim --players 40 --top-n 10 --trials 5
+
+模拟方式:
+- 每个 AI 有一个隐藏的真实实力，初始 ELO 为 1200
+- 每局由 matchmaker 选出 7 人，随机分成 3 红 4 蓝，按真实实力的
+  ELO 期望公式决定胜负，再按线上规则 (K=30、队伍几何平均、零和归一) 更新 ELO
+- 与自动对战一样，评分快照每隔 --refresh-every 局才同步给 matchmaker
+- "稳定" 指按 ELO 排出的前 N 名集合与真实前 N 名一致，并连续保持 --stable-window 局
+- 固定 K 值的 ELO 本身有噪声，稳定局数方差很大，因此同时报告后半程前 N 名的平均重合率
+"""
+
+import argparse
+import random
+import statistics
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from .matchmaker import (
+    MATCHMAKERS,
+    LINEUP_SIZE,
+    RED_TEAM_SIZE,
+    DEFAULT_ELO,
+    blue_win_probability,
+    create_matchmaker,
+)
+
+K_FACTOR = 30
+MIN_ELO = 10
+
+
+@dataclass
+class SimPlayer:
+    user_id: str
+    true_skill: float
+
+
+def _update_elo(elo: Dict[str, float], red: List[str], blue: List[str], blue_won):
+    """简化版线上 ELO 结算 (不含 token 修正)"""
+    blue_expected = blue_win_probability(
+        [elo[uid] for uid in red], [elo[uid] for uid in blue]
+    )
+    deltas = {}
+    for uid in blue:
+        deltas[uid] = K_FACTOR * ((1 if blue_won else 0) - blue_expected)
+    for uid in red:
+        deltas[uid] = K_FACTOR * ((0 if blue_won else 1) - (1 - blue_expected))
+    # 零和归一
+    mean_delta = sum(deltas.values()) / len(deltas)
+    for uid, delta in deltas.items():
+        elo[uid] = max(MIN_ELO, elo[uid] + delta - mean_delta)
+
+
+def simulate(
+    strategy: str,
+    players: List[SimPlayer],
+    top_n: int,
+    stable_window: int,
+    max_games: int,
+    refresh_every: int,
+    seed: int,
+) -> Tuple[Optional[int], float]:
+    """
+    运行一次模拟。
+
+    返回:
+        tuple: (前 N 名首次进入稳定状态时的对局数，max_games 内未稳定为 None;
+                后半程前 N 名与真实前 N 名的平均重合率)
+    """
+    rng = random.Random(seed)
+    matchmaker = create_matchmaker(strategy, rng=random.Random(seed + 1))
+    true_top = {
+        p.user_id
+        for p in sorted(players, key=lambda p: p.true_skill, reverse=True)[:top_n]
+    }
+    skill = {p.user_id: p.true_skill for p in players}
+    elo = {p.user_id: float(DEFAULT_ELO) for p in players}
+    games_played = {p.user_id: 0 for p in players}
+    stable_since = None
+    converged_at = None
+    overlaps = []
+
+    for game in range(1, max_games + 1):
+        if (game - 1) % refresh_every == 0:
+            matchmaker.update_ratings(
+                {uid: (elo[uid], games_played[uid]) for uid in elo}
+            )
+
+        lineup = [p.user_id for p in matchmaker.select_lineup(players, LINEUP_SIZE)]
+        red = rng.sample(lineup, RED_TEAM_SIZE)
+        blue = [uid for uid in lineup if uid not in red]
+        p_blue = blue_win_probability(
+            [skill[uid] for uid in red], [skill[uid] for uid in blue]
+        )
+        _update_elo(elo, red, blue, rng.random() < p_blue)
+        for uid in lineup:
+            games_played[uid] += 1
+
+        current_top = set(sorted(elo, key=elo.get, reverse=True)[:top_n])
+        if game > max_games // 2:
+            overlaps.append(len(current_top & true_top) / top_n)
+        if converged_at is not None:
+            continue
+        if current_top == true_top:
+            if stable_since is None:
+                stable_since = game
+            if game - stable_since + 1 >= stable_window:
+                converged_at = stable_since
+        else:
+            stable_since = None
+
+    return converged_at, statistics.mean(overlaps)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="matchmaker 收敛速度模拟")
+    parser.add_argument("--players", type=int, default=40)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--skill-std", type=float, default=200.0)
+    parser.add_argument("--stable-window", type=int, default=200)
+    parser.add_argument("--max-games", type=int, default=4000)
+    parser.add_argument("--refresh-every", type=int, default=10)
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        default=list(MATCHMAKERS.keys()),
+        choices=list(MATCHMAKERS.keys()),
+    )
+    args = parser.parse_args(argv)
+
+    print(
+        f"players={args.players} top_n={args.top_n} skill_std={args.skill_std} "
+        f"stable_window={args.stable_window} max_games={args.max_games}"
+    )
+    for strategy in args.strategies:
+        results, overlaps = [], []
+        for trial in range(args.trials):
+            rng = random.Random(args.seed + trial)
+            players = [
+                SimPlayer(f"ai_{i}", rng.gauss(DEFAULT_ELO, args.skill_std))
+                for i in range(args.players)
+            ]
+            converged_at, overlap = simulate(
+                strategy,
+                players,
+                args.top_n,
+                args.stable_window,
+                args.max_games,
+                args.refresh_every,
+                seed=args.seed * 1000 + trial,
+            )
+            results.append(converged_at)
+            overlaps.append(overlap)
+        converged = [r for r in results if r is not None]
+        summary = (
+            f"median={statistics.median(converged):.0f} "
+            f"mean={statistics.mean(converged):.0f}"
+            if converged
+            else "median=- mean=-"
+        )
+        print(
+            f"{strategy:>18}: converged {len(converged)}/{args.trials}  {summary}  "
+            f"top-{args.top_n} overlap={statistics.mean(overlaps):.2f}  raw={results}"
+        )
+
+
+if __name__ == "__main__":
+    main()
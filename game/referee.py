@@ -19,11 +19,13 @@ from copy import deepcopy
 import logging
 import importlib.util
 from datetime import datetime
-from .decorator import DebugDecorator, settings
+from .decorator import DebugDecorator
 from .observer import Observer
 from .avalon_game_helper import INIT_PRIVA_LOG_DICT
 from .restrictor import RESTRICTED_BUILTINS
 from .avalon_game_helper import GameHelper
+from .battle_result import BattleResult, PlayerError
+from .code_validator import install_compiled_artifact
 from database.models import Battle
 from database.base import db
 from database import (
@@ -63,9 +65,10 @@ class GameTerminationError(Exception):
 class BattleStatusChecker:
     """用于安全检查对战状态的辅助类，不直接依赖Flask上下文"""
 
-    def __init__(self, battle_id):
+    def __init__(self, battle_id, battle_service=None):
         """初始化状态检查器"""
         self.battle_id = battle_id
+        self.battle_service = battle_service
         self.last_known_status = "playing"  # 默认状态
         self.check_interval = 2  # 状态检查间隔（秒）
         self.last_check_time = 0  # 上次检查时间
@@ -75,7 +78,7 @@ class BattleStatusChecker:
 
     def get_battle_status(self, force=False):
         """
-        获取当前对战状态，使用直接SQL查询避免Flask上下文依赖
+        获取当前对战状态 (battle_service 自行创建应用上下文，调用方无需 Flask 上下文)
 
         参数:
             force (bool): 是否强制检查，忽略时间间隔限制
@@ -92,13 +95,14 @@ class BattleStatusChecker:
             # 尝试多种方法获取对战状态
 
             # 方法1: 通过battle_manager获取（如果可访问）
+            # 内存状态只反映本进程的操作；对战可能由其他进程取消，内存中仍在进行时再查数据库
             try:
                 from utils.battle_manager_utils import get_battle_manager
 
                 battle_manager = get_battle_manager()
                 if battle_manager:
                     status = battle_manager.get_battle_status(self.battle_id)
-                    if status:
+                    if status and status not in ["playing", "waiting"]:
                         self.last_known_status = status
                         logger.debug(
                             f"从battle_manager获取对战 {self.battle_id} 状态: {status}"
@@ -107,47 +111,13 @@ class BattleStatusChecker:
             except Exception as e:
                 logger.debug(f"无法从battle_manager获取状态: {str(e)}")
 
-            # 方法2: 使用原始SQL查询
-            import sqlite3
-            from os import path
-
-            # 尝试多个可能的数据库位置
-            possible_paths = [
-                "./database.sqlite",
-                "./platform/database.sqlite",
-                "../database.sqlite",
-                "../../database.sqlite",
-                os.path.join(
-                    os.path.dirname(os.path.abspath(__file__)), "../../database.sqlite"
-                ),
-            ]
-
-            db_path = None
-            for p in possible_paths:
-                if path.exists(p):
-                    db_path = p
-                    break
-
-            if not db_path:
-                logger.warning(f"无法找到数据库文件进行状态检查")
-                return self.last_known_status
-
-            # 连接数据库
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-
-            # 执行查询
-            cursor.execute("SELECT status FROM battles WHERE id = ?", (self.battle_id,))
-            result = cursor.fetchone()
-
-            # 关闭连接
-            conn.close()
-
-            if result:
-                self.last_known_status = result[0]
-                logger.debug(f"从数据库获取对战 {self.battle_id} 状态: {result[0]}")
-                return result[0]
-            else:
+            # 方法2: 通过 battle_service 查询数据库 (使用应用的连接池和 SQLite 配置)
+            if self.battle_service is not None:
+                status = self.battle_service.get_battle_db_status(self.battle_id)
+                if status:
+                    self.last_known_status = status
+                    logger.debug(f"从数据库获取对战 {self.battle_id} 状态: {status}")
+                    return status
                 logger.warning(f"在数据库中找不到对战 {self.battle_id}")
 
         except Exception as e:
@@ -157,7 +127,8 @@ class BattleStatusChecker:
 
     def should_abort(self):
         """检查对战是否应该中止"""
-        status = self.get_battle_status(force=True)  # 强制刷新状态
+        # 按检查间隔刷新状态 (需要查询数据库，每个阶段都强制刷新代价过高)
+        status = self.get_battle_status()
         should_stop = status not in ["playing", "waiting"]
 
         if should_stop:
@@ -186,10 +157,12 @@ class AvalonReferee:
         self.players = {}  # 玩家对象字典 {1: player1, 2: player2, ...}
         self.player_module_import_paths = {}  # 存储Python导入路径
         self.game_suspended = False  # 追踪游戏是否已挂起
+        self.player_error: Optional[PlayerError] = None  # suspend_game 记录的报错
 
         # 游戏状态变量初始化
         self.roles = {}  # 角色分配 {1: "Merlin", 2: "Assassin", ...}
         self.mission_results = []  # 任务结果 [True, False, ...]
+        self.assassination = None  # 刺杀结果 {"assassin", "target", "success"}
         self.current_round = 0  # 当前任务轮次
         self.blue_wins = 0  # 蓝方胜利次数
         self.red_wins = 0  # 红方胜利次数
@@ -212,11 +185,10 @@ class AvalonReferee:
         # 为这个referee创建一个专用的GameHelper实例
         self.game_helper = GameHelper(data_dir=self.data_dir)
 
-        # 装饰器
-        if settings["avalon_game_helper.GameHelper"] == 1:
-            # 装饰实例
-            dec = DebugDecorator(self.battle_id)
-            self.game_helper = dec.decorate_instance(self.game_helper)
+        # 调用追踪 (按对战的采样率记录，默认关闭)
+        self.game_helper = DebugDecorator(self.battle_id).decorate_instance(
+            self.game_helper
+        )
 
         self.game_helper.game_session_id = self.game_id  # 直接设置game_id
         from .avalon_game_helper import (
@@ -313,6 +285,8 @@ class AvalonReferee:
                 )
 
                 shutil.copy(original_ai_path, destination_path)
+                # 复用上传时生成的字节码 (按源码哈希校验)，省去每局重新编译
+                install_compiled_artifact(original_ai_path, destination_path)
                 logger.info(
                     f"Copied AI for player {player_position} (AI ID: {ai_code_id}) from '{original_ai_path}' to '{destination_path}'"
                 )
@@ -679,7 +653,7 @@ class AvalonReferee:
                     exc_info=True,  # Include traceback in log
                 )
                 self.suspend_game(
-                    "player_return_ERROR",
+                    "player_ruturn_ERROR",
                     self.leader_index,
                     "decide_mission_member",
                     f"Leader {self.leader_index} returned non-list: {type(mission_members)}, but it should be a list.",
@@ -1211,6 +1185,11 @@ class AvalonReferee:
         # 判断是否刺中梅林
         target_role = self.roles[target_id]
         success = target_role == "Merlin"
+        self.assassination = {
+            "assassin": assassin_id,
+            "target": target_id,
+            "success": success,
+        }
         logger.info(
             f"Assassination: Player {assassin_id} targeted Player {target_id} ({target_role}). Result: {'Success' if success else 'Fail'}"
         )
@@ -1238,7 +1217,16 @@ class AvalonReferee:
     这个实现专注于确保游戏结果的格式一致性，正确包含角色信息，并增强日志记录。
     """
 
-    def run_game(self) -> Dict[str, Any]:
+    def _build_result(self, game_result: Dict[str, Any]) -> BattleResult:
+        """把结果字典包装为 BattleResult，附带 token 用量和报错信息"""
+        result = BattleResult.from_dict(game_result)
+        result.tokens = deepcopy(self.game_helper.get_tokens())
+        result.player_error = self.player_error
+        result.mission_results = list(self.mission_results)
+        result.assassination = self.assassination
+        return result
+
+    def run_game(self) -> BattleResult:
         """
         运行游戏，返回游戏结果
         """
@@ -1249,7 +1237,9 @@ class AvalonReferee:
         try:
             # 直接使用传入的battle_service而不是直接查询数据库
             # 避免"Working outside of application context"错误
-            self.battle_status_checker = BattleStatusChecker(self.game_id)
+            self.battle_status_checker = BattleStatusChecker(
+                self.game_id, self.battle_service
+            )
         except Exception as e:
             logger.error(f"Error initializing battle status checker: {str(e)}")
             # 继续游戏流程，但没有状态检查
@@ -1300,13 +1290,13 @@ class AvalonReferee:
             self.init_game()
             abort_result = check_abort()
             if abort_result:
-                return abort_result
+                return self._build_result(abort_result)
 
             # 夜晚阶段
             self.night_phase()
             abort_result = check_abort()
             if abort_result:
-                return abort_result
+                return self._build_result(abort_result)
 
             # 任务阶段
             while (
@@ -1321,7 +1311,7 @@ class AvalonReferee:
                     # 将状态检查的结果包装成返回值
                     abort_result = check_abort()
                     if abort_result:
-                        return abort_result
+                        return self._build_result(abort_result)
                     else:
                         # 如果check_abort没有返回结果，我们仍然需要处理终止
                         # 创建标准格式的角色信息字典
@@ -1336,23 +1326,25 @@ class AvalonReferee:
                                 f"Game {self.game_id} terminated with roles: {roles_dict}"
                             )
 
-                        return {
-                            "blue_wins": self.blue_wins,
-                            "red_wins": self.red_wins,
-                            "rounds_played": self.current_round,
-                            "roles": roles_dict,
-                            "public_log_file": os.path.join(
-                                self.data_dir,
-                                f"{self.game_id}/public_game_{self.game_id}.json",
-                            ),
-                            "winner": None,
-                            "win_reason": "terminated_due_to_status_change",
-                        }
+                        return self._build_result(
+                            {
+                                "blue_wins": self.blue_wins,
+                                "red_wins": self.red_wins,
+                                "rounds_played": self.current_round,
+                                "roles": roles_dict,
+                                "public_log_file": os.path.join(
+                                    self.data_dir,
+                                    f"{self.game_id}/public_game_{self.game_id}.json",
+                                ),
+                                "winner": None,
+                                "win_reason": "terminated_due_to_status_change",
+                            }
+                        )
 
                 # 每轮结束后检查状态
                 abort_result = check_abort()
                 if abort_result:
-                    return abort_result
+                    return self._build_result(abort_result)
 
             # 游戏结束判定
             logger.info("===== Game Over =====")
@@ -1391,7 +1383,7 @@ class AvalonReferee:
                 )
                 abort_result = check_abort()
                 if abort_result:
-                    return abort_result  # 进入刺杀阶段前检查
+                    return self._build_result(abort_result)  # 进入刺杀阶段前检查
 
                 assassination_success = self.assassinate_phase()
                 if assassination_success:
@@ -1455,7 +1447,7 @@ class AvalonReferee:
             self.log_public_event({"type": "game_end", "result": game_result})
             logger.info(f"===== Game {self.game_id} Finished =====")
             self.battle_observer.make_snapshot("GameEnd", self.game_id)
-            return game_result
+            return self._build_result(game_result)
 
         except GameTerminationError as e:
             logger.error(f"Game terminated due to battle status change: {str(e)}")
@@ -1486,7 +1478,7 @@ class AvalonReferee:
             self.log_public_event(
                 {"type": "game_terminated", "result": terminate_result}
             )
-            return terminate_result
+            return self._build_result(terminate_result)
 
         except Exception as e:
             import traceback
@@ -1522,7 +1514,7 @@ class AvalonReferee:
             # 记录错误事件
             self.log_public_event({"type": "game_error", "result": error_result})
             logger.error(f"Error context: {error_result}")
-            return error_result
+            return self._build_result(error_result)
         finally:
             # 无论游戏如何结束（正常、终止或出错），都执行清理操作
             self._cleanup_battle_ai_modules()
@@ -1661,6 +1653,12 @@ class AvalonReferee:
         """一键中止游戏，提供详细的错误信息和 traceback"""
         # 标记游戏已挂起
         self.game_suspended = True
+        self.player_error = PlayerError(
+            pid=error_code_pid,
+            method=error_code_method_name,
+            error_type=game_error_type,
+            message=error_msg,
+        )
 
         SUSPEND_BROADCAST_MSG = (
             (
@@ -4,47 +4,50 @@ restrictor.py -- 限制用户代码的 __builtins__
 
 import types
 
+# 玩家代码可以导入的辅助模块及其公开接口
+HELPER_MODULE = "game.avalon_game_helper"
+HELPER_ATTRS = (
+    "write_into_private",
+    "read_private_lib",
+    "read_public_lib",
+    "askLLM",
+)
+
+# 白名单
+ALLOWED_MODULES = (
+    "random",
+    "re",
+    "collections",
+    "math",
+    "json",
+    # 建议添加的模块
+    "itertools",  # 提供高效的循环迭代工具
+    "functools",  # 高阶函数和操作可调用对象的工具
+    "copy",  # 提供深浅拷贝功能
+    "heapq",  # 堆队列算法
+    "datetime",  # 日期时间处理
+    "string",  # 常用字符串常量和操作
+    "bisect",  # 数组二分查找算法
+    "statistics",  # 提供数学统计功能
+    "typing",  # 类型提示支持
+)
+
 
 def _restricted_importer(name, globals=None, locals=None, fromlist=(), level=0):
     """安全模块导入器"""
-    if name == "game.avalon_game_helper":
+    if name == HELPER_MODULE:
         # 正确导入子模块
         helper_module = __import__(name, globals, locals, fromlist, level)
 
         # 创建受限模块对象
         restricted_module = types.ModuleType(name)
         # 暴露允许的接口
-        allowed_attrs = [
-            "write_into_private",
-            "read_private_lib",
-            "read_public_lib",
-            "askLLM",
-        ]
-        for attr in allowed_attrs:
+        for attr in HELPER_ATTRS:
             setattr(restricted_module, attr, getattr(helper_module, attr))
         return restricted_module
 
-    # 白名单
-    allowed_modules = {
-        "random": __import__("random"),
-        "re": __import__("re"),
-        "collections": __import__("collections"),
-        "math": __import__("math"),
-        "json": __import__("json"),
-        # 建议添加的模块
-        "itertools": __import__("itertools"),  # 提供高效的循环迭代工具
-        "functools": __import__("functools"),  # 高阶函数和操作可调用对象的工具
-        "copy": __import__("copy"),  # 提供深浅拷贝功能
-        "heapq": __import__("heapq"),  # 堆队列算法
-        "datetime": __import__("datetime"),  # 日期时间处理
-        "string": __import__("string"),  # 常用字符串常量和操作
-        "bisect": __import__("bisect"),  # 数组二分查找算法
-        "statistics": __import__("statistics"),  # 提供数学统计功能
-        "typing": __import__("typing"),  # 类型提示支持
-    }
-
-    if name in allowed_modules:
-        return allowed_modules[name]
+    if name in ALLOWED_MODULES:
+        return __import__(name)
 
     # Raise precise error messages
     if any(name.startswith(m) for m in ["os", "sys", "subprocess"]):
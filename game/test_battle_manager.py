@@ -0,0 +1,104 @@
+"""battle_manager.py: 对战不在本进程执行 (未持有租约) 时从数据库读取状态"""
+
+import pytest
+
+from database import claim_battle_job, create_battles
+from game.battle_manager import BattleManager
+from game.battle_result import BattleResult
+from services import battle_service as battle_service_module
+from services.battle_service import BattleService
+from services.usage_recorder import LlmUsageRecorder
+
+ROLES = {
+    1: "Merlin",
+    2: "Percival",
+    3: "Knight",
+    4: "Knight",
+    5: "Morgana",
+    6: "Assassin",
+    7: "Oberon",
+}
+
+
+@pytest.fixture
+def battle_service(app, tmp_path, monkeypatch):
+    (tmp_path / "ai.py").write_text("class Player:\n    pass\n")
+    app.config["AI_CODE_UPLOAD_FOLDER"] = str(tmp_path)
+    monkeypatch.setenv("AVALON_DATA_DIR", str(tmp_path / "data"))
+    # Observer 在工作目录下的 ./data 中创建归档文件
+    monkeypatch.chdir(tmp_path)
+    # 不导入仓库中的旧版调用日志
+    monkeypatch.setattr(
+        battle_service_module,
+        "LlmUsageRecorder",
+        lambda app: LlmUsageRecorder(app, str(tmp_path / "usage.json")),
+    )
+    service = BattleService(app)
+    yield service
+    service.shutdown()
+
+
+def _manager(battle_service, monkeypatch, run_workers=False):
+    """绕过单例创建一个新的对战管理器 (相当于另一个进程中的实例)"""
+    monkeypatch.setattr(BattleManager, "_instance", None)
+    # 不启动调度线程，任务只由测试显式领取
+    monkeypatch.setattr(BattleManager, "_start_worker_threads", lambda self: None)
+    return BattleManager(
+        battle_service, max_concurrent_battles=4, run_workers=run_workers
+    )
+
+
+def _finish_elsewhere(battle_service, monkeypatch, during=None):
+    """由另一个对战管理器领取任务并完成对战，during 在对战进行中调用"""
+    worker = _manager(battle_service, monkeypatch, run_workers=True)
+
+    def execute(battle_id, participant_data):
+        assert battle_service.mark_battle_as_playing(battle_id)
+        if during:
+            during(battle_id)
+        result = BattleResult(
+            roles=dict(ROLES), winner="blue", tokens=[{"input": 1, "output": 1}] * 7
+        )
+        assert battle_service.mark_battle_as_completed(battle_id, result)
+        worker.battle_status[battle_id] = "completed"
+
+    monkeypatch.setattr(worker, "_execute_battle", execute)
+    worker._process_job(claim_battle_job(worker.worker_id, 60))
+    return worker
+
+
+def test_enqueue_only_manager_reads_status_from_database(
+    battle_service, make_players, monkeypatch
+):
+    players = make_players(7)
+    (battle,) = create_battles([players], ranking_id=1)
+
+    web = _manager(battle_service, monkeypatch)
+    assert web.start_battle(battle.id, players)
+    assert web.get_battle_status(battle.id) == "waiting"
+
+    _finish_elsewhere(battle_service, monkeypatch)
+    assert web.get_battle_status(battle.id) == "completed"
+    # 已结束的对战不能再取消
+    assert not web.cancel_battle(battle.id)
+
+
+def test_battle_claimed_by_another_worker_reads_status_from_database(
+    battle_service, make_players, monkeypatch
+):
+    players = make_players(7)
+    (battle,) = create_battles([players], ranking_id=1)
+
+    # 同样执行对战，但任务被另一个 gunicorn 工作者领取
+    web = _manager(battle_service, monkeypatch, run_workers=True)
+    assert web.start_battle(battle.id, players)
+    assert web.get_battle_status(battle.id) == "waiting"
+
+    seen = []
+    _finish_elsewhere(
+        battle_service,
+        monkeypatch,
+        during=lambda battle_id: seen.append(web.get_battle_status(battle_id)),
+    )
+    assert seen == ["playing"]
+    assert web.get_battle_status(battle.id) == "completed"
@@ -0,0 +1,74 @@
+"""code_validator.py: 上传代码的静态检查 (check_source)"""
+
+import os
+
+from game.code_validator import PROJECT_ROOT, REQUIRED_METHODS, check_source
+
+METHODS = "\n".join(
+    f"    def {name}(self, *args):\n        return None" for name in REQUIRED_METHODS
+)
+
+VALID = f"""
+import random
+from game.avalon_game_helper import askLLM, read_public_lib
+
+
+class Player:
+    def __init__(self):
+        self.index = None
+
+{METHODS}
+"""
+
+
+def test_valid_source_passes():
+    assert check_source(VALID) == []
+
+
+def test_bundled_example_passes():
+    with open(os.path.join(PROJECT_ROOT, "aicode", "idiot_player.py")) as f:
+        assert check_source(f.read()) == []
+
+
+def test_syntax_error_reports_line():
+    errors = check_source("class Player:\n    def say(self)\n")
+    assert len(errors) == 1 and errors[0].startswith("第 2 行语法错误")
+
+
+def test_disallowed_imports():
+    source = VALID.replace(
+        "import random",
+        "import os\nfrom subprocess import run\nfrom . import sibling\n"
+        "from game.avalon_game_helper import secret",
+    )
+    errors = check_source(source)
+    assert any("os" in e for e in errors)
+    assert any("subprocess" in e for e in errors)
+    assert any("相对导入" in e for e in errors)
+    assert any("secret" in e for e in errors)
+
+
+def test_missing_player_class():
+    assert check_source("x = 1\n") == ["缺少 Player 类"]
+
+
+def test_missing_methods_and_required_init_args():
+    source = (
+        "class Player:\n"
+        "    def __init__(self, name):\n"
+        "        self.name = name\n"
+        "    def say(self):\n"
+        "        return ''\n"
+    )
+    errors = check_source(source)
+    assert any("必填参数" in e for e in errors)
+    missing = next(e for e in errors if e.startswith("Player 类缺少方法"))
+    assert "say" not in missing.split(": ", 1)[1].split(", ")
+    assert "assass" in missing
+
+
+def test_methods_inherited_from_local_base():
+    source = VALID.replace("class Player:", "class Base:") + (
+        "\n\nclass Player(Base):\n    pass\n"
+    )
+    assert check_source(source) == []
@@ -0,0 +1,87 @@
+"""concurrency_controller.py: 令牌池与 AIMD 控制律"""
+
+import threading
+import time
+
+import pytest
+
+from game.concurrency_controller import ConcurrencyController
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    controller = ConcurrencyController(max_limit=16, min_limit=4, initial_limit=8)
+    load = {"cpu": 10.0, "memory": 10.0}
+    monkeypatch.setattr(controller, "_system_signal", lambda: dict(load))
+    controller.load = load
+    return controller
+
+
+def _fill(controller, count):
+    for _ in range(count):
+        assert controller.acquire(timeout=0)
+
+
+def test_tokens_bound_in_flight(controller):
+    _fill(controller, 8)
+    assert not controller.acquire(timeout=0)
+    controller.release()
+    assert controller.acquire(timeout=0)
+
+
+def test_additive_increase_only_when_limit_binds(controller):
+    _fill(controller, 4)
+    assert controller.adjust()["action"] == "hold"
+    assert controller.limit == 8
+
+    _fill(controller, 4)
+    decision = controller.adjust()
+    assert (decision["action"], decision["new_limit"]) == ("increase", 10)
+    # 不超过硬上限
+    for _ in range(5):
+        _fill(controller, controller.limit - controller.in_flight)
+        controller.adjust()
+    assert controller.limit == 16
+
+
+def test_increase_wakes_waiting_battles(controller):
+    _fill(controller, 8)
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(controller.acquire(5)))
+    waiter.start()
+    time.sleep(0.05)
+    controller.adjust()
+    waiter.join(5)
+    assert acquired == [True]
+
+
+def test_multiplicative_decrease_on_overload(controller):
+    controller.load["cpu"] = 95.0
+    decision = controller.adjust()
+    assert (decision["action"], decision["new_limit"]) == ("decrease", 6)
+    assert "cpu" in decision["reason"]
+    controller.adjust()
+    controller.adjust()
+    assert controller.limit == 4  # 不低于下限
+
+    # 上限下调后，已运行的对战不受影响，新对战要等到低于上限
+    controller.load["cpu"] = 10.0
+    controller.limit = 8
+    _fill(controller, 8)
+    controller.load["memory"] = 95.0
+    controller.adjust()
+    assert controller.in_flight == 8
+    assert not controller.acquire(timeout=0)
+
+
+def test_llm_queue_delay_triggers_decrease(controller):
+    now = time.time()
+    # 基线 (较早的无排队调用) 1 秒，近期中位延迟 6 秒
+    controller._latencies.extend((now - 600, 1.0) for _ in range(20))
+    for _ in range(10):
+        controller.record_llm_latency(6.0)
+
+    decision = controller.adjust()
+    assert decision["llm_queue_delay"] == pytest.approx(5.0)
+    assert decision["action"] == "decrease"
+    assert controller.get_status()["recent_decisions"][-1] == decision
@@ -0,0 +1,94 @@
+"""decorator.py: 按对战采样的调用追踪、环形缓冲区与追踪文件导出"""
+
+import threading
+
+import pytest
+
+from game import decorator
+from game.decorator import (
+    DebugDecorator,
+    discard_trace,
+    dump_trace,
+    get_trace,
+    has_trace,
+    set_trace_sample_rate,
+)
+
+
+class Helper:
+    def add(self, a, b):
+        return a + b
+
+    def fail(self):
+        raise ValueError("boom")
+
+    def _private(self):
+        return "x"
+
+
+def _traced(battle_id):
+    return DebugDecorator(battle_id).decorate_instance(Helper())
+
+
+@pytest.fixture
+def battle_id():
+    battle_id = "trace-test"
+    yield battle_id
+    set_trace_sample_rate(battle_id, None)
+    discard_trace(battle_id)
+
+
+def test_disabled_by_default_records_nothing(battle_id):
+    helper = _traced(battle_id)
+    assert helper.add(1, 2) == 3
+    with pytest.raises(ValueError):
+        helper.fail()
+    assert not has_trace(battle_id)
+
+
+def test_full_sampling_records_calls_and_errors(battle_id):
+    set_trace_sample_rate(battle_id, 1)
+    helper = _traced(battle_id)
+    assert helper.add(1, 2) == 3
+    with pytest.raises(ValueError):
+        helper.fail()
+    assert helper._private() == "x"
+
+    events = [(r["event"], r["method"]) for r in get_trace(battle_id)]
+    assert events == [
+        ("call", "Helper.add"),
+        ("return", "Helper.add"),
+        ("call", "Helper.fail"),
+        ("error", "Helper.fail"),
+    ]
+
+
+def test_errors_are_recorded_even_when_not_sampled(battle_id, monkeypatch):
+    set_trace_sample_rate(battle_id, 0.5)
+    monkeypatch.setattr(decorator._sampler, "random", lambda: 0.9)
+    helper = _traced(battle_id)
+    helper.add(1, 2)
+    with pytest.raises(ValueError):
+        helper.fail()
+    assert [r["event"] for r in get_trace(battle_id)] == ["error"]
+
+
+def test_ring_buffer_keeps_latest_per_thread(battle_id, monkeypatch, tmp_path):
+    monkeypatch.setattr(decorator, "TRACE_BUFFER_SIZE", 10)
+    set_trace_sample_rate(battle_id, 1)
+    helper = _traced(battle_id)
+    for i in range(20):
+        helper.add(i, 0)
+    thread = threading.Thread(target=helper.add, args=(100, 0), name="other")
+    thread.start()
+    thread.join()
+
+    records = get_trace(battle_id)
+    assert len(records) == 12
+    assert {r["thread"] for r in records} == {"MainThread", "other"}
+    assert "(15, 0)" in records[0]["detail"]
+
+    path, count = dump_trace(battle_id, str(tmp_path))
+    assert count == 12
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 12
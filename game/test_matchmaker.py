@@ -0,0 +1,96 @@
+"""matchmaker.py / matchmaker_sim.py: 阵容评分、策略选择与模拟器的收敛判定"""
+
+import random
+from dataclasses import dataclass
+
+import pytest
+
+from game.matchmaker import (
+    InformationGainMatchmaker,
+    RandomMatchmaker,
+    create_matchmaker,
+    lineup_balance,
+    rating_uncertainty,
+)
+from game.matchmaker_sim import SimPlayer, simulate
+
+
+@dataclass
+class Participant:
+    user_id: str
+
+
+def test_random_is_the_default_strategy():
+    assert isinstance(create_matchmaker(), RandomMatchmaker)
+    assert isinstance(create_matchmaker("unknown"), RandomMatchmaker)
+    assert isinstance(create_matchmaker("information_gain"), InformationGainMatchmaker)
+
+
+def test_lineup_balance():
+    assert lineup_balance([1200] * 7) == pytest.approx(1.0)
+    # 实力差距越大，胜负越容易预测，平衡度越低
+    close = lineup_balance([1150, 1180, 1200, 1200, 1220, 1250, 1270])
+    wide = lineup_balance([600, 800, 1000, 1200, 1400, 1600, 1800])
+    assert 0 < wide < close < 1
+
+
+def test_score_prefers_uncertain_players():
+    matchmaker = InformationGainMatchmaker(rng=random.Random(0))
+    matchmaker.update_ratings(
+        {f"old{i}": (1200, 100) for i in range(7)}
+        | {f"new{i}": (1200, 0) for i in range(7)}
+    )
+    veterans = [Participant(f"old{i}") for i in range(7)]
+    newcomers = [Participant(f"new{i}") for i in range(7)]
+    assert matchmaker.score_lineup(newcomers) == pytest.approx(7 * 1.0)
+    assert matchmaker.score_lineup(veterans) == pytest.approx(
+        7 * rating_uncertainty(100)
+    )
+
+    lineup = matchmaker.select_lineup(veterans + newcomers)
+    assert {p.user_id for p in lineup} == {p.user_id for p in newcomers}
+    # 本次刷新内已选中的场次计入对局数
+    assert matchmaker.score_lineup(newcomers) == pytest.approx(
+        7 * rating_uncertainty(1)
+    )
+
+
+def test_small_pool_uses_everyone():
+    participants = [Participant(str(i)) for i in range(7)]
+    lineup = InformationGainMatchmaker(rng=random.Random(0)).select_lineup(participants)
+    assert sorted(p.user_id for p in lineup) == [str(i) for i in range(7)]
+
+
+def _players():
+    # 实力差距悬殊，前 3 名很快稳定
+    return [SimPlayer(f"ai_{i}", 600 + 300 * i) for i in range(7)]
+
+
+@pytest.mark.parametrize("strategy", ["random", "information_gain"])
+def test_simulation_reports_start_of_stable_streak(strategy):
+    converged_at, overlap = simulate(
+        strategy,
+        _players(),
+        top_n=3,
+        stable_window=20,
+        max_games=400,
+        refresh_every=5,
+        seed=0,
+    )
+    assert converged_at is not None
+    # 收敛局数是连续稳定区间的第一局，区间必须在 max_games 内走完
+    assert 1 <= converged_at <= 400 - 20 + 1
+    assert overlap > 0.9
+
+
+def test_simulation_without_full_window_does_not_converge():
+    converged_at, _ = simulate(
+        "random",
+        _players(),
+        top_n=3,
+        stable_window=20,
+        max_games=10,
+        refresh_every=5,
+        seed=0,
+    )
+    assert converged_at is None
@@ -0,0 +1,126 @@
+"""
+独立对战工作进程入口
+
+用法:
+    python -m game.worker [--max-concurrency N] [--drain-timeout 秒]
+
+Web 进程设置 RUN_BATTLE_WORKERS=0 后只负责创建对战并写入持久化队列，
+本进程从同一数据库的 battle_jobs 表领取任务、执行对战并写回结果。
+可以在一台或多台主机上启动多个工作进程，租约保证同一任务不会被重复执行。
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+from flask import Flask
+
+from config.config import Config
+from database import (
+    acquire_service_lease,
+    initialize_database,
+    recover_battle_queue,
+    release_service_lease,
+)
+from database.battle_queue import STARTUP_RECOVERY_LEASE, STARTUP_RECOVERY_LEASE_SECONDS
+from database.base import db
+from game.battle_manager import MAX_CONCURRENT_BATTLES
+from services.metrics import init_metrics
+from utils.battle_manager_utils import init_battle_manager_utils, get_battle_manager
+from utils.response_cache import init_response_cache
+
+logger = logging.getLogger("BattleWorker")
+
+
+def create_worker_app(max_concurrency: int = MAX_CONCURRENT_BATTLES) -> Flask:
+    """创建只包含数据库配置的精简 Flask 应用，供对战服务使用应用上下文"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    # 工作进程总是执行对战
+    app.config["RUN_BATTLE_WORKERS"] = True
+    app.config["MAX_CONCURRENT_BATTLES"] = max_concurrency
+
+    initialize_database(app)
+    # 评分写入后失效 Web 进程共享的排行榜缓存
+    init_response_cache(app)
+    with app.app_context():
+        db.create_all()
+
+    # 配置模块导入时可能已初始化 root logger，这里显式设置级别
+    logging.basicConfig(level=app.config["LOG_LEVEL"])
+    logging.getLogger().setLevel(app.config["LOG_LEVEL"])
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="阿瓦隆对战工作进程")
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=MAX_CONCURRENT_BATTLES,
+        help="本进程并发对战数的硬上限 (实际上限由并发控制器动态调整)",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=60.0,
+        help="收到退出信号后等待运行中对战结束的秒数，超时的对战由租约过期后重试",
+    )
+    args = parser.parse_args(argv)
+
+    app = create_worker_app(args.max_concurrency)
+
+    # 启动前回收崩溃工作者遗留的任务 (多个工作进程同时启动时只有一个执行)
+    with app.app_context():
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        if acquire_service_lease(
+            STARTUP_RECOVERY_LEASE, owner, STARTUP_RECOVERY_LEASE_SECONDS
+        ):
+            try:
+                summary = recover_battle_queue(include_orphans=True)
+            finally:
+                release_service_lease(STARTUP_RECOVERY_LEASE, owner)
+            if summary:
+                logger.info(f"启动恢复完成: {summary}")
+        else:
+            logger.info("其他进程正在恢复对战队列，跳过启动恢复")
+
+    init_battle_manager_utils(app)
+    battle_manager = get_battle_manager()
+    # 本进程执行的对战和 LLM 调用通过指标快照汇总到 Web 进程的 /metrics
+    metrics_publisher = init_metrics(app)
+    logger.info(f"对战工作进程已启动: {battle_manager.worker_id}")
+
+    stop_event = threading.Event()
+
+    def _handle_signal(signum, frame):
+        logger.info(f"收到信号 {signum}，准备退出")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+    while not stop_event.wait(30):
+        logger.info(f"工作进程状态: {battle_manager.get_queue_status()}")
+
+    # 停止领取新任务，等待运行中的对战结束
+    battle_manager.shutdown()
+    deadline = time.time() + args.drain_timeout
+    while battle_manager.concurrency.in_flight > 0 and time.time() < deadline:
+        time.sleep(1)
+    if battle_manager.concurrency.in_flight > 0:
+        logger.warning(
+            f"仍有 {battle_manager.concurrency.in_flight} 场对战未结束，将由其他工作者在租约过期后重试"
+        )
+    # 写完已排队的评分结果和状态变更
+    battle_manager.battle_service.shutdown()
+    metrics_publisher.shutdown()
+    logger.info("对战工作进程已退出")
+
+
+if __name__ == "__main__":
+    main()
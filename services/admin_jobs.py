@@ -0,0 +1,227 @@
+"""
+管理后台的后台任务
+
+晋级、重置榜单、终止 / 删除对局等操作涉及大量数据库和文件操作，在请求中执行会占住
+gevent 工作者，并可能超过 gunicorn 的请求超时。管理接口把它们写入 admin_jobs 表
+(见 database/admin_job_queue.py) 后立即返回任务ID，前端轮询 /admin/jobs/<任务ID>。
+
+- 处理函数用 @admin_job("类型") 注册，以任务参数 (JSON) 为关键字参数、
+  progress 为进度回调 progress(已完成, 总数, 说明) 调用，返回值 (可 JSON 序列化) 作为任务结果
+- 每个进程 ADMIN_JOB_WORKERS 个工作线程从表中原子领取任务，同一进程提交的任务立即唤醒，
+  其他进程提交的任务在 ADMIN_JOB_POLL_INTERVAL 秒内领取
+- 心跳线程定期续约并写回进度，同时带回取消请求；处理函数下一次报告进度时抛出
+  JobCancelled，未提交的事务回滚
+- 进程退出时执行中的任务在租约过期后标记为 failed，不会自动重新执行
+"""
+
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from flask import Flask, current_app
+
+from database import (
+    cancel_admin_job,
+    claim_admin_job,
+    db,
+    enqueue_admin_job,
+    finish_admin_job,
+    get_admin_job,
+    heartbeat_admin_jobs,
+    list_admin_jobs,
+    recover_admin_jobs,
+)
+from utils.sql_profiler import profile_sql
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_POLL_INTERVAL = 2.0
+LEASE_SECONDS = 120
+HEARTBEAT_SECONDS = 2.0
+RECOVER_EVERY = 30  # 每隔多少次心跳检查一次租约过期的任务
+
+# 任务类型 -> 处理函数
+JOB_HANDLERS = {}
+
+_create_lock = threading.Lock()
+
+
+def admin_job(kind):
+    """注册后台任务的处理函数"""
+
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+class JobCancelled(BaseException):
+    """
+    任务被取消。继承 BaseException (与 asyncio.CancelledError 相同)，
+    处理函数中通用的 except Exception 不会吞掉取消。
+    """
+
+
+class AdminJobRunner:
+    """从任务表领取并执行管理后台任务的工作线程 (每个进程一个)"""
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.poll_interval = float(
+            app.config.get("ADMIN_JOB_POLL_INTERVAL", DEFAULT_POLL_INTERVAL)
+        )
+        self._running = {}  # 本进程执行中的任务ID -> (完成百分比, 说明)
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+        with app.app_context():
+            recover_admin_jobs()
+
+        workers = int(app.config.get("ADMIN_JOB_WORKERS", DEFAULT_WORKERS))
+        self.threads = [
+            threading.Thread(target=self._work, name=f"AdminJob-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        self.threads.append(
+            threading.Thread(
+                target=self._heartbeat, name="AdminJobHeartbeat", daemon=True
+            )
+        )
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, kind, name, params=None, created_by=None):
+        """
+        提交任务 (需要在应用上下文中调用)。
+
+        参数:
+            kind (str): 已注册的任务类型。
+            name (str): 任务名称 (显示给管理员)。
+            params (dict): 处理函数的关键字参数，需可 JSON 序列化。
+            created_by (str): 提交任务的管理员ID。
+
+        返回:
+            dict: 任务信息，写入失败返回 None。
+
+        异常:
+            ValueError: 任务类型未注册。
+        """
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"未注册的后台任务类型: {kind}")
+        job = enqueue_admin_job(kind, name, params, created_by)
+        if job is not None:
+            logger.info(f"已提交后台任务 {name} ({job['id']})")
+            self._wakeup.set()
+        return job
+
+    def get(self, job_id):
+        """任务信息，不存在返回 None"""
+        return get_admin_job(job_id)
+
+    def list(self, limit=20, status=None):
+        """最近提交的任务，新的在前"""
+        return list_admin_jobs(limit, status)
+
+    def cancel(self, job_id):
+        """取消任务，返回更新后的任务信息；任务不存在或已结束返回 None"""
+        job = cancel_admin_job(job_id)
+        if job is not None:
+            # 本进程执行的任务不必等下一次心跳
+            with self._lock:
+                if job_id in self._running:
+                    self._cancelled.add(job_id)
+        return job
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    job = claim_admin_job(self.worker_id, LEASE_SECONDS)
+                    if job is not None:
+                        with profile_sql(f"admin_job:{job['kind']}"):
+                            self._execute(job)
+                        continue
+            except Exception as e:
+                logger.exception(f"执行后台任务出错: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _execute(self, job):
+        job_id = job["id"]
+
+        def progress(done, total, message=None):
+            with self._lock:
+                if job_id in self._cancelled:
+                    raise JobCancelled()
+                percent = round(done * 100 / total, 1) if total else 100.0
+                self._running[job_id] = (percent, message)
+
+        with self._lock:
+            self._running[job_id] = (0.0, None)
+        status, result, error = "done", None, None
+        try:
+            handler = JOB_HANDLERS.get(job["kind"])
+            if handler is None:
+                raise ValueError(f"未注册的后台任务类型: {job['kind']}")
+            logger.info(f"开始执行后台任务 {job['name']} ({job_id})")
+            result = handler(**job["params"], progress=progress)
+        except JobCancelled:
+            db.session.rollback()
+            status, error = "cancelled", "执行中被取消"
+            logger.info(f"后台任务 {job['name']} ({job_id}) 已取消")
+        except Exception as e:
+            db.session.rollback()
+            status, error = "failed", str(e)
+            logger.exception(f"后台任务 {job['name']} ({job_id}) 出错: {e}")
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+                self._cancelled.discard(job_id)
+        finish_admin_job(job_id, self.worker_id, status, result, error)
+
+    def _heartbeat(self):
+        ticks = 0
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            ticks += 1
+            with self._lock:
+                running = dict(self._running)
+            try:
+                with self.app.app_context():
+                    if running:
+                        cancelled = heartbeat_admin_jobs(
+                            self.worker_id, running, LEASE_SECONDS
+                        )
+                        if cancelled:
+                            with self._lock:
+                                self._cancelled |= cancelled & set(self._running)
+                    if ticks % RECOVER_EVERY == 0:
+                        recover_admin_jobs()
+            except Exception as e:
+                logger.exception(f"后台任务心跳出错: {e}")
+
+    def shutdown(self):
+        """停止领取新任务 (执行中的任务不等待，租约过期后标记为中断)"""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+
+def init_admin_jobs(app: Flask) -> AdminJobRunner:
+    """为应用创建任务执行器并启动工作线程 (标记上次退出时中断的任务)"""
+    with _create_lock:
+        if "admin_jobs" not in app.extensions:
+            app.extensions["admin_jobs"] = AdminJobRunner(app)
+        return app.extensions["admin_jobs"]
+
+
+def get_admin_jobs() -> AdminJobRunner:
+    """当前应用的任务执行器 (未初始化时创建)"""
+    return init_admin_jobs(current_app._get_current_object())
@@ -0,0 +1,93 @@
+"""
+批量写线程基类
+
+评分流水线、状态写线程和 LLM 调用记录写线程的写法相同：调用方把条目放进队列，
+唯一的写线程阻塞等待第一条，再在 linger_seconds 内尽量凑满 max_batch_size 条，
+合并为一个事务提交。队列中的 None 表示停止：处理完已排队的条目后线程退出。
+"""
+
+import logging
+import threading
+from queue import Queue, Empty
+from time import time
+from typing import List, Optional
+
+from utils.sql_profiler import profile_sql
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """
+    批量写线程。子类设置批量参数并实现 write_batch (在应用上下文中调用)；
+    线程在 __init__ 中启动，子类应在调用 super().__init__ 之前设置好自己的属性。
+
+    类属性:
+        max_batch_size: 单个事务最多合并的条目数
+        linger_seconds: 收到第一条后等待同批条目的时间
+        idle_seconds: 队列空闲多久后调用一次 maintain，None 为一直等待
+    """
+
+    max_batch_size = 64
+    linger_seconds = 0.02
+    idle_seconds: Optional[float] = None
+
+    def __init__(self, app, thread_name: str, profile_name: str):
+        self.app = app
+        self.profile_name = profile_name
+        self.queue: Queue = Queue()
+        self.thread = threading.Thread(target=self._run, name=thread_name, daemon=True)
+        self.thread.start()
+
+    def _collect_batch(self) -> Optional[List]:
+        """阻塞等待第一条，然后在短时间内尽量凑满一批；空闲超时返回空列表，停止返回 None"""
+        try:
+            first = self.queue.get(timeout=self.idle_seconds)
+        except Empty:
+            return []
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time() + self.linger_seconds
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self.queue.get(timeout=max(0, deadline - time()))
+            except Empty:
+                break
+            if item is None:
+                self.queue.put(None)  # 处理完本批后退出
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.exception(f"{self.thread.name} 维护出错: {e}")
+            batch = self._collect_batch()
+            if batch is None:
+                break
+            if not batch:
+                continue
+            try:
+                with self.app.app_context(), profile_sql(self.profile_name):
+                    self.write_batch(batch)
+            except Exception as e:
+                logger.exception(f"{self.thread.name} 批量写入出错: {e}")
+                self.on_error(batch)
+
+    def maintain(self):
+        """每批之前 (以及空闲超时后) 在写线程中调用，默认什么都不做"""
+
+    def write_batch(self, batch: List):
+        raise NotImplementedError
+
+    def on_error(self, batch: List):
+        """write_batch 抛出异常后调用，默认什么都不做"""
+
+    def shutdown(self, timeout: float = 10):
+        """写完已排队的条目后停止写线程"""
+        self.queue.put(None)
+        self.thread.join(timeout=timeout)
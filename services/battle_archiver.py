@@ -0,0 +1,86 @@
+"""
+对战归档线程
+
+每隔 BATTLE_ARCHIVE_INTERVAL 秒把结束超过 BATTLE_ARCHIVE_AFTER_DAYS 天的对战
+移入归档表 (archive_battles，见 database/archive.py)，热表只保留近期对战。
+BATTLE_ARCHIVE_AFTER_DAYS 为 0 (默认) 时不启动。
+
+每个进程 (gunicorn 的各个工作者、独立的对战工作进程) 都会创建归档线程，
+每次归档前先抢占数据库中的 battle_archive 租约 (见 database/service_lease.py)，
+租约时长为一个执行间隔，同一间隔内只有一个进程归档。管理员手动归档
+(admin.archive_old_battles 提交的后台任务) 同样先抢占该租约。
+"""
+
+import logging
+import os
+import socket
+import threading
+
+from flask import Flask
+
+from database import acquire_service_lease, archive_battles
+from utils.sql_profiler import profile_sql
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_SECONDS = 3600
+STARTUP_DELAY_SECONDS = 60  # 启动后等待一段时间再归档，避开启动时的数据库访问高峰
+ARCHIVE_LEASE = "battle_archive"
+
+
+class BattleArchiver:
+    """定期归档已结束对战的后台线程"""
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.after_days = float(app.config.get("BATTLE_ARCHIVE_AFTER_DAYS", 0))
+        self.interval = float(
+            app.config.get("BATTLE_ARCHIVE_INTERVAL", DEFAULT_INTERVAL_SECONDS)
+        )
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self.thread = None
+        if self.after_days > 0:
+            self.thread = threading.Thread(
+                target=self._run, name="BattleArchiver", daemon=True
+            )
+            self.thread.start()
+
+    def _run(self):
+        delay = STARTUP_DELAY_SECONDS
+        while not self._stop.wait(delay):
+            delay = self.interval
+            try:
+                with self.app.app_context(), profile_sql("battle_archive"):
+                    self.archive_now(self.after_days)
+            except Exception as e:
+                logger.exception(f"归档对战出错: {e}")
+
+    def archive_now(self, older_than_days=None, progress=None):
+        """
+        抢占 battle_archive 租约后归档一轮 (需要在应用上下文中调用)。
+        定期归档和管理员手动归档 (后台任务) 都经过这里，同一间隔内只有一个进程归档。
+
+        参数:
+            older_than_days (float, optional): 归档阈值 (天)，见 archive_battles。
+            progress (callable, optional): 进度回调，见 archive_battles。
+
+        返回:
+            int: 归档的对战数；其他进程持有租约时返回 None。
+
+        异常:
+            RuntimeError: 归档失败。
+        """
+        # 租约不释放，到期前 (一个间隔内) 其他进程都跳过本轮
+        if not acquire_service_lease(ARCHIVE_LEASE, self.owner, self.interval):
+            return None
+        archived = archive_battles(older_than_days, progress=progress)
+        if archived is None:
+            raise RuntimeError("归档对战失败")
+        return archived
+
+    def shutdown(self):
+        """停止归档线程 (正在进行的批次提交后退出)"""
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout=30)
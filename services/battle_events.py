@@ -0,0 +1,114 @@
+"""
+跨进程的对战结束事件 (Redis 发布/订阅)
+
+BattleManager 的完成事件只在执行对战的进程内回调；自动对战循环所在的进程
+(例如 RUN_BATTLE_WORKERS=0 的 Web 进程，或对战被其他 gunicorn worker 领取时)
+收不到，只能每隔几秒查询数据库。
+
+- 执行对战的进程在对战结束后向 CHANNEL 发布 {battle_id, status, origin}
+- 每个进程有一个订阅线程，收到其他进程 (origin 不同) 的事件后交给本进程的订阅者
+- Redis 不可用时发布直接跳过、订阅线程定期重连，自动对战退回到数据库轮询
+"""
+
+import json
+import logging
+import threading
+import time
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REDIS_URL = "redis://localhost:6379/0"
+CHANNEL = "avalon:battle_completed"
+REDIS_RETRY_SECONDS = 30  # Redis 出错后暂停发布 / 重新订阅的间隔
+POLL_TIMEOUT_SECONDS = 1.0  # 订阅线程检查关闭信号的间隔
+
+
+class BattleEventBus:
+    """经 Redis 广播对战结束事件，并把其他进程的事件交给 on_event(battle_id, status)"""
+
+    def __init__(self, redis_client, origin, on_event):
+        self.redis = redis_client
+        self.origin = origin
+        self.on_event = on_event
+        self._redis_down_until = 0.0
+        self._stop = threading.Event()
+        self.thread = None
+        if self.redis is not None:
+            self.thread = threading.Thread(
+                target=self._listen, name="BattleEventBus", daemon=True
+            )
+            self.thread.start()
+
+    def _redis_failed(self, e):
+        self._redis_down_until = time.time() + REDIS_RETRY_SECONDS
+        logger.warning(
+            f"对战事件无法访问 Redis，{REDIS_RETRY_SECONDS} 秒内只在进程内通知: {e}"
+        )
+
+    def publish(self, battle_id, status):
+        """广播对战结束事件 (尽力而为，失败时其他进程靠数据库轮询兜底)"""
+        if self.redis is None or time.time() < self._redis_down_until:
+            return False
+        payload = json.dumps(
+            {"battle_id": battle_id, "status": status, "origin": self.origin}
+        )
+        try:
+            self.redis.publish(CHANNEL, payload)
+            return True
+        except redis.RedisError as e:
+            self._redis_failed(e)
+            return False
+
+    def _dispatch(self, message):
+        try:
+            event = json.loads(message["data"])
+        except (TypeError, ValueError) as e:
+            logger.warning(f"无法解析对战事件: {e}")
+            return
+        if event.get("origin") == self.origin:
+            return  # 本进程的事件已经直接通知过订阅者
+        self.on_event(event.get("battle_id"), event.get("status"))
+
+    def _listen(self):
+        while not self._stop.is_set():
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=POLL_TIMEOUT_SECONDS)
+                    if message is not None:
+                        self._dispatch(message)
+            except redis.RedisError as e:
+                self._redis_failed(e)
+                self._stop.wait(REDIS_RETRY_SECONDS)
+            except Exception as e:
+                logger.exception(f"处理对战事件出错: {e}")
+                self._stop.wait(POLL_TIMEOUT_SECONDS)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except redis.RedisError:
+                        pass
+
+    def shutdown(self):
+        """停止订阅线程"""
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout=POLL_TIMEOUT_SECONDS * 2)
+
+
+def create_battle_event_bus(config, origin, on_event):
+    """根据应用配置创建事件总线；BATTLE_EVENTS_REDIS 关闭时只在进程内通知"""
+    redis_client = None
+    if config.get("BATTLE_EVENTS_REDIS", True):
+        redis_client = redis.from_url(
+            config.get("BATTLE_EVENTS_REDIS_URL") or DEFAULT_REDIS_URL,
+            socket_connect_timeout=0.5,
+            socket_timeout=2,  # 大于订阅线程的等待间隔
+            health_check_interval=30,
+        )
+    return BattleEventBus(redis_client, origin, on_event)
@@ -1,18 +1,31 @@
 import logging
 import json
 from flask import Flask  # 导入 Flask
-from typing import Optional
+from typing import Optional, Union
 from database import (
     get_battle_by_id,
     update_battle,
-    process_battle_results_and_update_stats,
     get_ai_code_path_full,
     mark_battle_as_cancelled,  # 新增: 导入处理取消状态的函数
     handle_cancelled_battle_stats,  # 新增: 导入处理取消对战统计的函数
+    enqueue_battle_job,
+    claim_battle_job,
+    heartbeat_battle_jobs,
+    ack_battle_job,
+    cancel_battle_job,
+    recover_battle_queue,
+    get_battle_queue_stats,
+    get_battle_traces,
+    record_battle_trace_dump,
 )
 from database.models import (
     Battle,
 )
+from game.battle_result import BattleResult
+from services.rating_pipeline import RatingPipeline
+from services.status_writer import BattleStatusWriter
+from services.usage_recorder import LlmUsageRecorder
+from services.battle_archiver import BattleArchiver
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +40,18 @@ class BattleService:
         if app is None:
             raise ValueError("Flask app instance is required for BattleService")
         self.app = app  # 存储 app 实例
+        # 对战结果经由每个榜单唯一的写线程批量写入
+        self.rating_pipeline = RatingPipeline(app)
+        # 可选：高频的状态变更由单独的写线程合并提交
+        self.status_writer = (
+            BattleStatusWriter(app)
+            if app.config.get("BATTLE_STATUS_WRITER", False)
+            else None
+        )
+        # LLM 调用记录由写线程批量写入数据库 (对战进程中由 BattleManager 接入 ClientManager)
+        self.usage_recorder = LlmUsageRecorder(app)
+        # 结束较久的对战定期移入归档表
+        self.archiver = BattleArchiver(app)
 
     def get_ai_code_path(self, ai_code_id: str) -> Optional[str]:
         """获取 AI 代码的完整路径。"""
@@ -40,10 +65,22 @@ class BattleService:
 
     def mark_battle_as_playing(self, battle_id: str) -> bool:
         """将数据库中的对战状态更新为 'playing'。"""
+        if self.status_writer is not None:
+            if self.status_writer.submit(battle_id, "playing"):
+                logger.info(f"数据库：对战 {battle_id} 状态更新为 playing")
+                return True
+            # 已取消、不存在的对战不会被改为 playing
+            logger.error(
+                f"数据库：更新对战 {battle_id} 状态为 playing 失败 (可能已取消)"
+            )
+            return False
         try:
             # 使用 self.app 创建上下文
             with self.app.app_context():
                 battle = get_battle_by_id(battle_id)
+                if battle and battle.status == "cancelled":
+                    logger.info(f"数据库：对战 {battle_id} 已取消，不再开始")
+                    return False
                 if battle:
                     if update_battle(battle, status="playing"):
                         logger.info(f"数据库：对战 {battle_id} 状态更新为 playing")
@@ -61,27 +98,28 @@ class BattleService:
             logger.exception(f"更新对战 {battle_id} 状态为 playing 时出错: {e}")
             return False
 
-    def mark_battle_as_completed(self, battle_id: str, result_data: dict) -> bool:
+    def mark_battle_as_completed(
+        self, battle_id: str, result_data: Union[BattleResult, dict]
+    ) -> bool:
         """处理对战完成，更新数据库状态和统计信息。"""
         try:
-            # 使用 self.app 创建上下文
+            # 在应用上下文之外等待写线程，避免持有数据库连接
+            if self.rating_pipeline.submit(battle_id, result_data):
+                logger.info(f"数据库：对战 {battle_id} 结果处理和统计更新成功")
+                return True
+            logger.error(f"数据库：对战 {battle_id} 结果处理或统计更新失败")
+            if isinstance(result_data, BattleResult):
+                result_data = result_data.to_dict()
             with self.app.app_context():
-                if process_battle_results_and_update_stats(battle_id, result_data):
-                    logger.info(f"数据库：对战 {battle_id} 结果处理和统计更新成功")
-                    return True
-                else:
-                    logger.error(f"数据库：对战 {battle_id} 结果处理或统计更新失败")
-                    # 尝试标记为 completed 但记录错误
-                    battle = get_battle_by_id(battle_id)
-                    if battle:
-                        update_battle(
-                            battle,
-                            status="completed",
-                            results=json.dumps(
-                                {"error": "结果处理失败", **result_data}
-                            ),
-                        )
-                    return False
+                # 尝试标记为 completed 但记录错误 (已取消的对战保持取消状态)
+                battle = get_battle_by_id(battle_id)
+                if battle and battle.status != "cancelled":
+                    update_battle(
+                        battle,
+                        status="completed",
+                        results=json.dumps({"error": "结果处理失败", **result_data}),
+                    )
+                return False
         except Exception as e:
             logger.exception(f"处理对战 {battle_id} 完成状态时出错: {e}")
             # 尝试在新的上下文中标记为 error
@@ -96,32 +134,42 @@ class BattleService:
                 )
             return False
 
-    def mark_battle_as_error(self, battle_id: str, error_details: dict) -> bool:
+    def mark_battle_as_error(
+        self, battle_id: str, error_details: Union[BattleResult, dict]
+    ) -> bool:
         """将数据库中的对战状态更新为 'error'。"""
         try:
+            results = (
+                error_details.to_dict()
+                if isinstance(error_details, BattleResult)
+                else error_details
+            )
             # 使用 self.app 创建上下文
             with self.app.app_context():
                 battle = get_battle_by_id(battle_id)
+                if battle and battle.status == "cancelled":
+                    logger.info(f"数据库：对战 {battle_id} 已取消，不标记为 error")
+                    return False
                 if battle:
                     if update_battle(
-                        battle, status="error", results=json.dumps(error_details)
+                        battle, status="error", results=json.dumps(results)
                     ):
                         logger.info(f"数据库：对战 {battle_id} 状态更新为 error")
-                        if process_battle_results_and_update_stats(
-                            battle_id, error_details
-                        ):
-                            logger.info(f"数据库：对战 {battle_id} 玩家报错处置成功")
-                            return True
-                        else:
-                            logger.error(
-                                f"数据库：对战 {battle_id} 玩家报错处置失败，或不需要处置玩家"
-                            )
                     else:
                         logger.error(f"数据库：更新对战 {battle_id} 状态为 error 失败")
                         return False
                 else:
                     logger.error(f"数据库：尝试更新错误状态时未找到对战 {battle_id}")
                     return False
+
+            # 玩家报错处置同样经由评分写线程
+            if self.rating_pipeline.submit(battle_id, error_details):
+                logger.info(f"数据库：对战 {battle_id} 玩家报错处置成功")
+                return True
+            else:
+                logger.error(
+                    f"数据库：对战 {battle_id} 玩家报错处置失败，或不需要处置玩家"
+                )
         except Exception as e:
             logger.exception(f"更新对战 {battle_id} 状态为 error 时出错: {e}")
             return False
@@ -172,6 +220,122 @@ class BattleService:
             logger.exception(f"取消对战 {battle_id} 时出错: {e}")
             return False
 
+    # ------------------------------------------------------------------
+    # 持久化对战队列
+
+    def get_battle_db_status(self, battle_id: str) -> Optional[str]:
+        """从数据库读取对战状态。"""
+        try:
+            with self.app.app_context():
+                battle = get_battle_by_id(battle_id)
+                return battle.status if battle else None
+        except Exception as e:
+            logger.error(f"读取对战 {battle_id} 数据库状态失败: {e}")
+            return None
+
+    def get_battle_ranking_id(self, battle_id: str) -> Optional[int]:
+        """读取对战所属的榜单ID (监控指标的标签)。"""
+        try:
+            with self.app.app_context():
+                battle = get_battle_by_id(battle_id)
+                return battle.ranking_id if battle else None
+        except Exception as e:
+            logger.error(f"读取对战 {battle_id} 所属榜单失败: {e}")
+            return None
+
+    def enqueue_battle(self, battle_id: str, participant_data: list) -> bool:
+        """将对战写入持久化队列。"""
+        try:
+            with self.app.app_context():
+                return enqueue_battle_job(battle_id, participant_data) is not None
+        except Exception as e:
+            logger.exception(f"对战 {battle_id} 入队时出错: {e}")
+            return False
+
+    def claim_battle_job(self, worker_id: str, lease_seconds: int) -> Optional[dict]:
+        """领取一个队列任务，没有任务时返回 None。"""
+        try:
+            with self.app.app_context():
+                return claim_battle_job(worker_id, lease_seconds)
+        except Exception as e:
+            logger.exception(f"领取对战队列任务时出错: {e}")
+            return None
+
+    def heartbeat_battle_jobs(
+        self, worker_id: str, job_ids: list, lease_seconds: int
+    ) -> int:
+        """为持有的任务续约，返回续约成功的数量。"""
+        try:
+            with self.app.app_context():
+                return heartbeat_battle_jobs(worker_id, job_ids, lease_seconds)
+        except Exception as e:
+            logger.exception(f"对战队列任务心跳时出错: {e}")
+            return -1
+
+    def ack_battle_job(
+        self, job_id: str, worker_id: str, success: bool = True, error: str = None
+    ) -> bool:
+        """确认队列任务执行结束。"""
+        try:
+            with self.app.app_context():
+                return ack_battle_job(job_id, worker_id, success, error)
+        except Exception as e:
+            logger.exception(f"确认对战队列任务 {job_id} 时出错: {e}")
+            return False
+
+    def cancel_battle_job(self, battle_id: str) -> bool:
+        """取消对战对应的队列任务。"""
+        try:
+            with self.app.app_context():
+                return cancel_battle_job(battle_id)
+        except Exception as e:
+            logger.exception(f"取消对战 {battle_id} 的队列任务时出错: {e}")
+            return False
+
+    def recover_battle_queue(self, include_orphans: bool = True) -> Optional[dict]:
+        """恢复过期租约，可选地恢复孤儿对战。"""
+        try:
+            with self.app.app_context():
+                return recover_battle_queue(include_orphans=include_orphans)
+        except Exception as e:
+            logger.exception(f"恢复对战队列时出错: {e}")
+            return None
+
+    def get_battle_queue_stats(self) -> dict:
+        """获取持久化队列统计信息。"""
+        try:
+            with self.app.app_context():
+                return get_battle_queue_stats()
+        except Exception as e:
+            logger.exception(f"获取对战队列统计时出错: {e}")
+            return {}
+
+    def get_battle_traces(self, battle_ids: list) -> Optional[dict]:
+        """获取对战的追踪设置 (对战ID -> 设置)，出错返回 None。"""
+        try:
+            with self.app.app_context():
+                return get_battle_traces(battle_ids)
+        except Exception as e:
+            logger.exception(f"获取对战追踪设置时出错: {e}")
+            return None
+
+    def record_battle_trace_dump(self, battle_id: str, path: str, records: int) -> bool:
+        """记录对战的追踪已导出。"""
+        try:
+            with self.app.app_context():
+                return record_battle_trace_dump(battle_id, path, records)
+        except Exception as e:
+            logger.exception(f"记录对战 {battle_id} 的追踪导出时出错: {e}")
+            return False
+
+    def shutdown(self):
+        """处理完已排队的评分结果、状态变更和调用记录后停止后台写线程"""
+        self.rating_pipeline.shutdown()
+        if self.status_writer is not None:
+            self.status_writer.shutdown()
+        self.usage_recorder.shutdown()
+        self.archiver.shutdown()
+
     # 可以添加包装好的日志方法，如果希望 BattleManager 完全不依赖 logging
     def log_info(self, message: str):
         logger.info(message)
@@ -0,0 +1,548 @@
+"""
+Prometheus 监控指标
+
+/metrics 以 Prometheus 文本格式 (0.0.4) 输出对战流水线的指标。gunicorn 的多个工作者和
+独立的对战工作进程 (game/worker.py) 各自只看到自己执行的对战和 LLM 调用，
+因此:
+
+- 计数器 (Counter) 和直方图 (Histogram) 在各进程内存中累计，MetricsPublisher 每
+  METRICS_FLUSH_INTERVAL 秒把快照写入 metric_snapshots 表 (见 database/metrics_store.py)，
+  /metrics 合并所有进程的快照输出；已退出进程的快照由存活的进程合并到 "retired" 行，
+  计数不会因为工作者重启而回退
+- 进程级的仪表 (Gauge，例如自动对战占用的并发槽) 随快照写入，只合并最近仍在更新的进程
+- 队列深度、各榜单进行中的对战等由数据库决定的仪表在抓取时直接查询
+
+指标在模块中定义 (名称、说明、标签、桶)，所有进程一致；调用方直接使用模块级的指标对象，
+例如 BATTLES_FINISHED.inc(ranking="1", status="completed")。
+"""
+
+import bisect
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import Flask, current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import (
+    get_active_battle_counts,
+    get_battle_queue_stats,
+    load_metric_snapshots,
+    retire_metric_snapshots,
+    save_metric_snapshot,
+)
+from database.metrics_store import RETIRED_WORKER_ID
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 15.0
+LIVE_INTERVALS = 3  # 超过几个写入周期没有更新的进程，其仪表不再计入
+RETIRE_INTERVALS = 20  # 超过几个写入周期没有更新的进程视为已退出，计数合并到 retired 行
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 指标名 -> 指标对象 (按定义顺序输出)
+REGISTRY = {}
+
+_create_lock = threading.Lock()
+
+
+# -----------------------------------------------------------------------------------------
+# 指标类型
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    """按上界分桶的观测值分布"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)  # 落在 value <= 上界 的第一个桶
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [各桶计数 (最后一个为 +Inf，非累计), 总和, 次数]
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                [list(key), list(counts), total, count]
+                for key, (counts, total, count) in self._values.items()
+            ]
+
+
+class Gauge(_Metric):
+    """
+    当前值，由采集函数在快照或抓取时计算。
+
+    scope 为 "process" 时采集函数返回本进程的值，随快照写入并在各进程间求和；
+    为 "cluster" 时返回全局的值 (例如查询数据库)，只在抓取时由处理请求的进程调用。
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), scope="process"):
+        super().__init__(name, documentation, labelnames)
+        self.scope = scope
+        self._collector = None
+
+    def set_collector(self, collector):
+        """设置采集函数，返回 {标签值元组: 值}"""
+        self._collector = collector
+
+    def snapshot(self):
+        if self._collector is None:
+            return []
+        try:
+            values = self._collector()
+        except Exception as e:
+            logger.warning(f"采集指标 {self.name} 出错: {e}")
+            return []
+        return [[[str(label) for label in key], value] for key, value in values.items()]
+
+
+# -----------------------------------------------------------------------------------------
+# 对战流水线指标
+
+BATTLE_QUEUE_WAIT = Histogram(
+    "avalon_battle_queue_wait_seconds",
+    "对战从入队到开始执行的等待时间",
+    ["ranking"],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+BATTLE_DURATION = Histogram(
+    "avalon_battle_duration_seconds",
+    "对战执行耗时",
+    ["ranking"],
+    buckets=(30, 60, 120, 300, 600, 900, 1200, 1800, 3600),
+)
+BATTLES_FINISHED = Counter(
+    "avalon_battles_finished_total",
+    "执行结束的对战数 (按结束时的状态)",
+    ["ranking", "status"],
+)
+BATTLE_SUSPENDED = Counter(
+    "avalon_battle_suspended_total",
+    "裁判挂起的对战数 (按 suspend_game 记录的错误类型)",
+    ["error_type"],
+)
+BATTLE_ERRORS = Counter(
+    "avalon_battle_errors_total",
+    "以错误结束的对战数 (exception 为执行对战本身抛出的异常)",
+    ["error_type"],
+)
+LLM_CALLS = Counter(
+    "avalon_llm_calls_total",
+    "LLM 调用次数 (含出错和超时回收的调用)",
+    ["client"],
+)
+LLM_ERRORS = Counter(
+    "avalon_llm_errors_total",
+    "出错或超时回收的 LLM 调用次数",
+    ["client", "error"],
+)
+LLM_CALL_DURATION = Histogram(
+    "avalon_llm_call_seconds",
+    "成功的 LLM 调用耗时",
+    ["client"],
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+DB_COMMIT_DURATION = Histogram(
+    "avalon_db_commit_seconds",
+    "数据库事务提交耗时",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+AUTOMATCH_SLOTS_USED = Gauge(
+    "avalon_automatch_slots_used",
+    "自动对战占用的并发槽 (已创建尚未结束的对战)",
+    ["ranking"],
+)
+AUTOMATCH_SLOTS_TOTAL = Gauge(
+    "avalon_automatch_slots_total",
+    "开启的自动对战的并发槽总数",
+    ["ranking"],
+)
+BATTLE_QUEUE_JOBS = Gauge(
+    "avalon_battle_queue_jobs",
+    "持久化对战队列中各状态的任务数",
+    ["status"],
+    scope="cluster",
+)
+BATTLE_QUEUE_OLDEST_WAIT = Gauge(
+    "avalon_battle_queue_oldest_wait_seconds",
+    "最早排队任务已等待的时间",
+    scope="cluster",
+)
+BATTLES_ACTIVE = Gauge(
+    "avalon_battles_active",
+    "各榜单等待中和进行中的对战数",
+    ["ranking", "status"],
+    scope="cluster",
+)
+METRICS_WORKERS = Gauge(
+    "avalon_metrics_workers",
+    "最近上报过指标的进程数 (抓取时根据快照的更新时间计算)",
+    scope="cluster",
+)
+
+
+def _queue_jobs():
+    stats = get_battle_queue_stats()
+    return {
+        (status,): stats[status]
+        for status in ("queued", "leased", "done", "failed", "cancelled")
+        if status in stats
+    }
+
+
+def _queue_oldest_wait():
+    stats = get_battle_queue_stats()
+    if "oldest_queued_seconds" not in stats:
+        return {}
+    return {(): stats["oldest_queued_seconds"]}
+
+
+def _active_battles():
+    return {
+        (ranking_id, status): count
+        for ranking_id, status, count in get_active_battle_counts()
+    }
+
+
+BATTLE_QUEUE_JOBS.set_collector(_queue_jobs)
+BATTLE_QUEUE_OLDEST_WAIT.set_collector(_queue_oldest_wait)
+BATTLES_ACTIVE.set_collector(_active_battles)
+
+
+def ranking_label(ranking_id):
+    """榜单ID作为标签值，未知时为 unknown"""
+    return "unknown" if ranking_id is None else str(ranking_id)
+
+
+def record_llm_usage(entry):
+    """ClientManager 使用记录监听者：统计 LLM 调用次数、耗时和错误"""
+    client = entry.get("client_id", "unknown")
+    LLM_CALLS.inc(client=client)
+    error = entry.get("error")
+    if error is None and not entry.get("completed", True):
+        error = entry.get("reason", "incomplete")
+    if error is None:
+        LLM_CALL_DURATION.observe(entry["usage_time"], client=client)
+    else:
+        LLM_ERRORS.inc(client=client, error=error)
+
+
+def _before_commit(session):
+    session.info["metrics_commit_started"] = time.perf_counter()
+
+
+def _after_commit(session):
+    started = session.info.pop("metrics_commit_started", None)
+    if started is not None:
+        DB_COMMIT_DURATION.observe(time.perf_counter() - started)
+
+
+def _install_commit_timer():
+    if not event.contains(Session, "before_commit", _before_commit):
+        event.listen(Session, "before_commit", _before_commit)
+        event.listen(Session, "after_commit", _after_commit)
+
+
+# -----------------------------------------------------------------------------------------
+# 快照与合并
+
+
+def collect_local(include_gauges=True):
+    """
+    本进程的指标快照。
+
+    返回:
+        dict: {"counters": {名称: [[标签值, 值], ...]},
+               "histograms": {名称: [[标签值, 各桶计数, 总和, 次数], ...]},
+               "gauges": {名称: [[标签值, 值], ...]}}
+    """
+    payload = {"counters": {}, "histograms": {}, "gauges": {}}
+    for name, metric in REGISTRY.items():
+        if isinstance(metric, Counter):
+            payload["counters"][name] = metric.snapshot()
+        elif isinstance(metric, Histogram):
+            payload["histograms"][name] = metric.snapshot()
+        elif include_gauges and metric.scope == "process":
+            payload["gauges"][name] = metric.snapshot()
+    return payload
+
+
+class _Totals:
+    """按指标名和标签值累加多个快照"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def add(self, payload, include_gauges=True, sign=1):
+        for name, samples in payload.get("counters", {}).items():
+            values = self.counters.setdefault(name, {})
+            for labels, value in samples:
+                key = tuple(labels)
+                values[key] = values.get(key, 0) + sign * value
+        for name, samples in payload.get("histograms", {}).items():
+            values = self.histograms.setdefault(name, {})
+            for labels, counts, total, count in samples:
+                key = tuple(labels)
+                entry = values.get(key)
+                if entry is None or len(entry[0]) != len(counts):
+                    # 桶定义变化 (升级前后的快照) 时以新的为准
+                    entry = values[key] = [[0] * len(counts), 0.0, 0]
+                for i, c in enumerate(counts):
+                    entry[0][i] += sign * c
+                entry[1] += sign * total
+                entry[2] += sign * count
+        if include_gauges:
+            for name, samples in payload.get("gauges", {}).items():
+                values = self.gauges.setdefault(name, {})
+                for labels, value in samples:
+                    key = tuple(labels)
+                    values[key] = values.get(key, 0) + value
+        return self
+
+    def to_payload(self):
+        return {
+            "counters": {
+                name: [[list(key), value] for key, value in values.items()]
+                for name, values in self.counters.items()
+            },
+            "histograms": {
+                name: [
+                    [list(key), counts, total, count]
+                    for key, (counts, total, count) in values.items()
+                ]
+                for name, values in self.histograms.items()
+            },
+            "gauges": {
+                name: [[list(key), value] for key, value in values.items()]
+                for name, values in self.gauges.items()
+            },
+        }
+
+
+def merge_snapshots(retired, stale):
+    """合并已退出进程的快照 (只保留计数器和直方图)"""
+    return (
+        _Totals()
+        .add(retired, include_gauges=False)
+        .add(stale, include_gauges=False)
+        .to_payload()
+    )
+
+
+class MetricsPublisher:
+    """定期把本进程的指标快照写入数据库的后台线程 (每个进程一个)"""
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.flush_interval = float(
+            app.config.get("METRICS_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)
+        )
+        # 快照被当作已退出进程合并后，已合并的部分记为基线，之后只上报增量
+        self._baseline = {}
+        self._last_flushed = None
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        _install_commit_timer()
+        self.thread = threading.Thread(
+            target=self._run, name="MetricsPublisher", daemon=True
+        )
+        self.thread.start()
+
+    def snapshot(self):
+        """本进程尚未合并到 retired 行的指标快照"""
+        current = collect_local()
+        return self._subtract_baseline(current), current
+
+    def _subtract_baseline(self, current):
+        if not self._baseline:
+            return current
+        totals = _Totals().add(current).add(self._baseline, False, sign=-1)
+        return totals.to_payload()
+
+    def flush(self):
+        """写入本进程的快照 (需要在应用上下文中调用)"""
+        with self._flush_lock:
+            payload, current = self.snapshot()
+            result = save_metric_snapshot(self.worker_id, payload)
+            if result == "created" and self._last_flushed is not None:
+                # 上次写入的快照已被其他进程合并 (本进程长时间未写入)
+                logger.warning(
+                    f"进程 {self.worker_id} 的指标快照已被合并，改为上报增量"
+                )
+                self._baseline = self._last_flushed
+                payload = self._subtract_baseline(current)
+                result = save_metric_snapshot(self.worker_id, payload)
+            if result is not None:
+                self._last_flushed = current
+            return result is not None
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                with self.app.app_context():
+                    self.flush()
+                    retire_metric_snapshots(
+                        datetime.now()
+                        - timedelta(seconds=self.flush_interval * RETIRE_INTERVALS),
+                        merge_snapshots,
+                    )
+            except Exception as e:
+                logger.exception(f"写入指标快照出错: {e}")
+
+    def render(self):
+        """合并所有进程的快照和抓取时计算的仪表，返回 Prometheus 文本 (需要在应用上下文中调用)"""
+        live_after = datetime.now() - timedelta(
+            seconds=self.flush_interval * LIVE_INTERVALS
+        )
+        totals = _Totals()
+        live_workers = 1  # 本进程
+        for row in load_metric_snapshots():
+            if row["worker_id"] == self.worker_id:
+                continue  # 本进程使用内存中的最新值
+            live = (
+                row["worker_id"] != RETIRED_WORKER_ID
+                and row["updated_at"] is not None
+                and row["updated_at"] >= live_after
+            )
+            totals.add(row["payload"], include_gauges=live)
+            if live:
+                live_workers += 1
+        totals.add(self.snapshot()[0])
+        for metric in REGISTRY.values():
+            if isinstance(metric, Gauge) and metric.scope == "cluster":
+                totals.gauges[metric.name] = {
+                    tuple(labels): value for labels, value in metric.snapshot()
+                }
+        totals.gauges[METRICS_WORKERS.name] = {(): live_workers}
+        return render_text(totals)
+
+    def shutdown(self):
+        """停止后台线程并写入最后一次快照"""
+        self._stop.set()
+        self.thread.join(timeout=5)
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception as e:
+            logger.warning(f"写入最后一次指标快照出错: {e}")
+
+
+# -----------------------------------------------------------------------------------------
+# 文本格式
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape_label(str(v))}"' for n, v in pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if math.isnan(value):
+            return "NaN"
+        return repr(value)
+    return str(value)
+
+
+def render_text(totals):
+    """按 REGISTRY 的顺序输出合并后的指标"""
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        if isinstance(metric, Histogram):
+            for key, (counts, total, count) in sorted(
+                totals.histograms.get(name, {}).items()
+            ):
+                cumulative = 0
+                bounds = [_format_value(float(b)) for b in metric.buckets] + ["+Inf"]
+                for bound, c in zip(bounds, counts):
+                    cumulative += c
+                    labels = _format_labels(metric.labelnames, key, [("le", bound)])
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                labels = _format_labels(metric.labelnames, key)
+                lines.append(f"{name}_sum{labels} {_format_value(float(total))}")
+                lines.append(f"{name}_count{labels} {count}")
+        else:
+            values = (
+                totals.counters if isinstance(metric, Counter) else totals.gauges
+            ).get(name, {})
+            for key, value in sorted(values.items()):
+                labels = _format_labels(metric.labelnames, key)
+                lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def init_metrics(app: Flask) -> MetricsPublisher:
+    """为应用创建指标快照的写线程 (同时开始统计数据库提交耗时)"""
+    with _create_lock:
+        if "metrics" not in app.extensions:
+            app.extensions["metrics"] = MetricsPublisher(app)
+        return app.extensions["metrics"]
+
+
+def get_metrics() -> MetricsPublisher:
+    """当前应用的指标快照写线程 (未初始化时创建)"""
+    return init_metrics(current_app._get_current_object())
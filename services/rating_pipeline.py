@@ -0,0 +1,107 @@
+"""
+评分写入流水线：每个排行榜一个写线程，串行、批量地处理对战结果
+
+多场同榜单对战同时结束时，结果先进入该榜单的队列，由唯一的写线程
+合并为一个事务 (apply_battle_results_batch) 提交，既避免了同一进程内
+并发写覆盖，也减少了 SQLite 上的写锁竞争。跨进程的一致性由
+GameStats 的增量原子更新保证。
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Optional
+
+from flask import Flask
+
+from database import apply_battle_results_batch, get_battle_by_id
+from services.batch_writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+SUBMIT_TIMEOUT_SECONDS = 120  # 提交方等待写入完成的最长时间
+
+
+class _RankingWriter(BatchWriter):
+    """单个排行榜的写线程"""
+
+    max_batch_size = 32  # 单个事务最多处理的对战数
+    linger_seconds = 0.05  # 收到第一条结果后等待同批结果的时间
+
+    def __init__(self, app: Flask, ranking_id: int):
+        self.ranking_id = ranking_id
+        super().__init__(
+            app, f"RatingWriter-Rank-{ranking_id}", f"rating_batch:{ranking_id}"
+        )
+
+    def write_batch(self, batch):
+        outcomes = apply_battle_results_batch(
+            [(battle_id, results_data) for battle_id, results_data, _ in batch]
+        )
+        for battle_id, _, future in batch:
+            future.set_result(outcomes.get(battle_id, False))
+        if len(batch) > 1:
+            logger.info(f"[Rank-{self.ranking_id}] 合并写入 {len(batch)} 场对战结果")
+
+    def on_error(self, batch):
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(False)
+
+
+class RatingPipeline:
+    """按排行榜路由对战结果到对应的写线程"""
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self._writers: Dict[int, _RankingWriter] = {}
+        self._lock = threading.Lock()
+
+    def _get_writer(self, ranking_id: int) -> _RankingWriter:
+        with self._lock:
+            writer = self._writers.get(ranking_id)
+            if writer is None:
+                writer = _RankingWriter(self.app, ranking_id)
+                self._writers[ranking_id] = writer
+            return writer
+
+    def _get_ranking_id(self, battle_id: str) -> Optional[int]:
+        # 独立的应用上下文，查询结束即释放连接，避免持有读锁等待写线程
+        with self.app.app_context():
+            battle = get_battle_by_id(battle_id)
+            return battle.ranking_id if battle else None
+
+    def submit(
+        self,
+        battle_id: str,
+        results_data: dict,
+        timeout: float = SUBMIT_TIMEOUT_SECONDS,
+    ) -> bool:
+        """
+        提交一场对战结果并等待写线程处理完成。
+
+        返回:
+            bool: 处理是否成功 (与 process_battle_results_and_update_stats 一致)
+        """
+        ranking_id = self._get_ranking_id(battle_id)
+        if ranking_id is None:
+            logger.error(f"提交评分时未找到对战 {battle_id}")
+            return False
+
+        future: Future = Future()
+        self._get_writer(ranking_id).queue.put((battle_id, results_data, future))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.error(f"等待对战 {battle_id} 的评分写入超时 ({timeout}s)")
+            return False
+
+    def shutdown(self):
+        """处理完已排队的结果后停止所有写线程"""
+        with self._lock:
+            writers = list(self._writers.values())
+            self._writers = {}
+        for writer in writers:
+            writer.queue.put(None)
+        for writer in writers:
+            writer.thread.join(timeout=10)
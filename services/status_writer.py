@@ -0,0 +1,54 @@
+"""
+对战状态写线程 (可选，配置 BATTLE_STATUS_WRITER 开启)
+
+大量对战线程同时开始时，每个线程各自提交一次 "playing" 状态，
+在 SQLite 上会排队争抢写锁。开启后状态变更先进入队列，由唯一的
+写线程合并为一个事务 (update_battle_statuses) 提交，调用方仍同步等待结果。
+"""
+
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from flask import Flask
+
+from database import update_battle_statuses
+from services.batch_writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+SUBMIT_TIMEOUT_SECONDS = 30  # 提交方等待写入完成的最长时间
+
+
+class BattleStatusWriter(BatchWriter):
+    """合并写入对战状态的后台线程"""
+
+    max_batch_size = 64  # 单个事务最多合并的状态变更数
+    linger_seconds = 0.02  # 收到第一条变更后等待同批变更的时间
+
+    def __init__(self, app: Flask):
+        super().__init__(app, "BattleStatusWriter", "battle_status_batch")
+
+    def write_batch(self, batch):
+        # 同一对战在一批中出现多次时以最后一次为准
+        outcomes = update_battle_statuses(
+            {battle_id: status for battle_id, status, _ in batch}
+        )
+        for battle_id, _, future in batch:
+            future.set_result(outcomes.get(battle_id, False))
+
+    def on_error(self, batch):
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(False)
+
+    def submit(
+        self, battle_id: str, status: str, timeout: float = SUBMIT_TIMEOUT_SECONDS
+    ) -> bool:
+        """提交一次状态变更并等待写入完成，返回是否成功"""
+        future: Future = Future()
+        self.queue.put((battle_id, status, future))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.error(f"等待对战 {battle_id} 状态写入超时 ({timeout}s)")
+            return False
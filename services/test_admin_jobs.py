@@ -0,0 +1,95 @@
+"""admin_jobs.py / admin_job_queue.py: 任务领取与租约、进度写回、执行中取消和中断恢复"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import (
+    cancel_admin_job,
+    claim_admin_job,
+    db,
+    enqueue_admin_job,
+    finish_admin_job,
+    get_admin_job,
+    heartbeat_admin_jobs,
+    recover_admin_jobs,
+)
+from database.models import AdminJob
+from services.admin_jobs import AdminJobRunner, admin_job
+
+_started = threading.Event()
+_release = threading.Event()
+
+
+@admin_job("test_steps")
+def _steps_job(steps, progress=None):
+    """报告一次进度后等待测试放行，再逐步报告进度"""
+    progress(0, steps, "开始")
+    _started.set()
+    _release.wait(5)
+    for done in range(1, steps + 1):
+        progress(done, steps)
+    return {"steps": steps}
+
+
+def _wait_for(job_id, status, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = get_admin_job(job_id)
+        if job["status"] == status:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"任务 {job_id} 未进入 {status}: {job}")
+
+
+def test_lease_owner_heartbeats_and_finishes(app):
+    job = enqueue_admin_job("test_steps", "排队", {"steps": 1})
+    claimed = claim_admin_job("w1", lease_seconds=60)
+    assert claimed["id"] == job["id"] and claimed["params"] == {"steps": 1}
+    assert claim_admin_job("w2") is None
+
+    assert heartbeat_admin_jobs("w1", {job["id"]: (50.0, "一半")}) == set()
+    assert get_admin_job(job["id"])["progress"] == 50.0
+    assert cancel_admin_job(job["id"])["status"] == "running"
+    assert heartbeat_admin_jobs("w1", {job["id"]: (60.0, None)}) == {job["id"]}
+
+    # 只有租约持有者的结束记录生效
+    assert not finish_admin_job(job["id"], "w2", "done")
+    assert finish_admin_job(job["id"], "w1", "cancelled", error="取消")
+    assert cancel_admin_job(job["id"]) is None
+
+
+def test_expired_lease_is_marked_failed(app):
+    job = enqueue_admin_job("test_steps", "中断", {"steps": 1})
+    claim_admin_job("w1")
+    db.session.get(AdminJob, job["id"]).lease_expires_at = datetime.now() - timedelta(
+        seconds=1
+    )
+    db.session.commit()
+
+    assert recover_admin_jobs() == 1
+    assert get_admin_job(job["id"])["status"] == "failed"
+    # 排队中的任务取消后不会被领取
+    queued = enqueue_admin_job("test_steps", "排队", {"steps": 1})
+    assert cancel_admin_job(queued["id"])["status"] == "cancelled"
+    assert claim_admin_job("w1") is None
+
+
+def test_runner_cancels_at_next_progress_report(app):
+    app.config["ADMIN_JOB_WORKERS"] = 1
+    runner = AdminJobRunner(app)
+    try:
+        _started.clear()
+        _release.clear()
+        job = runner.submit("test_steps", "取消", {"steps": 3})
+        assert _started.wait(5)
+        runner.cancel(job["id"])
+        _release.set()
+        assert _wait_for(job["id"], "cancelled")["error"] == "执行中被取消"
+
+        _release.set()
+        job = runner.submit("test_steps", "完成", {"steps": 3})
+        done = _wait_for(job["id"], "done")
+        assert (done["progress"], done["result"]) == (100.0, {"steps": 3})
+    finally:
+        runner.shutdown()
@@ -0,0 +1,70 @@
+"""batch_writer.py: 批量写线程的合并、出错恢复与停止；services 可以单独导入"""
+
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from services.batch_writer import BatchWriter
+
+
+class _Recorder(BatchWriter):
+    linger_seconds = 0.2
+
+    def __init__(self, app):
+        self.batches = []
+        self.failed = []
+        self.gate = threading.Event()
+        super().__init__(app, "TestWriter", "test_batch")
+
+    def write_batch(self, batch):
+        self.gate.wait(5)
+        if "boom" in batch:
+            raise RuntimeError("boom")
+        self.batches.append(list(batch))
+
+    def on_error(self, batch):
+        self.failed.append(list(batch))
+
+
+def test_items_are_merged_and_flushed_on_shutdown(app):
+    writer = _Recorder(app)
+    for i in range(5):
+        writer.queue.put(i)
+    writer.gate.set()
+    writer.shutdown()
+    assert not writer.thread.is_alive()
+    assert [i for batch in writer.batches for i in batch] == [0, 1, 2, 3, 4]
+    assert len(writer.batches) == 1
+
+
+def test_failed_batch_does_not_stop_the_writer(app):
+    writer = _Recorder(app)
+    writer.gate.set()
+    writer.queue.put("boom")
+    writer.shutdown(timeout=0)  # 只放入停止标记
+    writer.thread.join(5)
+    assert writer.failed == [["boom"]]
+
+    writer = _Recorder(app)
+    writer.gate.set()
+    writer.queue.put("boom")
+    writer.queue.put("ok")
+    writer.shutdown()
+    assert writer.failed == [["boom", "ok"]]
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "services.status_writer",
+        "services.rating_pipeline",
+        "services.usage_recorder",
+        "services.battle_archiver",
+        "services.admin_jobs",
+    ],
+)
+def test_services_import_without_cycle(module):
+    # 新的解释器中首先导入 (不经过 app 或 utils)
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
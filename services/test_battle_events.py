@@ -0,0 +1,92 @@
+"""battle_events.py: 跨进程广播对战结束事件，跳过本进程的事件，Redis 出错时暂停发布"""
+
+import queue
+import time
+
+import redis
+
+from services.battle_events import CHANNEL, BattleEventBus
+
+
+class _FakeRedis:
+    """进程内的发布/订阅，所有订阅者收到每条消息"""
+
+    def __init__(self):
+        self.subscribers = []
+        self.fail = False
+        self.published = 0
+
+    def publish(self, channel, data):
+        if self.fail:
+            raise redis.ConnectionError("down")
+        self.published += 1
+        for pubsub in list(self.subscribers):
+            pubsub.messages.put({"channel": channel, "data": data})
+
+    def pubsub(self, ignore_subscribe_messages=True):
+        return _FakePubSub(self)
+
+
+class _FakePubSub:
+    def __init__(self, client):
+        self.client = client
+        self.messages = queue.Queue()
+
+    def subscribe(self, channel):
+        assert channel == CHANNEL
+        self.client.subscribers.append(self)
+
+    def get_message(self, timeout=None):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.client.subscribers.remove(self)
+
+
+def _bus(client, origin):
+    events = queue.Queue()
+    bus = BattleEventBus(client, origin, lambda *event: events.put(event))
+    return bus, events
+
+
+def _wait_subscribed(client, count):
+    for _ in range(100):
+        if len(client.subscribers) == count:
+            return
+        time.sleep(0.02)
+    raise AssertionError("订阅线程未启动")
+
+
+def test_other_processes_receive_the_event():
+    client = _FakeRedis()
+    web, web_events = _bus(client, "web:1")
+    worker, worker_events = _bus(client, "worker:2")
+    try:
+        _wait_subscribed(client, 2)
+        assert worker.publish("b1", "completed")
+        assert web_events.get(timeout=2) == ("b1", "completed")
+        # 本进程发布的事件已直接通知过订阅者，订阅线程跳过
+        assert web.publish("b2", "cancelled")
+        assert worker_events.get(timeout=2) == ("b2", "cancelled")
+    finally:
+        web.shutdown()
+        worker.shutdown()
+    assert client.subscribers == []
+
+
+def test_publish_is_skipped_while_redis_is_down():
+    client = _FakeRedis()
+    client.fail = True
+    bus = BattleEventBus(client, "worker:1", lambda *event: None)
+    try:
+        assert not bus.publish("b1", "error")
+        client.fail = False
+        # 出错后暂停一段时间，其他进程靠数据库轮询兜底
+        assert not bus.publish("b2", "completed")
+        assert client.published == 0
+    finally:
+        bus.shutdown()
+    assert not BattleEventBus(None, "web:1", lambda *event: None).publish("b3", "x")
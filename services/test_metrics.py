@@ -0,0 +1,93 @@
+"""metrics.py: 直方图与文本格式、多进程快照合并、已退出进程并入 retired 行"""
+
+from datetime import datetime, timedelta
+
+from database import (
+    load_metric_snapshots,
+    retire_metric_snapshots,
+    save_metric_snapshot,
+)
+from services.metrics import (
+    LLM_CALLS,
+    MetricsPublisher,
+    _Totals,
+    collect_local,
+    merge_snapshots,
+    record_llm_usage,
+    render_text,
+)
+
+
+def _lines(text, prefix):
+    return [line for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_llm_usage_is_rendered_as_prometheus_text():
+    for entry in (
+        {"client_id": "t-text", "usage_time": 0.7},
+        {"client_id": "t-text", "usage_time": 3.0},
+        {"client_id": "t-text", "usage_time": 1.0, "error": "TimeoutError"},
+        {"client_id": "t-text", "usage_time": 9.0, "completed": False},
+    ):
+        record_llm_usage(entry)
+    text = render_text(_Totals().add(collect_local(include_gauges=False)))
+
+    assert _lines(text, 'avalon_llm_calls_total{client="t-text"}') == [
+        'avalon_llm_calls_total{client="t-text"} 4'
+    ]
+    assert sorted(_lines(text, 'avalon_llm_errors_total{client="t-text"')) == [
+        'avalon_llm_errors_total{client="t-text",error="TimeoutError"} 1',
+        'avalon_llm_errors_total{client="t-text",error="incomplete"} 1',
+    ]
+    # 桶计数是累计的，超时回收和出错的调用不计入耗时
+    buckets = _lines(text, 'avalon_llm_call_seconds_bucket{client="t-text"')
+    assert buckets[0].endswith('le="0.5"} 0')
+    assert buckets[1].endswith('le="1.0"} 1')
+    assert buckets[3].endswith('le="5.0"} 2')
+    assert buckets[-1].endswith('le="+Inf"} 2')
+    assert _lines(text, 'avalon_llm_call_seconds_sum{client="t-text"}') == [
+        'avalon_llm_call_seconds_sum{client="t-text"} 3.7'
+    ]
+
+
+def test_render_sums_workers_and_keeps_retired_counts(app):
+    app.config["METRICS_FLUSH_INTERVAL"] = 3600
+    publisher = MetricsPublisher(app)
+    try:
+        LLM_CALLS.inc(client="t-merge")
+        other = {"counters": {LLM_CALLS.name: [[["t-merge"], 5]]}}
+        save_metric_snapshot("other-host:1", other)
+        line = 'avalon_llm_calls_total{client="t-merge"}'
+        assert _lines(publisher.render(), line) == [f"{line} 6"]
+
+        # 其他进程退出后计数合并到 retired 行，不会回退
+        stale_before = datetime.now() + timedelta(seconds=1)
+        assert retire_metric_snapshots(stale_before, merge_snapshots) == 1
+        assert [s["worker_id"] for s in load_metric_snapshots()] == ["retired"]
+        assert _lines(publisher.render(), line) == [f"{line} 6"]
+        assert _lines(publisher.render(), "avalon_metrics_workers ") == [
+            "avalon_metrics_workers 1"
+        ]
+    finally:
+        publisher.shutdown()
+
+
+def test_own_retired_snapshot_switches_to_deltas(app):
+    app.config["METRICS_FLUSH_INTERVAL"] = 3600
+    publisher = MetricsPublisher(app)
+    try:
+        LLM_CALLS.inc(2, client="t-retire")
+        assert publisher.flush()
+        # 本进程长时间未写入，快照被其他进程当作已退出合并
+        retire_metric_snapshots(datetime.now() + timedelta(seconds=1), merge_snapshots)
+        LLM_CALLS.inc(client="t-retire")
+        assert publisher.flush()
+
+        own = {s["worker_id"]: s["payload"] for s in load_metric_snapshots()}[
+            publisher.worker_id
+        ]
+        assert [["t-retire"], 1] in own["counters"][LLM_CALLS.name]
+        line = 'avalon_llm_calls_total{client="t-retire"}'
+        assert _lines(publisher.render(), line) == [f"{line} 3"]
+    finally:
+        publisher.shutdown()
@@ -0,0 +1,60 @@
+"""
+LLM 调用记录写线程
+
+ClientManager 每释放一次客户端产生一条记录。记录先进入队列，由写线程
+合并成批写入 llm_usage_samples (record_usage_samples)，调用方不等待写入；
+写线程同时按 LLM_USAGE_RETENTION_DAYS 定期清理过期记录。
+启动时导入旧版 client_usage_times.json (导入后改名为 .imported)。
+"""
+
+import logging
+import os
+from time import time
+
+from flask import Flask
+
+from database import import_usage_log, prune_usage_samples, record_usage_samples
+from services.batch_writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+PRUNE_INTERVAL_SECONDS = 3600  # 清理过期记录的间隔
+
+LEGACY_LOG_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "game", "client_usage_times.json"
+)
+
+
+class LlmUsageRecorder(BatchWriter):
+    """批量写入 LLM 调用记录的后台线程"""
+
+    max_batch_size = 500  # 单个事务最多写入的记录数
+    linger_seconds = 1.0  # 收到第一条记录后等待同批记录的时间
+    idle_seconds = PRUNE_INTERVAL_SECONDS  # 没有调用时也定期清理
+
+    def __init__(self, app: Flask, legacy_log_file: str = LEGACY_LOG_FILE):
+        self.legacy_log_file = legacy_log_file
+        self.retention_seconds = (
+            float(app.config.get("LLM_USAGE_RETENTION_DAYS", 30)) * 86400
+        )
+        self._next_prune = 0.0
+        super().__init__(app, "LlmUsageRecorder", "llm_usage_batch")
+
+    def maintain(self):
+        """导入旧版日志文件、清理过期记录"""
+        with self.app.app_context():
+            if os.path.exists(self.legacy_log_file):
+                import_usage_log(self.legacy_log_file)
+            now = time()
+            if self.retention_seconds > 0 and now >= self._next_prune:
+                self._next_prune = now + PRUNE_INTERVAL_SECONDS
+                deleted = prune_usage_samples(now - self.retention_seconds)
+                if deleted:
+                    logger.info(f"已清理 {deleted} 条过期的 LLM 调用记录")
+
+    def write_batch(self, batch):
+        record_usage_samples(batch)
+
+    def submit(self, entry: dict):
+        """提交一条调用记录 (ClientManager 使用记录监听者)，不等待写入"""
+        self.queue.put(dict(entry))
@@ -11,9 +11,21 @@ from .db_utils import (
     ensure_data_directories,
 )
 
-# 从 battle_manager_utils 导入函数
-from .battle_manager_utils import get_battle_manager
-from .automatch_utils import get_automatch
+# get_battle_manager / get_automatch 按需导入：battle_manager_utils 会加载 BattleManager
+# 和 services，而 services 又依赖 utils.sql_profiler，包导入时加载会形成循环导入
+_LAZY_EXPORTS = {
+    "get_battle_manager": ".battle_manager_utils",
+    "get_automatch": ".automatch_utils",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        from importlib import import_module
+
+        return getattr(import_module(_LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # 定义 __all__ 以便 `from utils import *` 使用
 __all__ = [
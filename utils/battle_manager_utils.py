@@ -6,7 +6,7 @@
 
 import logging
 from flask import Flask  # 导入 Flask
-from game.battle_manager import BattleManager
+from game.battle_manager import BattleManager, MAX_CONCURRENT_BATTLES
 from services.battle_service import BattleService, get_battle_service
 
 # 配置日志
@@ -52,7 +52,13 @@ def get_battle_manager() -> BattleManager:
                 ) from e
 
         # 创建 BattleManager 并注入 service
-        _battle_manager = BattleManager(battle_service=_battle_service)
+        _battle_manager = BattleManager(
+            battle_service=_battle_service,
+            max_concurrent_battles=_app_ref.config.get(
+                "MAX_CONCURRENT_BATTLES", MAX_CONCURRENT_BATTLES
+            ),
+            run_workers=_app_ref.config.get("RUN_BATTLE_WORKERS", True),
+        )
         logger.info("BattleManager instance created and injected with BattleService.")
     # else: # 移除这个日志，因为它在每次获取时都会打印
     # logger.info("BattleManager instance reused.")
@@ -0,0 +1,376 @@
+"""
+对局重放编译器
+
+把对局归档 (archive_game_<id>.json，observer 记录的事件列表) 编译为重放页面使用的模型:
+    {"game_info": {...}, "game_events": [按回合组织的事件, ..., 刺杀信息]}
+
+- 单次遍历事件列表。TeamPropose 对应的队长为同一回合段内其后的第一个 Leader 事件，
+  没有则取其前最近的 Leader；通过记录段内待定的提案，在遇到 Leader 或下一个 RoundStart 时确定
+- 已结束的归档不会再变化，编译结果以 (归档路径, mtime, 大小, 编译器版本) 为键缓存在磁盘上，
+  同一键也用作 HTTP ETag
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 编译输出格式变化时递增，旧缓存自动失效
+COMPILER_VERSION = 1
+
+
+class ReplayFormatError(ValueError):
+    """归档内容不是有效的对局事件列表"""
+
+
+def _new_vote_attempt():
+    return {
+        "type": "vote_attempt",
+        "data": {
+            "votes": {},
+            "approved": None,
+            "approve_count": 0,
+            "reject_count": 0,
+        },
+    }
+
+
+def _last_vote_attempt(round_events):
+    """返回当前回合最新的投票尝试，不存在则新建"""
+    if not round_events or round_events[-1]["type"] != "vote_attempt":
+        round_events.append(_new_vote_attempt())
+    return round_events[-1]["data"]
+
+
+def _format_game_info(game_info, last_round_num, last_scoreboard):
+    """补全未正常结束的对局信息，并格式化时间与时长"""
+    # 如果游戏未正常结束 (没有 GameResult)
+    if not game_info["is_completed"]:
+        game_info["end_time_formatted"] = "游戏未正常结束"
+        game_info["win_reason"] = "游戏未记录结束状态"
+        # 使用最后记录的回合数和计分板（如果存在）
+        game_info["rounds_played"] = last_round_num
+        if last_scoreboard:
+            game_info["blue_wins"] = last_scoreboard[0]
+            game_info["red_wins"] = last_scoreboard[1]
+            if game_info["blue_wins"] >= 3:
+                game_info["winner"] = "blue"
+                game_info["win_reason"] = "游戏中断时蓝方已达3胜"
+            elif game_info["red_wins"] >= 3:
+                game_info["winner"] = "red"
+                game_info["win_reason"] = "游戏中断时红方已达3胜"
+
+    time_format_in = "%Y-%m-%d %H:%M:%S"  # observer 记录的格式
+    time_format_out = "%Y-%m-%d %H:%M"
+
+    def _parse(timestamp):
+        return datetime.strptime(timestamp.split(".")[0], time_format_in)
+
+    if game_info["start_time"]:
+        try:
+            game_info["start_time_formatted"] = _parse(
+                game_info["start_time"]
+            ).strftime(time_format_out)
+        except (ValueError, TypeError, AttributeError):
+            game_info["start_time_formatted"] = str(game_info["start_time"])
+
+    if game_info["end_time"] and game_info["is_completed"]:
+        try:
+            game_info["end_time_formatted"] = _parse(game_info["end_time"]).strftime(
+                time_format_out
+            )
+        except (ValueError, TypeError, AttributeError):
+            if game_info["end_time_formatted"] == "未知":
+                game_info["end_time_formatted"] = str(game_info["end_time"])
+
+    # 计算游戏时长
+    if game_info["start_time"] and game_info["end_time"] and game_info["is_completed"]:
+        try:
+            total_seconds = (
+                _parse(game_info["end_time"]) - _parse(game_info["start_time"])
+            ).total_seconds()
+            if total_seconds >= 0:
+                minutes = math.floor(total_seconds / 60)
+                seconds = math.floor(total_seconds % 60)
+                game_info["duration"] = f"{minutes}分{seconds}秒"
+            else:
+                game_info["duration"] = "时间戳错误"
+        except (ValueError, TypeError, AttributeError):
+            game_info["duration"] = "无法计算"
+    elif not game_info["is_completed"]:
+        game_info["duration"] = "未完成"
+
+    game_info["roles"] = {str(k): v for k, v in game_info.get("roles", {}).items()}
+    return game_info
+
+
+def compile_replay(game_data, game_id):
+    """
+    单次遍历对局事件，生成重放模型。
+
+    参数:
+        game_data (list): 归档中的事件列表。
+        game_id (str): 对局ID (显示用)。
+
+    返回:
+        dict: {"game_info": 对局基本信息, "game_events": 按回合组织的事件列表}
+    """
+    if not isinstance(game_data, list) or not game_data:
+        raise ReplayFormatError("文件格式无效或为空")
+
+    game_info = {
+        "game_id": game_id,
+        "player_count": 0,
+        "map_size": 0,
+        "start_time": None,
+        "end_time": None,
+        "winner": "未知",
+        "rounds_played": 0,
+        "roles": {},
+        "win_reason": "未知",
+        "blue_wins": 0,
+        "red_wins": 0,
+        "is_completed": False,
+        "start_time_formatted": "未知",
+        "end_time_formatted": "未知",
+        "duration": "未知",
+    }
+    last_round_num = 0
+    last_scoreboard = None
+
+    events_by_round = {}
+    round_num = 0
+    assassination_info = None
+    current_leader = None  # 跟踪当前队长
+    # 当前回合段 (两个 RoundStart 之间) 内的队长与尚未找到后续 Leader 的提案
+    segment_leader = None
+    pending_proposals = []  # [(提案数据, 段内此前的队长)]
+
+    def _settle_pending():
+        for data, fallback in pending_proposals:
+            data["leader"] = fallback
+        pending_proposals.clear()
+
+    for event in game_data:
+        if not isinstance(event, dict):
+            continue
+        event_type = event.get("event_type")
+        event_data = event.get("event_data")
+
+        # --- 对局信息 ---
+        if event_type == "GameStart":
+            game_info["player_count"] = event.get("player_count", 0)
+            game_info["map_size"] = event.get("map_size", 0)
+            game_info["start_time"] = event.get("timestamp")
+        elif event_type == "RoleAssign":
+            game_info["roles"] = (
+                {str(k): v for k, v in event_data.items()}
+                if isinstance(event_data, dict)
+                else {}
+            )
+        elif event_type == "ScoreBoard":
+            if isinstance(event_data, list) and len(event_data) == 2:
+                last_scoreboard = event_data
+        elif event_type == "GameResult":
+            if isinstance(event_data, (list, tuple)) and len(event_data) >= 2:
+                game_info["winner"] = event_data[0].lower()
+                game_info["win_reason"] = event_data[1]
+                game_info["end_time"] = event.get("timestamp")
+                game_info["is_completed"] = True
+        elif event_type == "FinalScore":
+            if isinstance(event_data, list) and len(event_data) == 2:
+                game_info["blue_wins"] = event_data[0]
+                game_info["red_wins"] = event_data[1]
+                game_info["rounds_played"] = event_data[0] + event_data[1]
+
+        # --- 刺杀 ---
+        if event_type == "Assass":
+            if isinstance(event_data, list) and len(event_data) == 4:
+                assassination_info = {
+                    "assassin": str(event_data[0]),
+                    "target": str(event_data[1]),
+                    "target_role": event_data[2],
+                    "success": event_data[3] == "Success",
+                }
+            continue
+
+        # --- 回合 ---
+        if event_type == "RoundStart":
+            # 上一段内没有等到后续 Leader 的提案，使用段内此前的队长
+            _settle_pending()
+            segment_leader = None
+            if isinstance(event_data, int):
+                round_num = event_data
+                last_round_num = max(last_round_num, event_data)
+                if round_num > 0 and round_num not in events_by_round:
+                    events_by_round[round_num] = {
+                        "round": round_num,
+                        "leader": None,  # 将在TeamPropose时确定
+                        "team_members": [],
+                        "events": [],
+                        # {success: bool, fail_votes: int}
+                        "mission_execution": None,
+                        # {success: bool} - 用于徽章颜色
+                        "mission_result": None,
+                    }
+            continue
+
+        if event_type == "Leader":
+            segment_leader = str(event_data)
+            # 段内此前的提案以其后的第一个 Leader 为队长
+            for data, _ in pending_proposals:
+                data["leader"] = segment_leader
+            pending_proposals.clear()
+
+        # 只有存在有效回合结构时才处理其他事件
+        if round_num <= 0 or round_num not in events_by_round:
+            continue
+        current_round = events_by_round[round_num]
+        round_events = current_round["events"]
+
+        if event_type == "Leader":
+            current_leader = str(event_data)
+            current_round["leader"] = current_leader  # 回合级别的队长（向后兼容）
+        elif event_type == "TeamPropose":
+            members = (
+                [str(m) for m in event_data] if isinstance(event_data, list) else []
+            )
+            current_round["team_members"] = members
+            data = {"leader": None, "team_members": members}
+            fallback = segment_leader or current_leader or current_round.get("leader")
+            pending_proposals.append((data, fallback))
+            round_events.append({"type": "team_propose", "data": data})
+        elif event_type == "PublicSpeech":
+            if isinstance(event_data, (list, tuple)) and len(event_data) == 2:
+                round_events.append(
+                    {
+                        "type": "speech",
+                        "data": [str(event_data[0]), event_data[1], "public", ["ALL"]],
+                    }
+                )
+        elif event_type == "PublicVote":
+            if isinstance(event_data, (list, tuple)) and len(event_data) == 2:
+                _last_vote_attempt(round_events)["votes"][str(event_data[0])] = (
+                    event_data[1] == "Approve"
+                )
+        elif event_type == "PublicVoteResult":
+            if isinstance(event_data, list) and len(event_data) == 2:
+                vote = _last_vote_attempt(round_events)
+                vote["approve_count"] = event_data[0]
+                vote["reject_count"] = event_data[1]
+        elif event_type == "MissionApproved":
+            _last_vote_attempt(round_events)["approved"] = True
+        elif event_type == "MissionRejected":
+            _last_vote_attempt(round_events)["approved"] = False
+        elif event_type == "MissionVote":
+            if isinstance(event_data, dict):
+                fail_votes = sum(1 for vote in event_data.values() if not vote)
+                if current_round["mission_execution"] is None:
+                    current_round["mission_execution"] = {}
+                current_round["mission_execution"]["fail_votes"] = fail_votes
+        elif event_type == "MissionResult":
+            if isinstance(event_data, (list, tuple)) and len(event_data) == 2:
+                success = event_data[1] == "Success"
+                if current_round["mission_execution"] is None:
+                    current_round["mission_execution"] = {}
+                current_round["mission_execution"]["success"] = success
+                current_round["mission_result"] = {"success": success}
+
+    _settle_pending()
+
+    game_events = sorted(events_by_round.values(), key=lambda x: x["round"])
+    if assassination_info:
+        game_events.append(
+            {
+                "round": "assassination",  # 模板中的特殊键
+                "assassination": assassination_info,
+            }
+        )
+
+    return {
+        "game_info": _format_game_info(game_info, last_round_num, last_scoreboard),
+        "game_events": game_events,
+    }
+
+
+# -----------------------------------------------------------------------------------------
+# 磁盘缓存
+
+
+def replay_cache_key(archive_path):
+    """
+    归档的缓存键 (同时用作 ETag)，只需一次 stat。
+
+    返回:
+        tuple: (路径摘要, 版本摘要)；归档不存在时抛出 OSError。
+    """
+    stat = os.stat(archive_path)
+    path_digest = hashlib.sha1(
+        os.path.abspath(archive_path).encode("utf-8")
+    ).hexdigest()[:20]
+    version_digest = hashlib.sha1(
+        f"{COMPILER_VERSION}:{stat.st_mtime_ns}:{stat.st_size}".encode()
+    ).hexdigest()[:16]
+    return path_digest, version_digest
+
+
+def replay_etag(archive_path):
+    """归档的 ETag 值 (不含引号)"""
+    return "-".join(replay_cache_key(archive_path))
+
+
+def load_compiled_replay(archive_path, game_id, cache_dir=None):
+    """
+    读取编译后的重放模型，优先使用磁盘缓存。
+
+    参数:
+        archive_path (str): 归档文件路径。
+        game_id (str): 对局ID。
+        cache_dir (str, optional): 缓存目录，为 None 时不使用磁盘缓存。
+
+    返回:
+        dict: compile_replay 的输出。
+
+    异常:
+        OSError: 归档不存在或无法读取。
+        json.JSONDecodeError: 归档不是有效的 JSON。
+        ReplayFormatError: 归档不是有效的事件列表。
+    """
+    path_digest, version_digest = replay_cache_key(archive_path)
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, f"{path_digest}.{version_digest}.json")
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"重放缓存 {cache_file} 无法读取，重新编译: {e}")
+
+    with open(archive_path, "r", encoding="utf-8") as f:
+        game_data = json.load(f)
+    compiled = compile_replay(game_data, game_id)
+
+    if cache_file:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(compiled, f, ensure_ascii=False)
+            os.replace(tmp_file, cache_file)
+            # 清理同一归档的旧版本缓存
+            for name in os.listdir(cache_dir):
+                if (
+                    name.startswith(f"{path_digest}.")
+                    and name.endswith(".json")
+                    and name != os.path.basename(cache_file)
+                ):
+                    os.remove(os.path.join(cache_dir, name))
+        except OSError as e:
+            logger.warning(f"写入重放缓存 {cache_file} 失败: {e}")
+    return compiled
@@ -0,0 +1,272 @@
+"""
+跨进程共享、可主动失效的响应缓存
+
+- 两级缓存: 进程内 LRU (条目数有上限) + Redis (所有 gunicorn worker 与对战进程共用)
+- 过期时间从写入时算起，持续被访问的条目也会按时刷新
+- 失效基于标签代数: 每个条目写入时记下所属标签 (如 ranking:1、user:<id>) 的当前代数，
+  读取时在同一次 Redis 往返中取回这些代数，任何一个变了就视为未命中；
+  invalidate(标签) 只需 INCR 代数，不需要找出并删除所有相关键
+- 评分写入 (GameStats 变动) 提交后自动失效对应榜单和玩家的标签 (见 database/leaderboard.py)
+
+Redis 不可用时退化为进程内缓存: 本进程的失效仍然生效，其他进程的条目靠过期时间兜底。
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REDIS_URL = "redis://localhost:6379/0"
+DEFAULT_MAX_ENTRIES = 1024  # 进程内 LRU 的条目上限
+DEFAULT_TTL = 60  # 秒
+REDIS_RETRY_SECONDS = 30  # Redis 出错后暂停使用的时间
+KEY_PREFIX = "avalon:cache:"
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+# 无法确定榜单的变动 (批量语句) 会失效该标签，所有榜单条目都应带上它
+ALL_RANKINGS_TAG = "ranking:*"
+
+
+def ranking_tags(ranking_id):
+    """榜单条目的标签"""
+    return (f"ranking:{ranking_id}", ALL_RANKINGS_TAG)
+
+
+def user_tag(user_id):
+    """玩家标签"""
+    return f"user:{user_id}"
+
+
+class ResponseCache:
+    """两级响应缓存，按标签失效"""
+
+    def __init__(self, redis_client=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.redis = redis_client
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (过期时间, {标签: 代数}, 值)
+        self._generations = {}  # 本进程的标签代数 (Redis 不可用时使用)
+        self._lock = threading.Lock()
+        self._redis_down_until = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    # ------------------------------------------------------------------
+    # Redis 访问
+
+    def _redis_available(self):
+        return self.redis is not None and time.time() >= self._redis_down_until
+
+    def _redis_failed(self, e):
+        self._redis_down_until = time.time() + REDIS_RETRY_SECONDS
+        logger.warning(
+            f"响应缓存无法访问 Redis，{REDIS_RETRY_SECONDS} 秒内只使用进程内缓存: {e}"
+        )
+
+    def _gen_key(self, tag):
+        return f"{KEY_PREFIX}gen:{tag}"
+
+    def _value_key(self, key):
+        return f"{KEY_PREFIX}val:{key}"
+
+    def _fetch(self, key, tags, need_value):
+        """
+        一次往返读取标签代数和 (need_value 时) 共享值。
+
+        返回:
+            tuple: ({标签: 代数}, 共享值的原始内容或 None)；Redis 不可用时代数取本进程的。
+        """
+        if self._redis_available() and (tags or need_value):
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                if tags:
+                    pipe.mget([self._gen_key(tag) for tag in tags])
+                if need_value:
+                    pipe.get(self._value_key(key))
+                results = pipe.execute()
+                gens = (
+                    {tag: int(g or 0) for tag, g in zip(tags, results[0])}
+                    if tags
+                    else {}
+                )
+                return gens, results[-1] if need_value else None
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        with self._lock:
+            return {tag: self._generations.get(tag, 0) for tag in tags}, None
+
+    # ------------------------------------------------------------------
+    # 读写
+
+    def get_or_set(self, key, fetch_func, ttl=DEFAULT_TTL, tags=()):
+        """
+        读取缓存，未命中、过期或标签已失效时调用 fetch_func 重新获取并写入。
+
+        参数:
+            key (str): 缓存键。
+            fetch_func (callable): 无参数，返回可 JSON 序列化的值。
+            ttl (int): 过期秒数，从写入时算起。
+            tags (iterable): 条目所属的标签。
+
+        返回:
+            缓存的值或 fetch_func 的返回值 (经 Redis 读出时元组会变成列表)。
+        """
+        tags = tuple(tags)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        # 本进程有未过期的条目时只需要核对标签代数
+        need_value = entry is None or entry[0] <= now
+        gens, raw = self._fetch(key, tags, need_value)
+
+        if not need_value:
+            with self._lock:
+                expires_at, entry_gens, value = entry
+                if entry_gens == gens:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._entries.pop(key, None)
+            # 已失效: 其他进程可能已经写入了新值
+            raw = self._fetch(key, (), True)[1]
+
+        if raw is not None:
+            try:
+                shared = json.loads(raw)
+                if shared["expires_at"] > now and shared["gens"] == gens:
+                    self._store_local(key, shared["expires_at"], gens, shared["v"])
+                    self.hits += 1
+                    return shared["v"]
+            except (ValueError, KeyError, TypeError):
+                pass
+
+        self.misses += 1
+        value = fetch_func()
+        self._store_local(key, now + ttl, gens, value)
+        if self._redis_available():
+            try:
+                payload = json.dumps(
+                    {"gens": gens, "expires_at": now + ttl, "v": value},
+                    ensure_ascii=False,
+                    default=str,
+                )
+                self.redis.set(self._value_key(key), payload, ex=max(1, int(ttl)))
+            except (redis.RedisError, TypeError, ValueError) as e:
+                if isinstance(e, redis.RedisError):
+                    self._redis_failed(e)
+                else:
+                    logger.warning(f"响应缓存无法序列化 {key}: {e}")
+        return value
+
+    def _store_local(self, key, expires_at, gens, value):
+        with self._lock:
+            self._entries[key] = (expires_at, gens, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # 失效
+
+    def invalidate(self, *tags):
+        """
+        使带有任一给定标签的条目失效 (所有进程)。
+
+        参数:
+            *tags (str): 标签，如 ranking_tags(1) 中的标签、user_tag(user_id)。
+        """
+        if not tags:
+            return
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+        if self._redis_available():
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for tag in tags:
+                    pipe.incr(self._gen_key(tag))
+                pipe.execute()
+            except redis.RedisError as e:
+                self._redis_failed(e)
+
+    def clear_local(self):
+        """清空本进程的缓存条目"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """本进程的命中统计"""
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "redis": self._redis_available(),
+        }
+
+
+def invalidate_game_stats_changes(changes, cache=None):
+    """
+    GameStats 变动提交后的回调: 失效对应榜单和玩家的缓存。
+
+    参数:
+        changes (dict): {ranking_id: 用户ID集合 或 None}，ranking_id 为 None 表示所有榜单。
+        cache (ResponseCache, optional): 默认使用 get_response_cache()。
+    """
+    cache = cache or get_response_cache()
+    tags = []
+    for ranking_id, user_ids in changes.items():
+        tags.append(ALL_RANKINGS_TAG if ranking_id is None else f"ranking:{ranking_id}")
+        tags.extend(user_tag(user_id) for user_id in user_ids or ())
+    cache.invalidate(*tags)
+
+
+def create_response_cache(config):
+    """根据应用配置创建缓存实例"""
+    redis_client = None
+    if config.get("RESPONSE_CACHE_REDIS", True):
+        redis_client = redis.from_url(
+            config.get("RESPONSE_CACHE_REDIS_URL") or DEFAULT_REDIS_URL,
+            socket_connect_timeout=0.5,
+            socket_timeout=0.5,
+        )
+    return ResponseCache(
+        redis_client,
+        max_entries=int(config.get("RESPONSE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+    )
+
+
+def init_response_cache(app):
+    """为应用创建缓存实例，并在 GameStats 变动提交后自动失效"""
+    from database.leaderboard import add_game_stats_listener
+
+    cache = create_response_cache(app.config)
+    app.extensions["response_cache"] = cache
+    add_game_stats_listener(invalidate_game_stats_changes)
+    return cache
+
+
+def get_response_cache():
+    """当前应用的缓存实例；应用未初始化缓存时使用按默认配置创建的共享实例"""
+    global _default_cache
+    if has_app_context():
+        cache = current_app.extensions.get("response_cache")
+        if cache is not None:
+            return cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = create_response_cache(
+                current_app.config if has_app_context() else {}
+            )
+        return _default_cache
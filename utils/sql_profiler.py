@@ -0,0 +1,336 @@
+"""
+按请求 / 后台任务统计 SQL 查询，发现 N+1
+
+- 引擎级事件 (before/after_cursor_execute) 记录当前请求或任务执行的每条语句；
+  没有处于采样中的请求或任务时只多一次 ContextVar 读取，开销可以忽略
+- 语句按 "形状" 归并 (字面量和 IN 列表折叠为 ?)，同一形状在一次请求内执行次数达到
+  SQL_PROFILER_N_PLUS_ONE_THRESHOLD 时视为疑似 N+1，记录首次达到阈值时的调用位置并告警
+- 请求按 SQL_PROFILER_SAMPLE_RATE 采样 (0 关闭)；管理员 (或调试模式) 带请求头
+  X-SQL-Profile: 1 时强制采样。采样的响应带 X-SQL-Queries、X-SQL-Time、
+  X-SQL-N-Plus-One 和 Server-Timing 头
+- 后台任务用 profile_sql(名称) 包裹，采样规则相同
+- 每个进程保留最近 SQL_PROFILER_HISTORY 条记录，并按请求路由 / 任务名汇总，
+  见 /performance/api/sql_profiles
+
+与 app.py 中的 werkzeug ProfilerMiddleware 不同，这里不做函数级剖析，可以在生产环境以低采样率常开。
+"""
+
+import logging
+import os
+import random
+import re
+import threading
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from time import perf_counter, time
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+DEFAULT_HISTORY = 200
+TOP_SHAPES = 10  # 每条记录保留的语句形状数
+FORCE_HEADER = "X-SQL-Profile"
+
+_THIS_FILE = os.path.abspath(__file__)
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(_THIS_FILE))
+_current = ContextVar("sql_profile", default=None)
+_listeners_installed = False
+_install_lock = threading.Lock()
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+@lru_cache(maxsize=4096)
+def statement_shape(statement):
+    """语句的形状: 折叠空白、字面量和 IN 列表，同一查询不同参数得到同一形状"""
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _LITERAL.sub("?", shape)
+    return _PLACEHOLDER_LIST.sub("(?, ...)", shape)
+
+
+def _callsite():
+    """项目内最近的调用位置 (跳过 SQLAlchemy 与本模块)"""
+    frames = [
+        frame
+        for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(_PROJECT_ROOT)
+        and frame.filename != _THIS_FILE
+        and "site-packages" not in frame.filename
+    ]
+    return [
+        f"{os.path.relpath(f.filename, _PROJECT_ROOT)}:{f.lineno} in {f.name}"
+        for f in frames[-3:]
+    ]
+
+
+class QueryProfile:
+    """一次请求或后台任务中的查询统计"""
+
+    __slots__ = (
+        "name",
+        "kind",
+        "threshold",
+        "started_at",
+        "_start",
+        "queries",
+        "sql_seconds",
+        "shapes",
+        "callsites",
+    )
+
+    def __init__(self, name, kind, threshold):
+        self.name = name
+        self.kind = kind
+        self.threshold = threshold
+        self.started_at = time()
+        self._start = perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.shapes = {}  # 形状 -> [次数, 耗时]
+        self.callsites = {}  # 疑似 N+1 的形状 -> 调用位置
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        shape = statement_shape(statement)
+        entry = self.shapes.get(shape)
+        if entry is None:
+            self.shapes[shape] = [1, seconds]
+            return
+        entry[0] += 1
+        entry[1] += seconds
+        if entry[0] == self.threshold:
+            self.callsites[shape] = _callsite()
+
+    @property
+    def n_plus_one(self):
+        """疑似 N+1 的形状: [(形状, 次数, 耗时)]"""
+        return [
+            (shape, count, seconds)
+            for shape, (count, seconds) in self.shapes.items()
+            if count >= self.threshold
+        ]
+
+    def to_dict(self):
+        top = sorted(self.shapes.items(), key=lambda kv: kv[1][1], reverse=True)
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "started_at": self.started_at,
+            "duration_ms": round((perf_counter() - self._start) * 1000, 2),
+            "queries": self.queries,
+            "sql_ms": round(self.sql_seconds * 1000, 2),
+            "distinct_statements": len(self.shapes),
+            "top_statements": [
+                {"statement": shape, "count": count, "sql_ms": round(sec * 1000, 2)}
+                for shape, (count, sec) in top[:TOP_SHAPES]
+            ],
+            "n_plus_one": [
+                {
+                    "statement": shape,
+                    "count": count,
+                    "sql_ms": round(sec * 1000, 2),
+                    "callsite": self.callsites.get(shape, []),
+                }
+                for shape, count, sec in self.n_plus_one
+            ],
+        }
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("sql_profiler_start", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is None:
+        return
+    starts = conn.info.get("sql_profiler_start")
+    if starts:
+        profile.record(statement, perf_counter() - starts.pop())
+
+
+def _install_listeners():
+    global _listeners_installed
+    with _install_lock:
+        if _listeners_installed:
+            return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _listeners_installed = True
+
+
+class SqlProfiler:
+    """采样决策、最近记录与按名称的汇总 (每个进程一个)"""
+
+    def __init__(
+        self,
+        sample_rate=0.0,
+        n_plus_one_threshold=DEFAULT_N_PLUS_ONE_THRESHOLD,
+        history=DEFAULT_HISTORY,
+    ):
+        self.sample_rate = float(sample_rate)
+        self.threshold = int(n_plus_one_threshold)
+        self._recent = deque(maxlen=int(history))
+        self._totals = {}  # 名称 -> 汇总
+        self._lock = threading.Lock()
+
+    def start(self, name, kind, force=False):
+        """
+        按采样率开始记录 (已在记录中时不嵌套)。
+
+        返回:
+            (QueryProfile, token) 或 None (未采样)。
+        """
+        if _current.get() is not None:
+            return None
+        if not force and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None
+        _install_listeners()
+        profile = QueryProfile(name, kind, self.threshold)
+        return profile, _current.set(profile)
+
+    def finish(self, started):
+        """结束记录，保存结果；发现疑似 N+1 时告警。返回记录字典"""
+        profile, token = started
+        _current.reset(token)
+        data = profile.to_dict()
+        for item in data["n_plus_one"]:
+            logger.warning(
+                f"[SQL] 疑似 N+1: {profile.name} 中同一语句执行 {item['count']} 次 "
+                f"({item['sql_ms']}ms): {item['statement'][:200]} "
+                f"调用位置: {' <- '.join(reversed(item['callsite'])) or '未知'}"
+            )
+        with self._lock:
+            self._recent.append(data)
+            total = self._totals.setdefault(
+                profile.name,
+                {
+                    "name": profile.name,
+                    "kind": profile.kind,
+                    "samples": 0,
+                    "queries": 0,
+                    "max_queries": 0,
+                    "sql_ms": 0.0,
+                    "n_plus_one_samples": 0,
+                },
+            )
+            total["samples"] += 1
+            total["queries"] += data["queries"]
+            total["max_queries"] = max(total["max_queries"], data["queries"])
+            total["sql_ms"] += data["sql_ms"]
+            if data["n_plus_one"]:
+                total["n_plus_one_samples"] += 1
+        return data
+
+    def recent(self, limit=50, n_plus_one_only=False):
+        """最近的记录，新的在前"""
+        with self._lock:
+            items = list(self._recent)
+        if n_plus_one_only:
+            items = [item for item in items if item["n_plus_one"]]
+        return items[::-1][:limit]
+
+    def summary(self):
+        """按请求路由 / 任务名汇总，按平均查询数降序"""
+        with self._lock:
+            totals = [dict(total) for total in self._totals.values()]
+        for total in totals:
+            total["avg_queries"] = round(total["queries"] / total["samples"], 2)
+            total["avg_sql_ms"] = round(total["sql_ms"] / total["samples"], 2)
+            total["sql_ms"] = round(total["sql_ms"], 2)
+        return sorted(totals, key=lambda t: t["avg_queries"], reverse=True)
+
+
+def get_sql_profiler():
+    """当前应用的 SqlProfiler；应用未初始化时返回 None"""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("sql_profiler")
+
+
+@contextmanager
+def profile_sql(name, force=False):
+    """
+    统计一个后台任务 (如一批评分写入) 的查询，采样规则与请求相同。需要在应用上下文中使用。
+
+    用法:
+        with profile_sql("rating_batch:rank-1"):
+            apply_battle_results_batch(items)
+    """
+    profiler = get_sql_profiler()
+    started = profiler.start(name, "job", force) if profiler else None
+    try:
+        yield
+    finally:
+        if started:
+            profiler.finish(started)
+
+
+# -----------------------------------------------------------------------------------------
+# Flask 集成
+
+
+def _force_requested(app):
+    if request.headers.get(FORCE_HEADER) != "1":
+        return False
+    if app.debug:
+        return True
+    from flask_login import current_user
+
+    return current_user.is_authenticated and current_user.is_admin
+
+
+def init_sql_profiler(app):
+    """为应用创建 SqlProfiler，并注册请求级采样与响应头"""
+    profiler = SqlProfiler(
+        sample_rate=app.config.get("SQL_PROFILER_SAMPLE_RATE", 0.0),
+        n_plus_one_threshold=app.config.get(
+            "SQL_PROFILER_N_PLUS_ONE_THRESHOLD", DEFAULT_N_PLUS_ONE_THRESHOLD
+        ),
+        history=app.config.get("SQL_PROFILER_HISTORY", DEFAULT_HISTORY),
+    )
+    app.extensions["sql_profiler"] = profiler
+
+    @app.before_request
+    def _start_sql_profile():
+        if request.endpoint == "static":
+            return
+        rule = request.url_rule.rule if request.url_rule else request.path
+        g.sql_profile = profiler.start(
+            f"{request.method} {rule}", "request", _force_requested(app)
+        )
+
+    @app.after_request
+    def _finish_sql_profile(response):
+        started = g.pop("sql_profile", None)
+        if not started:
+            return response
+        data = profiler.finish(started)
+        response.headers["X-SQL-Queries"] = str(data["queries"])
+        response.headers["X-SQL-Time"] = f"{data['sql_ms']}ms"
+        response.headers["X-SQL-N-Plus-One"] = str(len(data["n_plus_one"]))
+        response.headers.add(
+            "Server-Timing",
+            f'sql;dur={data["sql_ms"]};desc="{data["queries"]} queries"',
+        )
+        return response
+
+    @app.teardown_request
+    def _discard_sql_profile(exc):
+        # after_request 未执行 (请求处理中抛出异常) 时也要结束记录
+        started = g.pop("sql_profile", None)
+        if started:
+            profiler.finish(started)
+
+    return profiler
@@ -0,0 +1,90 @@
+"""replay_compiler.py: 对局事件编译为重放模型"""
+
+import pytest
+
+from utils.replay_compiler import ReplayFormatError, compile_replay
+
+
+def _event(event_type, event_data=None, **extra):
+    return dict(extra, event_type=event_type, event_data=event_data)
+
+
+GAME = [
+    _event("GameStart", player_count=7, map_size=9, timestamp="2025-05-01 10:00:00"),
+    _event("RoleAssign", {1: "Merlin", 6: "Assassin"}),
+    _event("RoundStart", 1),
+    # 提案在 Leader 之前记录: 队长取其后的第一个 Leader
+    _event("TeamPropose", [1, 2]),
+    _event("Leader", 3),
+    _event("PublicSpeech", [3, "选 1 和 2"]),
+    _event("PublicVote", [1, "Approve"]),
+    _event("PublicVote", [2, "Reject"]),
+    _event("PublicVoteResult", [4, 3]),
+    _event("MissionApproved"),
+    _event("MissionVote", {1: True, 2: False}),
+    _event("MissionResult", [1, "Fail"]),
+    _event("ScoreBoard", [0, 1]),
+    _event("RoundStart", 2),
+    _event("Leader", 4),
+    # 段内没有后续 Leader: 取此前最近的 Leader
+    _event("TeamPropose", [4, 5]),
+    _event("PublicVoteResult", [2, 5]),
+    _event("MissionRejected"),
+    _event("Assass", [6, 1, "Merlin", "Success"]),
+    _event("GameResult", ["Red", "刺杀成功"], timestamp="2025-05-01 10:12:30"),
+    _event("FinalScore", [0, 1]),
+]
+
+
+def test_compile_replay():
+    replay = compile_replay(GAME, "g1")
+
+    info = replay["game_info"]
+    assert info["game_id"] == "g1"
+    assert info["player_count"] == 7
+    assert info["winner"] == "red"
+    assert info["is_completed"]
+    assert info["roles"] == {"1": "Merlin", "6": "Assassin"}
+    assert info["duration"] == "12分30秒"
+    assert info["start_time_formatted"] == "2025-05-01 10:00"
+
+    round1, round2, assassination = replay["game_events"]
+    assert round1["round"] == 1 and round1["leader"] == "3"
+    assert [e["type"] for e in round1["events"]] == [
+        "team_propose",
+        "speech",
+        "vote_attempt",
+    ]
+    assert round1["events"][0]["data"] == {"leader": "3", "team_members": ["1", "2"]}
+    vote = round1["events"][2]["data"]
+    assert vote["votes"] == {"1": True, "2": False}
+    assert (vote["approve_count"], vote["reject_count"], vote["approved"]) == (
+        4,
+        3,
+        True,
+    )
+    assert round1["mission_execution"] == {"fail_votes": 1, "success": False}
+    assert round1["mission_result"] == {"success": False}
+
+    assert round2["events"][0]["data"]["leader"] == "4"
+    assert round2["events"][1]["data"]["approved"] is False
+
+    assert assassination["round"] == "assassination"
+    assert assassination["assassination"]["success"]
+
+
+def test_unfinished_game_uses_last_scoreboard():
+    events = [e for e in GAME if e["event_type"] not in ("GameResult", "FinalScore")]
+    events.append(_event("ScoreBoard", [3, 1]))
+
+    info = compile_replay(events, "g2")["game_info"]
+    assert not info["is_completed"]
+    assert info["winner"] == "blue"
+    assert info["rounds_played"] == 2
+    assert info["duration"] == "未完成"
+
+
+@pytest.mark.parametrize("game_data", [[], {}, None])
+def test_invalid_archive_raises(game_data):
+    with pytest.raises(ReplayFormatError):
+        compile_replay(game_data, "bad")
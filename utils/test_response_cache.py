@@ -0,0 +1,78 @@
+"""response_cache.py: 进程内 LRU、按标签代数失效，评分写入提交后自动失效"""
+
+from database import apply_battle_results_batch, create_battles
+from game.battle_result import BattleResult
+from utils.response_cache import (
+    ResponseCache,
+    init_response_cache,
+    ranking_tags,
+    user_tag,
+)
+
+ROLES = {
+    1: "Merlin",
+    2: "Percival",
+    3: "Knight",
+    4: "Knight",
+    5: "Morgana",
+    6: "Assassin",
+    7: "Oberon",
+}
+
+
+def _counter():
+    calls = []
+
+    def fetch():
+        calls.append(None)
+        return len(calls)
+
+    return fetch
+
+
+def test_hit_until_tag_is_invalidated():
+    cache = ResponseCache()
+    fetch = _counter()
+
+    assert cache.get_or_set("board", fetch, tags=ranking_tags(1)) == 1
+    assert cache.get_or_set("board", fetch, tags=ranking_tags(1)) == 1
+    # 其他榜单的失效不影响
+    cache.invalidate(*ranking_tags(2)[:1])
+    assert cache.get_or_set("board", fetch, tags=ranking_tags(1)) == 1
+
+    cache.invalidate(user_tag("u1"), "ranking:1")
+    assert cache.get_or_set("board", fetch, tags=ranking_tags(1)) == 2
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_ttl_and_lru_bound(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("utils.response_cache.time.time", lambda: now[0])
+    cache = ResponseCache(max_entries=2)
+    fetch = _counter()
+
+    cache.get_or_set("a", fetch, ttl=10)
+    now[0] += 11
+    assert cache.get_or_set("a", fetch, ttl=10) == 2
+
+    cache.get_or_set("b", fetch)
+    cache.get_or_set("c", fetch)
+    assert cache.stats()["entries"] == 2
+    # "a" 最久未使用，已被淘汰
+    assert cache.get_or_set("a", fetch) == 5
+
+
+def test_game_stats_commit_invalidates_ranking(app, make_players):
+    cache = init_response_cache(app)
+    fetch = _counter()
+    (battle,) = create_battles([make_players(7)], ranking_id=1)
+    cache.get_or_set("board", fetch, tags=ranking_tags(1))
+    cache.get_or_set("other", fetch, tags=ranking_tags(2))
+
+    result = BattleResult(
+        roles=dict(ROLES), winner="blue", tokens=[{"input": 1, "output": 1}] * 7
+    )
+    assert apply_battle_results_batch([(battle.id, result)])[battle.id]
+
+    assert cache.get_or_set("board", fetch, tags=ranking_tags(1)) == 3
+    assert cache.get_or_set("other", fetch, tags=ranking_tags(2)) == 2
@@ -0,0 +1,45 @@
+"""sql_profiler.py: 语句形状归并、后台任务采样与 N+1 检测"""
+
+from sqlalchemy import select
+
+from database import db
+from database.models import User
+from utils.sql_profiler import SqlProfiler, profile_sql, statement_shape
+
+
+def test_statement_shape_folds_literals_and_in_lists():
+    assert statement_shape(
+        "SELECT *  FROM users\n WHERE id = 42 AND name = 'bob' AND x IN (?, ?, ?)"
+    ) == ("SELECT * FROM users WHERE id = ? AND name = ? AND x IN (?, ...)")
+
+
+def _install(app, **kwargs):
+    profiler = SqlProfiler(**kwargs)
+    app.extensions["sql_profiler"] = profiler
+    return profiler
+
+
+def test_repeated_statement_is_reported_as_n_plus_one(app, make_players):
+    players = make_players(6)
+    profiler = _install(app, n_plus_one_threshold=5)
+
+    with profile_sql("load_users", force=True):
+        db.session.execute(select(User.id)).all()
+        for player in players:
+            db.session.execute(select(User).where(User.id == player["user_id"]))
+
+    (record,) = profiler.recent()
+    assert record["name"] == "load_users" and record["kind"] == "job"
+    assert record["queries"] == 7
+    (suspect,) = record["n_plus_one"]
+    assert suspect["count"] == 6
+    assert any("utils/test_sql_profiler.py" in site for site in suspect["callsite"])
+    (total,) = profiler.summary()
+    assert total["samples"] == 1 and total["n_plus_one_samples"] == 1
+
+
+def test_unsampled_jobs_are_not_recorded(app):
+    profiler = _install(app, sample_rate=0.0)
+    with profile_sql("idle"):
+        db.session.execute(select(User.id)).all()
+    assert profiler.recent() == []